@@ -11,6 +11,7 @@
 """
 import argparse
 import errno
+import functools
 import os
 import shlex
 import subprocess
@@ -26,6 +27,7 @@ from entropy.exceptions import EntropyPackageException, \
 from entropy.services.client import WebService
 from entropy.client.interfaces.repository import Repository
 from entropy.client.interfaces.package.preservedlibs import PreservedLibraries
+from entropy.debug import SolverProfiler
 
 import entropy.tools
 import entropy.dep
@@ -67,7 +69,33 @@ class SoloManage(SoloCommand):
             return parser.print_help, []
 
         self._nsargs = nsargs
-        return self._call_shared, [nsargs.func]
+        func = nsargs.func
+        profile = getattr(nsargs, "profile", None)
+        if profile is not None:
+            func = functools.partial(self._profile, profile, func)
+        return self._call_shared, [func]
+
+    def _profile(self, path, func, entropy_client):
+        """
+        Execute func (int func(entropy_client)) with the dependency
+        solver profiler enabled and write its JSON report to path.
+        """
+        profiler = SolverProfiler()
+        profiler.reset()
+        profiler.enable()
+        try:
+            return func(entropy_client)
+        finally:
+            profiler.disable()
+            try:
+                with open(path, "w") as profile_f:
+                    profiler.dump(profile_f)
+            except (OSError, IOError) as err:
+                entropy_client.output(
+                    "%s: %s" % (
+                        darkred(_("Cannot write the profile report")),
+                        err),
+                    level="error", importance=1)
 
     def _signal_ugc(self, entropy_client, package_keys):
         """
@@ -9,11 +9,17 @@
     B{Entropy Command Line Client}.
 
 """
+import errno
+import os
 import sys
+import time
 import argparse
 
 from entropy.i18n import _
-from entropy.output import blue, brown, darkgreen
+from entropy.output import blue, brown, darkgreen, darkred, purple, teal
+from entropy.cache import EntropyCacher, CacheMetrics
+
+import entropy.tools
 
 from solo.commands.descriptor import SoloCommandDescriptor
 from solo.commands.command import SoloCommand, sharedlock
@@ -72,6 +78,37 @@ Manage Entropy Library Cache.
         clean_parser.set_defaults(func=self._clean)
         _commands.append("clean")
 
+        usage_parser = subparsers.add_parser(
+            "usage", help=_("show Entropy Library Cache disk usage"))
+        usage_parser.add_argument(
+            "--quiet", "-q", action="store_true", default=False,
+            help=_("print results in a scriptable way"))
+
+        usage_parser.set_defaults(func=self._usage)
+        _commands.append("usage")
+
+        prewarm_parser = subparsers.add_parser(
+            "prewarm", help=_("pre-compute the Entropy Library Cache"))
+
+        prewarm_parser.set_defaults(func=self._prewarm)
+        _commands.append("prewarm")
+
+        stats_parser = subparsers.add_parser(
+            "stats", help=_("show Entropy Library Cache statistics "
+                            "(collected when ETP_CACHE_STATS is set)"))
+        stats_parser.add_argument(
+            "--top", metavar="<number>", type=int, default=0,
+            help=_("show the given number of most accessed keys"))
+        stats_parser.add_argument(
+            "--reset", action="store_true", default=False,
+            help=_("drop the collected statistics"))
+        stats_parser.add_argument(
+            "--quiet", "-q", action="store_true", default=False,
+            help=_("print results in a scriptable way"))
+
+        stats_parser.set_defaults(func=self._stats)
+        _commands.append("stats")
+
         self._commands = _commands
         return parser
 
@@ -116,6 +153,12 @@ Manage Entropy Library Cache.
         elif command == "enable":
             outcome += ["--verbose", "-v", "--quiet", "-q"]
 
+        elif command == "usage":
+            outcome += ["--quiet", "-q"]
+
+        elif command == "stats":
+            outcome += ["--top", "--reset", "--quiet", "-q"]
+
         return self._bashcomp(sys.stdout, last_arg, outcome)
 
     @sharedlock  # clear_cache uses inst_repo
@@ -137,6 +180,148 @@ Manage Entropy Library Cache.
         )
         return 0
 
+    def _prewarm(self, entropy_client):
+        """
+        Solo Cache Prewarm command.
+        """
+        if entropy_client.prewarm_cache():
+            return 0
+        return 1
+
+    def _stats(self, entropy_client):
+        """
+        Solo Cache Stats command.
+        """
+        quiet = self._nsargs.quiet
+        top = self._nsargs.top
+
+        if self._nsargs.reset:
+            try:
+                os.remove(CacheMetrics.path())
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    entropy_client.output(
+                        "%s: %s" % (darkred(_("Cannot reset statistics")),
+                                    err),
+                        header=brown(" @@ "), level="error")
+                    return 1
+            if not quiet:
+                entropy_client.output(
+                    darkgreen(_("Entropy cache statistics reset.")),
+                    header=brown(" @@ "), level="info")
+            return 0
+
+        report = CacheMetrics.load()
+        if report is None:
+            if not quiet:
+                entropy_client.output(
+                    "%s. %s." % (
+                        purple(_("No cache statistics collected")),
+                        blue(_("Set ETP_CACHE_STATS=1 to collect them"))),
+                    header=brown(" @@ "), level="warning")
+            return 1
+
+        caches = report["caches"]
+        def _lookups(cache_id):
+            return caches[cache_id]["hits"] + caches[cache_id]["misses"]
+
+        for cache_id in sorted(caches, key = lambda x: -_lookups(x)):
+            data = caches[cache_id]
+            hits, misses = data["hits"], data["misses"]
+            unserialize_avg = 0.0
+            if data["unserializations"]:
+                unserialize_avg = data["unserialize_time"] / \
+                    data["unserializations"]
+
+            if quiet:
+                entropy_client.output(
+                    "%s %d %d %d %d %.6f" % (
+                        cache_id, hits, misses, data["bytes_read"],
+                        data["bytes_written"], unserialize_avg),
+                    level="generic")
+                continue
+
+            hit_ratio = 0.0
+            if hits + misses:
+                hit_ratio = 100.0 * hits / (hits + misses)
+            txt = "%s: %s %s, %s %s (%s), %s %s, %s %s" % (
+                darkgreen(cache_id),
+                teal(str(hits)), brown(_("hits")),
+                teal(str(misses)), brown(_("misses")),
+                purple("%.1f%%" % (hit_ratio,)),
+                purple(entropy.tools.bytes_into_human(
+                    data["bytes_read"])), brown(_("read")),
+                purple(entropy.tools.bytes_into_human(
+                    data["bytes_written"])), brown(_("written")))
+            if data["unserializations"]:
+                txt += ", %s %s" % (
+                    teal("%.3fms" % (unserialize_avg * 1000,)),
+                    brown(_("average unserialize time")))
+            entropy_client.output(txt, header=brown("  # "), level="info")
+
+            for key, count in data["top_keys"][:top]:
+                entropy_client.output(
+                    "%s %s" % (teal(str(count).rjust(8)), key),
+                    header="    ", level="info")
+
+        if not quiet:
+            entropy_client.output(
+                "%s: %s" % (
+                    blue(_("Collected since")),
+                    teal(time.strftime(
+                        "%Y-%m-%d %H:%M",
+                        time.localtime(report["since"])))),
+                header=brown(" @@ "), level="info")
+        return 0
+
+    def _usage(self, entropy_client):
+        """
+        Solo Cache Usage command.
+        """
+        quiet = self._nsargs.quiet
+        usage = EntropyCacher.usage()
+
+        total_count, total_size = 0, 0
+        for cache_id in sorted(usage, key = lambda x: -usage[x][1]):
+            count, size, atime = usage[cache_id]
+            total_count += count
+            total_size += size
+            if cache_id is None:
+                cache_id = "other"
+
+            if quiet:
+                entropy_client.output(
+                    "%s %d %d" % (cache_id, count, size),
+                    level="generic")
+                continue
+
+            entropy_client.output(
+                "%s: %s, %s %s, %s %s" % (
+                    darkgreen(cache_id),
+                    purple(entropy.tools.bytes_into_human(size)),
+                    teal(str(count)), brown(_("entries")),
+                    brown(_("last used")),
+                    teal(time.strftime("%Y-%m-%d %H:%M",
+                                       time.localtime(atime)))),
+                header=brown("  # "), level="info")
+
+        if quiet:
+            return 0
+
+        limit = EntropyCacher.SIZE_LIMIT
+        if limit:
+            limit_str = entropy.tools.bytes_into_human(limit * 1024 * 1024)
+        else:
+            limit_str = _("unlimited")
+        entropy_client.output(
+            "%s: %s (%s %s), %s: %s" % (
+                blue(_("Total")),
+                purple(entropy.tools.bytes_into_human(total_size)),
+                teal(str(total_count)), brown(_("entries")),
+                blue(_("limit")), purple(limit_str)),
+            header=brown(" @@ "), level="info")
+        return 0
+
 
 SoloCommandDescriptor.register(
     SoloCommandDescriptor(
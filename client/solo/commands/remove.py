@@ -83,6 +83,11 @@ Remove previously installed packages from system.
         _commands["--verbose"] = {}
         _commands["-v"] = {}
 
+        parser.add_argument(
+            "--profile", metavar="<file>", default=None,
+            help=_("write a dependency solver profile (JSON) to file"))
+        _commands["--profile"] = {}
+
         parser.add_argument(
             "--nodeps", action="store_true",
             default=False,
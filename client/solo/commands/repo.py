@@ -687,11 +687,11 @@ Manage Entropy Repositories.
         total = len(pkg_ids)
         count = 0
         conflict_cache = set()
-        for pkg_id in pkg_ids:
+        pkgs_meta = source_db.iterPackagesData(
+            pkg_ids, get_content = True,
+            content_insert_formatted = True)
+        for pkg_meta in pkgs_meta:
             count += 1
-            pkg_meta = source_db.getPackageData(
-                pkg_id, get_content = True,
-                content_insert_formatted = True)
 
             entropy_client.output(
                 "[%s:%s|%s] %s" % (
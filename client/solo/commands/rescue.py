@@ -452,79 +452,79 @@ Tools to rescue the running system.
 
         spm_packages = spm.get_installed_packages()
         total = len(spm_packages)
-        count = 0
         # perf: reuse temp file
         tmp_fd, tmp_path = const_mkstemp(
             prefix="equo.rescue.generate")
         os.close(tmp_fd)
 
-        for spm_package in spm_packages:
-            count += 1
-
-            # make sure the file is empty
-            with open(tmp_path, "w") as tmp_f:
-                tmp_f.flush()
+        def _generate():
+            count = 0
+            for spm_package in spm_packages:
+                count += 1
 
-            entropy_client.output(
-                teal(spm_package),
-                count=(count, total),
-                back=True,
-                header=brown(" @@ "))
+                # make sure the file is empty
+                with open(tmp_path, "w") as tmp_f:
+                    tmp_f.flush()
 
-            appended = spm.append_metadata_to_package(
-                spm_package, tmp_path)
-            if not appended:
                 entropy_client.output(
-                    "%s: %s" % (
-                        purple(_("Invalid package")),
-                        teal(spm_package),),
-                    importance=1,
-                    header=darkred(" @@ "))
-                continue
+                    teal(spm_package),
+                    count=(count, total),
+                    back=True,
+                    header=brown(" @@ "))
 
-            try:
-                data = spm.extract_package_metadata(tmp_path)
-            except Exception as err:
-                entropy.tools.print_traceback()
-                entropy_client.output(
-                    "%s, %s: %s" % (
-                        teal(spm_package),
-                        purple(_("Metadata generation error")),
-                        err,
-                        ),
-                    level="warning",
-                    importance=1,
-                    header=darkred(" @@ ")
-                    )
-                continue
+                appended = spm.append_metadata_to_package(
+                    spm_package, tmp_path)
+                if not appended:
+                    entropy_client.output(
+                        "%s: %s" % (
+                            purple(_("Invalid package")),
+                            teal(spm_package),),
+                        importance=1,
+                        header=darkred(" @@ "))
+                    continue
 
-            # Try to see if it's possible to use
-            # the revision of a possible old db
-            data['revision'] = etpConst['spmetprev']
-            # create atom string
-            atom = entropy.dep.create_package_atom_string(
-                data['category'],
-                data['name'],
-                data['version'],
-                data['versiontag'])
-
-            # now see if a revision is available
-            saved_rev = revisions_match.get(atom)
-            if saved_rev is not None:
-                saved_rev = saved_rev
-                data['revision'] = saved_rev
-
-            # set digest to "0" to disable entropy dependencies
-            # calculation check that forces the pkg to
-            # be pulled in if digest differs from the one on the repo
-            saved_digest = digest_match.get(atom, "0")
-            data['digest'] = saved_digest
-
-            package_id = inst_repo.addPackage(data,
-                revision = data['revision'])
-            inst_repo.storeInstalledPackage(package_id,
-                etpConst['spmdbid'])
-            inst_repo.commit()
+                try:
+                    data = spm.extract_package_metadata(tmp_path)
+                except Exception as err:
+                    entropy.tools.print_traceback()
+                    entropy_client.output(
+                        "%s, %s: %s" % (
+                            teal(spm_package),
+                            purple(_("Metadata generation error")),
+                            err,
+                            ),
+                        level="warning",
+                        importance=1,
+                        header=darkred(" @@ ")
+                        )
+                    continue
+
+                # Try to see if it's possible to use
+                # the revision of a possible old db
+                data['revision'] = etpConst['spmetprev']
+                # create atom string
+                atom = entropy.dep.create_package_atom_string(
+                    data['category'],
+                    data['name'],
+                    data['version'],
+                    data['versiontag'])
+
+                # now see if a revision is available
+                saved_rev = revisions_match.get(atom)
+                if saved_rev is not None:
+                    saved_rev = saved_rev
+                    data['revision'] = saved_rev
+
+                # set digest to "0" to disable entropy dependencies
+                # calculation check that forces the pkg to
+                # be pulled in if digest differs from the one on the repo
+                saved_digest = digest_match.get(atom, "0")
+                data['digest'] = saved_digest
+
+                data['original_repository'] = etpConst['spmdbid']
+                yield data
+
+        inst_repo.addPackages(_generate())
 
         try:
             os.remove(tmp_path)
@@ -81,6 +81,11 @@ Upgrade the system.
         _commands["--verbose"] = {}
         _commands["-v"] = {}
 
+        parser.add_argument(
+            "--profile", metavar="<file>", default=None,
+            help=_("write a dependency solver profile (JSON) to file"))
+        _commands["--profile"] = {}
+
         parser.add_argument(
             "--quiet", "-q", action="store_true",
             default=False,
@@ -15,24 +15,1057 @@
     entropy.client.interfaces.cache mixin methods)
 
 """
+import atexit
 import os
 import errno
 import hashlib
-import sys
+import json
+import shutil
+import sqlite3
 import tempfile
+import zlib
 
 from entropy.const import etpConst, const_debug_write, \
     const_debug_enabled, const_pid_exists, const_setup_perms, \
-    const_mkdtemp
+    const_setup_file, const_mkdtemp
 from entropy.core import Singleton
-from entropy.misc import TimeScheduled, ParallelTask, Lifo
+from entropy.misc import FlockFile
 import time
 import threading
-import copy
 
 import entropy.dump
 import entropy.tools
 
+
+class FileCacheBackend(object):
+
+    """
+    EntropyCacher storage backend keeping every cached object into its
+    own file (see entropy.dump), inside the given cache directory.
+    """
+
+    # files inside the cache directory owned by the backend
+    RESERVED_FILES = ()
+
+    # when evicting objects, shrink the cache directory to this ratio
+    # of the size limit, so that eviction does not run at every write
+    EVICTION_RATIO = 0.8
+
+    # errors raised by entropy.dump.unserialize_string() on bad data
+    _UNPICKLE_ERRORS = (ValueError, EOFError, IOError, OSError, TypeError,
+        AttributeError, ImportError, SystemError,
+        entropy.dump.pickle.UnpicklingError)
+
+    def load(self, key, cache_dir, aging_days = None):
+        """
+        Load the object stored with the given key.
+
+        @param key: cache data identifier
+        @type key: string
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @keyword aging_days: if int, consider the object invalid if older
+            than aging_days
+        @type aging_days: int
+        @return: the stored object or None
+        @rtype: any picklable object or None
+        """
+        return entropy.dump.loadobj(key, dump_dir = cache_dir,
+            aging_days = aging_days)
+
+    def load_serialized(self, key, cache_dir, aging_days = None):
+        """
+        Load the object stored with the given key, without unserializing
+        it (see entropy.dump.unserialize_string()).
+
+        @param key: cache data identifier
+        @type key: string
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @keyword aging_days: if int, consider the object invalid if older
+            than aging_days
+        @type aging_days: int
+        @return: the serialized object or None
+        @rtype: string or None
+        """
+        path = os.path.join(cache_dir, key) + entropy.dump.D_EXT
+        try:
+            if aging_days is not None:
+                mtime = os.path.getmtime(path)
+                if abs(time.time() - mtime) > (aging_days * 86400):
+                    return None
+            with open(path, "rb") as dump_f:
+                return dump_f.read()
+        except (IOError, OSError):
+            return None
+
+    def store(self, key, data, cache_dir, ignore_exceptions = True):
+        """
+        Store the given object with the given key.
+
+        @param key: cache data identifier
+        @type key: string
+        @param data: object to store
+        @type data: any picklable object
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @keyword ignore_exceptions: if False, raise storage errors
+        @type ignore_exceptions: bool
+        @raise IOError: if the object cannot be stored and
+            ignore_exceptions is False
+        """
+        entropy.dump.dumpobj(key, data, dump_dir = cache_dir,
+            ignore_exceptions = ignore_exceptions)
+
+    def store_many(self, items, cache_dir):
+        """
+        Store the given (key, data) pairs, storage errors are ignored.
+
+        @param items: list of (key, data) tuples
+        @type items: list
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        """
+        for key, data in items:
+            self.store(key, data, cache_dir)
+
+    def store_serialized_many(self, items, cache_dir,
+                              ignore_exceptions = True):
+        """
+        Store the given (key, serialized data) pairs, where data has been
+        serialized by entropy.dump.serialize_string().
+
+        @param items: list of (key, serialized data) tuples
+        @type items: list
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @keyword ignore_exceptions: if False, raise storage errors
+        @type ignore_exceptions: bool
+        @raise IOError: if the objects cannot be stored and
+            ignore_exceptions is False
+        """
+        for key, data in items:
+            entropy.dump.dumpobj(key, data, dump_dir = cache_dir,
+                ignore_exceptions = ignore_exceptions, serialized = True)
+
+    def remove(self, key, cache_dir):
+        """
+        Remove the object stored with the given key.
+
+        @param key: cache data identifier
+        @type key: string
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @return: True, if the object has been removed
+        @rtype: bool
+        """
+        path = os.path.join(cache_dir, key + entropy.dump.D_EXT)
+        try:
+            os.remove(path)
+            return True
+        except (OSError, IOError) as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return False
+
+    def remove_many(self, keys, cache_dir):
+        """
+        Remove the objects stored with the given keys, errors are ignored.
+
+        @param keys: list of cache data identifiers
+        @type keys: list
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        """
+        for key in keys:
+            try:
+                FileCacheBackend.remove(self, key, cache_dir)
+            except (IOError, OSError):
+                continue
+
+    def keys(self, cache_dir, prefix):
+        """
+        Return the keys of the objects stored under the given key
+        directory, for instance "deptree".
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @param prefix: key directory
+        @type prefix: string
+        @return: list of cache data identifiers
+        @rtype: list
+        """
+        d_ext = entropy.dump.D_EXT
+        try:
+            names = os.listdir(os.path.join(cache_dir, prefix))
+        except (IOError, OSError):
+            return []
+        return [prefix + "/" + x[:-len(d_ext)] for x in names \
+                    if x.endswith(d_ext)]
+
+    def clear(self, cache_item, cache_dir):
+        """
+        Remove all the objects stored in the key directory of the
+        given cache item.
+
+        @param cache_item: cache item identifier (see
+            EntropyCacher.CACHE_IDS)
+        @type cache_item: string
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        """
+        dump_path = os.path.join(cache_dir, cache_item)
+
+        dump_dir = os.path.dirname(dump_path)
+        for currentdir, subdirs, files in os.walk(dump_dir):
+            path = os.path.join(dump_dir, currentdir)
+            for item in files:
+                if item.endswith(entropy.dump.D_EXT):
+                    item = os.path.join(path, item)
+                    try:
+                        os.remove(item)
+                    except (OSError, IOError,):
+                        pass
+            try:
+                if not os.listdir(path):
+                    os.rmdir(path)
+            except (OSError, IOError,):
+                pass
+
+    def purge(self, cache_dir, kept_prefixes):
+        """
+        Remove the whole content of the cache directory but the objects
+        stored under the given key directories.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @param kept_prefixes: key directories to keep, for instance
+            "deptree"
+        @type kept_prefixes: set
+        """
+        try:
+            items = os.listdir(cache_dir)
+        except (IOError, OSError):
+            return
+        for item in items:
+            if item in kept_prefixes or item in self.RESERVED_FILES:
+                continue
+            path = os.path.join(cache_dir, item)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, True)
+                else:
+                    os.remove(path)
+            except (shutil.Error, IOError, OSError):
+                continue
+
+    def compact(self, cache_dir):
+        """
+        Reclaim the storage space left unused by removed objects.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        """
+
+    def flush(self, cache_dir):
+        """
+        Write the pending metadata updates of the objects, such as their
+        last access time.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        """
+
+    def usage(self, cache_dir):
+        """
+        Return the size and the last access time of the stored objects.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @return: list of (key, size in bytes, last access time) tuples
+        @rtype: list
+        """
+        return self._file_usage(cache_dir)
+
+    def _file_usage(self, cache_dir):
+        """
+        Return the size and the last access time of the objects stored
+        one per file, see usage().
+        """
+        d_ext = entropy.dump.D_EXT
+        entries = []
+        for currentdir, subdirs, files in os.walk(cache_dir):
+            for item in files:
+                if not item.endswith(d_ext):
+                    continue
+                path = os.path.join(currentdir, item)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = os.path.relpath(path, cache_dir)[:-len(d_ext)]
+                entries.append((key.replace(os.path.sep, "/"), st.st_size,
+                                max(st.st_atime, st.st_mtime)))
+        return entries
+
+    def size(self, cache_dir):
+        """
+        Return the size of the stored objects.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @return: size in bytes
+        @rtype: int
+        """
+        return sum(x[1] for x in self.usage(cache_dir))
+
+    def evict(self, cache_dir, size_limit):
+        """
+        Remove the least recently used objects if their size exceeds
+        the given limit.
+
+        @param cache_dir: cache directory
+        @type cache_dir: string
+        @param size_limit: size limit in bytes
+        @type size_limit: int
+        @return: number of removed objects
+        @rtype: int
+        """
+        if self.size(cache_dir) <= size_limit:
+            return 0
+
+        entries = sorted(self.usage(cache_dir), key = lambda x: x[2])
+        exceeding = sum(x[1] for x in entries) - \
+            int(size_limit * self.EVICTION_RATIO)
+        keys = []
+        for key, size, atime in entries:
+            if exceeding <= 0:
+                break
+            keys.append(key)
+            exceeding -= size
+
+        self.remove_many(keys, cache_dir)
+        self.compact(cache_dir)
+        return len(keys)
+
+
+class PackedCacheBackend(FileCacheBackend):
+
+    """
+    EntropyCacher storage backend keeping all the cached objects of a
+    cache directory into a single SQLite key-value file, saving the
+    file creation, permissions setup and rename syscalls of each stored
+    object and the inodes of the per-file layout. Objects are written
+    in batches, each one committed atomically. Large objects are stored
+    compressed.
+    Objects stored by the per-file layout into the same cache directory
+    are cleared and evicted along with the packed ones.
+    """
+
+    PACK_FILE = "__packed_cache__.db"
+
+    # packs with a different schema version are recreated
+    SCHEMA_VERSION = 1
+
+    # compress objects whose serialized size exceeds this amount of bytes
+    COMPRESS_THRESHOLD = 4096
+
+    RESERVED_FILES = (PACK_FILE, PACK_FILE + "-journal")
+
+    # compact the pack when its unused pages exceed this ratio
+    COMPACT_RATIO = 0.25
+
+    # and this amount
+    COMPACT_MIN_PAGES = 256
+
+    def __init__(self):
+        object.__init__(self)
+        self._conns = {}
+        self._accessed = {}
+        self._lock = threading.RLock()
+
+    def _path(self, cache_dir):
+        """
+        Return the path to the pack file of the given cache directory.
+        """
+        return os.path.join(cache_dir, self.PACK_FILE)
+
+    def _connection(self, cache_dir, create = False):
+        """
+        Return the connection to the pack file of the given cache
+        directory, or None if it does not exist and create is False.
+        The connection is reopened if the pack file has been replaced
+        or removed (for instance by a cache directory cleanup done by
+        another process) or if the current process has been forked.
+        Must be called with the backend lock held.
+
+        @raise sqlite3.Error: if the pack file cannot be opened
+        @raise OSError: if the pack file cannot be created
+        """
+        path = self._path(cache_dir)
+        try:
+            st = os.stat(path)
+            ident = (st.st_dev, st.st_ino, os.getpid())
+        except OSError as err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            ident = None
+
+        cached = self._conns.get(cache_dir)
+        if cached is not None:
+            conn, conn_ident = cached
+            if ident is not None and ident == conn_ident:
+                return conn
+            del self._conns[cache_dir]
+            if conn_ident[2] == os.getpid():
+                conn.close()
+
+        if ident is None:
+            if not create:
+                return None
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o775)
+                const_setup_perms(cache_dir, etpConst['entropygid'])
+
+        conn = sqlite3.connect(path, timeout = 30.0,
+            check_same_thread = False)
+        conn.text_factory = str
+        try:
+            conn.execute("PRAGMA synchronous = NORMAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                self._setup(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        if ident is None:
+            const_setup_file(path, etpConst['entropygid'], 0o664)
+            st = os.stat(path)
+            ident = (st.st_dev, st.st_ino, os.getpid())
+
+        self._conns[cache_dir] = (conn, ident)
+        return conn
+
+    def _setup(self, conn):
+        """
+        Create the pack schema, dropping the objects stored with a
+        different one.
+        """
+        # manual transaction handling, DDL statements would commit
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version != self.SCHEMA_VERSION:
+                    conn.execute("DROP TABLE IF EXISTS cache")
+                    # keep the blob last, so that the other columns can
+                    # be read without going through its overflow pages
+                    conn.execute("""
+                    CREATE TABLE cache (
+                        key VARCHAR PRIMARY KEY,
+                        mtime FLOAT,
+                        atime FLOAT,
+                        size INTEGER,
+                        compressed INTEGER,
+                        data BLOB
+                    )""")
+                    # size checks and eviction scan this one only
+                    conn.execute("""
+                    CREATE INDEX cache_atime ON cache (atime, size)
+                    """)
+                    conn.execute("PRAGMA user_version = %d" % (
+                            self.SCHEMA_VERSION,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.isolation_level = ""
+
+    def load(self, key, cache_dir, aging_days = None):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        data = self.load_serialized(key, cache_dir, aging_days = aging_days)
+        if data is None:
+            return None
+        try:
+            return entropy.dump.unserialize_string(data)
+        except self._UNPICKLE_ERRORS:
+            return None
+
+    def load_serialized(self, key, cache_dir, aging_days = None):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return None
+                row = conn.execute(
+                    "SELECT mtime, compressed, data FROM cache "
+                    "WHERE key = ?", (key,)).fetchone()
+            except (sqlite3.Error, OSError):
+                return None
+            if row is None:
+                return None
+            accessed = self._accessed.setdefault(cache_dir, {})
+            accessed[key] = time.time()
+
+        mtime, compressed, data = row
+        if aging_days is not None:
+            if abs(time.time() - mtime) > (aging_days * 86400):
+                return None
+        data = bytes(data)
+        if compressed:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                return None
+        return data
+
+    def store(self, key, data, cache_dir, ignore_exceptions = True):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        try:
+            self._store_many([(key, data)], cache_dir)
+        except (sqlite3.Error, IOError, OSError) as err:
+            if not ignore_exceptions:
+                raise IOError("cannot store %s: %s" % (key, err,))
+
+    def store_many(self, items, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        try:
+            self._store_many(items, cache_dir)
+        except (sqlite3.Error, IOError, OSError) as err:
+            if const_debug_enabled():
+                const_debug_write(__name__,
+                    "PackedCacheBackend.store_many: %s" % (repr(err),))
+
+    def store_serialized_many(self, items, cache_dir,
+                              ignore_exceptions = True):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        try:
+            self._store_many(items, cache_dir, serialized = True)
+        except (sqlite3.Error, IOError, OSError) as err:
+            if not ignore_exceptions:
+                raise IOError("cannot store objects: %s" % (err,))
+            if const_debug_enabled():
+                const_debug_write(__name__,
+                    "PackedCacheBackend.store_serialized_many: %s" % (
+                        repr(err),))
+
+    def _store_many(self, items, cache_dir, serialized = False):
+        """
+        Store the given (key, data) pairs in a single transaction.
+        If serialized is True, data has already been serialized.
+        """
+        rows = []
+        mtime = time.time()
+        for key, data in items:
+            if serialized:
+                blob = data
+            else:
+                try:
+                    blob = entropy.dump.serialize_string(data)
+                except (RuntimeError, TypeError,
+                        entropy.dump.pickle.PicklingError) as err:
+                    const_debug_write(__name__,
+                        "PackedCacheBackend: cannot serialize %s: %s" % (
+                            key, repr(err)))
+                    continue
+            compressed = len(blob) > self.COMPRESS_THRESHOLD
+            if compressed:
+                blob = zlib.compress(blob)
+            rows.append((key, mtime, mtime, len(blob),
+                         int(compressed), sqlite3.Binary(blob)))
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connection(cache_dir, create = True)
+            try:
+                self._flush(conn, cache_dir)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                    rows)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def _flush(self, conn, cache_dir):
+        """
+        Write the pending last access time updates of the objects of the
+        given cache directory, without committing.
+        Must be called with the backend lock held.
+        """
+        accessed = self._accessed.pop(cache_dir, None)
+        if accessed:
+            conn.executemany("UPDATE cache SET atime = ? WHERE key = ?",
+                [(atime, key) for key, atime in accessed.items()])
+
+    def flush(self, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    self._accessed.pop(cache_dir, None)
+                    return
+                self._flush(conn, cache_dir)
+                conn.commit()
+            except (sqlite3.Error, OSError) as err:
+                if const_debug_enabled():
+                    const_debug_write(__name__,
+                        "PackedCacheBackend.flush: %s" % (repr(err),))
+
+    def remove(self, key, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        removed = FileCacheBackend.remove(self, key, cache_dir)
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return removed
+                cur = conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                conn.commit()
+            except (sqlite3.Error, OSError):
+                return removed
+        return removed or cur.rowcount > 0
+
+    def remove_many(self, keys, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        FileCacheBackend.remove_many(self, keys, cache_dir)
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return
+                conn.executemany("DELETE FROM cache WHERE key = ?",
+                    [(x,) for x in keys])
+                conn.commit()
+            except (sqlite3.Error, OSError):
+                return
+
+    def keys(self, cache_dir, prefix):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        keys = set(FileCacheBackend.keys(self, cache_dir, prefix))
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is not None:
+                    cur = conn.execute(
+                        "SELECT key FROM cache WHERE key > ? AND key < ?",
+                        (prefix + "/", prefix + "0"))
+                    keys.update(x for x, in cur if "/" not in \
+                                    x[len(prefix) + 1:])
+            except (sqlite3.Error, OSError):
+                pass
+        return sorted(keys)
+
+    def clear(self, cache_item, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        FileCacheBackend.clear(self, cache_item, cache_dir)
+        prefix = os.path.dirname(cache_item)
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return
+                if prefix:
+                    conn.execute(
+                        "DELETE FROM cache WHERE key > ? AND key < ?",
+                        (prefix + "/", prefix + "0"))
+                else:
+                    conn.execute("DELETE FROM cache")
+                conn.commit()
+            except (sqlite3.Error, OSError):
+                return
+        self.compact(cache_dir)
+
+    def purge(self, cache_dir, kept_prefixes):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        FileCacheBackend.purge(self, cache_dir, kept_prefixes)
+        kept_prefixes = sorted(kept_prefixes)
+        sql = "DELETE FROM cache"
+        if kept_prefixes:
+            sql += " WHERE " + " AND ".join(
+                ["NOT (key > ? AND key < ?)"] * len(kept_prefixes))
+        args = []
+        for prefix in kept_prefixes:
+            args.extend((prefix + "/", prefix + "0"))
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return
+                conn.execute(sql, args)
+                conn.commit()
+            except (sqlite3.Error, OSError):
+                return
+        self.compact(cache_dir)
+
+    def compact(self, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is None:
+                    return
+                pages = conn.execute("PRAGMA page_count").fetchone()[0]
+                free_pages = conn.execute(
+                    "PRAGMA freelist_count").fetchone()[0]
+                if free_pages < self.COMPACT_MIN_PAGES:
+                    return
+                if free_pages < pages * self.COMPACT_RATIO:
+                    return
+                conn.execute("VACUUM")
+            except (sqlite3.Error, OSError) as err:
+                if const_debug_enabled():
+                    const_debug_write(__name__,
+                        "PackedCacheBackend.compact: %s" % (repr(err),))
+
+    def usage(self, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        entries = self._file_usage(cache_dir)
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is not None:
+                    self._flush(conn, cache_dir)
+                    conn.commit()
+                    entries.extend(conn.execute(
+                            "SELECT key, size, atime FROM cache"))
+            except (sqlite3.Error, OSError):
+                pass
+        return entries
+
+    def size(self, cache_dir):
+        """
+        Reimplemented from FileCacheBackend.
+        """
+        size = sum(x[1] for x in self._file_usage(cache_dir))
+        with self._lock:
+            try:
+                conn = self._connection(cache_dir)
+                if conn is not None:
+                    size += conn.execute(
+                        "SELECT COALESCE(SUM(size), 0) FROM cache"
+                        ).fetchone()[0]
+            except (sqlite3.Error, OSError):
+                pass
+        return size
+
+    def close(self):
+        """
+        Close all the pack files.
+        """
+        with self._lock:
+            conns = list(self._conns.values())
+            self._conns.clear()
+            for conn, ident in conns:
+                if ident[2] == os.getpid():
+                    conn.close()
+
+
+class CacheMetrics(Singleton):
+    """
+    Registry of the cache usage metrics: hits, misses, bytes read and
+    written, unserialization time and most accessed keys, by cache
+    identifier. Collection is disabled by default and instrumented code
+    only checks the "enabled" attribute, set the ETP_CACHE_STATS
+    environment variable or call enable() to turn it on. When enabled
+    through ETP_CACHE_STATS, the collected metrics are merged into the
+    file at path() at exit, see "equo cache stats".
+    """
+
+    # number of keys whose accesses are counted, per cache, the least
+    # accessed ones are dropped once twice this amount is reached
+    TRACKED_KEYS = 256
+
+    _COUNTERS = ("hits", "misses", "bytes_read", "bytes_written", "writes",
+                 "unserializations", "unserialize_time")
+
+    def init_singleton(self):
+        self._mutex = threading.Lock()
+        self.enabled = bool(os.getenv("ETP_CACHE_STATS"))
+        self.reset()
+        if self.enabled:
+            atexit.register(self._save_at_exit)
+
+    @classmethod
+    def path(cls):
+        """
+        Return the path to the file metrics are saved to.
+        """
+        return os.path.join(etpConst['entropyworkdir'], "cache_stats.json")
+
+    def enable(self):
+        """
+        Enable metrics collection.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Disable metrics collection, collected data is kept.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop the collected data.
+        """
+        with self._mutex:
+            self._caches = {}
+            self._started = time.time()
+
+    def _cache(self, cache_id):
+        """
+        Return the metrics of the given cache. Must be called with the
+        mutex held.
+        """
+        cache = self._caches.get(cache_id)
+        if cache is None:
+            cache = dict((x, 0) for x in self._COUNTERS)
+            cache["unserialize_time"] = 0.0
+            cache["keys"] = {}
+            self._caches[cache_id] = cache
+        return cache
+
+    def _access(self, cache, key):
+        """
+        Count an access to the given key. Must be called with the mutex
+        held.
+        """
+        key = "%s" % (key,)
+        keys = cache["keys"]
+        keys[key] = keys.get(key, 0) + 1
+        if len(keys) >= 2 * self.TRACKED_KEYS:
+            top_keys = sorted(keys.items(), key = lambda x: -x[1])
+            cache["keys"] = dict(top_keys[:self.TRACKED_KEYS])
+
+    def hit(self, cache_id, key, size = 0, unserialize_time = None):
+        """
+        Account a cache hit.
+
+        @param cache_id: the cache identifier
+        @type cache_id: string
+        @param key: the cache key
+        @type key: string
+        @keyword size: the amount of bytes read
+        @type size: int
+        @keyword unserialize_time: the time spent unserializing the
+            object, in seconds, if it has been unserialized
+        @type unserialize_time: float
+        """
+        if not self.enabled:
+            return
+        with self._mutex:
+            cache = self._cache(cache_id)
+            cache["hits"] += 1
+            cache["bytes_read"] += size
+            if unserialize_time is not None:
+                cache["unserializations"] += 1
+                cache["unserialize_time"] += unserialize_time
+            self._access(cache, key)
+
+    def miss(self, cache_id, key):
+        """
+        Account a cache miss.
+
+        @param cache_id: the cache identifier
+        @type cache_id: string
+        @param key: the cache key
+        @type key: string
+        """
+        if not self.enabled:
+            return
+        with self._mutex:
+            cache = self._cache(cache_id)
+            cache["misses"] += 1
+            self._access(cache, key)
+
+    def write(self, cache_id, size):
+        """
+        Account a cache write.
+
+        @param cache_id: the cache identifier
+        @type cache_id: string
+        @param size: the amount of bytes written
+        @type size: int
+        """
+        if not self.enabled:
+            return
+        with self._mutex:
+            cache = self._cache(cache_id)
+            cache["writes"] += 1
+            cache["bytes_written"] += size
+
+    def report(self, top = 10):
+        """
+        Return the collected data.
+
+        @keyword top: number of most accessed keys to return, per cache
+        @type top: int
+        @return: a dictionary, with "since" (collection start time) and
+            "caches" mapping cache identifiers to their counters (see
+            _COUNTERS, "unserialize_time" is in seconds) and "top_keys",
+            the list of [key, accesses] pairs of the most accessed keys
+        @rtype: dict
+        """
+        with self._mutex:
+            caches = {}
+            for cache_id, cache in self._caches.items():
+                data = dict((x, cache[x]) for x in self._COUNTERS)
+                top_keys = sorted(cache["keys"].items(),
+                                  key = lambda x: (-x[1], x[0]))
+                data["top_keys"] = [list(x) for x in top_keys[:top]]
+                caches[cache_id] = data
+            return {
+                "since": self._started,
+                "caches": caches,
+            }
+
+    @classmethod
+    def merge(cls, report, other_report):
+        """
+        Merge two reports returned by report(), the number of the most
+        accessed keys kept is capped to TRACKED_KEYS.
+
+        @param report: a report
+        @type report: dict
+        @param other_report: another report
+        @type other_report: dict
+        @return: the merged report
+        @rtype: dict
+        """
+        caches = {}
+        for cache_id in set(report["caches"]) | set(other_report["caches"]):
+            data = dict((x, 0) for x in cls._COUNTERS)
+            keys = {}
+            for rep in (report, other_report):
+                rep_data = rep["caches"].get(cache_id)
+                if rep_data is None:
+                    continue
+                for counter in cls._COUNTERS:
+                    data[counter] += rep_data.get(counter, 0)
+                for key, count in rep_data.get("top_keys", []):
+                    keys[key] = keys.get(key, 0) + count
+            top_keys = sorted(keys.items(), key = lambda x: (-x[1], x[0]))
+            data["top_keys"] = [list(x) for x in \
+                                    top_keys[:cls.TRACKED_KEYS]]
+            caches[cache_id] = data
+        return {
+            "since": min(report["since"], other_report["since"]),
+            "caches": caches,
+        }
+
+    @classmethod
+    def load(cls, path = None):
+        """
+        Load the metrics previously saved by save().
+
+        @keyword path: alternative file path
+        @type path: string
+        @return: a report (see report()) or None
+        @rtype: dict or None
+        """
+        if path is None:
+            path = cls.path()
+        try:
+            with open(path, "r") as stats_f:
+                report = json.load(stats_f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(report, dict) or "caches" not in report:
+            return None
+        return report
+
+    def save(self, path = None):
+        """
+        Merge the collected data into the file at path() and reset it.
+        Concurrent savers are serialized through an exclusive flock() on
+        the file at path() + ".lock".
+
+        @keyword path: alternative file path
+        @type path: string
+        @raise IOError: if the file cannot be written
+        """
+        if path is None:
+            path = self.path()
+        report = self.report(top = self.TRACKED_KEYS)
+        self.reset()
+
+        # the stats file is replaced by rename(), lock a separate file
+        lock_path = path + ".lock"
+        try:
+            flock_f = FlockFile(lock_path)
+        except FlockFile.FlockFileInitFailure as err:
+            raise IOError("cannot save cache metrics: %s" % (err,))
+
+        tmp_path = path + ".%d" % (os.getpid(),)
+        try:
+            try:
+                # let other users of the entropy group lock it too
+                const_setup_file(lock_path, etpConst['entropygid'], 0o664)
+            except OSError:
+                pass
+
+            with flock_f.exclusive():
+                stored = self.load(path = path)
+                if stored is not None:
+                    report = self.merge(stored, report)
+
+                with open(tmp_path, "w") as stats_f:
+                    json.dump(report, stats_f, sort_keys = True)
+                const_setup_file(tmp_path, etpConst['entropygid'], 0o664)
+                os.rename(tmp_path, path)
+        except (IOError, OSError) as err:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise IOError("cannot save cache metrics: %s" % (err,))
+        finally:
+            flock_f.close()
+
+    def _save_at_exit(self):
+        """
+        Save the collected data, if any, at exit.
+        """
+        if not self._caches:
+            return
+        try:
+            self.save()
+        except IOError as err:
+            const_debug_write(__name__, "%s" % (err,))
+
+
 class EntropyCacher(Singleton):
 
     CACHE_IDS = {
@@ -46,22 +1079,55 @@ class EntropyCacher(Singleton):
             'world_masked': 'world_available/masked_cache_',
             'check_package_update': 'check_update/package_update_',
             'depends_tree': 'depends/depends_tree_',
+            'dep_subgraph': 'depsubgraph/dep_subgraph',
             'filter_satisfied_deps': 'depfilter/filter_satisfied_deps_',
             'library_breakage': 'libs_break/library_breakage_',
             'mask_filter': 'match/mask_filter',
         }
 
+    # (key prefix, cache identifier) pairs, longer prefixes first
+    _CACHE_ID_PREFIXES = sorted(zip(CACHE_IDS.values(), CACHE_IDS.keys()),
+                                reverse = True)
+
     # Max number of cache objects written at once
     _OBJS_WRITTEN_AT_ONCE = 250
 
-    # Number of seconds between cache writeback to disk
+    # Number of seconds pushed objects are kept in RAM before being
+    # written to disk, further pushes of the same key replace them
     WRITEBACK_TIMEOUT = 5
 
+    # Number of threads writing the pushed objects to disk
+    WRITER_THREADS = 2
+
+    # Maximum size, in bytes, of the serialized objects waiting to be
+    # written to disk. Once exceeded, the writer threads are woken up
+    # and push() waits for them, at most BACKPRESSURE_TIMEOUT seconds.
+    PENDING_BYTES_LIMIT = 32 * 1024 * 1024
+    BACKPRESSURE_TIMEOUT = 5
+
     # If True, in-ram cache will be used to mitigate
     # concurrent push/pop executions with push() not
     # yet able to write data to disk.
     STASHING_CACHE = True
 
+    # If set, objects stored into the default cache directory are
+    # written one per file instead of into the packed store.
+    DISABLE_PACKED_CACHE = os.getenv("ETP_DISABLE_PACKED_CACHE")
+
+    # Maximum size of the default cache directory, in MiB, least
+    # recently used objects are evicted by the cache writer once it is
+    # exceeded. 0 disables the limit.
+    SIZE_LIMIT = entropy.tools.setting_to_int(
+        os.getenv("ETP_CACHE_SIZE_LIMIT", "256"), 0, None)
+    if SIZE_LIMIT is None:
+        SIZE_LIMIT = 256
+
+    # Minimum number of seconds between two size limit checks
+    EVICTION_INTERVAL = 60
+
+    _FILE_BACKEND = FileCacheBackend()
+    _PACKED_BACKEND = PackedCacheBackend()
+
     """
     Entropy asynchronous and synchronous cache writer
     and reader. This class is a Singleton and contains
@@ -99,30 +1165,37 @@ class EntropyCacher(Singleton):
 
     """
 
-    class SemaphoreTimeScheduled(TimeScheduled):
-
-        def __init__(self, sem, *args, **kwargs):
-            self._sem = sem
-            TimeScheduled.__init__(self, *args, **kwargs)
-
-        def kill(self):
-            self._sem.release()
-            return TimeScheduled.kill(self)
-
     def init_singleton(self):
         """
         Singleton overloaded method. Equals to __init__.
         This is the place where all the properties initialization
         takes place.
         """
-        self.__copy = copy
         self.__alive = False
-        self.__cache_writer = None
-        self.__cache_buffer = Lifo()
-        self.__stashing_cache = {}
+        self.__writers = []
+        # (key, cache_dir) -> serialized object waiting to be written,
+        # the last push() of a key wins
+        self.__pending = {}
+        self.__pending_bytes = 0
+        # (key, cache_dir) -> serialized object being written
+        self.__writing = {}
+        # guards the above and the statistics, notified whenever
+        # they change
+        self.__pending_cond = threading.Condition(threading.Lock())
+        self.__stats = {
+            'pushed': 0,
+            'coalesced': 0,
+            'written': 0,
+            'batches': 0,
+            'backpressure': 0,
+            'write_time': 0.0,
+            'write_time_max': 0.0,
+        }
         self.__inside_with_stmt = 0
         self.__dump_data_lock = threading.Lock()
-        self.__worker_sem = threading.Semaphore(0)
+        self.__eviction_lock = threading.Lock()
+        self.__eviction_time = 0.0
+        self.__metrics = CacheMetrics()
         # this lock ensures that all the writes are hold while it's acquired
         self.__enter_context_lock = threading.RLock()
 
@@ -132,6 +1205,10 @@ class EntropyCacher(Singleton):
         """
         self.__enter_context_lock.acquire()
         self.__inside_with_stmt += 1
+        # wait for the writes already started by the writer threads
+        with self.__pending_cond:
+            while self.__writing:
+                self.__pending_cond.wait()
 
     def __exit__(self, exc_type, exc_value, traceback):
         """
@@ -140,112 +1217,155 @@ class EntropyCacher(Singleton):
         self.__inside_with_stmt -= 1
         self.__enter_context_lock.release()
 
-    def __copy_obj(self, obj):
+    def __writer(self):
+        """
+        Body of the writer threads. Sleep until objects are pushed, give
+        them WRITEBACK_TIMEOUT seconds to be replaced by further pushes
+        (unless PENDING_BYTES_LIMIT is exceeded) and write them to disk.
+        A batch that fails to be written is dropped and reported, the
+        thread keeps serving the following pushes.
         """
-        Return a copy of an object done by the standard
-        library "copy" module.
+        cond = self.__pending_cond
+        while True:
+            with cond:
+                while self.__alive and not self.__pending:
+                    cond.wait()
+                if self.__alive and self.__pending_bytes <= \
+                        EntropyCacher.PENDING_BYTES_LIMIT:
+                    cond.wait(EntropyCacher.WRITEBACK_TIMEOUT)
+                if not self.__alive:
+                    break
+            try:
+                self.__drain()
+            except Exception:
+                if not self.__alive:
+                    # stopped, or interpreter shutdown, while writing
+                    break
+                entropy.tools.print_traceback()
 
-        @param obj: object to copy
-        @type obj: any Python object
-        @rtype: copied object
-        @return: copied object
+    def __take_batch(self):
         """
-        return self.__copy.deepcopy(obj)
+        Move at most _OBJS_WRITTEN_AT_ONCE pending objects to the ones
+        being written and return them. Objects whose key is already being
+        written are left pending, so that writes of the same key are never
+        reordered.
+        """
+        max_count = EntropyCacher._OBJS_WRITTEN_AT_ONCE
+        with self.__pending_cond:
+            obj_keys = []
+            for obj_key in self.__pending:
+                if obj_key in self.__writing:
+                    continue
+                obj_keys.append(obj_key)
+                if len(obj_keys) >= max_count:
+                    break
 
-    def __cacher(self, run_until_empty = False, sync = False, _loop=False):
+            batch = []
+            for obj_key in obj_keys:
+                data = self.__pending[obj_key]
+                # make it visible to pop() before removing it
+                self.__writing[obj_key] = data
+                del self.__pending[obj_key]
+                self.__pending_bytes -= len(data)
+                batch.append((obj_key, data))
+            return batch
+
+    def __write(self, batch):
         """
-        This is where the actual asynchronous copy takes
-        place. __cacher runs on a different threads and
-        all the operations done by this are atomic and
-        thread-safe. It just loops over and over until
-        __alive becomes False.
+        Write the given batch, taken by __take_batch(), to disk.
         """
+        start_t = time.time()
         try:
-            if self.__inside_with_stmt != 0:
+            batches = {}
+            for (key, cache_dir), data in batch:
+                batches.setdefault(cache_dir, []).append((key, data))
+            for cache_dir, items in batches.items():
+                self.backend(cache_dir).store_serialized_many(
+                    items, cache_dir)
+        finally:
+            write_t = time.time() - start_t
+            with self.__pending_cond:
+                for obj_key, data in batch:
+                    del self.__writing[obj_key]
+                stats = self.__stats
+                stats['written'] += len(batch)
+                stats['batches'] += 1
+                stats['write_time'] += write_t
+                stats['write_time_max'] = max(
+                    stats['write_time_max'], write_t)
+                self.__pending_cond.notify_all()
+
+        metrics = self.__metrics
+        if metrics.enabled:
+            for (key, cache_dir), data in batch:
+                metrics.write(self._cache_id(key, cache_dir), len(data))
+
+        if const_debug_enabled():
+            const_debug_write(
+                __name__,
+                "EntropyCacher.__write: %d objs written in %.3fs" % (
+                    len(batch), write_t,))
+        self.__evict()
+
+    def __drain(self):
+        """
+        Write all the pending objects to disk, unless writes are paused
+        by the with statement.
+        """
+        while True:
+            with self.__enter_context_lock:
+                if self.__inside_with_stmt != 0:
+                    return
+                batch = self.__take_batch()
+            if not batch:
                 return
-        except AttributeError:
-            # interpreter shutdown
-            pass
+            self.__write(batch)
 
-        # make sure our set delay is respected
+    def __evict(self, force = False):
+        """
+        Enforce SIZE_LIMIT on the default cache directory, at most once
+        every EVICTION_INTERVAL seconds, unless force is True.
+        """
         try:
-            self.__cache_writer.set_delay(EntropyCacher.WRITEBACK_TIMEOUT)
+            size_limit = EntropyCacher.SIZE_LIMIT
         except AttributeError:
-            # can be None
-            pass
-
-        # sleep if there's nothing to do
-        if _loop:
-            try:
-                # CANBLOCK
-                self.__worker_sem.acquire()
-                # we just consumed one acquire()
-                # that was dedicated to actual data,
-                # put it back
-                self.__worker_sem.release()
-            except AttributeError:
-                pass
-
-        def _commit_data(_massive_data):
-            for (key, cache_dir), data in _massive_data:
-                d_o = entropy.dump.dumpobj
-                if d_o is not None:
-                    d_o(key, data, dump_dir = cache_dir)
-
-        while self.__alive or run_until_empty:
+            # interpreter shutdown
+            return
+        if not size_limit:
+            return
+        if not self.__eviction_lock.acquire(False):
+            # already running
+            return
+        try:
+            cur_t = time.time()
+            elapsed = cur_t - self.__eviction_time
+            if not force and elapsed < EntropyCacher.EVICTION_INTERVAL:
+                return
+            self.__eviction_time = cur_t
 
-            if const_debug_enabled():
+            cache_dir = self.current_directory()
+            evicted = self.backend(cache_dir).evict(
+                cache_dir, size_limit * 1024 * 1024)
+            if evicted and const_debug_enabled():
                 const_debug_write(__name__,
-                    "EntropyCacher.__cacher: loop: %s, alive: %s, empty: %s" % (
-                        _loop, self.__alive, run_until_empty,))
+                    "EntropyCacher.__evict: %d objects evicted" % (
+                        evicted,))
+        finally:
+            self.__eviction_lock.release()
 
-            with self.__enter_context_lock:
-                massive_data = []
-                try:
-                    massive_data_count = EntropyCacher._OBJS_WRITTEN_AT_ONCE
-                except AttributeError: # interpreter shutdown
-                    break
-                while massive_data_count > 0:
-
-                    if _loop:
-                        # extracted an item from worker_sem
-                        # call down() on the semaphore without caring
-                        # can't sleep here because we're in a critical region
-                        # holding __enter_context_lock
-                        self.__worker_sem.acquire(False)
-
-                    massive_data_count -= 1
-                    try:
-                        data = self.__cache_buffer.pop()
-                    except (ValueError, TypeError,):
-                        # TypeError is when objects are being destroyed
-                        break # stack empty
-                    massive_data.append(data)
-
-                if not massive_data:
-                    break
-
-                task = ParallelTask(_commit_data, massive_data)
-                task.name = "EntropyCacherCommitter"
-                task.daemon = not sync
-                task.start()
-                if sync:
-                    task.join()
-
-                if const_debug_enabled():
-                    const_debug_write(
-                        __name__,
-                        "EntropyCacher.__cacher [%s], writing %s objs" % (
-                            task, len(massive_data),))
-
-                if EntropyCacher.STASHING_CACHE:
-                    for (key, cache_dir), data in massive_data:
-                        try:
-                            del self.__stashing_cache[(key, cache_dir)]
-                        except (AttributeError, KeyError,):
-                            continue
-                del massive_data[:]
-                del massive_data
+    @classmethod
+    def _cache_id(cls, key, cache_dir):
+        """
+        Return the CacheMetrics cache identifier of the given key: the
+        CACHE_IDS one, the name of the cache directory if not the default
+        one or "other".
+        """
+        for prefix, cache_id in cls._CACHE_ID_PREFIXES:
+            if key.startswith(prefix):
+                return cache_id
+        if cache_dir != cls.current_directory():
+            return os.path.basename(cache_dir.rstrip(os.path.sep))
+        return "other"
 
     @classmethod
     def current_directory(cls):
@@ -254,6 +1374,27 @@ class EntropyCacher(Singleton):
         """
         return entropy.dump.D_DIR
 
+    @classmethod
+    def backend(cls, cache_dir = None):
+        """
+        Return the storage backend handling the given cache directory.
+        Objects stored into the default one (see current_directory())
+        are packed into a single file (see PackedCacheBackend), unless
+        the ETP_DISABLE_PACKED_CACHE environment variable is set.
+
+        @keyword cache_dir: alternative cache directory
+        @type cache_dir: string
+        @return: the storage backend
+        @rtype: FileCacheBackend
+        """
+        if cache_dir is None:
+            cache_dir = cls.current_directory()
+        if cls.DISABLE_PACKED_CACHE:
+            return cls._FILE_BACKEND
+        if cache_dir != cls.current_directory():
+            return cls._FILE_BACKEND
+        return cls._PACKED_BACKEND
+
     def start(self):
         """
         This is the method used to start the asynchronous cache
@@ -263,17 +1404,18 @@ class EntropyCacher(Singleton):
 
         @return: None
         """
-        self.__cache_buffer.clear()
-        self.__cache_writer = EntropyCacher.SemaphoreTimeScheduled(
-            self.__worker_sem, EntropyCacher.WRITEBACK_TIMEOUT,
-            self.__cacher, _loop=True)
-        self.__cache_writer.daemon = True
-        self.__cache_writer.name = "EntropyCacheWriter"
-        self.__cache_writer.set_delay_before(True)
-        self.__cache_writer.start()
-        while not self.__cache_writer.isAlive():
-            continue
-        self.__alive = True
+        if self.__writers:
+            return
+        with self.__pending_cond:
+            self.__pending.clear()
+            self.__pending_bytes = 0
+            self.__alive = True
+        for index in range(EntropyCacher.WRITER_THREADS):
+            writer = threading.Thread(target = self.__writer)
+            writer.daemon = True
+            writer.name = "EntropyCacheWriter-%d" % (index,)
+            writer.start()
+            self.__writers.append(writer)
 
     def is_started(self):
         """
@@ -288,30 +1430,35 @@ class EntropyCacher(Singleton):
     def stop(self):
         """
         This method stops the execution of the cacher, which won't
-        accept cache writes anymore. The thread responsible of writing
-        to disk is stopped here and the Cacher will be back to being
-        inactive. A watchdog will avoid the thread to freeze the
-        call if the write buffer is overloaded.
+        accept cache writes anymore. The writer threads are stopped
+        here, the objects still pending are written to disk and the
+        Cacher will be back to being inactive.
 
         @return: None
         """
-        self.__alive = False
-        if self.__cache_writer is not None:
-            self.__cache_writer.kill()
-            # make sure it unblocks
-            self.__worker_sem.release()
-            self.__cache_writer.join()
-            self.__cache_writer = None
+        with self.__pending_cond:
+            self.__alive = False
+            self.__pending_cond.notify_all()
+        for writer in self.__writers:
+            writer.join()
+        del self.__writers[:]
         self.sync()
+        cache_dir = self.current_directory()
+        backend = self.backend(cache_dir)
+        backend.flush(cache_dir)
+        self.__evict(force = True)
+        backend.compact(cache_dir)
 
     def sync(self):
         """
         This method can be called anytime and forces the instance
-        to flush all the cache writes queued to disk. If wait == False
-        a watchdog prevents this call to get stuck in case of write
-        buffer overloads.
+        to flush all the cache writes queued to disk, waiting for
+        the ones in progress.
         """
-        self.__cacher(run_until_empty = True, sync = True)
+        self.__drain()
+        with self.__pending_cond:
+            while self.__writing:
+                self.__pending_cond.wait()
 
     def discard(self):
         """
@@ -319,8 +1466,30 @@ class EntropyCacher(Singleton):
 
         @return: None
         """
-        self.__cache_buffer.clear()
-        self.__stashing_cache.clear()
+        with self.__pending_cond:
+            self.__pending.clear()
+            self.__pending_bytes = 0
+
+    def stats(self):
+        """
+        Return the asynchronous writer statistics: the number of objects
+        (pending) and bytes (pending_bytes) waiting to be written, the
+        number of objects being written (writing), the number of objects
+        pushed, replaced by a later push() of the same key before being
+        written (coalesced) and written, the number of written batches,
+        the number of push() calls exceeding PENDING_BYTES_LIMIT
+        (backpressure), the total and maximum batch write latency in
+        seconds (write_time, write_time_max).
+
+        @return: the writer statistics
+        @rtype: dict
+        """
+        with self.__pending_cond:
+            stats = self.__stats.copy()
+            stats['pending'] = len(self.__pending)
+            stats['pending_bytes'] = self.__pending_bytes
+            stats['writing'] = len(self.__writing)
+        return stats
 
     def save(self, key, data, cache_dir = None):
         """
@@ -338,18 +1507,40 @@ class EntropyCacher(Singleton):
         if cache_dir is None:
             cache_dir = self.current_directory()
         try:
-            with self.__dump_data_lock:
-                entropy.dump.dumpobj(key, data, dump_dir = cache_dir,
-                    ignore_exceptions = False)
+            self.__store(key, data, cache_dir, ignore_exceptions = False)
         except (EOFError, IOError, OSError) as err:
             raise IOError("cannot store %s to %s. err: %s" % (
                 key, cache_dir, repr(err)))
 
+    def __store(self, key, data, cache_dir, ignore_exceptions = True):
+        """
+        Synchronously store the given object, for save() and push().
+        """
+        backend = self.backend(cache_dir)
+        blob = None
+        if self.__metrics.enabled:
+            try:
+                blob = entropy.dump.serialize_string(data)
+            except (RuntimeError, TypeError,
+                    entropy.dump.pickle.PicklingError):
+                pass
+
+        with self.__dump_data_lock:
+            if blob is None:
+                backend.store(key, data, cache_dir,
+                    ignore_exceptions = ignore_exceptions)
+                return
+            backend.store_serialized_many([(key, blob)], cache_dir,
+                ignore_exceptions = ignore_exceptions)
+        self.__metrics.write(self._cache_id(key, cache_dir), len(blob))
+
     def push(self, key, data, async = True, cache_dir = None):
         """
         This is the place where data is either added
         to the write queue or written to disk (if async == False)
         only and only if start() method has been called.
+        Asynchronous writes of the same key are coalesced, only the
+        last pushed object is written.
 
         @param key: cache data identifier
         @type key: string
@@ -366,30 +1557,50 @@ class EntropyCacher(Singleton):
         if cache_dir is None:
             cache_dir = self.current_directory()
 
-        if async:
-            try:
-                obj_copy = self.__copy_obj(data)
-                self.__cache_buffer.push(((key, cache_dir,), obj_copy,))
-                self.__worker_sem.release()
-                if EntropyCacher.STASHING_CACHE:
-                    self.__stashing_cache[(key, cache_dir)] = obj_copy
-            except TypeError:
-                # sometimes, very rarely, copy.deepcopy() is unable
-                # to properly copy an object (blame Python bug)
-                sys.stdout.write("!!! cannot cache object with key %s\n" % (
-                    key,))
-                sys.stdout.flush()
-            #if const_debug_enabled():
-            #   const_debug_write(__name__,
-            #        "EntropyCacher.push, async push %s, into %s" % (
-            #            key, cache_dir,))
-        else:
-            #if const_debug_enabled():
-            #    const_debug_write(__name__,
-            #        "EntropyCacher.push, sync push %s, into %s" % (
-            #            key, cache_dir,))
-            with self.__dump_data_lock:
-                entropy.dump.dumpobj(key, data, dump_dir = cache_dir)
+        if not async:
+            self.__store(key, data, cache_dir)
+            return
+
+        try:
+            # this is also the snapshot of data, which could be
+            # modified by the caller afterwards
+            data = entropy.dump.serialize_string(data)
+        except (RuntimeError, TypeError,
+                entropy.dump.pickle.PicklingError) as err:
+            const_debug_write(__name__,
+                "EntropyCacher.push: cannot cache object with key "
+                "%s: %s" % (key, repr(err)))
+            return
+
+        obj_key = (key, cache_dir)
+        limit = EntropyCacher.PENDING_BYTES_LIMIT
+        cond = self.__pending_cond
+        with cond:
+            old_data = self.__pending.get(obj_key)
+            if old_data is not None:
+                self.__pending_bytes -= len(old_data)
+                self.__stats['coalesced'] += 1
+            self.__pending[obj_key] = data
+            self.__pending_bytes += len(data)
+            self.__stats['pushed'] += 1
+
+            if self.__pending_bytes <= limit:
+                if old_data is None and len(self.__pending) == 1:
+                    # wake up the idle writers
+                    cond.notify_all()
+                return
+
+            self.__stats['backpressure'] += 1
+            cond.notify_all()
+            if self.__inside_with_stmt != 0:
+                # writes are paused, do not wait for them
+                return
+            deadline = time.time() + EntropyCacher.BACKPRESSURE_TIMEOUT
+            while self.__alive and self.__pending_bytes > limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                cond.wait(remaining)
 
     def pop(self, key, cache_dir = None, aging_days = None):
         """
@@ -407,16 +1618,57 @@ class EntropyCacher(Singleton):
         if cache_dir is None:
             cache_dir = self.current_directory()
 
+        if self.__metrics.enabled:
+            return self.__pop_measured(key, cache_dir, aging_days)
+
         if EntropyCacher.STASHING_CACHE:
-            # object is being saved on disk, it's in RAM atm
-            ram_obj = self.__stashing_cache.get((key, cache_dir))
-            if ram_obj is not None:
-                return ram_obj
+            data = self.__unwritten(key, cache_dir)
+            if data is not None:
+                return entropy.dump.unserialize_string(data)
 
-        l_o = entropy.dump.loadobj
-        if not l_o:
-            return
-        return l_o(key, dump_dir = cache_dir, aging_days = aging_days)
+        return self.backend(cache_dir).load(key, cache_dir,
+            aging_days = aging_days)
+
+    def __unwritten(self, key, cache_dir):
+        """
+        Return the serialized object pushed with the given key and not
+        written to disk yet, if any.
+        """
+        # __take_batch() adds it to __writing before removing it
+        # from __pending and __write() removes it from __writing
+        # once on disk, so it cannot be missed.
+        obj_key = (key, cache_dir)
+        data = self.__pending.get(obj_key)
+        if data is None:
+            data = self.__writing.get(obj_key)
+        return data
+
+    def __pop_measured(self, key, cache_dir, aging_days):
+        """
+        pop() accounting its outcome to CacheMetrics.
+        """
+        metrics = self.__metrics
+        cache_id = self._cache_id(key, cache_dir)
+        data = None
+        if EntropyCacher.STASHING_CACHE:
+            data = self.__unwritten(key, cache_dir)
+        backend = self.backend(cache_dir)
+        if data is None:
+            data = backend.load_serialized(key, cache_dir,
+                aging_days = aging_days)
+        if data is None:
+            metrics.miss(cache_id, key)
+            return None
+
+        start_t = time.time()
+        try:
+            obj = entropy.dump.unserialize_string(data)
+        except backend._UNPICKLE_ERRORS:
+            metrics.miss(cache_id, key)
+            return None
+        metrics.hit(cache_id, key, size = len(data),
+                    unserialize_time = time.time() - start_t)
+        return obj
 
     @classmethod
     def clear_cache_item(cls, cache_item, cache_dir = None):
@@ -430,23 +1682,35 @@ class EntropyCacher(Singleton):
         """
         if cache_dir is None:
             cache_dir = cls.current_directory()
-        dump_path = os.path.join(cache_dir, cache_item)
+        cls.backend(cache_dir).clear(cache_item, cache_dir)
 
-        dump_dir = os.path.dirname(dump_path)
-        for currentdir, subdirs, files in os.walk(dump_dir):
-            path = os.path.join(dump_dir, currentdir)
-            for item in files:
-                if item.endswith(entropy.dump.D_EXT):
-                    item = os.path.join(path, item)
-                    try:
-                        os.remove(item)
-                    except (OSError, IOError,):
-                        pass
-            try:
-                if not os.listdir(path):
-                    os.rmdir(path)
-            except (OSError, IOError,):
-                pass
+    @classmethod
+    def usage(cls, cache_dir = None):
+        """
+        Return the disk usage of the given cache directory, by cache
+        identifier (see CACHE_IDS).
+
+        @keyword cache_dir: alternative cache directory
+        @type cache_dir: string
+        @return: dict mapping cache identifiers (None for the objects not
+            belonging to any of them) to (number of objects, size in bytes,
+            last access time) tuples
+        @rtype: dict
+        """
+        if cache_dir is None:
+            cache_dir = cls.current_directory()
+
+        usage = {}
+        for key, size, atime in cls.backend(cache_dir).usage(cache_dir):
+            cache_id = None
+            for prefix, prefix_id in cls._CACHE_ID_PREFIXES:
+                if key.startswith(prefix):
+                    cache_id = prefix_id
+                    break
+            count, total, last_atime = usage.get(cache_id, (0, 0, 0.0))
+            usage[cache_id] = (count + 1, total + size,
+                               max(last_atime, atime))
+        return usage
 
     @classmethod
     def clear_cache(cls, excluded_items = None, cache_dir = None):
@@ -9,26 +9,85 @@
     B{Entropy Package Manager Client Cache Interface}.
 
 """
+import contextlib
 import os
 import shutil
 import hashlib
+import subprocess
+import sys
+import time
 
 from entropy.i18n import _
-from entropy.output import purple
+from entropy.output import purple, blue, darkgreen, brown
 from entropy.const import etpConst, const_setup_perms, \
-    const_convert_to_unicode, const_convert_to_rawstring
+    const_convert_to_unicode, const_convert_to_rawstring, \
+    const_debug_write
 from entropy.exceptions import RepositoryError
 from entropy.cache import EntropyCacher
 from entropy.db.exceptions import OperationalError, DatabaseError
+from entropy.locks import EntropyResourcesLock
+
+import entropy
+import entropy.dep
+
+
+def _prewarm_main():
+    """
+    Entry point of the background process spawned by
+    CacheMixin.spawn_cache_prewarm().
+    """
+    from entropy.client.interfaces import Client
+
+    client = Client()
+    try:
+        # the spawning process may still hold the resources lock
+        if client.prewarm_cache(
+                lock_timeout = CacheMixin.PREWARM_LOCK_TIMEOUT):
+            return 0
+        return 1
+    finally:
+        client.shutdown()
 
 
 class CacheMixin:
 
-    def clear_cache(self):
+    # on-disk caches whose entries carry a package keys footprint, these
+    # are validated against the packages they reference and are
+    # selectively dropped by clear_cache(package_keys = ...)
+    FOOTPRINT_CACHE_IDS = ("dep_tree", "depends_tree", "world_update")
+
+    # on-disk caches validating each of their entries when loaded, these
+    # are kept by clear_cache(package_keys = ...)
+    VALIDATED_CACHE_IDS = ("dep_subgraph",)
+
+    # pseudo package key whose fingerprint changes every time the
+    # installed packages repository is modified
+    INSTALLED_FOOTPRINT = "@installed"
+
+    _FOOTPRINT_SUFFIX = "_footprint"
+
+    # fingerprints memo key of the installed packages repository indexes
+    # used by reverse fingerprints
+    _REVERSE_INDEXES_MEMO_KEY = None
+
+    def clear_cache(self, package_keys = None):
         """
         Clear all the Entropy default cache directory. This function is
         fault tolerant and will never return any exception.
+        If package_keys is given, the entries of the dependency caches
+        (see FOOTPRINT_CACHE_IDS) are only dropped if they reference at
+        least one of the given package keys, the other caches are
+        cleared anyway.
+
+        @keyword package_keys: package keys (category/name) whose metadata
+            changed in the installed packages repository or in the
+            available repositories
+        @type package_keys: iterable
         """
+        if package_keys is not None:
+            # flush the pending writes, the still valid dependency cache
+            # entries would be discarded otherwise
+            self._cacher.sync()
         with self._cacher:
             # no data is written while holding self._cacher by the balls
             # drop all the buffers then remove on-disk data
@@ -40,7 +99,12 @@ class CacheMixin:
             with self._repodb_cache_mutex:
                 for repo in self._repodb_cache.values():
                     repo.clearCache()
+            with self._package_keys_states_lock:
+                self._package_keys_states.clear()
             cache_dir = self._cacher.current_directory()
+            if package_keys is not None:
+                self.__clear_footprint_cache(cache_dir, package_keys)
+                return
             try:
                 shutil.rmtree(cache_dir, True)
             except (shutil.Error, IOError, OSError):
@@ -54,6 +118,494 @@ class CacheMixin:
             except (IOError, OSError):
                 return
 
+    def __clear_footprint_cache(self, cache_dir, package_keys):
+        """
+        Remove the whole content of the cache directory but the entries
+        of the dependency caches not referencing any of the given package
+        keys.
+        """
+        package_keys = frozenset(package_keys)
+        footprint_dirs = set(
+            EntropyCacher.CACHE_IDS[x].split("/")[0] for x in \
+                self.FOOTPRINT_CACHE_IDS)
+        validated_dirs = set(
+            EntropyCacher.CACHE_IDS[x].split("/")[0] for x in \
+                self.VALIDATED_CACHE_IDS)
+
+        backend = self._cacher.backend(cache_dir)
+        backend.purge(cache_dir, footprint_dirs | validated_dirs)
+
+        suffix = self._FOOTPRINT_SUFFIX
+        for footprint_dir in footprint_dirs:
+            keys = set(backend.keys(cache_dir, footprint_dir))
+
+            obj_keys = []
+            for cache_key in keys:
+                if cache_key.endswith(suffix):
+                    continue
+                footprint_key = cache_key + suffix
+
+                if footprint_key in keys:
+                    footprint = backend.load(footprint_key, cache_dir)
+                    if isinstance(footprint, dict) and \
+                            package_keys.isdisjoint(footprint):
+                        continue
+
+                obj_keys.append(cache_key)
+                obj_keys.append(footprint_key)
+            backend.remove_many(obj_keys, cache_dir)
+
+    # niceness of the process spawned by spawn_cache_prewarm()
+    PREWARM_NICE_LEVEL = 19
+
+    # seconds the process spawned by spawn_cache_prewarm() waits for
+    # the Entropy Resources Lock to be released by its parent
+    PREWARM_LOCK_TIMEOUT = 300
+
+    def _prewarm_steps(self):
+        """
+        Return the list of (description, callable) pairs executed by
+        prewarm_cache(), in order.
+        """
+        def _reverse_dependencies():
+            repos = [self.installed_repository()]
+            for repository_id in self._enabled_repos:
+                try:
+                    repos.append(self.open_repository(repository_id))
+                except RepositoryError:
+                    continue
+            for repo in repos:
+                generate = getattr(
+                    repo, "_generateReverseDependenciesMetadata", None)
+                if generate is not None:
+                    generate()
+
+        def _security():
+            security = self.Security()
+            if not security.available():
+                return
+            security.advisories()
+            security.vulnerabilities()
+
+        return [
+            (_("package updates"),
+             lambda: self.calculate_updates(quiet = True)),
+            (_("available packages"), self.calculate_available_packages),
+            (_("masked packages"), self.calculate_masked_packages),
+            (_("reverse dependencies"), _reverse_dependencies),
+            (_("security advisories"), _security),
+        ]
+
+    def prewarm_cache(self, abort_event = None, lock_timeout = 0):
+        """
+        Recompute the most expensive cached results (updates, available
+        and masked packages, reverse dependencies metadata, security
+        advisories) and store them in the on-disk cache. This is meant
+        to be run right after the caches have been invalidated, for
+        instance by a repositories update.
+        Each step is executed holding the Entropy Resources Lock in
+        shared mode, acquired in non-blocking mode: if another process
+        is holding (or waiting for) it exclusively, the pre-warm is
+        aborted. The first acquisition is retried for up to lock_timeout
+        seconds, so that a process can spawn the pre-warm before
+        releasing the lock.
+
+        @keyword abort_event: if set, the pre-warm is aborted before
+            starting the next step
+        @type abort_event: threading.Event
+        @keyword lock_timeout: seconds to wait for the lock before the
+            first step
+        @type lock_timeout: int
+        @return: True, if all the steps have been completed
+        @rtype: bool
+        """
+        if not self.xcache:
+            return False
+
+        header = darkgreen(" @@ ")
+        steps = self._prewarm_steps()
+        total = len(steps)
+        lock = EntropyResourcesLock(output=self)
+        deadline = time.time() + lock_timeout
+
+        for count, (description, step) in enumerate(steps, 1):
+            if abort_event is not None and abort_event.is_set():
+                break
+            acquired = lock.try_acquire_shared()
+            while not acquired and count == 1 and time.time() < deadline:
+                time.sleep(1.0)
+                if abort_event is not None and abort_event.is_set():
+                    break
+                acquired = lock.try_acquire_shared()
+            if not acquired:
+                break
+            try:
+                self.output(
+                    "%s: %s" % (blue(_("Pre-warming caches")),
+                                darkgreen(description)),
+                    importance = 0,
+                    level = "info",
+                    count = (count, total),
+                    back = True,
+                    header = header
+                )
+                step()
+                # write the results while holding the lock, pending
+                # data is discarded at the next acquisition
+                self._cacher.sync()
+            finally:
+                lock.release()
+        else:
+            self.output(
+                blue(_("Caches pre-warmed")),
+                importance = 0,
+                level = "info",
+                header = header
+            )
+            return True
+
+        self.output(
+            brown(_("Caches pre-warming aborted")),
+            importance = 0,
+            level = "warning",
+            header = header
+        )
+        return False
+
+    def spawn_cache_prewarm(self):
+        """
+        Run prewarm_cache() in a detached, low priority process, using
+        the idle I/O scheduling class when ionice is available. The
+        process waits up to PREWARM_LOCK_TIMEOUT seconds for the Entropy
+        Resources Lock to be released, so this can be called while
+        holding it, then exits as soon as another Entropy process needs
+        exclusive access to the resources.
+
+        @return: the pid of the spawned process, or None on failure
+        @rtype: int or None
+        """
+        if not self.xcache:
+            return None
+
+        env = os.environ.copy()
+        python_path = [os.path.dirname(os.path.dirname(entropy.__file__))]
+        if env.get("PYTHONPATH"):
+            python_path.append(env["PYTHONPATH"])
+        env["PYTHONPATH"] = os.pathsep.join(python_path)
+
+        args = [sys.executable, "-c",
+                "import entropy.client.interfaces.cache as c; "
+                "raise SystemExit(c._prewarm_main())"]
+        for path in env.get("PATH", "").split(os.pathsep):
+            ionice = os.path.join(path, "ionice")
+            if os.access(ionice, os.X_OK):
+                args = [ionice, "-c", "3"] + args
+                break
+
+        nice_level = self.PREWARM_NICE_LEVEL
+
+        def _setup():
+            os.setsid()
+            os.nice(nice_level)
+
+        try:
+            with open(os.devnull, "r+") as null_f:
+                proc = subprocess.Popen(
+                    args, env = env, stdin = null_f, stdout = null_f,
+                    stderr = null_f, close_fds = True, preexec_fn = _setup)
+        except (OSError, IOError) as err:
+            const_debug_write(
+                __name__, "spawn_cache_prewarm: cannot spawn: %s" % (err,))
+            return None
+
+        const_debug_write(
+            __name__, "spawn_cache_prewarm: spawned pid %d" % (proc.pid,))
+        return proc.pid
+
+    @contextlib.contextmanager
+    def _package_keys_footprint(self):
+        """
+        Context manager recording the package keys referenced by the
+        dependency calculations run inside it, in the current thread.
+        The yielded set is filled with them and, once done, merged
+        into the one of the enclosing recording, if any.
+        """
+        recorders = getattr(self._package_keys_recorder, "stack", None)
+        if recorders is None:
+            recorders = []
+            self._package_keys_recorder.stack = recorders
+
+        package_keys = set()
+        recorders.append(package_keys)
+        try:
+            yield package_keys
+        finally:
+            recorders.pop()
+            if recorders:
+                recorders[-1].update(package_keys)
+
+    def _record_package_keys(self, package_keys):
+        """
+        Record the given package keys into the current package keys
+        footprint, if any. See _package_keys_footprint().
+
+        @param package_keys: package keys (category/name)
+        @type package_keys: iterable
+        """
+        recorders = getattr(self._package_keys_recorder, "stack", None)
+        if recorders:
+            recorders[-1].update(package_keys)
+
+    def _record_dependency_keys(self, dependencies):
+        """
+        Record the package keys referenced by the given dependency strings
+        (including conflicts, simple or-dependencies and conditional ones)
+        into the current package keys footprint, if any.
+
+        @param dependencies: dependency strings
+        @type dependencies: iterable
+        """
+        recorders = getattr(self._package_keys_recorder, "stack", None)
+        if not recorders:
+            return
+
+        package_keys = recorders[-1]
+        or_sep = etpConst['entropyordepsep']
+        or_question = etpConst['entropyordepquestion']
+        for dependency in dependencies:
+            for atom in dependency.replace(or_sep, " ").split():
+                if atom in ("(", ")", "|", "&"):
+                    continue
+                key = entropy.dep.dep_getkey(atom.rstrip(or_question))
+                if key:
+                    package_keys.add(key)
+
+    def _record_package_matches(self, package_matches):
+        """
+        Record the package keys of the given package matches into the
+        current package keys footprint, if any.
+
+        @param package_matches: package matches
+        @type package_matches: iterable
+        """
+        recorders = getattr(self._package_keys_recorder, "stack", None)
+        if not recorders:
+            return
+
+        package_keys = recorders[-1]
+        for package_id, repository_id in package_matches:
+            key_slot = self.open_repository(
+                repository_id).retrieveKeySlot(package_id)
+            if key_slot is not None:
+                package_keys.add(key_slot[0])
+
+    def __package_keys_states(self):
+        """
+        Return the packages metadata of the installed packages repository
+        and of the enabled repositories, grouped by package key, as list of
+        (repository, is installed, state token, rows by key, fingerprints
+        memo) tuples.
+        Each state is rebuilt only when its repository changes.
+        """
+        repositories = []
+        inst_repo = self.installed_repository()
+        if inst_repo is not None:
+            repositories.append((inst_repo.repository_id(), inst_repo, True))
+        for repository_id in self._enabled_repos:
+            try:
+                repo = self.open_repository(repository_id)
+            except RepositoryError:
+                continue # repo not available
+            repositories.append((repository_id, repo, False))
+
+        states = []
+        with self._package_keys_states_lock:
+            for repository_id, repo, installed in repositories:
+                try:
+                    if installed:
+                        token = repo.checksum()
+                    else:
+                        token = repo.mtime()
+                    state = self._package_keys_states.get(repository_id)
+                    if state is None or state[0] != token:
+                        state = (token, self.__strict_data_by_key(repo), {})
+                        self._package_keys_states[repository_id] = state
+                except (OperationalError, DatabaseError, OSError, IOError):
+                    continue
+                states.append((repo, installed, state[0], state[1], state[2]))
+        return states
+
+    def _repository_keys_snapshot(self, repository_id):
+        """
+        Return the packages metadata of the given repository, grouped by
+        package key. Comparing two snapshots taken before and after a
+        repository update gives the package keys whose packages changed,
+        to be passed to clear_cache().
+
+        @param repository_id: repository identifier
+        @type repository_id: string
+        @return: dict composed by package key as key and sorted list of
+            package metadata as value, or None if the repository is not
+            available
+        @rtype: dict or None
+        """
+        try:
+            repo = self.open_repository(repository_id)
+            return self.__strict_data_by_key(repo)
+        except (RepositoryError, OperationalError, DatabaseError,
+                OSError, IOError):
+            return None
+
+    def __strict_data_by_key(self, repo):
+        """
+        Return the packages metadata of the given repository, as dict
+        composed by package key as key and sorted list of (package_id,
+        slot, version, tag, revision, digest) tuples as value.
+        """
+        rows = {}
+        for package_id, key, slot, version, tag, revision, \
+                _atom, digest in repo.listAllStrictData():
+            obj = rows.setdefault(key, [])
+            obj.append((package_id, slot, version, tag, revision, digest))
+        for obj in rows.values():
+            obj.sort()
+        return rows
+
+    def __reverse_indexes(self, inst_repo, memo):
+        """
+        Return the installed packages conflicts by package key, the
+        dependency index and the library index of the installed packages
+        repository, as tuple. These are loaded once per repository state,
+        with a few bulk queries, and stored in memo.
+        """
+        indexes = memo.get(self._REVERSE_INDEXES_MEMO_KEY)
+        if indexes is None:
+            conflicts = {}
+            for package_id, conflict in inst_repo.listAllConflicts():
+                key = entropy.dep.dep_getkey(conflict)
+                if key:
+                    conflicts.setdefault(key, set()).add(package_id)
+            indexes = (conflicts, inst_repo.getDependencyIndex(),
+                       inst_repo.getLibraryIndex())
+            memo[self._REVERSE_INDEXES_MEMO_KEY] = indexes
+        return indexes
+
+    def __reverse_footprint(self, inst_repo, memo, key, key_rows):
+        """
+        Return the installed packages referencing the given package key,
+        through their dependencies, conflicts and libraries.
+        """
+        conflicts, inst_deps, inst_libs = self.__reverse_indexes(
+            inst_repo, memo)
+        footprint = [sorted(conflicts.get(key, ()))]
+        for row in key_rows:
+            package_id = row[0]
+            footprint.append(
+                sorted(inst_deps.retrieveReverseDependencies(package_id)))
+            for needed, _path, elfclass in sorted(
+                    inst_libs.retrieveProvidedLibraries(package_id)):
+                footprint.append(sorted(
+                        inst_libs.searchNeeded(needed, elfclass = elfclass)))
+                footprint.append(sorted(
+                        inst_libs.resolveNeeded(needed, elfclass = elfclass)))
+        return footprint
+
+    def _package_keys_fingerprints(self, package_keys, reverse = False):
+        """
+        Return the fingerprints of the given package keys, built from the
+        metadata of the packages having such key in the installed packages
+        repository and in the enabled repositories. The fingerprint of
+        INSTALLED_FOOTPRINT changes at every installed packages
+        repository change.
+
+        @param package_keys: package keys (category/name)
+        @type package_keys: iterable
+        @keyword reverse: also include the installed packages referencing
+            the given package keys (reverse dependencies, conflicts and
+            library consumers and providers)
+        @type reverse: bool
+        @return: dict composed by package key as key and fingerprint
+            as value
+        @rtype: dict
+        """
+        states = self.__package_keys_states()
+        fingerprints = {}
+
+        for key in package_keys:
+            sha = hashlib.sha1()
+            for repo, installed, token, rows, memo in states:
+                memo_key = (key, reverse and installed)
+                partial = memo.get(memo_key)
+                if partial is None:
+                    if key == self.INSTALLED_FOOTPRINT:
+                        footprint = [installed and token]
+                    else:
+                        key_rows = rows.get(key, [])
+                        footprint = [repo.repository_id(), key_rows]
+                        if installed and reverse:
+                            footprint.append(self.__reverse_footprint(
+                                repo, memo, key, key_rows))
+                    partial = hashlib.sha1(
+                        const_convert_to_rawstring(repr(footprint))
+                        ).hexdigest()
+                    memo[memo_key] = partial
+                sha.update(const_convert_to_rawstring(partial))
+            fingerprints[key] = sha.hexdigest()
+
+        return fingerprints
+
+    def _push_footprint_cache(self, cache_key, result, package_keys,
+                              reverse = False, async = True):
+        """
+        Push the result of a dependency calculation to the on-disk cache,
+        together with the fingerprints of the package keys it references.
+        See _package_keys_fingerprints().
+
+        @param cache_key: cache key
+        @type cache_key: string
+        @param result: the object to cache
+        @type result: any picklable object
+        @param package_keys: package keys referenced by the calculation
+        @type package_keys: iterable
+        @keyword reverse: see _package_keys_fingerprints()
+        @type reverse: bool
+        @keyword async: store cache asynchronously or not
+        @type async: bool
+        """
+        fingerprints = self._package_keys_fingerprints(
+            package_keys, reverse = reverse)
+        self._cacher.push(cache_key + self._FOOTPRINT_SUFFIX, fingerprints,
+                          async = async)
+        self._cacher.push(cache_key, (reverse, fingerprints, result),
+                          async = async)
+
+    def _pop_footprint_cache(self, cache_key):
+        """
+        Pop the result of a dependency calculation from the on-disk cache,
+        if the packages it references did not change in the meantime.
+        The referenced package keys are recorded into the current package
+        keys footprint, if any.
+
+        @param cache_key: cache key
+        @type cache_key: string
+        @return: the cached object or None
+        @rtype: any picklable object or None
+        """
+        cached = self._cacher.pop(cache_key)
+        if not isinstance(cached, tuple) or len(cached) != 3:
+            return None
+
+        reverse, fingerprints, result = cached
+        if not isinstance(fingerprints, dict):
+            return None
+        current = self._package_keys_fingerprints(
+            fingerprints, reverse = reverse)
+        if current != fingerprints:
+            return None
+
+        self._record_package_keys(fingerprints)
+        return result
+
     def _get_available_packages_hash(self):
         """
         Get available packages cache hash.
@@ -116,7 +668,7 @@ class CacheMixin:
         return self._cacher.pop("%s%s" % (
             EntropyCacher.CACHE_IDS['world_available'], chash))
 
-    def _get_updates_cache(self, empty_deps, repo_hash = None):
+    def _get_updates_cache(self, empty_deps):
         """
         Get available updates on-disk cache, if available, otherwise return None
         """
@@ -125,14 +677,11 @@ class CacheMixin:
 
         if self.xcache:
 
-            if repo_hash is None:
-                repo_hash = self._repositories_hash()
-
-            c_hash = self._get_updates_cache_hash(repo_hash, empty_deps,
+            c_hash = self._get_updates_cache_hash(empty_deps,
                 ignore_spm_downgrades)
 
-            disk_cache = self._cacher.pop(c_hash)
-            if isinstance(disk_cache, tuple):
+            disk_cache = self._pop_footprint_cache(c_hash)
+            if isinstance(disk_cache, dict):
                 return disk_cache
 
     def _filter_available_repositories(self, _enabled_repos = None):
@@ -152,24 +701,20 @@ class CacheMixin:
             x.endswith(etpConst['packagesext'])]
         return enabled_repos
 
-    def _get_updates_cache_hash(self, repo_hash, empty_deps,
-        ignore_spm_downgrades):
+    def _get_updates_cache_hash(self, empty_deps, ignore_spm_downgrades):
         """
         Get package updates cache hash that can be used to retrieve the on-disk
-        cached object.
+        cached object. The installed and available packages are not part of
+        it, see _pop_footprint_cache().
         """
         enabled_repos = self._filter_available_repositories()
         repo_order = [x for x in self._settings['repositories']['order'] if
             x in enabled_repos]
 
-        inst_repo = self.installed_repository()
-
-        cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|v3" % (
-            repo_hash,
+        cache_s = "%s|%s|%s|%s|%s|%s|%s|v4" % (
             empty_deps,
             enabled_repos,
-            inst_repo.checksum(),
-            self._all_repositories_hash(),
+            ";".join(self._enabled_repos),
             ";".join(sorted(self._settings['repositories']['available'])),
             repo_order,
             ignore_spm_downgrades,
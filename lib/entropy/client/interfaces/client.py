@@ -102,6 +102,11 @@ class Client(Singleton, TextInterface, LoadersMixin, CacheMixin,
         self._real_enabled_repos = None
         self._real_enabled_repos_lock = threading.RLock()
 
+        # package keys footprint of the dependency caches, see CacheMixin
+        self._package_keys_recorder = threading.local()
+        self._package_keys_states = {}
+        self._package_keys_states_lock = threading.Lock()
+
         # class init
         LoadersMixin.__init__(self)
 
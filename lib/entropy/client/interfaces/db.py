@@ -24,7 +24,7 @@ from entropy.const import const_debug_write, const_setup_perms, etpConst, \
     const_file_writable
 from entropy.output import blue, darkred, red, darkgreen, purple, teal, brown, \
     bold, TextInterface
-from entropy.dump import dumpobj, loadobj
+from entropy.dump import dumpobj
 from entropy.cache import EntropyCacher
 from entropy.db import EntropyRepository
 from entropy.exceptions import RepositoryError, SystemDatabaseError, \
@@ -34,6 +34,7 @@ from entropy.misc import TimeScheduled, ParallelTask
 from entropy.fetchers import UrlFetcher
 from entropy.i18n import _
 from entropy.db.skel import EntropyRepositoryPlugin, EntropyRepositoryBase
+from entropy.debug import SolverProfiler
 from entropy.db.exceptions import IntegrityError, OperationalError, Error, \
     DatabaseError
 from entropy.core.settings.base import SystemSettings
@@ -44,6 +45,8 @@ from entropy.client.services.interfaces import RepositoryWebService, \
 import entropy.dep
 import entropy.tools
 
+_profiler = SolverProfiler()
+
 __all__ = ["CachedRepository", "ClientEntropyRepositoryPlugin",
     "InstalledPackagesRepository", "AvailablePackagesRepository",
     "GenericRepository"]
@@ -122,6 +125,19 @@ class InstalledPackagesRepository(CachedRepository):
     # Name of the repository
     NAME = "__system__"
 
+    # package masking does not apply to installed packages
+    PERSISTENT_REVERSE_DEPENDENCIES = True
+
+    # "content" metadata of installed packages dominates the repository
+    # size, intern directory prefixes
+    COMPACT_CONTENT = True
+
+    # let readers run alongside package merges, only effective if the
+    # repository is not readable by users that cannot write its
+    # directory, which is not the case with the default permissions
+    # (see EntropySQLiteRepository._wal_journal_allowed())
+    WAL_JOURNAL = True
+
     def __init__(self, *args, **kwargs):
         # force our own name, always.
         kwargs = kwargs.copy()
@@ -174,6 +190,7 @@ class AvailablePackagesRepositoryUpdater(object):
         self._supported_download_items = (
             "db", "dbck", "dblight", "ck", "cklight", "compck",
             "lock", "dbdump", "dbdumplight", "dbdumplightck", "dbdumpck",
+            "dbdumpbinlight", "dbdumpbinlightck",
             "meta_file", "meta_file_gpg", "notice_board"
         )
         self._developer_repo = \
@@ -302,12 +319,13 @@ class AvailablePackagesRepositoryUpdater(object):
             os.rename(dbfile_old, dbfile)
         return upd_rc
 
-    def __eapi2_inject_downloaded_dump(self, dumpfile, dbfile, cmethod):
+    def __eapi2_eapi4_inject_downloaded_dump(self, dumpfile, dbfile):
 
-        # load the dump into database
+        # load the dump into database, importRepository() handles
+        # both the textual (EAPI2) and the binary (EAPI4) dumps
         mytxt = "%s %s, %s %s" % (
             red(_("Injecting downloaded dump")),
-            darkgreen(etpConst['etpdatabasedumplight']),
+            darkgreen(os.path.basename(dumpfile)),
             red(_("please wait")),
             red("..."),
         )
@@ -323,12 +341,20 @@ class AvailablePackagesRepositoryUpdater(object):
         dbconn.close()
         return rc
 
+    def __is_text_dump_supported(self):
+        """
+        Return whether textual repository dumps (EAPI2) can be imported,
+        /usr/bin/sqlite3 is required.
+        """
+        if not os.path.lexists("/usr/bin/sqlite3"):
+            return False
+        sqlite3_rc = subprocess.call("/usr/bin/sqlite3 -version > /dev/null",
+            shell = True)
+        return sqlite3_rc == 0
+
     def __get_repo_eapi(self):
 
         eapi_env = os.getenv("FORCE_EAPI")
-        sqlite3_access = os.path.lexists("/usr/bin/sqlite3")
-        sqlite3_rc = subprocess.call("/usr/bin/sqlite3 -version > /dev/null",
-            shell = True)
         try:
             eapi_env_clear = int(eapi_env)
             if eapi_env_clear not in self._supported_apis:
@@ -336,15 +362,13 @@ class AvailablePackagesRepositoryUpdater(object):
         except (ValueError, TypeError,):
             eapi_env_clear = None
 
-        repo_eapi = 2
+        # binary dumps do not require /usr/bin/sqlite3
+        repo_eapi = 4
         eapi_avail = self.__check_webserv_availability()
         if eapi_avail:
             repo_eapi = 3
-        else:
-            if not sqlite3_access or entropy.tools.islive():
-                repo_eapi = 1
-            elif sqlite3_rc != 0:
-                repo_eapi = 1
+        elif entropy.tools.islive():
+            repo_eapi = 1
 
         # if differential update is disabled and FORCE_EAPI is not overriding
         # we cannot use EAPI=3
@@ -352,7 +376,7 @@ class AvailablePackagesRepositoryUpdater(object):
             (repo_eapi == 3):
             const_debug_write(__name__,
                 "__get_repo_eapi: differential update is disabled !")
-            repo_eapi -= 1
+            repo_eapi = 4
 
         # check EAPI
         if eapi_env_clear is not None:
@@ -595,6 +619,27 @@ class AvailablePackagesRepositoryUpdater(object):
         downloaded_item = None
         down_status = False
         sig_status = False
+        if self._repo_eapi == 4:
+
+            down_item = "dbdumpbinlight"
+
+            down_status = self._download_item(
+                uri, down_item, cmethod,
+                disallow_redirect = True)
+            if down_status:
+                # get GPG file if available
+                sig_status = self._download_item(
+                    uri, down_item, cmethod,
+                    disallow_redirect = True,
+                    get_signature = True)
+
+            downloaded_item = down_item
+
+            if not down_status: # fallback to textual dump
+                self._repo_eapi = 2
+                if not self.__is_text_dump_supported():
+                    self._repo_eapi = 1
+
         if self._repo_eapi == 2:
 
             down_item = "dbdumplight"
@@ -651,6 +696,8 @@ class AvailablePackagesRepositoryUpdater(object):
             downitem = 'dbck'
         if self._repo_eapi == 2: # EAPI = 2
             downitem = 'dbdumplightck'
+        elif self._repo_eapi == 4: # EAPI = 4
+            downitem = 'dbdumpbinlightck'
 
         garbage_url, hashfile = self._construct_paths(
             uri, downitem, cmethod)
@@ -726,8 +773,14 @@ class AvailablePackagesRepositoryUpdater(object):
             remote_gb, md5file = self._construct_paths(
                 uri, "dbdumplightck", cmethod)
 
+        elif self._repo_eapi == 4:
+            remote_gb, dbfile = self._construct_paths(
+                uri, "dbdumpbinlight", cmethod)
+            remote_gb, md5file = self._construct_paths(
+                uri, "dbdumpbinlightck", cmethod)
+
         else:
-            raise AttributeError("EAPI must be = 1 or 2")
+            raise AttributeError("EAPI must be = 1, 2 or 4")
 
         try:
             return self.__verify_file_checksum(dbfile, md5file)
@@ -774,6 +827,10 @@ class AvailablePackagesRepositoryUpdater(object):
         """
         Unpack the downloaded database.
         """
+        if self._repo_eapi == 4:
+            # binary dumps are compressed internally
+            return True, 'dbdumpbinlight'
+
         file_to_unpack = etpConst['etpdatabasedump']
         if self._repo_eapi == 1:
             file_to_unpack = etpConst['etpdatabasefile']
@@ -952,6 +1009,15 @@ class AvailablePackagesRepositoryUpdater(object):
                 "%s/%s" % (uri, ec_cm6,),
                 "%s/%s" % (repo_dbpath, ec_cm6,),
             ),
+            'dbdumpbinlight': (
+                "%s/%s" % (uri, etpConst['etpdatabasedumpbinlight'],),
+                "%s/%s" % (repo_dbpath, etpConst['etpdatabasedumpbinlight'],),
+            ),
+            'dbdumpbinlightck': (
+                "%s/%s" % (uri, etpConst['etpdatabasedumpbinlighthashfile'],),
+                "%s/%s" % (repo_dbpath,
+                           etpConst['etpdatabasedumpbinlighthashfile'],),
+            ),
             'lock': (
                 "%s/%s" % (uri, repo_lock_file,),
                 "%s/%s" % (repo_dbpath, repo_lock_file,),
@@ -1238,6 +1304,8 @@ class AvailablePackagesRepositoryUpdater(object):
         dbitem = "dblight"
         if self._repo_eapi == 2:
             dbitem = "dbdumplight"
+        elif self._repo_eapi == 4:
+            dbitem = "dbdumpbinlight"
         elif self._developer_repo:
             dbitem = "db"
         garbage, dbfilename = self._construct_paths(uri, dbitem, cmethod)
@@ -1919,7 +1987,7 @@ class AvailablePackagesRepositoryUpdater(object):
         This method returns None if the request failed or the
         webservice is not available.
         """
-        if self._repo_eapi < 3:
+        if self._repo_eapi != 3:
             return
 
         # ask WebService then
@@ -1933,8 +2001,8 @@ class AvailablePackagesRepositoryUpdater(object):
         if revision is not None:
             return revision
 
-        # otherwise, fallback to previous EAPI
-        self._repo_eapi -= 1
+        # otherwise, fallback to dump based EAPI
+        self._repo_eapi = 4
 
     def _remote_revision(self, uri):
         """
@@ -2048,7 +2116,7 @@ class AvailablePackagesRepositoryUpdater(object):
             downloaded_db_item = None
             sig_down_status = False
             db_checksum_down_status = False
-            if self._repo_eapi < 3:
+            if self._repo_eapi in (1, 2, 4):
 
                 down_status, sig_down_status, downloaded_db_item = \
                     self.__database_download(uri, cmethod)
@@ -2060,7 +2128,7 @@ class AvailablePackagesRepositoryUpdater(object):
 
             elif self._repo_eapi == 3 and not const_file_writable(dbfile):
                 do_db_update_transfer = None
-                self._repo_eapi -= 1
+                self._repo_eapi = 4
                 continue
 
             elif self._repo_eapi == 3:
@@ -2077,7 +2145,7 @@ class AvailablePackagesRepositoryUpdater(object):
                 if not status:
                     # set to none and completely skip database alignment
                     do_db_update_transfer = None
-                    self._repo_eapi -= 1
+                    self._repo_eapi = 4
                     continue
 
                 break
@@ -2094,7 +2162,7 @@ class AvailablePackagesRepositoryUpdater(object):
                 d_sig_path = self.__append_gpg_signature_to_path(dpath)
                 downloaded_files.append(d_sig_path)
 
-            # 1. we're always in EAPI1 or 2 here
+            # 1. we're always in EAPI1, 2 or 4 here
             # 2. new policy, always deny repository if
             #    its database checksum cannot be fetched
             if not db_checksum_down_status:
@@ -2116,7 +2184,7 @@ class AvailablePackagesRepositoryUpdater(object):
 
         # Now we can unpack
         files_to_remove = []
-        if self._repo_eapi in (1, 2,):
+        if self._repo_eapi in (1, 2, 4):
 
             # if do_db_update_transfer == False and not None
             if (do_db_update_transfer is not None) and not \
@@ -2151,8 +2219,11 @@ class AvailablePackagesRepositoryUpdater(object):
                 os.remove(dbfile)
 
             if self._repo_eapi == 2:
-                rc = self.__eapi2_inject_downloaded_dump(dumpfile,
-                    dbfile, cmethod)
+                rc = self.__eapi2_eapi4_inject_downloaded_dump(dumpfile,
+                    dbfile)
+            elif self._repo_eapi == 4:
+                rc = self.__eapi2_eapi4_inject_downloaded_dump(unpack_path,
+                    dbfile)
 
             if do_db_update_transfer:
                 self.__eapi1_eapi2_databases_alignment(dbfile, dbfile_old)
@@ -2255,13 +2326,14 @@ class MaskableRepository(EntropyRepositoryBase):
 
     def _mask_filter_fetch_cache(self, package_id):
         if self._caching:
-            return loadobj("%s/%s/%s" % (
+            return self._cacher.pop("%s/%s/%s" % (
                 MaskableRepository._MASK_FILTER_CACHE_ID, self.name,
                     package_id,))
 
     def _mask_filter_store_cache(self, package_id, value):
         if self._caching:
-            dumpobj("%s/%s/%s" % (MaskableRepository._MASK_FILTER_CACHE_ID,
+            self._cacher.push("%s/%s/%s" % (
+                MaskableRepository._MASK_FILTER_CACHE_ID,
                 self.name, package_id,), value)
 
     def _maskFilter_live(self, package_id):
@@ -2615,6 +2687,7 @@ class MaskableRepository(EntropyRepositoryBase):
                 package_id, myr
             return package_id, myr
 
+    @SolverProfiler.profiled("repository.mask_filter")
     def maskFilter(self, package_id, live = True):
         """
         Reimplemented from EntropyRepositoryBase
@@ -2624,12 +2697,15 @@ class MaskableRepository(EntropyRepositoryBase):
 
         cached = validator_cache.get((package_id, self.name, live))
         if cached is not None:
+            _profiler.count("repository.mask_filter.cache_hit")
             return cached
 
         # use on-disk cache?
         cached = self._mask_filter_fetch_cache(package_id)
         if cached is not None:
+            _profiler.count("repository.mask_filter.cache_hit")
             return cached
+        _profiler.count("repository.mask_filter.cache_miss")
 
         # avoid memleaks
         if len(validator_cache) > 100000:
@@ -2678,6 +2754,10 @@ class AvailablePackagesRepository(CachedRepository, MaskableRepository):
     subclass of EntropyRepository. It implements the update() method in order
     to make possible to update the repository.
     """
+
+    # mostly read, use a larger page cache and memory mapped I/O
+    READ_OPTIMIZED = True
+
     def __init__(self, *args, **kwargs):
         super(AvailablePackagesRepository, self).__init__(*args, **kwargs)
 
@@ -2748,6 +2828,13 @@ class AvailablePackagesRepository(CachedRepository, MaskableRepository):
         raise PermissionDenied(
             "cannot execute addPackage on this repository")
 
+    def addPackages(self, pkgs_data, formatted_content = False):
+        """
+        Reimplemented from EntropyRepository
+        """
+        raise PermissionDenied(
+            "cannot execute addPackages on this repository")
+
     def removePackage(self, package_id, from_add_package = False):
         """
         Reimplemented from EntropyRepository
@@ -15,15 +15,17 @@ import copy
 import hashlib
 import multiprocessing
 import threading
+import time
 
 from entropy.const import etpConst, const_debug_write, const_isstring, \
     const_isnumber, const_convert_to_rawstring, const_convert_to_unicode, \
-    const_debug_enabled, const_file_readable
+    const_debug_enabled, const_file_readable, const_cmp
 from entropy.exceptions import RepositoryError, SystemDatabaseError, \
     DependenciesNotFound, DependenciesNotRemovable, DependenciesCollision
 from entropy.graph import Graph
 from entropy.misc import Lifo
 from entropy.cache import EntropyCacher
+from entropy.debug import SolverProfiler
 from entropy.output import bold, darkgreen, darkred, blue, purple, teal, brown
 from entropy.i18n import _
 from entropy.db.exceptions import IntegrityError, OperationalError, \
@@ -33,6 +35,44 @@ from entropy.client.interfaces.db import InstalledPackagesRepository
 
 import entropy.dep
 
+_profiler = SolverProfiler()
+
+
+class _DependencyNodeRecorder(object):
+    """
+    Stack and Graph stand-in recording the effects of the dependency
+    analysis of a single package match, so that they can be stored in
+    the subgraph cache and replayed later.
+    """
+
+    def __init__(self):
+        self.pushes = []
+        self.edges = []
+
+    def push(self, item):
+        self.pushes.append(item)
+
+    def add(self, item, dependency_items):
+        self.edges.append((item, frozenset(dependency_items)))
+
+
+class _ElementsCacheProbe(object):
+    """
+    Wrapper of the set of package matches already pulled in by a dependency
+    calculation, recording the lookups made against it. A stored analysis
+    is only valid if the same lookups give the same outcome again.
+    """
+
+    def __init__(self, elements_cache):
+        self._elements_cache = elements_cache
+        self.probes = []
+
+    def intersection(self, package_matches):
+        common = self._elements_cache.intersection(package_matches)
+        self.probes.append((frozenset(package_matches), bool(common)))
+        return common
+
+
 class CalculatorsMixin:
 
     def dependencies_test(self):
@@ -66,8 +106,8 @@ class CalculatorsMixin:
             xdeps = [x for x in xdeps if x not in deps_cache]
             deps_cache.update(xdeps)
 
-            needed_deps = [(x, self.installed_repository().atomMatch(x),) for \
-                x in xdeps]
+            needed_deps = zip(xdeps,
+                self.installed_repository().atomMatchMany(xdeps))
             deps_not_matched |= set(
                 [x for x, (y, z,) in needed_deps if y == -1])
 
@@ -108,7 +148,7 @@ class CalculatorsMixin:
                 version_duplicates.add(version)
             versions.add(version)
 
-        newer_ver = entropy.dep.get_newer_version(list(versions))[0]
+        newer_ver = max(versions, key = entropy.dep.version_sort_key)
         # if no duplicates are found or newer version is not in
         # duplicates we're done
         if (not version_duplicates) or (newer_ver not in version_duplicates):
@@ -169,6 +209,7 @@ class CalculatorsMixin:
             if reponame in conflictingRevisions:
                 return (results[reponame], reponame)
 
+    @SolverProfiler.profiled("atom_match")
     def atom_match(self, atom, match_slot = None, mask_filter = True,
             multi_match = False, multi_repo = False, match_repo = None,
             extended_results = False, use_cache = True):
@@ -205,7 +246,9 @@ class CalculatorsMixin:
 
             cached = self._cacher.pop(cache_key)
             if cached is not None:
+                _profiler.count("atom_match.cache_hit")
                 return cached
+            _profiler.count("atom_match.cache_miss")
 
         valid_repos = self._enabled_repos
         if match_repo and (type(match_repo) in (list, tuple, set)):
@@ -269,6 +312,21 @@ class CalculatorsMixin:
                         break
                     break
 
+        dbpkginfo = self.__atom_match_results(atom, repo_results,
+            valid_repos, match_slot, mask_filter, multi_match, multi_repo,
+            extended_results)
+
+        if cache_key is not None:
+            self._cacher.push(cache_key, dbpkginfo)
+
+        return dbpkginfo
+
+    def __atom_match_results(self, atom, repo_results, valid_repos,
+        match_slot, mask_filter, multi_match, multi_repo, extended_results):
+        """
+        Turn the per-repository atomMatch() results of an atom into
+        the atom_match() return value.
+        """
         dbpkginfo = (-1, 1)
         if extended_results:
             dbpkginfo = ((-1, None, None, None), 1)
@@ -335,11 +393,84 @@ class CalculatorsMixin:
                         dbpkginfo = (
                             set([(x, dbpkginfo[1]) for x in query_data]), 0)
 
-        if cache_key is not None:
-            self._cacher.push(cache_key, dbpkginfo)
-
         return dbpkginfo
 
+    @SolverProfiler.profiled("atom_match_many")
+    def _atom_match_many(self, atoms, match_repo = None, multi_match = False,
+                         multi_repo = False):
+        """
+        Match a list of atoms inside all the available repositories at once.
+        The returned list has the same length and order of atoms and each
+        element is exactly what atom_match() would have returned for the
+        atom at the same position. Each repository is queried through
+        atomMatchMany(). "or" dependencies and atoms carrying their own
+        repositories are handed to atom_match(). On-disk caching is not used.
+
+        @param atoms: list of atoms or dependencies to match
+        @type atoms: iterable
+        @keyword match_repo: restrict matching to the given repositories
+        @type match_repo: tuple
+        @keyword multi_match: match all the available packages, not just the
+            best one
+        @type multi_match: bool
+        @keyword multi_repo: match packages in all the repositories
+        @type multi_repo: bool
+        @return: list of atom_match() results
+        @rtype: list
+        """
+        atoms = list(atoms)
+        valid_repos = self._enabled_repos
+        if match_repo and (type(match_repo) in (list, tuple, set)):
+            valid_repos = list(match_repo)
+
+        simple_atoms = set()
+        for atom in atoms:
+            if atom.endswith(etpConst['entropyordepquestion']):
+                continue
+            if entropy.dep.dep_get_match_in_repos(atom)[1] is not None:
+                continue
+            simple_atoms.add(atom)
+        simple_atoms = list(simple_atoms)
+
+        repo_results = dict((x, {}) for x in simple_atoms)
+        if not simple_atoms:
+            valid_repos = []
+        for repo in valid_repos:
+            try:
+                dbconn = self.open_repository(repo)
+            except (RepositoryError, SystemDatabaseError):
+                # ouch, repository not available or corrupted !
+                continue
+            try:
+                try:
+                    results = dbconn.atomMatchMany(simple_atoms)
+                except TypeError:
+                    results = dbconn.atomMatchMany(
+                        simple_atoms, useCache = False)
+            except (OperationalError, DatabaseError):
+                # repository fooked, skip!
+                continue
+            for atom, (query_data, query_rc) in zip(simple_atoms, results):
+                if query_rc == 0:
+                    repo_results[atom][repo] = query_data
+
+        results = {}
+        outcome = []
+        for atom in atoms:
+            result = results.get(atom)
+            if result is None:
+                atom_results = repo_results.get(atom)
+                if atom_results is None:
+                    result = self.atom_match(atom, match_repo = match_repo,
+                        multi_match = multi_match, multi_repo = multi_repo)
+                else:
+                    result = self.__atom_match_results(atom, atom_results,
+                        valid_repos, None, True, multi_match, multi_repo,
+                        False)
+                results[atom] = result
+            outcome.append(result)
+        return outcome
+
     def atom_search(self, keyword, description = False, repositories = None,
                     use_cache = True):
         """
@@ -434,6 +565,19 @@ class CalculatorsMixin:
 
         return matches
 
+    def __dependency_match_cache(self, selected_matches_cache):
+        """
+        Return the DependencyMatchCache object stored in the given
+        selected matches cache, creating it if needed. It is shared by
+        the conditional and or dependencies resolution of a dependency
+        graph calculation.
+        """
+        match_cache = selected_matches_cache.get('matches')
+        if match_cache is None:
+            match_cache = entropy.dep.DependencyMatchCache()
+            selected_matches_cache['matches'] = match_cache
+        return match_cache
+
     def _resolve_or_dependencies(self, dependencies, selected_matches,
                                  _selected_matches_cache = None):
         """
@@ -455,6 +599,16 @@ class CalculatorsMixin:
             cache = {}
         else:
             cache = _selected_matches_cache
+        match_cache = self.__dependency_match_cache(cache)
+
+        def _atom_match(dep):
+            key = ("or", dep)
+            matches = match_cache.get(key)
+            if matches is None:
+                matches, _pkg_rc = self.atom_match(
+                    dep, multi_match = True, multi_repo = True)
+                match_cache.set(key, matches)
+            return matches
 
         def _generate_keyslot_cache():
             keyslot_map = {}
@@ -474,8 +628,7 @@ class CalculatorsMixin:
         for dep in dependencies:
 
             # determine if dependency has been explicitly selected
-            matches, _pkg_rc = self.atom_match(
-                dep, multi_match = True, multi_repo = True)
+            matches = _atom_match(dep)
             if matches:
                 found_matches.append((dep, matches))
             if const_debug_enabled():
@@ -525,7 +678,7 @@ class CalculatorsMixin:
                         dep,))
 
             # generate cache now.
-            if not cache:
+            if 'set' not in cache:
                 _generate_keyslot_cache()
 
             dep_keyslot_set = set()
@@ -565,8 +718,7 @@ class CalculatorsMixin:
 
                 # determining if the new packages are still matching
                 # the selected dependency in the or literal.
-                repo_matches, repo_rc = self.atom_match(
-                    dep, multi_match = True, multi_repo = True)
+                repo_matches = _atom_match(dep)
                 common = set(repo_matches) & common_pkg_matches
 
                 if const_debug_enabled():
@@ -631,10 +783,25 @@ class CalculatorsMixin:
 
     DISABLE_SLOT_INTERSECTION = os.getenv("ETP_DISABLE_SLOT_INTERSECTION")
 
+    @SolverProfiler.profiled("unsatisfied_dependencies")
     def _get_unsatisfied_dependencies(self, dependencies, deep_deps = False,
                                       relaxed_deps = False, depcache = None,
                                       match_repo = None):
 
+        if depcache is None:
+            depcache = {}
+
+        # dependencies already evaluated, for instance by
+        # _get_unsatisfied_dependencies_many() while walking a whole
+        # level of the dependency graph, do not need the on-disk cache.
+        for dependency in dependencies:
+            if dependency not in depcache:
+                break
+        else:
+            return self._get_unsatisfied_dependencies_many(dependencies,
+                deep_deps = deep_deps, relaxed_deps = relaxed_deps,
+                depcache = depcache, match_repo = match_repo)
+
         inst_repo = self.installed_repository()
         cl_settings = self.ClientSettings()
         misc_settings = cl_settings['misc']
@@ -662,27 +829,78 @@ class CalculatorsMixin:
 
             cached = self._cacher.pop(cache_key)
             if cached is not None:
+                _profiler.count("unsatisfied_dependencies.cache_hit")
                 return cached
+            _profiler.count("unsatisfied_dependencies.cache_miss")
 
         if const_debug_enabled():
             const_debug_write(__name__,
             "_get_unsatisfied_dependencies (not cached, deep: %s) for => %s" % (
                 deep_deps, dependencies,))
 
+        unsatisfied = self._get_unsatisfied_dependencies_many(dependencies,
+            deep_deps = deep_deps, relaxed_deps = relaxed_deps,
+            depcache = depcache, match_repo = match_repo)
+
+        if self.xcache:
+            self._cacher.push(cache_key, unsatisfied)
+
+        return unsatisfied
+
+    def _get_unsatisfied_dependencies_many(self, dependencies,
+                                           deep_deps = False,
+                                           relaxed_deps = False,
+                                           depcache = None,
+                                           match_repo = None):
+        """
+        Return the subset of the given dependencies that are not satisfied
+        by the installed packages. Dependencies are matched against the
+        installed packages repository and the available repositories all
+        at once, so that a whole dependency graph level can be evaluated
+        with a handful of queries. The outcome of each dependency is
+        stored into depcache, either False (satisfied) or the unsatisfied,
+        eventually rewritten, dependency string. Unlike
+        _get_unsatisfied_dependencies(), on-disk caching is not used.
+
+        @param dependencies: list of dependency strings
+        @type dependencies: iterable
+        @keyword deep_deps: consider installed packages not matching the
+            best available version as unsatisfied
+        @type deep_deps: bool
+        @keyword relaxed_deps: consider any installed match as satisfied
+        @type relaxed_deps: bool
+        @keyword depcache: dependency outcome cache, updated in place
+        @type depcache: dict
+        @keyword match_repo: restrict matching to the given repositories
+        @type match_repo: tuple
+        @return: the unsatisfied dependencies
+        @rtype: set
+        """
+        inst_repo = self.installed_repository()
+        cl_settings = self.ClientSettings()
+        misc_settings = cl_settings['misc']
+        ignore_spm_downgrades = misc_settings['ignore_spm_downgrades']
+
         etp_cmp = entropy.dep.entropy_compare_versions
         etp_get_rev = entropy.dep.dep_get_entropy_revision
+        version_key = entropy.dep.version_sort_key
 
         if depcache is None:
             depcache = {}
 
-        def push_to_cache(dependency, is_unsat):
+        def push_to_cache(dependency, unsatisfied_dependency):
             # push to cache
-            depcache[dependency] = is_unsat
+            depcache[dependency] = unsatisfied_dependency
+            if unsatisfied_dependency:
+                depcache[unsatisfied_dependency] = unsatisfied_dependency
 
         def _my_get_available_tags(dependency, installed_tags):
             available_tags = set()
-            matches, t_rc = self.atom_match(dependency, multi_match = True,
-                multi_repo = True, match_repo = match_repo)
+            matches, t_rc = multi_matches.get(dependency, (None, None))
+            if matches is None:
+                matches, t_rc = self.atom_match(dependency,
+                    multi_match = True, multi_repo = True,
+                    match_repo = match_repo)
             for pkg_id, repo_id in matches:
                 dbconn = self.open_repository(repo_id)
                 t_ver_tag = dbconn.retrieveTag(pkg_id)
@@ -703,25 +921,82 @@ class CalculatorsMixin:
                 return True
             return False
 
+        installed_data = {}
+
+        def _get_installed_data(c_id):
+            data = installed_data.get(c_id)
+            if data is None:
+                try:
+                    installed_ver, installed_tag, installed_rev = \
+                        inst_repo.getVersioningData(c_id)
+                    # note: read rationale below
+                    installed_digest = inst_repo.retrieveDigest(c_id)
+                except TypeError: # corrupted entry?
+                    installed_ver = "0"
+                    installed_tag = ''
+                    installed_rev = 0
+                    installed_digest = None
+                data = (installed_ver, installed_tag, installed_rev,
+                        installed_digest, version_key(
+                            installed_ver, installed_tag, installed_rev))
+                installed_data[c_id] = data
+            return data
+
+        def _is_relaxed(dependency):
+            return relaxed_deps and (not deep_deps) and \
+                (etp_get_rev(dependency) != -1)
+
+        # match the dependencies against the installed packages repository
+        # all at once, conflicts are matched without their "!" prefix.
+        pending = set(x for x in dependencies if x not in depcache)
+        conflicts = [x for x in pending if x.startswith("!")]
+        conflict_matches = dict(zip(conflicts,
+            inst_repo.atomMatchMany([x[1:] for x in conflicts])))
+        pending = [x for x in pending if not x.startswith("!")]
+        installed_matches = dict(zip(pending,
+            inst_repo.atomMatchMany(pending, multiMatch = True)))
+
+        # then against the available repositories, again all at once.
+        # Best matches are only needed by installed dependencies, while
+        # all the available matches are also used to look for tags.
+        best_pending = []
+        multi_pending = []
+        for dependency in pending:
+            if installed_matches[dependency][1] == 0:
+                if not _is_relaxed(dependency):
+                    best_pending.append(dependency)
+                    multi_pending.append(dependency)
+            elif not entropy.dep.dep_gettag(dependency):
+                multi_pending.append(dependency)
+        best_matches = dict(zip(best_pending,
+            self._atom_match_many(best_pending, match_repo = match_repo)))
+        multi_matches = dict(zip(multi_pending,
+            self._atom_match_many(multi_pending, match_repo = match_repo,
+                multi_match = True, multi_repo = True)))
+        del pending
+        del conflicts
+        del best_pending
+        del multi_pending
+
         unsatisfied = set()
         for dependency in dependencies:
 
             if dependency in depcache:
                 # already analized ?
-                is_unsat = depcache[dependency]
-                if is_unsat:
-                    unsatisfied.add(dependency)
+                unsatisfied_dependency = depcache[dependency]
+                if unsatisfied_dependency:
+                    unsatisfied.add(unsatisfied_dependency)
                 if const_debug_enabled():
                     const_debug_write(__name__,
                     "_get_unsatisfied_dependencies control cached for => %s" % (
                         dependency,))
                     const_debug_write(__name__, "...")
                 continue
+            original_dependency = dependency
 
             ### conflict
             if dependency.startswith("!"):
-                package_id, rc = inst_repo.atomMatch(
-                    dependency[1:])
+                package_id, rc = conflict_matches[dependency]
                 if package_id != -1:
                     if const_debug_enabled():
                         const_debug_write(
@@ -730,16 +1005,15 @@ class CalculatorsMixin:
                             "found on system for => %s" % (dependency,))
                         const_debug_write(__name__, "...")
                     unsatisfied.add(dependency)
-                    push_to_cache(dependency, True)
+                    push_to_cache(original_dependency, dependency)
                     continue
 
                 if const_debug_enabled():
                     const_debug_write(__name__, "...")
-                push_to_cache(dependency, False)
+                push_to_cache(original_dependency, False)
                 continue
 
-            c_ids, c_rc = inst_repo.atomMatch(dependency,
-                multiMatch = True)
+            c_ids, c_rc = installed_matches[dependency]
             if c_rc != 0:
 
                 # check if dependency can be matched in available repos and
@@ -777,7 +1051,7 @@ class CalculatorsMixin:
                             dependency,))
                     const_debug_write(__name__, "...")
                 unsatisfied.add(dependency)
-                push_to_cache(dependency, True)
+                push_to_cache(original_dependency, dependency)
                 continue
 
             # support for app-foo/foo-123~-1
@@ -791,7 +1065,7 @@ class CalculatorsMixin:
             # force_unsatisfied is another way to see "deep_deps".
             # in this case, we are going to consider valid any dep that
             # matches something in installed packages repo.
-            if (not deep_deps) and (not do_rev_deep) and (relaxed_deps):
+            if _is_relaxed(dependency):
                 if const_debug_enabled():
                     const_debug_write(
                         __name__,
@@ -799,7 +1073,7 @@ class CalculatorsMixin:
                         "(force unsat) SATISFIED => %s" % (
                             dependency,))
                     const_debug_write(__name__, "...")
-                push_to_cache(dependency, False)
+                push_to_cache(original_dependency, False)
                 continue
 
             # WARN: unfortunately, need to deal with Portage (and other
@@ -819,20 +1093,23 @@ class CalculatorsMixin:
                                 "provide, satisfied => %s" % (
                                     dependency,))
                             const_debug_write(__name__, "...")
-                        push_to_cache(dependency, False)
+                        push_to_cache(original_dependency, False)
                         provide_stop = True
                         break
                 if provide_stop:
                     continue
 
-            r_id, r_repo = self.atom_match(dependency, match_repo = match_repo)
+            r_id, r_repo = best_matches.get(dependency, (None, None))
+            if r_id is None:
+                r_id, r_repo = self.atom_match(dependency,
+                    match_repo = match_repo)
             if r_id == -1:
                 if const_debug_enabled():
                     const_debug_write(__name__,
                     "_get_unsatisfied_dependencies repository match "
                     "not found for => %s, CONSIDER SATISFIED !" % (dependency,))
                     const_debug_write(__name__, "...")
-                push_to_cache(dependency, False)
+                push_to_cache(original_dependency, False)
                 continue
 
             # Slot intersection support:
@@ -852,9 +1129,14 @@ class CalculatorsMixin:
 
             available_slots = set()
             if not self.DISABLE_SLOT_INTERSECTION:
-                r_matches, r_rcs = self.atom_match(
-                    dependency, match_repo = match_repo,
-                    multi_match = True, multi_repo = multi_repo)
+                r_matches = None
+                if multi_repo:
+                    r_matches, r_rcs = multi_matches.get(
+                        dependency, (None, None))
+                if r_matches is None:
+                    r_matches, r_rcs = self.atom_match(
+                        dependency, match_repo = match_repo,
+                        multi_match = True, multi_repo = multi_repo)
                 available_slots |= set(self.open_repository(x[1]).retrieveSlot(
                         x[0]) for x in r_matches)
             if len(available_slots) > 1:
@@ -912,24 +1194,10 @@ class CalculatorsMixin:
                             (r_id, r_repo),))
                     const_debug_write(__name__, "...")
                 unsatisfied.add(dependency)
-                push_to_cache(dependency, True)
+                push_to_cache(original_dependency, dependency)
                 continue
 
-            client_data = set()
-            for c_id in c_ids:
-                try:
-                    installed_ver, installed_tag, installed_rev = \
-                        inst_repo.getVersioningData(c_id)
-                    # note: read rationale below
-                    installed_digest = inst_repo.retrieveDigest(
-                        c_id)
-                except TypeError: # corrupted entry?
-                    installed_ver = "0"
-                    installed_tag = ''
-                    installed_rev = 0
-                    installed_digest = None
-                client_data.add((installed_ver, installed_tag, installed_rev,
-                    installed_digest,))
+            client_data = set(_get_installed_data(c_id) for c_id in c_ids)
 
             # restrict dependency matching scope inside mutually available
             # package tags. Equals to tags available in both installed and
@@ -964,10 +1232,17 @@ class CalculatorsMixin:
             # this is required for multi-slotted packages (like python)
             # and when people mix Entropy and Portage
             do_cont = False
-            for installed_ver, installed_tag, installed_rev, cdigest in client_data:
+            repo_key = version_key(repo_pkgver, repo_pkgtag, repo_pkgrev)
+            for installed_ver, installed_tag, installed_rev, cdigest, \
+                    installed_key in client_data:
 
-                vcmp = etp_cmp((repo_pkgver, repo_pkgtag, repo_pkgrev,),
-                    (installed_ver, installed_tag, installed_rev,))
+                if bool(repo_pkgtag) == bool(installed_tag):
+                    vcmp = const_cmp(repo_key, installed_key)
+                else:
+                    # version keys sort untagged versions first, which
+                    # is not what entropy_compare_versions() does.
+                    vcmp = etp_cmp((repo_pkgver, repo_pkgtag, repo_pkgrev,),
+                        (installed_ver, installed_tag, installed_rev,))
 
                 # check if both pkgs share the same branch and digest, this must
                 # be done to avoid system inconsistencies across branch upgrades
@@ -998,7 +1273,7 @@ class CalculatorsMixin:
                                 deep_deps, dependency,))
                         const_debug_write(__name__, "...")
                     do_cont = True
-                    push_to_cache(dependency, False)
+                    push_to_cache(original_dependency, False)
                     break
 
                 ver_tag_repo = (repo_pkgver, repo_pkgtag,)
@@ -1022,7 +1297,7 @@ class CalculatorsMixin:
                                 deep_deps, dependency,))
                         const_debug_write(__name__, "...")
                     do_cont = True
-                    push_to_cache(dependency, False)
+                    push_to_cache(original_dependency, False)
                     break
 
             if do_cont:
@@ -1038,10 +1313,7 @@ class CalculatorsMixin:
                 const_debug_write(__name__, "...")
 
             unsatisfied.add(dependency)
-            push_to_cache(dependency, True)
-
-        if self.xcache:
-            self._cacher.push(cache_key, unsatisfied)
+            push_to_cache(original_dependency, dependency)
 
         return unsatisfied
 
@@ -1143,7 +1415,9 @@ class CalculatorsMixin:
         # expand list of package dependencies evaluating conditionals
         unsatisfied_deps = entropy.dep.expand_dependencies(unsatisfied_deps,
             [self.open_repository(repo_id) for repo_id in self._enabled_repos],
-            selected_matches = selected_matches)
+            selected_matches = selected_matches,
+            match_cache = self.__dependency_match_cache(
+                selected_matches_cache))
 
         def _simple_or_dep_map(dependency):
             # simple or dependency format support.
@@ -1210,6 +1484,7 @@ class CalculatorsMixin:
         myundeps = repo_db.retrieveDependenciesList(pkg_id,
             exclude_deptypes = excluded_deptypes,
             resolve_conditional_deps = False)
+        self._record_dependency_keys(myundeps)
 
         # this solves some conditional dependencies using selected_matches.
         # also expands all the conditional dependencies using
@@ -1262,7 +1537,7 @@ class CalculatorsMixin:
         def _post_deps_filter(post_dep):
             pkg_matches, rc = self.atom_match(post_dep,
                 multi_match = True, multi_repo = True)
-            commons = pkg_matches & elements_cache
+            commons = elements_cache.intersection(pkg_matches)
             if commons:
                 return False
             return True
@@ -1344,9 +1619,11 @@ class CalculatorsMixin:
         potential_conflicts = self.installed_repository().searchConflict(
             pkg_key)
 
-        for dep_package_id, conflict_str in potential_conflicts:
-            confl_pkg_ids, confl_pkg_rc = repo_db.atomMatch(
-                conflict_str, multiMatch = True)
+        conflict_matches = repo_db.atomMatchMany(
+            [x[1] for x in potential_conflicts], multiMatch = True)
+
+        for (dep_package_id, conflict_str), (confl_pkg_ids, confl_pkg_rc) in \
+                zip(potential_conflicts, conflict_matches):
 
             # is this really me? ignore the rc, just go straight to ids
             if pkg_id not in confl_pkg_ids:
@@ -1373,11 +1650,243 @@ class CalculatorsMixin:
 
         return conflicts
 
+    DISABLE_SUBGRAPH_CACHE = os.getenv("ETP_DISABLE_SUBGRAPH_CACHE")
+
+    # maximum amount of package matches analysis kept in the subgraph cache
+    SUBGRAPH_CACHE_SIZE = 4096
+
+    def _load_subgraph_cache(self, selected_matches):
+        """
+        Load the persistent cache of the dependency analysis of single
+        package matches, used by _generate_dependency_tree() to splice in
+        the subgraphs already resolved by previous calculations.
+        Return None if the cache is disabled.
+
+        @param selected_matches: package matches requested by the user,
+            see _generate_dependency_tree()
+        @type selected_matches: set
+        @return: the subgraph cache object or None
+        @rtype: dict or None
+        """
+        if not self.xcache or self.DISABLE_SUBGRAPH_CACHE:
+            return None
+
+        records = self._cacher.pop(EntropyCacher.CACHE_IDS['dep_subgraph'])
+        if not isinstance(records, dict):
+            records = {}
+
+        selected_keys = {}
+        for package_id, repository_id in selected_matches:
+            key_slot = self.open_repository(
+                repository_id).retrieveKeySlot(package_id)
+            if key_slot is not None:
+                obj = selected_keys.setdefault(key_slot[0], set())
+                obj.add((package_id, repository_id))
+
+        return {
+            'records': records,
+            'selected_keys': selected_keys,
+            'changed': False,
+        }
+
+    def _save_subgraph_cache(self, subgraph_cache):
+        """
+        Store the subgraph cache object returned by _load_subgraph_cache(),
+        if changed, dropping the least recently stored entries exceeding
+        SUBGRAPH_CACHE_SIZE. Cache hits do not change the object, so that
+        calculations fully answered by the cache do not rewrite it.
+
+        @param subgraph_cache: the subgraph cache object
+        @type subgraph_cache: dict or None
+        """
+        if subgraph_cache is None or not subgraph_cache['changed']:
+            return
+
+        records = subgraph_cache['records']
+        if len(records) > self.SUBGRAPH_CACHE_SIZE:
+            lru = sorted(records, key = lambda x: records[x][0])
+            for node_key in lru[:len(records) - self.SUBGRAPH_CACHE_SIZE]:
+                del records[node_key]
+
+        self._cacher.push(EntropyCacher.CACHE_IDS['dep_subgraph'], records)
+        subgraph_cache['changed'] = False
+
+    def __subgraph_selected_view(self, subgraph_cache, pkg_match,
+                                 package_keys):
+        """
+        Return the selected package matches having one of the given package
+        keys, which are the only ones that can affect the analysis of a
+        package match referencing just those keys. The analyzed package
+        match itself is not considered.
+        """
+        selected_keys = subgraph_cache['selected_keys']
+        view = set()
+        for key in package_keys:
+            view.update(selected_keys.get(key, ()))
+        view.discard(pkg_match)
+        return frozenset(view)
+
+    def __pop_subgraph_record(self, subgraph_cache, node_key,
+                              elements_cache):
+        """
+        Return the stored analysis of a package match, if still valid.
+        """
+        records = subgraph_cache['records']
+        entry = records.get(node_key)
+        if entry is None:
+            return None
+
+        _stored, fingerprints, probes, selected_view, effects = entry
+        valid = self.__subgraph_selected_view(
+            subgraph_cache, node_key[0], fingerprints) == selected_view
+        if valid:
+            for package_matches, common in probes:
+                if bool(elements_cache.intersection(package_matches)) != \
+                        common:
+                    valid = False
+                    break
+        if valid:
+            current = self._package_keys_fingerprints(
+                fingerprints, reverse = True)
+            if current != fingerprints:
+                # stale, the referenced packages changed
+                del records[node_key]
+                subgraph_cache['changed'] = True
+                return None
+
+        if not valid:
+            return None
+
+        self._record_package_keys(fingerprints)
+        return effects
+
+    def __push_subgraph_record(self, subgraph_cache, node_key, package_keys,
+                               probes, effects):
+        """
+        Store the analysis of a package match into the subgraph cache.
+        """
+        fingerprints = self._package_keys_fingerprints(
+            package_keys, reverse = True)
+        selected_view = self.__subgraph_selected_view(
+            subgraph_cache, node_key[0], fingerprints)
+        subgraph_cache['records'][node_key] = [
+            time.time(), fingerprints, probes, selected_view, effects]
+        subgraph_cache['changed'] = True
+
+    def __generate_dependency_tree_node(self, pkg_match, pkg_key, pkg_slot,
+        repo_db, relaxed_deps, build_deps, deep_deps, empty_deps,
+        unsatisfied_deps_cache, elements_cache, recursive, selected_matches,
+        selected_matches_cache):
+        """
+        Analyze the dependencies of a single package match, see
+        _generate_dependency_tree(). Return its effects on the dependency
+        graph as (stack pushes, graph edges, inverse dependency children,
+        dependency matches, post dependency matches, dependencies not
+        found, conflicts) tuple.
+        """
+        recorder = _DependencyNodeRecorder()
+        children_matches = set()
+        deps_not_found = set()
+        conflicts = set()
+
+        cm_package_id, cm_result = self.installed_repository().atomMatch(
+            pkg_key, matchSlot = pkg_slot)
+
+        if cm_package_id != -1:
+            # this method does:
+            # - broken libraries detection
+            # - inverse dependencies check
+            children_matches, after_pkgs, before_pkgs, inverse_deps = \
+                self.__generate_dependency_tree_inst_hooks(
+                    (cm_package_id, cm_result), pkg_match,
+                    build_deps, elements_cache)
+            # this is fine this way, these are strong inverse deps
+            # and their order is already written in stone
+            for inv_match in inverse_deps:
+                recorder.push(inv_match)
+            # children_matches are always inverse dependencies, and
+            # must be stated as such, once they eventually end into
+            # the graph (see _generate_dependency_tree())
+            for child_match in children_matches:
+                recorder.push(child_match)
+
+            # these are misc and cannot be differentiated
+            for br_match in after_pkgs: # don't care about the position
+                if br_match in children_matches:
+                    # already pushed and inverse dep
+                    continue
+                recorder.push(br_match)
+            for br_match in before_pkgs:
+                # enforce dependency explicitly?
+                if br_match in children_matches:
+                    # already pushed and inverse dep
+                    continue
+                recorder.push(br_match)
+            if before_pkgs:
+                recorder.add(pkg_match, before_pkgs)
+
+        dep_matches, post_dep_matches = \
+            self.__generate_dependency_tree_analyze_deplist(
+                pkg_match, repo_db, recorder, recorder, deps_not_found,
+                conflicts, unsatisfied_deps_cache, relaxed_deps,
+                build_deps, deep_deps, empty_deps, recursive,
+                selected_matches, elements_cache, selected_matches_cache)
+
+        return (recorder.pushes, recorder.edges, frozenset(children_matches),
+                frozenset(dep_matches), frozenset(post_dep_matches),
+                frozenset(deps_not_found), frozenset(conflicts))
+
+    def __evaluate_dependency_tree_level(self, level, elements_cache,
+        unsatisfied_deps_cache, relaxed_deps, build_deps, deep_deps,
+        empty_deps, recursive, subgraph_cache):
+        """
+        Evaluate the dependencies of all the package matches in a level of
+        the dependency graph through _get_unsatisfied_dependencies_many(),
+        filling unsatisfied_deps_cache. Conflicts, conditional and "or"
+        dependencies are left to the analysis of each package match.
+        """
+        if empty_deps:
+            return
+
+        excluded_deptypes = [etpConst['dependency_type_ids']['pdepend_id']]
+        if not build_deps:
+            excluded_deptypes += [etpConst['dependency_type_ids']['bdepend_id']]
+
+        dependencies = set()
+        for pkg_match in set(level):
+            if pkg_match in elements_cache:
+                continue
+            if subgraph_cache is not None:
+                node_key = (pkg_match, empty_deps, relaxed_deps, build_deps,
+                            deep_deps, recursive)
+                if node_key in subgraph_cache['records']:
+                    # likely to be spliced in
+                    continue
+
+            pkg_id, repo_id = pkg_match
+            repo_db = self.open_repository(repo_id)
+            for dependency in repo_db.retrieveDependenciesList(pkg_id,
+                exclude_deptypes = excluded_deptypes,
+                resolve_conditional_deps = False):
+                if dependency.startswith("!") or dependency.startswith("("):
+                    continue
+                if dependency.endswith(etpConst['entropyordepquestion']):
+                    continue
+                dependencies.add(dependency)
+
+        dependencies.difference_update(unsatisfied_deps_cache)
+        if dependencies:
+            self._get_unsatisfied_dependencies_many(dependencies,
+                deep_deps = deep_deps, relaxed_deps = relaxed_deps,
+                depcache = unsatisfied_deps_cache)
+
+    @SolverProfiler.profiled("dependency_graph")
     def _generate_dependency_tree(self, matched_atom, graph,
         empty_deps = False, relaxed_deps = False, build_deps = False,
         only_deps = False, deep_deps = False, unsatisfied_deps_cache = None,
         elements_cache = None, post_deps_cache = None, recursive = True,
-        selected_matches = None, selected_matches_cache = None):
+        selected_matches = None, selected_matches_cache = None,
+        subgraph_cache = None):
 
         pkg_id, pkg_repo = matched_atom
         if (pkg_id == -1) or (pkg_repo == 1):
@@ -1394,16 +1903,29 @@ class CalculatorsMixin:
 
         if selected_matches is None:
             selected_matches = set()
+        if selected_matches_cache is None:
+            selected_matches_cache = {}
         deps_not_found = set()
         conflicts = set()
         first_element = True
 
         stack = Lifo()
-        stack.push(matched_atom)
+        next_level = [matched_atom]
         inverse_dep_stack_cache = {}
         graph_cache = set()
 
-        while stack.is_filled():
+        while stack.is_filled() or next_level:
+
+            if not stack.is_filled():
+                # the graph is walked one level at a time, so that the
+                # dependencies of the whole level are evaluated at once.
+                self.__evaluate_dependency_tree_level(next_level,
+                    elements_cache, unsatisfied_deps_cache, relaxed_deps,
+                    build_deps, deep_deps, empty_deps, recursive,
+                    subgraph_cache)
+                for match in next_level:
+                    stack.push(match)
+                del next_level[:]
 
             # get item from stack
             pkg_id, repo_id = stack.pop()
@@ -1442,50 +1964,47 @@ class CalculatorsMixin:
             except TypeError:
                 deps_not_found.add("unknown_%s_%s" % (pkg_id, repo_id,))
                 continue
-            cm_package_id, cm_result = self.installed_repository().atomMatch(
-                pkg_key, matchSlot = pkg_slot)
-
-            if cm_package_id != -1:
-                # this method does:
-                # - broken libraries detection
-                # - inverse dependencies check
-                children_matches, after_pkgs, before_pkgs, inverse_deps = \
-                    self.__generate_dependency_tree_inst_hooks(
-                        (cm_package_id, cm_result), pkg_match,
-                        build_deps, elements_cache)
-                # this is fine this way, these are strong inverse deps
-                # and their order is already written in stone
-                for inv_match in inverse_deps:
-                    stack.push(inv_match)
-                # children_matches are always inverse dependencies, and
-                # must be stated as such, once they eventually end into
-                # the graph (see below)
-                for child_match in children_matches:
-                    obj = inverse_dep_stack_cache.setdefault(child_match, set())
-                    obj.add(pkg_match)
-                    stack.push(child_match)
-
-                # these are misc and cannot be differentiated
-                for br_match in after_pkgs: # don't care about the position
-                    if br_match in children_matches:
-                        # already pushed and inverse dep
-                        continue
-                    stack.push(br_match)
-                for br_match in before_pkgs:
-                    # enforce dependency explicitly?
-                    if br_match in children_matches:
-                        # already pushed and inverse dep
-                        continue
-                    stack.push(br_match)
-                if before_pkgs:
-                    graph.add(pkg_match, before_pkgs)
-
-            dep_matches, post_dep_matches = \
-                self.__generate_dependency_tree_analyze_deplist(
-                    pkg_match, repo_db, stack, graph, deps_not_found,
-                    conflicts, unsatisfied_deps_cache, relaxed_deps,
-                    build_deps, deep_deps, empty_deps, recursive,
-                    selected_matches, elements_cache, selected_matches_cache)
+            self._record_package_keys((pkg_key,))
+
+            # the analysis of a package match may have been already done
+            # by a previous calculation, in this case splice it in
+            effects = None
+            node_key = None
+            if subgraph_cache is not None:
+                node_key = (pkg_match, empty_deps, relaxed_deps, build_deps,
+                            deep_deps, recursive)
+                effects = self.__pop_subgraph_record(
+                    subgraph_cache, node_key, elements_cache)
+                if effects is None:
+                    _profiler.count("dependency_subgraph.cache_miss")
+                else:
+                    _profiler.count("dependency_subgraph.cache_hit")
+
+            if effects is None:
+                probe = _ElementsCacheProbe(elements_cache)
+                with self._package_keys_footprint() as node_keys:
+                    node_keys.add(pkg_key)
+                    effects = self.__generate_dependency_tree_node(
+                        pkg_match, pkg_key, pkg_slot, repo_db,
+                        relaxed_deps, build_deps, deep_deps, empty_deps,
+                        unsatisfied_deps_cache, probe, recursive,
+                        selected_matches, selected_matches_cache)
+                if node_key is not None:
+                    self.__push_subgraph_record(
+                        subgraph_cache, node_key, node_keys, probe.probes,
+                        effects)
+
+            (pushes, edges, children_matches, dep_matches, post_dep_matches,
+             node_deps_not_found, node_conflicts) = effects
+
+            for child_match in children_matches:
+                obj = inverse_dep_stack_cache.setdefault(child_match, set())
+                obj.add(pkg_match)
+            next_level.extend(pushes)
+            for item, dependency_items in edges:
+                graph.add(item, set(dependency_items))
+            deps_not_found.update(node_deps_not_found)
+            conflicts.update(node_conflicts)
 
             if post_dep_matches:
                 obj = post_deps_cache.setdefault(pkg_match, set())
@@ -1526,6 +2045,7 @@ class CalculatorsMixin:
         unsatisfied_deps):
 
         post_deps = repo_db.retrievePostDependencies(repo_package_id)
+        self._record_dependency_keys(post_deps)
 
         if const_debug_enabled():
             const_debug_write(__name__,
@@ -1624,6 +2144,8 @@ class CalculatorsMixin:
             # grab its deps
             mydeps = inst_repo.retrieveDependencies(
                 inst_package_id, exclude_deptypes = excluded_dep_types)
+            self._record_dependency_keys(mydeps)
+            self._record_dependency_keys((key_slot,))
             found = False
 
             for mydep in mydeps:
@@ -1653,7 +2175,7 @@ class CalculatorsMixin:
                 mymatches, rc = self.atom_match(
                     key_slot, multi_match = True,
                     multi_repo = True)
-                got_it = mymatches & elements_cache
+                got_it = elements_cache.intersection(mymatches)
                 if got_it:
                     if const_debug_enabled():
                         atom = self.open_repository(
@@ -1675,6 +2197,7 @@ class CalculatorsMixin:
 
         return results
 
+    @SolverProfiler.profiled("library_drops")
     def _lookup_library_drops(self, match, installed_package_id):
         """
         Look for packages that would break if package match
@@ -1694,11 +2217,13 @@ class CalculatorsMixin:
         match_package_id, match_repo_id = match
 
         inst_repo = self.installed_repository()
+        inst_libs = inst_repo.getLibraryIndex()
         match_repo = self.open_repository(match_repo_id)
-        repo_libs = match_repo.retrieveProvidedLibraries(match_package_id)
+        repo_libs = match_repo.getLibraryIndex().retrieveProvidedLibraries(
+            match_package_id)
 
         # compute a list of sonames that are going to be dropped
-        client_libs = inst_repo.retrieveProvidedLibraries(
+        client_libs = inst_libs.retrieveProvidedLibraries(
             installed_package_id)
         removed_libs = [x for x in client_libs if x not in repo_libs]
 
@@ -1719,7 +2244,7 @@ class CalculatorsMixin:
         # sonames
         inst_package_ids = set()
         for lib, path, elf in removed_libs:
-            inst_package_ids |= inst_repo.searchNeeded(lib,
+            inst_package_ids |= inst_libs.searchNeeded(lib,
                 elfclass = elf)
         if not inst_package_ids:
             return set()
@@ -1737,6 +2262,7 @@ class CalculatorsMixin:
                 inst_package_id)
             if keyslot is None:
                 continue
+            self._record_dependency_keys((keyslot,))
             package_id, repository_id = self.atom_match(keyslot)
             if package_id == -1:
                 continue
@@ -1807,10 +2333,11 @@ class CalculatorsMixin:
         package_id, repository_id = package_match
         repo = self.open_repository(repository_id)
 
-        repo_needed = repo.retrieveNeeded(package_id,
+        repo_needed = repo.getLibraryIndex().retrieveNeeded(package_id,
             extended = True, formatted = True)
-        installed_needed = self.installed_repository().retrieveNeeded(
-            installed_package_id, extended = True, formatted = True)
+        installed_needed = \
+            self.installed_repository().getLibraryIndex().retrieveNeeded(
+                installed_package_id, extended = True, formatted = True)
 
         # intersect the two dicts and find the libraries that
         # have not changed. We assume that a pkg cannot link
@@ -1863,6 +2390,7 @@ class CalculatorsMixin:
 
         return inst_lib_dumps, repo_lib_dumps
 
+    @SolverProfiler.profiled("library_breakages")
     def _lookup_library_breakages(self, match, installed_package_id):
         """
         Lookup packages that need to be bumped because "match" is being
@@ -1891,7 +2419,9 @@ class CalculatorsMixin:
 
             cached = self._cacher.pop(cache_key)
             if cached is not None:
+                _profiler.count("library_breakages.cache_hit")
                 return cached
+            _profiler.count("library_breakages.cache_miss")
 
         client_side, repo_side = self.__get_library_breakages(
             match, installed_package_id)
@@ -1969,7 +2499,7 @@ class CalculatorsMixin:
             for s_repo_id in self._settings['repositories']['order']:
 
                 s_repo = self.open_repository(s_repo_id)
-                solved_needed = s_repo.resolveNeeded(
+                solved_needed = s_repo.getLibraryIndex().resolveNeeded(
                     needed, elfclass = elfclass)
                 if solved_needed:
                     solved_neededs.append((s_repo_id, solved_needed))
@@ -2040,12 +2570,13 @@ class CalculatorsMixin:
         packages requiring libfoo.so.1 have been dropped alltogether.
         """
         inst_repo = self.installed_repository()
+        inst_libs = inst_repo.getLibraryIndex()
 
         # all the packages in bumped_needed_libs should be
         # pulled in and updated
         installed_package_ids = set()
         for needed, elfclass in bumped_needed_libs:
-            installed_package_ids |= inst_repo.searchNeeded(
+            installed_package_ids |= inst_libs.searchNeeded(
                 needed, elfclass = elfclass)
         # drop myself
         installed_package_ids.discard(installed_package_id)
@@ -2150,17 +2681,30 @@ class CalculatorsMixin:
                     deptree[stick_level] = (post_dep,)
                     _setup_levels()
 
+    @SolverProfiler.profiled("required_packages")
     def _get_required_packages(self, package_matches, empty_deps = False,
         deep_deps = False, relaxed_deps = False, build_deps = False,
-        only_deps = False, quiet = False, recursive = True):
-
-        inst_repo = self.installed_repository()
+        only_deps = False, quiet = False, recursive = True, levels = False):
+        """
+        Calculate the dependency tree of the given package matches.
+        Return a dict mapping dependency levels (install order, starting
+        from 1) to tuples of package matches. Level 0 contains the
+        installed package identifiers that should be removed due to
+        conflicts. If levels is True, package matches without mutual
+        ordering constraints are grouped in the same dependency level
+        (and could be fetched, unpacked and merged concurrently),
+        otherwise every level contains a single package match, or the
+        package matches of a dependency cycle.
+        The on-disk cache is validated against the packages the
+        calculation went through, see CacheMixin._pop_footprint_cache().
+        """
         cache_key = None
+        system_mask = self.ClientSettings()['repositories']['system_mask']
 
         if self.xcache:
             sha = hashlib.sha1()
 
-            cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v4" % (
+            cache_s = "%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|%s|v5" % (
                 ";".join(["%s" % (x,) for x in sorted(package_matches)]),
                 empty_deps,
                 deep_deps,
@@ -2168,9 +2712,10 @@ class CalculatorsMixin:
                 build_deps,
                 only_deps,
                 recursive,
-                inst_repo.checksum(),
-                self._all_repositories_hash(),
+                levels,
+                ";".join(self._enabled_repos),
                 ";".join(sorted(self._settings['repositories']['available'])),
+                ";".join(sorted(system_mask)),
                 # needed when users do bogus things like editing config files
                 # manually (branch setting)
                 self._settings['repositories']['branch'])
@@ -2180,10 +2725,32 @@ class CalculatorsMixin:
                 EntropyCacher.CACHE_IDS['dep_tree'],
                 sha.hexdigest())
 
-            cached = self._cacher.pop(cache_key)
+            cached = self._pop_footprint_cache(cache_key)
             if cached is not None:
+                _profiler.count("required_packages.cache_hit")
                 return cached
+            _profiler.count("required_packages.cache_miss")
+
+        with self._package_keys_footprint() as package_keys:
+            self._record_dependency_keys(system_mask)
+            self._record_package_matches(package_matches)
+            reverse_tree = self.__calculate_required_packages(
+                package_matches, empty_deps, deep_deps, relaxed_deps,
+                build_deps, only_deps, quiet, recursive, levels)
 
+        if self.xcache:
+            self._push_footprint_cache(cache_key, reverse_tree,
+                                       package_keys, reverse = True)
+
+        return reverse_tree
+
+    def __calculate_required_packages(self, package_matches, empty_deps,
+        deep_deps, relaxed_deps, build_deps, only_deps, quiet, recursive,
+        levels):
+        """
+        Calculate the dependency tree of the given package matches,
+        see _get_required_packages().
+        """
         graph = Graph()
         deptree_conflicts = set()
         atomlen = len(package_matches)
@@ -2212,6 +2779,7 @@ class CalculatorsMixin:
         selected_matches_set = set(package_matches)
         post_deps_cache = {}
         matchfilter = set()
+        subgraph_cache = self._load_subgraph_cache(selected_matches_set)
         for matched_atom in package_matches:
 
             pkg_id, pkg_repo = matched_atom
@@ -2246,7 +2814,8 @@ class CalculatorsMixin:
                     post_deps_cache = post_deps_cache,
                     recursive = recursive,
                     selected_matches = selected_matches_set,
-                    selected_matches_cache = selected_matches_cache
+                    selected_matches_cache = selected_matches_cache,
+                    subgraph_cache = subgraph_cache
                 )
             except DependenciesNotFound as err:
                 deps_not_found |= err.value
@@ -2254,6 +2823,8 @@ class CalculatorsMixin:
 
             deptree_conflicts |= conflicts
 
+        self._save_subgraph_cache(subgraph_cache)
+
         if deps_not_found:
             graph.destroy()
             raise DependenciesNotFound(deps_not_found)
@@ -2262,7 +2833,7 @@ class CalculatorsMixin:
         adj_map = dict((x.item(), set(k.item() for k in y)) \
             for x, y in graph.get_adjacency_map().items())
         # solve depgraph and append conflicts
-        deptree = graph.solve()
+        deptree = graph.solve(levels = levels)
         if 0 in deptree:
             graph.destroy()
             raise KeyError("Graph contains a dep_level == 0")
@@ -2302,9 +2873,6 @@ class CalculatorsMixin:
         graph.destroy()
         reverse_tree[0] = deptree_conflicts
 
-        if self.xcache:
-            self._cacher.push(cache_key, reverse_tree)
-
         return reverse_tree
 
     def __filter_depends_multimatched_atoms(self, package_id, repo_id, depends,
@@ -2324,8 +2892,8 @@ class CalculatorsMixin:
                 my_remove_depends = set()
 
                 dbconn = self.open_repository(d_repo_id)
-                mydeps = dbconn.retrieveDependencies(d_package_id,
-                    exclude_deptypes = excluded_dep_types)
+                mydeps = dbconn.getDependencyIndex().retrieveDependencies(
+                    d_package_id, exclude_deptypes = excluded_dep_types)
 
                 for mydep in mydeps:
 
@@ -2360,6 +2928,7 @@ class CalculatorsMixin:
 
     DISABLE_NEEDED_SCANNING = os.getenv("ETP_DISABLE_ELF_NEEDED_SCANNING")
 
+    @SolverProfiler.profiled("reverse_dependency_graph")
     def _generate_reverse_dependency_tree(self, matched_atoms, deep = False,
         recursive = True, empty = False, system_packages = True,
         elf_needed_scanning = True):
@@ -2383,38 +2952,57 @@ class CalculatorsMixin:
                         for x in matched_atoms], deep, recursive, empty,
                         system_packages, elf_needed_scanning))
 
-        inst_repo = self.installed_repository()
         cache_key = None
+        system_mask = self.ClientSettings()['repositories']['system_mask']
 
         if self.xcache:
             sha = hashlib.sha1()
 
-            cache_s = "ma{%s}s{%s;%s;%s;%s;%s;%s;%s;%s;%s}v2" % (
+            cache_s = "ma{%s}s{%s;%s;%s;%s;%s;%s;%s;%s}v3" % (
                 ";".join(["%s" % (x,) for x in sorted(matched_atoms)]),
                 deep,
                 recursive,
                 empty,
                 system_packages,
                 elf_needed_scanning,
-                inst_repo.checksum(),
-                self._all_repositories_hash(),
                 ";".join(self._enabled_repos),
                 ";".join(sorted(self._settings['repositories']['available'])),
+                ";".join(sorted(system_mask)),
                 )
             sha.update(const_convert_to_rawstring(cache_s))
 
             cache_key = "%s%s" % (
                 EntropyCacher.CACHE_IDS['depends_tree'], sha.hexdigest(),)
 
-            cached = self._cacher.pop(cache_key)
+            cached = self._pop_footprint_cache(cache_key)
             if cached is not None:
+                _profiler.count("reverse_dependency_graph.cache_hit")
                 return cached
+            _profiler.count("reverse_dependency_graph.cache_miss")
 
         if const_debug_enabled():
             const_debug_write(__name__,
                 "\n_generate_reverse_dependency_tree [m:%s] not cached!" % (
                     matched_atoms,))
 
+        with self._package_keys_footprint() as package_keys:
+            self._record_dependency_keys(system_mask)
+            deptree = self.__calculate_reverse_dependency_tree(
+                matched_atoms, deep, recursive, empty, system_packages,
+                elf_needed_scanning)
+
+        if cache_key is not None:
+            self._push_footprint_cache(cache_key, deptree, package_keys,
+                                       reverse = True)
+
+        return deptree
+
+    def __calculate_reverse_dependency_tree(self, matched_atoms, deep,
+        recursive, empty, system_packages, elf_needed_scanning):
+        """
+        Calculate the reverse dependency tree of the given package matches,
+        see _generate_reverse_dependency_tree().
+        """
         count = 0
         match_cache = set()
         stack = Lifo()
@@ -2446,8 +3034,10 @@ class CalculatorsMixin:
             return deps
 
         def get_direct_deps(repo_db, pkg_id):
-            return repo_db.retrieveDependencies(pkg_id,
-                exclude_deptypes = (bdepend_id,))
+            d_deps = repo_db.getDependencyIndex().retrieveDependencies(
+                pkg_id, exclude_deptypes = (bdepend_id,))
+            self._record_dependency_keys(d_deps)
+            return d_deps
 
         def filter_deps(raw_deps):
             filtered_deps = set()
@@ -2525,7 +3115,8 @@ class CalculatorsMixin:
 
         def get_revdeps(pkg_id, repo_id, repo_db):
             # obtain its inverse deps
-            reverse_deps_ids = repo_db.retrieveReverseDependencies(
+            repo_deps = repo_db.getDependencyIndex()
+            reverse_deps_ids = repo_deps.retrieveReverseDependencies(
                 pkg_id, exclude_deptypes = (pdepend_id, bdepend_id,),
                 extended = True)
             if const_debug_enabled():
@@ -2559,7 +3150,8 @@ class CalculatorsMixin:
             return reverse_deps
 
         def get_revdeps_lib(pkg_id, repo_id, repo_db):
-            provided_libs = repo_db.retrieveProvidedLibraries(pkg_id)
+            repo_libs = repo_db.getLibraryIndex()
+            provided_libs = repo_libs.retrieveProvidedLibraries(pkg_id)
             reverse_deps = set()
 
             for needed, path, elfclass in provided_libs:
@@ -2569,7 +3161,7 @@ class CalculatorsMixin:
                 needed_key = (needed, elfclass)
                 needed_providers = needed_providers_left.get(needed_key)
                 if needed_providers is None:
-                    needed_providers = set(repo_db.resolveNeeded(
+                    needed_providers = set(repo_libs.resolveNeeded(
                         needed, elfclass = elfclass))
                     needed_providers_left[needed_key] = needed_providers
 
@@ -2589,7 +3181,7 @@ class CalculatorsMixin:
                                  for x in needed_providers]))
                     continue
 
-                for needed_package_id in repo_db.searchNeeded(
+                for needed_package_id in repo_libs.searchNeeded(
                         needed, elfclass = elfclass):
                     reverse_deps.add((needed_package_id, repo_id))
 
@@ -2637,8 +3229,9 @@ class CalculatorsMixin:
 
         def setup_revdeps(filtered_deps):
             for d_rev_dep, d_repo_id in filtered_deps:
-                d_repo_db = self.open_repository(d_repo_id)
-                mydepends = d_repo_db.retrieveReverseDependencies(
+                d_repo_deps = self.open_repository(
+                    d_repo_id).getDependencyIndex()
+                mydepends = d_repo_deps.retrieveReverseDependencies(
                     d_rev_dep, exclude_deptypes = \
                         (pdepend_id, bdepend_id,))
                 deep_dep_map[(d_rev_dep, d_repo_id)] = \
@@ -2681,6 +3274,7 @@ class CalculatorsMixin:
                     "\n_generate_reverse_dependency_tree %s not available!" % (
                     (pkg_id, repo_id),))
                 continue
+            self._record_dependency_keys((p_atom,))
             self.output(
                 blue(rem_dep_text + " %s" % (purple(p_atom),)),
                 importance = 0,
@@ -2800,9 +3394,8 @@ class CalculatorsMixin:
             del flat_dep_tree
 
         graph.destroy()
-
-        if cache_key is not None:
-            self._cacher.push(cache_key, deptree)
+        for r_deps in deptree.values():
+            self._record_package_matches(r_deps)
 
         return deptree
 
@@ -2994,6 +3587,120 @@ class CalculatorsMixin:
 
         return sec_updates
 
+    DISABLE_BULK_UPDATES = os.getenv("ETP_DISABLE_BULK_UPDATES")
+
+    def __calculate_updates_bulk(self, match_repos):
+        """
+        Match the installed packages against the given repositories
+        through a (key, slot) join of the metadata returned by
+        listAllStrictData(), rather than calling atom_match() for every
+        installed package. Tagged, injected and multi-slot installed
+        packages, as well as old-style virtuals, are left out and must go
+        through atom_match().
+
+        @param match_repos: ordered list of repository identifiers
+        @type match_repos: tuple
+        @return: dict mapping installed package identifiers to a tuple
+            composed by (getStrictData() tuple, installed package digest,
+            atom_match() extended result, matched package digest)
+        @rtype: dict
+        """
+        inst_repo = self.installed_repository()
+        installed = inst_repo.listAllStrictData()
+        injected = inst_repo.listAllInjectedPackageIds()
+        virtual_cat = EntropyRepositoryBase.VIRTUAL_META_PACKAGE_CATEGORY
+
+        key_slots = {}
+        for inst_data in installed:
+            key_slots.setdefault(inst_data[1], set()).add(inst_data[2])
+
+        wanted = {}
+        for inst_data in installed:
+            package_id, key, slot, _ver, tag = inst_data[:5]
+            if tag or (package_id in injected) or (len(key_slots[key]) > 1):
+                continue
+            wanted.setdefault((key, slot), []).append(inst_data)
+
+        # (key, slot) => {repository_id: (package_id, version, tag, rev)}
+        repo_matches = {}
+        digests = {}
+        # multi-slot packages are left out, keys are unique in wanted
+        virtual_keys = dict((x[0], x) for x in wanted \
+                                if x[0].split("/")[0] == virtual_cat)
+
+        for repository_id in match_repos:
+            try:
+                repo = self.open_repository(repository_id)
+            except (RepositoryError, SystemDatabaseError):
+                continue
+            try:
+                available = repo.listAllStrictData()
+            except (OperationalError, DatabaseError):
+                # atom_match() would skip the repository as well
+                continue
+
+            candidates = {}
+            repo_keys = set()
+            for r_data in available:
+                repo_keys.add(r_data[1])
+                key_slot = (r_data[1], r_data[2])
+                if key_slot in wanted:
+                    candidates.setdefault(key_slot, []).append(r_data)
+
+            # atomMatch() looks old-style virtuals up in PROVIDE
+            # metadata if their key is not available, keep them out.
+            for key in [x for x in virtual_keys if x not in repo_keys]:
+                key_slot = virtual_keys.pop(key)
+                del wanted[key_slot]
+                candidates.pop(key_slot, None)
+
+            for key_slot, r_datas in candidates.items():
+                versions = {}
+                for r_data in r_datas:
+                    r_package_id, _key, _slot, version, tag, revision, \
+                        _atom, digest = r_data
+                    if repo.maskFilter(r_package_id)[0] == -1:
+                        continue
+                    versions[(version, tag, revision)] = r_package_id
+                    digests[(r_package_id, repository_id)] = digest
+                if not versions:
+                    continue
+
+                # prefer non-tagged packages, like atomMatch() does
+                if [x for x in versions if not x[1]]:
+                    versions = dict((x, y) for x, y in versions.items() \
+                                        if not x[1])
+
+                newer = max(versions,
+                            key = lambda x: entropy.dep.version_sort_key(*x))
+                repo_matches.setdefault(key_slot, {})[repository_id] = (
+                    versions[newer],) + newer
+
+        no_match = ((-1, None, None, None), 1)
+        resolved = {}
+        for key_slot, inst_datas in wanted.items():
+            results = repo_matches.get(key_slot)
+            if not results:
+                match = no_match
+            elif len(results) == 1:
+                repository_id = list(results.keys())[0]
+                match = (results[repository_id], repository_id)
+            else:
+                match = self.__handle_multi_repo_matches(
+                    results, True, list(match_repos))
+                if match is None:
+                    match = no_match
+
+            r_digest = None
+            if match[1] != 1:
+                r_digest = digests.get((match[0][0], match[1]))
+            for inst_data in inst_datas:
+                resolved[inst_data[0]] = (
+                    inst_data[1:7], inst_data[7], match, r_digest)
+
+        return resolved
+
+    @SolverProfiler.profiled("calculate_updates")
     def calculate_updates(self, empty = False, use_cache = True,
         critical_updates = True, quiet = False):
         """
@@ -3038,12 +3745,12 @@ class CalculatorsMixin:
                     'critical_found': True,
                     }
 
-        repo_hash = self._repositories_hash()
         if use_cache and self.xcache:
-            cached = self._get_updates_cache(empty_deps = empty,
-                repo_hash = repo_hash)
+            cached = self._get_updates_cache(empty_deps = empty)
             if cached is not None:
+                _profiler.count("calculate_updates.cache_hit")
                 return cached
+            _profiler.count("calculate_updates.cache_miss")
 
         # do not match package repositories, never consider them in updates!
         # that would be a nonsense, since package repos are temporary.
@@ -3061,6 +3768,15 @@ class CalculatorsMixin:
             # client db is broken!
             raise SystemDatabaseError("installed packages repository is broken")
 
+        # match most of the installed packages at once, the others
+        # go through atom_match() below
+        bulk_matches = {}
+        if self.DISABLE_BULK_UPDATES is None:
+            try:
+                bulk_matches = self.__calculate_updates_bulk(match_repos)
+            except (OperationalError, DatabaseError):
+                bulk_matches = {}
+
         count = 0
         total = len(package_ids)
         last_count = 0
@@ -3068,6 +3784,7 @@ class CalculatorsMixin:
         fine = collections.deque()
         spm_fine = collections.deque()
         update = set()
+        unmatched = {}
 
         while True:
             try:
@@ -3096,27 +3813,36 @@ class CalculatorsMixin:
                         footer = " ::"
                     )
 
-            try:
+            bulk_match = bulk_matches.get(package_id)
+            if bulk_match is not None:
+                strict_data, _c_digest, match, _r_digest = bulk_match
                 cl_pkgkey, cl_slot, cl_version, \
-                    cl_tag, cl_revision, \
-                    cl_atom = self.installed_repository().getStrictData(
-                        package_id)
-            except TypeError:
-                # check against broken entries, or removed during iteration
-                continue
+                    cl_tag, cl_revision, cl_atom = strict_data
+                m_package_id = match[0][0]
+            else:
+                try:
+                    cl_pkgkey, cl_slot, cl_version, \
+                        cl_tag, cl_revision, \
+                        cl_atom = self.installed_repository().getStrictData(
+                            package_id)
+                except TypeError:
+                    # check against broken entries, or removed during
+                    # iteration
+                    continue
+
             use_match_cache = True
             do_continue = False
 
             # try to search inside package tag, if it's available,
             # otherwise, do the usual duties.
             cl_pkgkey_tag = None
-            if cl_tag:
+            if (bulk_match is None) and cl_tag:
                 cl_pkgkey_tag = "%s%s%s" % (
                     cl_pkgkey,
                     etpConst['entropytagprefix'],
                     cl_tag)
 
-            while True:
+            while bulk_match is None:
                 try:
                     match = None
                     if cl_pkgkey_tag is not None:
@@ -3201,14 +3927,22 @@ class CalculatorsMixin:
                     # first check branch
                     if package_id is not None:
 
-                        c_digest = self.installed_repository().retrieveDigest(
-                            package_id)
+                        if bulk_match is not None:
+                            c_digest = bulk_match[1]
+                        else:
+                            c_digest = \
+                                self.installed_repository().retrieveDigest(
+                                    package_id)
                         # If the repo has been manually (user-side)
                         # regenerated, digest == "0". In this case
                         # skip the check.
                         if c_digest != "0":
-                            c_repodb = self.open_repository(repoid)
-                            r_digest = c_repodb.retrieveDigest(m_package_id)
+                            if bulk_match is not None:
+                                r_digest = bulk_match[3]
+                            else:
+                                c_repodb = self.open_repository(repoid)
+                                r_digest = c_repodb.retrieveDigest(
+                                    m_package_id)
 
                             if (r_digest != c_digest) and \
                                (r_digest is not None) \
@@ -3220,20 +3954,44 @@ class CalculatorsMixin:
                     fine.append(cl_atom)
                     continue
 
-            # don't take action if it's just masked
-            maskedresults = self.atom_match(
-                cl_pkgkey, match_slot = cl_slot,
-                mask_filter = False, match_repo = match_repos)
-            if maskedresults[0] == -1:
-                remove.append(package_id)
+            # don't take action if it's just masked, see below
+            unmatched.setdefault(cl_slot, []).append((package_id, cl_pkgkey))
+
+        # packages not found in repositories are removed only if they are
+        # not even available as masked. Look them up in bulk, grouped by slot.
+        for repository_id in match_repos:
+            if not unmatched:
+                break
+            try:
+                repo = self.open_repository(repository_id)
+            except (RepositoryError, SystemDatabaseError):
+                continue
+
+            for cl_slot, slot_unmatched in list(unmatched.items()):
+                try:
+                    results = repo.atomMatchMany(
+                        [x[1] for x in slot_unmatched],
+                        matchSlot = cl_slot, maskFilter = False)
+                except (OperationalError, DatabaseError):
+                    break
+                slot_unmatched = [x for x, (m_id, m_rc) in zip(
+                        slot_unmatched, results) if m_rc != 0]
+                if slot_unmatched:
+                    unmatched[cl_slot] = slot_unmatched
+                else:
+                    del unmatched[cl_slot]
+
+        for slot_unmatched in unmatched.values():
+            remove.extend([x[0] for x in slot_unmatched])
 
         # validate remove, do not return installed packages that are
         # still referenced by others as "removable"
         # check inverse dependencies at the cost of growing complexity
         if remove:
+            inst_deps = self.installed_repository().getDependencyIndex()
             remove = [
                 x for x in remove if not \
-                    self.installed_repository().retrieveReverseDependencies(x)]
+                    inst_deps.retrieveReverseDependencies(x)]
         else:
             remove = list(remove)
 
@@ -3254,9 +4012,15 @@ class CalculatorsMixin:
             }
 
         if self.xcache:
-            c_hash = self._get_updates_cache_hash(repo_hash, empty,
+            c_hash = self._get_updates_cache_hash(empty,
                 ignore_spm_downgrades)
-            self._cacher.push(c_hash, outcome, async = False)
+            # the outcome depends on every installed package and on its
+            # counterparts in the available repositories
+            package_keys = set(x[1] for x in \
+                self.installed_repository().listAllStrictData())
+            package_keys.add(self.INSTALLED_FOOTPRINT)
+            self._push_footprint_cache(c_hash, outcome, package_keys,
+                                       async = False)
             self._cacher.sync()
 
         if not update:
@@ -95,6 +95,7 @@ class LoadersMixin:
         """
         client_data = self.ClientSettings()['misc']
         kwargs['gpg'] = client_data['gpg']
+        kwargs.setdefault('prewarm_cache', client_data['cache_prewarm'])
         return self.__repository_loader(self, *args, **kwargs)
 
     def WebServices(self):
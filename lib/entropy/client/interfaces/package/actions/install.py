@@ -1233,7 +1233,12 @@ class _PackageInstallAction(_PackageInstallRemoveAction):
         """
         Execute the package installation code.
         """
-        self._entropy.clear_cache()
+        package_keys = [entropy.dep.dep_getkey(self._meta['atom'])]
+        if remove_package_id != -1:
+            key_slot = inst_repo.retrieveKeySlot(remove_package_id)
+            if key_slot is not None:
+                package_keys.append(key_slot[0])
+        self._entropy.clear_cache(package_keys = package_keys)
 
         self._entropy.logger.log(
             "[Package]",
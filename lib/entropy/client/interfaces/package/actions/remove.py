@@ -163,7 +163,11 @@ class _PackageRemoveAction(_PackageInstallRemoveAction):
         _remove_phase(), assuming that the installed packages repository lock
         is held.
         """
-        self._entropy.clear_cache()
+        package_keys = []
+        key_slot = inst_repo.retrieveKeySlot(self._package_id)
+        if key_slot is not None:
+            package_keys.append(key_slot[0])
+        self._entropy.clear_cache(package_keys = package_keys)
 
         removecontent_file = self._generate_content_file(
             inst_repo.retrieveContentIter(
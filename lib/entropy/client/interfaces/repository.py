@@ -68,7 +68,7 @@ class Repository(object):
 
     def __init__(self, entropy_client, repo_identifiers = None,
         force = False, entropy_updates_alert = True, fetch_security = True,
-        gpg = True):
+        gpg = True, prewarm_cache = False):
         """
         Entropy Client Repositories management interface constructor.
 
@@ -78,7 +78,9 @@ class Repository(object):
         @keyword repo_identifiers: list of repository identifiers you want to
             take into consideration
         @type repo_identifiers: list
-        @
+        @keyword prewarm_cache: recompute the invalidated caches in a low
+            priority background process after a successful sync
+        @type prewarm_cache: bool
         """
 
         if repo_identifiers is None:
@@ -98,6 +100,7 @@ class Repository(object):
         self.already_updated = 0
         self.not_available = 0
         self._gpg_feature = gpg
+        self._prewarm_cache = prewarm_cache
         env_gpg = os.getenv('ETP_DISBLE_GPG')
         if env_gpg is not None:
             self._gpg_feature = False
@@ -147,6 +150,12 @@ class Repository(object):
         self.updated = False
         sts = EntropyRepositoryBase
 
+        # packages metadata before the update, used to only drop the
+        # dependency caches referencing changed packages
+        snapshots = dict((x, self._entropy._repository_keys_snapshot(x)) \
+                             for x in self.repo_ids)
+        self._entropy.close_repositories()
+
         for repo in self.repo_ids:
 
             try:
@@ -180,7 +189,18 @@ class Repository(object):
 
         # clean caches, fetch security
         if self.updated:
-            self._entropy.clear_cache()
+            package_keys = set()
+            for repo in self.updated_repos:
+                before = snapshots.get(repo)
+                after = self._entropy._repository_keys_snapshot(repo)
+                if before is None or after is None:
+                    package_keys = None
+                    break
+                for key in set(before) | set(after):
+                    if before.get(key) != after.get(key):
+                        package_keys.add(key)
+            self._entropy.close_repositories()
+            self._entropy.clear_cache(package_keys = package_keys)
             if self.fetch_security:
                 self._update_security_advisories()
 
@@ -372,4 +392,9 @@ class Repository(object):
 
             self._set_last_successful_sync_time()
 
+        if self.updated and self._prewarm_cache:
+            # caches have been invalidated by _run_sync(), recompute
+            # them now rather than on the next user command
+            self._entropy.spawn_cache_prewarm()
+
         return 0
@@ -524,6 +524,7 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             'configprotectskip': set(),
             'autoprune_days': None, # disabled by default
             'edelta_support': False, # disabled by default
+            'cache_prewarm': False, # disabled by default
         }
 
         cli_conf = ClientSystemSettingsPlugin.client_conf_path()
@@ -597,6 +598,11 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             if bool_setting is not None:
                 data['ignore_spm_downgrades'] = bool_setting
 
+        def _cacheprewarm(setting):
+            bool_setting = entropy.tools.setting_to_bool(setting)
+            if bool_setting is not None:
+                data['cache_prewarm'] = bool_setting
+
         def _splitdebug(setting):
             bool_setting = entropy.tools.setting_to_bool(setting)
             if bool_setting is not None:
@@ -636,6 +642,7 @@ class ClientSystemSettingsPlugin(SystemSettingsPlugin):
             'gpg': _gpg,
             'ignore-spm-downgrades': _spm_downgrades,
             'splitdebug': _splitdebug,
+            'cache-prewarm': _cacheprewarm,
             # backward compatibility
             'collisionprotect': _collisionprotect,
             'collision-protect': _collisionprotect,
@@ -403,6 +403,11 @@ def const_default_settings(rootdir):
         'etpdatabasedumplighthashfilebz2': default_etp_dbfile+".dumplight.bz2.md5",
         'etpdatabasedumplighthashfilegzip': default_etp_dbfile+".dumplight.gz.md5",
         'etpdatabasedumplight': default_etp_dbfile+".dumplight",
+        # Entropy binary database dump file, light ver (no content),
+        # rows are compressed internally (see entropy.db.dump)
+        'etpdatabasedumpbinlight': default_etp_dbfile+".dumpbinlight",
+        'etpdatabasedumpbinlighthashfile': \
+            default_etp_dbfile+".dumpbinlight.md5",
         # expiration based server-side packages removal
 
         'etpdatabaseexpbasedpkgsrm': default_etp_dbfile+".fatscope",
@@ -542,7 +547,7 @@ def const_default_settings(rootdir):
         # Entropy database API revision
         'etpapi': etpSys['api'],
         # Entropy database API currently supported
-        'supportedapis': (1, 2, 3),
+        'supportedapis': (1, 2, 3, 4),
         # contains the current running architecture
         'currentarch': etpSys['arch'],
         # Entropy supported Archs
@@ -9,65 +9,289 @@
     I{EntropyRepository} caching interface.
 
 """
-import weakref
+import collections
+import itertools
+import os
+import sys
+import threading
 
+from entropy.cache import CacheMetrics
+from entropy.const import const_debug_write
 from entropy.core import Singleton
 
 
+# number of items sampled per container and container nesting levels
+# looked into by _estimate_size()
+_ESTIMATE_SAMPLES = 8
+_ESTIMATE_DEPTH = 3
+
+
+def _estimate_size(obj, depth = _ESTIMATE_DEPTH):
+    """
+    Roughly estimate the memory used by obj, in constant time: only the
+    first _ESTIMATE_SAMPLES items of each container, down to depth
+    nesting levels, are measured and the result is extrapolated to the
+    container length. Objects shared among items are accounted more
+    than once.
+    """
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, dict):
+        # items() is not lazy on Python 2
+        items = itertools.chain.from_iterable(
+            (key, obj[key]) for key in
+            itertools.islice(obj, _ESTIMATE_SAMPLES))
+        length = 2 * len(obj)
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        items = itertools.islice(obj, _ESTIMATE_SAMPLES)
+        length = len(obj)
+    else:
+        return size
+
+    sampled = 0
+    sampled_size = 0
+    for item in items:
+        sampled += 1
+        sampled_size += _estimate_size(item, depth = depth - 1)
+    if sampled:
+        size += sampled_size * length // sampled
+    return size
+
+
 class EntropyRepositoryCacher(Singleton):
     """
     Tiny singleton-based helper class used by EntropyRepository in order
     to keep cached items in RAM.
+    Items are stored into namespaces (usually, one per repository) and
+    evicted in least recently used order whenever their estimated memory
+    usage exceeds the configured budget. The budget can be set through
+    the ETP_REPOSITORY_CACHE_MB environment variable or set_budget().
+    Memory usage accounting is approximate: the size of an item is
+    estimated by sampling when it is set (unless given by the caller) and
+    later changes to the item itself, or to objects loaded lazily by it,
+    are not accounted.
     """
+
+    # default memory budget, in bytes
+    DEFAULT_BUDGET = 128 * 1024 * 1024
+
+    # CacheMetrics cache identifier
+    METRICS_ID = "repository_memory"
+
     def init_singleton(self):
-        self.__live_cache = {}
+        self._mutex = threading.Lock()
+        self._metrics = CacheMetrics()
+        self._budget = self.DEFAULT_BUDGET
+        budget = os.getenv("ETP_REPOSITORY_CACHE_MB")
+        if budget is not None:
+            try:
+                self._budget = int(budget) * 1024 * 1024
+            except ValueError:
+                const_debug_write(
+                    __name__,
+                    "invalid ETP_REPOSITORY_CACHE_MB value: %s" % (budget,))
+        self._reset()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _reset(self):
+        """
+        Drop all the cached items. Must be called with the mutex held.
+        """
+        # namespace -> {key: (value, size)}
+        self._namespaces = {}
+        # namespace -> discard generation, entries of older generations
+        # left in the LRU list are just skipped
+        self._generations = {}
+        # (namespace, generation, key) -> None, in least recently
+        # used order
+        self._lru = collections.OrderedDict()
+        self._entries = 0
+        self._size = 0
+
+    def _touch(self, namespace, key):
+        """
+        Mark the given item as the most recently used.
+        Must be called with the mutex held.
+        """
+        lru_key = (namespace, self._generations.get(namespace, 0), key)
+        self._lru.pop(lru_key, None)
+        self._lru[lru_key] = None
+
+    def _remove(self, namespace, key):
+        """
+        Remove the given item. Must be called with the mutex held.
+        """
+        items = self._namespaces.get(namespace)
+        if items is None or key not in items:
+            return
+        _value, size = items.pop(key)
+        self._lru.pop(
+            (namespace, self._generations.get(namespace, 0), key), None)
+        self._entries -= 1
+        self._size -= size
+        if not items:
+            del self._namespaces[namespace]
+
+    def _evict(self):
+        """
+        Evict the least recently used items until the memory budget is
+        respected, always keeping the most recently used one.
+        Must be called with the mutex held.
+        """
+        while self._size > self._budget and len(self._lru) > 1:
+            (namespace, generation, key), _x = self._lru.popitem(
+                last = False)
+            if generation != self._generations.get(namespace, 0):
+                # discarded namespace
+                continue
+            items = self._namespaces[namespace]
+            _value, size = items.pop(key)
+            self._entries -= 1
+            self._size -= size
+            self._evictions += 1
+            if not items:
+                del self._namespaces[namespace]
+
+        # drop the entries of discarded namespaces, if too many
+        if len(self._lru) > 2 * self._entries + 1024:
+            lru = collections.OrderedDict()
+            for lru_key in self._lru:
+                namespace, generation, key = lru_key
+                if generation == self._generations.get(namespace, 0):
+                    lru[lru_key] = None
+            self._lru = lru
 
     def clear(self):
         """
         Clear all the cached items
         """
-        self.__live_cache.clear()
+        with self._mutex:
+            self._reset()
 
-    def clear_key(self, key):
+    def clear_key(self, key, namespace = None):
         """
         Clear just the cached item at key (hash table).
+
+        @param key: the cache key
+        @type key: string
+        @keyword namespace: the cache namespace
+        @type namespace: string
         """
-        try:
-            del self.__live_cache[key]
-        except KeyError:
-            pass
+        with self._mutex:
+            self._remove(namespace, key)
 
     def keys(self):
         """
-        Return a list of available cache keys
+        Return a list of available cache keys, prefixed by their
+        namespace.
         """
-        return list(self.__live_cache.keys())
+        with self._mutex:
+            keys = []
+            for namespace, items in self._namespaces.items():
+                for key in items:
+                    if namespace is None:
+                        keys.append(key)
+                    else:
+                        keys.append(namespace + key)
+            return keys
 
-    def discard(self, key):
+    def discard(self, namespace):
         """
-        Discard all the cache items with hash table key starting with "key".
+        Discard all the cache items in the given namespace.
+
+        @param namespace: the cache namespace
+        @type namespace: string
         """
-        for dkey in tuple(self.__live_cache.keys()):
-            if dkey.startswith(key):
-                try:
-                    self.__live_cache.pop(dkey)
-                except KeyError:
-                    pass
+        with self._mutex:
+            items = self._namespaces.pop(namespace, None)
+            if items is None:
+                return
+            self._generations[namespace] = \
+                self._generations.get(namespace, 0) + 1
+            self._entries -= len(items)
+            self._size -= sum((size for _value, size in items.values()))
 
-    def get(self, key):
+    def get(self, key, namespace = None):
         """
         Get the cached item, if exists.
+
+        @param key: the cache key
+        @type key: string
+        @keyword namespace: the cache namespace
+        @type namespace: string
+        @return: the cached item or None
         """
-        obj = self.__live_cache.get(key)
-        if isinstance(obj, weakref.ref):
-            return obj()
-        return obj
+        with self._mutex:
+            items = self._namespaces.get(namespace)
+            if items is None or key not in items:
+                self._misses += 1
+                if self._metrics.enabled:
+                    self._metrics.miss(self.METRICS_ID, key)
+                return None
+            self._hits += 1
+            self._touch(namespace, key)
+            value, size = items[key]
+            if self._metrics.enabled:
+                self._metrics.hit(self.METRICS_ID, key, size = size)
+            return value
 
-    def set(self, key, value):
+    def set(self, key, value, namespace = None, size = None):
         """
         Set item in cache.
+
+        @param key: the cache key
+        @type key: string
+        @param value: the item to cache
+        @type value: any
+        @keyword namespace: the cache namespace
+        @type namespace: string
+        @keyword size: the memory used by value, in bytes, if known,
+            otherwise it is roughly estimated
+        @type size: int
+        """
+        if size is None:
+            size = _estimate_size(value)
+        if self._metrics.enabled:
+            self._metrics.write(self.METRICS_ID, size)
+        with self._mutex:
+            self._remove(namespace, key)
+            items = self._namespaces.setdefault(namespace, {})
+            items[key] = (value, size)
+            self._entries += 1
+            self._size += size
+            self._touch(namespace, key)
+            self._evict()
+
+    def set_budget(self, budget):
+        """
+        Set the memory budget, evicting items if needed.
+
+        @param budget: the memory budget, in bytes
+        @type budget: int
+        """
+        with self._mutex:
+            self._budget = budget
+            self._evict()
+
+    def stats(self):
+        """
+        Return the cache usage statistics.
+
+        @return: dict containing "hits", "misses", "evictions", "entries",
+            "size" (estimated memory usage, in bytes), "budget" (in bytes)
+            and "namespaces" (number of namespaces)
+        @rtype: dict
         """
-        if isinstance(value, (set, frozenset)):
-            self.__live_cache[key] = weakref.ref(value)
-        else:
-            self.__live_cache[key] = value
+        with self._mutex:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": self._entries,
+                "size": self._size,
+                "budget": self._budget,
+                "namespaces": len(self._namespaces),
+            }
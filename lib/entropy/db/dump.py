@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+
+    @author: Fabio Erculiani <lxnay@sabayon.org>
+    @contact: lxnay@sabayon.org
+    @copyright: Fabio Erculiani
+    @license: GPL-2
+
+    I{EntropyRepository} binary dump format.
+
+    A binary dump is a stream of length-prefixed, zlib-compressed records
+    following a fixed header (magic string + format version):
+        - a schema record, listing tables (name, SQL and columns)
+        - any number of row records, containing a batch of rows of a table
+        - an objects record, listing the SQL of indexes, views and
+          triggers to be created once all the rows have been restored
+        - an end record, containing the amount of rows of every table,
+          used to detect truncated or corrupted dumps
+
+    Rows are JSON encoded, binary values are stored in base64 form,
+    whatever the declared type of their column is.
+
+"""
+import base64
+import json
+import struct
+import zlib
+
+from entropy.const import const_convert_to_rawstring, \
+    const_convert_to_unicode, const_get_buffer, const_is_python3
+
+
+class RepositoryDumpError(Exception):
+    """
+    Raised when a binary dump is invalid, truncated or unsupported.
+    """
+
+
+class _RepositoryDump(object):
+
+    MAGIC = const_convert_to_rawstring("ETPBDUMP")
+    VERSION = 1
+
+    _HEADER = struct.Struct(">8sH")
+    _RECORD = struct.Struct(">BI")
+
+    SCHEMA_RECORD = 1
+    ROWS_RECORD = 2
+    OBJECTS_RECORD = 3
+    END_RECORD = 4
+
+    # types of the binary values returned by DB-API cursors, on Python 2
+    # str is also used for text.
+    if const_is_python3():
+        _BLOB_TYPES = (const_get_buffer(), bytes, bytearray)
+    else:
+        _BLOB_TYPES = (const_get_buffer(), bytearray)
+
+
+class RepositoryDumpWriter(_RepositoryDump):
+    """
+    Streaming writer of binary repository dumps.
+
+    Usage:
+        writer = RepositoryDumpWriter(dump_f)
+        writer.write_schema([(table, sql, columns, blob_columns), ...])
+        writer.write_rows(table, cursor)
+        writer.write_objects([sql, ...])
+        writer.close()
+    """
+
+    # amount of rows stored in a single record
+    BATCH_SIZE = 2000
+
+    def __init__(self, dump_f, compression_level = 6):
+        """
+        RepositoryDumpWriter constructor.
+
+        @param dump_f: file object to write to (opened in binary mode)
+        @type dump_f: file object
+        @keyword compression_level: zlib compression level
+        @type compression_level: int
+        """
+        self._dump_f = dump_f
+        self._level = compression_level
+        self._counters = {}
+        self._dump_f.write(self._HEADER.pack(self.MAGIC, self.VERSION))
+
+    def _write_record(self, record_type, obj):
+        """
+        Write a record containing the given JSON serializable object.
+        """
+        payload = zlib.compress(
+            const_convert_to_rawstring(json.dumps(obj)), self._level)
+        self._dump_f.write(self._RECORD.pack(record_type, len(payload)))
+        self._dump_f.write(payload)
+
+    def write_schema(self, tables):
+        """
+        Write the schema record. Must be called once, before any other
+        write_* method.
+
+        @param tables: list of (table name, CREATE TABLE SQL, list of
+            column names, list of BLOB column indexes) tuples. BLOB column
+            indexes are informative, binary values are detected by type.
+        @type tables: list
+        """
+        schema = []
+        for name, sql, columns, blob_columns in tables:
+            schema.append([name, sql, list(columns), list(blob_columns)])
+            self._counters[name] = 0
+        self._write_record(self.SCHEMA_RECORD, schema)
+
+    def _encode_row(self, row):
+        """
+        Encode the binary values of the given row.
+        """
+        encoded = None
+        for idx, value in enumerate(row):
+            if isinstance(value, self._BLOB_TYPES):
+                if encoded is None:
+                    encoded = list(row)
+                encoded[idx] = {"b": const_convert_to_unicode(
+                    base64.b64encode(bytes(value)))}
+        if encoded is None:
+            return row
+        return encoded
+
+    def write_rows(self, table, rows):
+        """
+        Write all the given rows of table, in batches.
+
+        @param table: table name, as passed to write_schema()
+        @type table: string
+        @param rows: iterable of rows (sequence of column values)
+        @type rows: iterable
+        """
+        batch = []
+        for row in rows:
+            batch.append(self._encode_row(row))
+            if len(batch) >= self.BATCH_SIZE:
+                self._write_record(self.ROWS_RECORD, [table, batch])
+                self._counters[table] += len(batch)
+                batch = []
+        if batch:
+            self._write_record(self.ROWS_RECORD, [table, batch])
+            self._counters[table] += len(batch)
+
+    def write_objects(self, statements):
+        """
+        Write the objects record, containing SQL statements (indexes,
+        views, triggers) to execute after all the rows are restored.
+
+        @param statements: list of SQL statements
+        @type statements: list
+        """
+        self._write_record(self.OBJECTS_RECORD, list(statements))
+
+    def close(self):
+        """
+        Write the end record and flush the file object, which is not
+        closed.
+        """
+        self._write_record(self.END_RECORD, self._counters)
+        if hasattr(self._dump_f, "flush"):
+            self._dump_f.flush()
+
+
+class RepositoryDumpReader(_RepositoryDump):
+    """
+    Streaming reader of binary repository dumps.
+
+    Usage:
+        reader = RepositoryDumpReader(dump_f)
+        for record_type, data in reader:
+            ...
+    Where record_type is one of SCHEMA_RECORD (data is the list of
+    [table, sql, columns, blob_columns]), ROWS_RECORD (data is a
+    (table, rows) tuple) and OBJECTS_RECORD (data is a list of SQL
+    statements). RepositoryDumpError is raised if the dump is invalid or
+    truncated, even after some records have been returned.
+    """
+
+    def __init__(self, dump_f):
+        """
+        RepositoryDumpReader constructor.
+
+        @param dump_f: file object to read from (opened in binary mode)
+        @type dump_f: file object
+        @raise RepositoryDumpError: if the header is invalid
+        """
+        self._dump_f = dump_f
+        header = self._dump_f.read(self._HEADER.size)
+        if len(header) != self._HEADER.size:
+            raise RepositoryDumpError("invalid dump header")
+        magic, version = self._HEADER.unpack(header)
+        if magic != self.MAGIC:
+            raise RepositoryDumpError("invalid dump header")
+        if version != self.VERSION:
+            raise RepositoryDumpError(
+                "unsupported dump version: %s" % (version,))
+
+    @classmethod
+    def is_dump(cls, path):
+        """
+        Return whether the file at path is a binary dump.
+
+        @param path: file path
+        @type path: string
+        @rtype: bool
+        """
+        with open(path, "rb") as dump_f:
+            magic = dump_f.read(len(cls.MAGIC))
+        return magic == cls.MAGIC
+
+    def _read_record(self):
+        """
+        Read the next record, returning its type and decoded content.
+        """
+        header = self._dump_f.read(self._RECORD.size)
+        if len(header) != self._RECORD.size:
+            raise RepositoryDumpError("truncated dump")
+        record_type, length = self._RECORD.unpack(header)
+        payload = self._dump_f.read(length)
+        if len(payload) != length:
+            raise RepositoryDumpError("truncated dump")
+        try:
+            obj = json.loads(
+                const_convert_to_unicode(zlib.decompress(payload)))
+        except (zlib.error, ValueError) as err:
+            raise RepositoryDumpError("invalid dump record: %s" % (err,))
+        return record_type, obj
+
+    def _decode_row(self, row):
+        """
+        Decode the binary values of the given row.
+        """
+        buf = const_get_buffer()
+        for idx, value in enumerate(row):
+            if isinstance(value, dict):
+                row[idx] = buf(base64.b64decode(
+                    const_convert_to_rawstring(value["b"])))
+        return row
+
+    def __iter__(self):
+        blob_columns = None
+        counters = {}
+        while True:
+            record_type, obj = self._read_record()
+
+            if record_type == self.SCHEMA_RECORD:
+                blob_columns = {}
+                for name, sql, columns, blobs in obj:
+                    blob_columns[name] = tuple(blobs)
+                    counters[name] = 0
+                yield record_type, obj
+
+            elif record_type == self.ROWS_RECORD:
+                if blob_columns is None:
+                    raise RepositoryDumpError("missing dump schema")
+                table, rows = obj
+                if table not in blob_columns:
+                    raise RepositoryDumpError(
+                        "unknown dump table: %s" % (table,))
+                rows = [self._decode_row(x) for x in rows]
+                counters[table] += len(rows)
+                yield record_type, (table, rows)
+
+            elif record_type == self.OBJECTS_RECORD:
+                yield record_type, obj
+
+            elif record_type == self.END_RECORD:
+                if obj != counters:
+                    raise RepositoryDumpError("corrupted dump")
+                break
+
+            else:
+                raise RepositoryDumpError(
+                    "invalid dump record type: %s" % (record_type,))
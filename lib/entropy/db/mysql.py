@@ -916,10 +916,15 @@ class EntropyMySQLRepository(EntropySQLRepository):
         except OSError:
             return 1
 
-    def exportRepository(self, dumpfile):
+    def exportRepository(self, dumpfile, binary = False):
         """
         Reimplemented from EntropyRepositoryBase.
+        Binary dumps are restored by EntropySQLiteRepository, which cannot
+        execute the MySQL schema, so they are not supported.
         """
+        if binary:
+            raise NotSupportedError(
+                "binary dumps are not supported by MySQL repositories")
         try:
             proc = subprocess.Popen(
                 ("/usr/bin/mysqldump",
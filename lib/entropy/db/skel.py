@@ -31,10 +31,13 @@ from entropy.exceptions import RepositoryPluginError
 from entropy.spm.plugins.factory import get_default_instance as get_spm, \
     get_default_class as get_spm_class
 from entropy.db.exceptions import OperationalError
+from entropy.debug import SolverProfiler
 
 import entropy.dep
 import entropy.tools
 
+_profiler = SolverProfiler()
+
 class EntropyRepositoryPlugin(object):
     """
     This is the base class for implementing EntropyRepository plugin hooks.
@@ -357,6 +360,229 @@ class EntropyRepositoryPluginStore(EntropyPluginStore):
         meta[key] = value
 
 
+class EntropyRepositoryLibraryIndex(object):
+    """
+    In-memory index of the ELF libraries (sonames) provided and needed by
+    the packages of a repository, see
+    EntropyRepositoryBase.getLibraryIndex().
+    It implements the library lookup methods of EntropyRepositoryBase,
+    answering them from RAM. The provided libraries half and the needed
+    libraries half of the index are loaded separately, the first time
+    they are used.
+    """
+
+    def __init__(self, provided_libs_loader, needed_loader):
+        """
+        EntropyRepositoryLibraryIndex constructor.
+
+        @param provided_libs_loader: callable returning an iterable of
+            (package_id, library, path, elfclass) tuples
+        @type provided_libs_loader: callable
+        @param needed_loader: callable returning an iterable of
+            (package_id, library, elfclass) tuples
+        @type needed_loader: callable
+        """
+        self._provided_libs_loader = provided_libs_loader
+        self._needed_loader = needed_loader
+        self._mutex = threading.Lock()
+        self._provided_libs = None
+        self._needed = None
+
+    @staticmethod
+    def _freeze(mapping):
+        """
+        Turn the set values of mapping into frozensets.
+        """
+        return dict((k, frozenset(v)) for k, v in mapping.items())
+
+    def _getProvidedLibs(self):
+        """
+        Return the provided libraries half of the index, loading it if
+        needed, as (providers, provided, elfclasses) tuple.
+        """
+        with self._mutex:
+            if self._provided_libs is None:
+                providers = {}
+                provided = {}
+                elfclasses = {}
+                for package_id, library, path, elfclass in \
+                        self._provided_libs_loader():
+                    obj = providers.setdefault((library, elfclass), set())
+                    obj.add((package_id, path))
+                    obj = provided.setdefault(package_id, set())
+                    obj.add((library, path, elfclass))
+                    obj = elfclasses.setdefault(library, set())
+                    obj.add(elfclass)
+                self._provided_libs = (self._freeze(providers),
+                    self._freeze(provided), self._freeze(elfclasses))
+            return self._provided_libs
+
+    def _getNeeded(self):
+        """
+        Return the needed libraries half of the index, loading it if
+        needed, as (needers, needed, elfclasses) tuple.
+        """
+        with self._mutex:
+            if self._needed is None:
+                needers = {}
+                needed = {}
+                elfclasses = {}
+                for package_id, library, elfclass in self._needed_loader():
+                    obj = needers.setdefault((library, elfclass), set())
+                    obj.add(package_id)
+                    obj = needed.setdefault(package_id, set())
+                    obj.add((library, elfclass))
+                    obj = elfclasses.setdefault(library, set())
+                    obj.add(elfclass)
+                self._needed = (self._freeze(needers),
+                    self._freeze(needed), self._freeze(elfclasses))
+            return self._needed
+
+    @staticmethod
+    def _lookup(mapping, elfclasses, library, elfclass):
+        """
+        Return the union of the mapping values for library, considering
+        all the ELF classes if elfclass is -1.
+        """
+        if elfclass != -1:
+            return mapping.get((library, elfclass), frozenset())
+        result = set()
+        for lib_elfclass in elfclasses.get(library, ()):
+            result.update(mapping[(library, lib_elfclass)])
+        return frozenset(result)
+
+    def resolveNeeded(self, needed, elfclass = -1, extended = False):
+        """
+        Same as EntropyRepositoryBase.resolveNeeded().
+        """
+        providers, _provided, elfclasses = self._getProvidedLibs()
+        result = self._lookup(providers, elfclasses, needed, elfclass)
+        if extended:
+            return result
+        return frozenset(x for x, _path in result)
+
+    def searchNeeded(self, needed, elfclass = -1):
+        """
+        Same as EntropyRepositoryBase.searchNeeded(), without the "like"
+        keyword argument.
+        """
+        needers, _needed, elfclasses = self._getNeeded()
+        return self._lookup(needers, elfclasses, needed, elfclass)
+
+    def retrieveProvidedLibraries(self, package_id):
+        """
+        Same as EntropyRepositoryBase.retrieveProvidedLibraries().
+        """
+        _providers, provided, _elfclasses = self._getProvidedLibs()
+        return provided.get(package_id, frozenset())
+
+    def retrieveNeeded(self, package_id, extended = False, formatted = False):
+        """
+        Same as EntropyRepositoryBase.retrieveNeeded().
+        """
+        _needers, needed, _elfclasses = self._getNeeded()
+        pkg_needed = sorted(needed.get(package_id, ()))
+        if extended and formatted:
+            return dict(pkg_needed)
+        if extended:
+            return tuple(pkg_needed)
+        return tuple(x for x, _elfclass in pkg_needed)
+
+
+class EntropyRepositoryDependencyIndex(object):
+    """
+    In-memory index of the dependency graph of a repository, see
+    EntropyRepositoryBase.getDependencyIndex().
+    It implements the dependency lookup methods of EntropyRepositoryBase,
+    answering them from RAM, so that whole reverse dependency closures
+    can be walked without querying the repository for every package.
+    The index is loaded the first time it is used.
+    """
+
+    def __init__(self, dependencies_loader, reverse_dependencies_loader):
+        """
+        EntropyRepositoryDependencyIndex constructor.
+
+        @param dependencies_loader: callable returning an iterable of
+            (package_id, dependency, dependency_type) tuples, with
+            conditional dependencies already resolved
+        @type dependencies_loader: callable
+        @param reverse_dependencies_loader: callable returning an iterable
+            of (package_id, reverse_package_id, dependency, dependency_type)
+            tuples, where dependency is the dependency string of
+            reverse_package_id matching package_id
+        @type reverse_dependencies_loader: callable
+        """
+        self._dependencies_loader = dependencies_loader
+        self._reverse_dependencies_loader = reverse_dependencies_loader
+        self._mutex = threading.Lock()
+        self._index = None
+
+    def _getIndex(self):
+        """
+        Return the index, loading it if needed, as (dependencies,
+        reverse_dependencies) tuple. Both map package identifiers to
+        tuples of (package_id or dependency, dependency_type) pairs.
+        """
+        with self._mutex:
+            if self._index is None:
+                # share the dependency strings among the two halves
+                strings = {}
+                dependencies = {}
+                for package_id, dependency, dep_type in \
+                        self._dependencies_loader():
+                    dependency = strings.setdefault(dependency, dependency)
+                    obj = dependencies.setdefault(package_id, [])
+                    obj.append((dependency, dep_type))
+
+                reverse_dependencies = {}
+                for package_id, rev_package_id, dependency, dep_type in \
+                        self._reverse_dependencies_loader():
+                    dependency = strings.setdefault(dependency, dependency)
+                    obj = reverse_dependencies.setdefault(package_id, [])
+                    obj.append((rev_package_id, dependency, dep_type))
+
+                self._index = (
+                    dict((k, tuple(v)) for k, v in dependencies.items()),
+                    dict((k, tuple(v)) for k, v in
+                         reverse_dependencies.items()))
+            return self._index
+
+    def retrieveDependencies(self, package_id, extended = False,
+                             deptype = None, exclude_deptypes = None):
+        """
+        Same as EntropyRepositoryBase.retrieveDependencies(), without the
+        "resolve_conditional_deps" keyword argument.
+        """
+        dependencies, _reverse_dependencies = self._getIndex()
+        data = dependencies.get(package_id, ())
+        if deptype is not None:
+            data = [x for x in data if x[1] == deptype]
+        elif exclude_deptypes is not None:
+            excl_set = frozenset(exclude_deptypes)
+            data = [x for x in data if x[1] not in excl_set]
+
+        if extended:
+            return tuple(data)
+        return frozenset(x for x, _x in data)
+
+    def retrieveReverseDependencies(self, package_id, exclude_deptypes = None,
+                                    extended = False):
+        """
+        Same as EntropyRepositoryBase.retrieveReverseDependencies(),
+        without the "atoms" and "key_slot" keyword arguments.
+        """
+        _dependencies, reverse_dependencies = self._getIndex()
+        data = reverse_dependencies.get(package_id, ())
+        if exclude_deptypes is not None:
+            excl_set = frozenset(exclude_deptypes)
+            data = [x for x in data if x[2] not in excl_set]
+
+        if extended:
+            return tuple((x, y) for x, y, _z in data)
+        return frozenset(x for x, _y, _z in data)
+
+
 class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
     """
     EntropyRepository interface base class.
@@ -1150,6 +1376,27 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                     "[add_package_hook] %s: status: %s" % (
                         plug_inst.get_id(), exec_rc,))
 
+    def addPackages(self, pkgs_data, formatted_content = False):
+        """
+        Add many packages to this Entropy repository at once, like
+        addPackage() does, for each of them. Subclasses can implement
+        faster bulk insertion strategies, like deferring index creation and
+        committing changes in batches, so avoid interleaving other
+        repository accesses.
+
+        @param pkgs_data: iterable of Entropy package metadata
+        @type pkgs_data: iterable
+        @keyword formatted_content: if True, determines whether the content
+            metadata (usually the biggest part) in pkg_data is already
+            prepared for insertion
+        @type formatted_content: bool
+        @return: list of new package identifiers, in pkgs_data order
+        @rtype: list
+        """
+        return [self.addPackage(pkg_data,
+                                formatted_content = formatted_content)
+                for pkg_data in pkgs_data]
+
     def removePackage(self, package_id, from_add_package = False):
         """
         Remove package from this Entropy repository using it's identifier
@@ -1915,6 +2162,109 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         return data
 
+    # metadata keys returned by getPackageData()
+    _PACKAGE_DATA_FIELDS = frozenset([
+        "atom", "name", "version", "versiontag", "description", "category",
+        "chost", "cflags", "cxxflags", "homepage", "license", "branch",
+        "download", "digest", "slot", "etpapi", "datecreation", "size",
+        "revision", "counter", "trigger", "disksize", "changelog", "injected",
+        "systempackage", "config_protect", "config_protect_mask", "useflags",
+        "keywords", "sources", "needed", "provided_libs", "provide_extended",
+        "conflicts", "licensedata", "content", "content_safety",
+        "pkg_dependencies", "mirrorlinks", "signatures", "spm_phases",
+        "spm_repository", "desktop_mime", "provided_mime",
+        "original_repository", "extra_download"])
+
+    def _getPackagesDataFields(self, fields):
+        """
+        Validate the metadata keys passed to getPackagesData().
+
+        @param fields: metadata keys or None
+        @type fields: iterable
+        @return: the metadata keys to return
+        @rtype: frozenset
+        @raise AttributeError: if fields contains invalid keys
+        """
+        if fields is None:
+            return self._PACKAGE_DATA_FIELDS
+        fields = frozenset(fields)
+        if not fields.issubset(self._PACKAGE_DATA_FIELDS):
+            raise AttributeError("invalid fields argument")
+        return fields
+
+    def getPackagesData(self, package_ids, fields = None, get_content = True,
+            content_insert_formatted = False, get_changelog = True,
+            get_content_safety = True):
+        """
+        Reconstruct the package metadata of all the provided package
+        identifiers, like getPackageData() does. Metadata can be limited
+        to the given keys, avoiding the cost of retrieving unneeded data.
+        All the metadata is loaded in RAM at once, see iterPackagesData()
+        for a streaming variant.
+
+        @param package_ids: list of package indentifiers
+        @type package_ids: list
+        @keyword fields: metadata keys to return (see getPackageData()),
+            if None, all of them are returned
+        @type fields: iterable
+        @keyword get_content: see getPackageData()
+        @type get_content: bool
+        @keyword content_insert_formatted: see getPackageData()
+        @type content_insert_formatted: bool
+        @keyword get_changelog: see getPackageData()
+        @type get_changelog: bool
+        @keyword get_content_safety: see getPackageData()
+        @type get_content_safety: bool
+        @return: iterator of package metadata dicts, in package_ids order,
+            None is returned for package identifiers not available
+        @rtype: iterator
+        @raise AttributeError: if fields contains invalid keys
+        """
+        fields = self._getPackagesDataFields(fields)
+        data = []
+        for package_id in package_ids:
+            pkg_data = self.getPackageData(
+                package_id, get_content = get_content,
+                content_insert_formatted = content_insert_formatted,
+                get_changelog = get_changelog,
+                get_content_safety = get_content_safety)
+            if pkg_data is not None:
+                pkg_data = dict((k, v) for k, v in pkg_data.items() \
+                                    if k in fields)
+            data.append(pkg_data)
+        return iter(data)
+
+    def iterPackagesData(self, package_ids, fields = None, chunk_size = 256,
+            **kwargs):
+        """
+        Streaming variant of getPackagesData(), metadata is retrieved
+        chunk_size packages at a time, keeping memory usage bounded when
+        going through very large package sets.
+
+        @param package_ids: list of package indentifiers
+        @type package_ids: list
+        @keyword fields: see getPackagesData()
+        @type fields: iterable
+        @keyword chunk_size: number of packages retrieved at a time
+        @type chunk_size: int
+        @return: iterator of package metadata dicts, in package_ids order,
+            None is returned for package identifiers not available
+        @rtype: iterator
+        @raise AttributeError: if fields contains invalid keys
+        """
+        # validate now rather than at the first iteration
+        self._getPackagesDataFields(fields)
+        package_ids = list(package_ids)
+
+        def _iterator():
+            for index in range(0, len(package_ids), chunk_size):
+                for pkg_data in self.getPackagesData(
+                        package_ids[index:index + chunk_size],
+                        fields = fields, **kwargs):
+                    yield pkg_data
+
+        return _iterator()
+
     def getPackageXmlData(self, package_ids, get_content=True,
                           get_changelog=True, get_content_safety=True):
         """
@@ -1945,11 +2295,13 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         package_changelogs_id = 1
         package_changelogs = {}
 
-        for package_id in package_ids:
-            data = self.getPackageData(
-                package_id, get_content = get_content,
-                get_changelog = get_changelog,
-                get_content_safety = get_content_safety)
+        package_ids = list(package_ids)
+        packages_data = self.iterPackagesData(
+            package_ids, get_content = get_content,
+            get_changelog = get_changelog,
+            get_content_safety = get_content_safety)
+        for index, data in enumerate(packages_data):
+            package_id = package_ids[index]
 
             package = doc.createElement("package")
             package.setAttribute("id", "id-%d" % (package_id,))
@@ -3792,6 +4144,65 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
+    def getLibraryIndex(self):
+        """
+        Return the in-memory index of the ELF libraries provided and needed
+        by the packages in repository, an EntropyRepositoryLibraryIndex
+        object. Use it instead of resolveNeeded(), searchNeeded(),
+        retrieveProvidedLibraries() and retrieveNeeded() when many
+        packages or libraries are going to be looked up.
+        The index must be considered valid until the repository changes.
+
+        @return: the library index
+        @rtype: EntropyRepositoryLibraryIndex
+        """
+        def _provided_libs():
+            for package_id in self.listAllPackageIds():
+                for library, path, elfclass in \
+                        self.retrieveProvidedLibraries(package_id):
+                    yield package_id, library, path, elfclass
+
+        def _needed():
+            for package_id in self.listAllPackageIds():
+                for library, elfclass in self.retrieveNeeded(
+                        package_id, extended = True):
+                    yield package_id, library, elfclass
+
+        return EntropyRepositoryLibraryIndex(_provided_libs, _needed)
+
+    def getDependencyIndex(self):
+        """
+        Return the in-memory index of the dependencies and reverse
+        dependencies of the packages in repository, an
+        EntropyRepositoryDependencyIndex object. Use it instead of
+        retrieveDependencies() and retrieveReverseDependencies() when
+        the dependency graph of many packages is going to be walked.
+        The index must be considered valid until the repository changes.
+
+        @return: the dependency index
+        @rtype: EntropyRepositoryDependencyIndex
+        """
+        def _dependencies():
+            for package_id in self.listAllPackageIds():
+                for dependency, dep_type in self.retrieveDependencies(
+                        package_id, extended = True):
+                    yield package_id, dependency, dep_type
+
+        def _reverse_dependencies():
+            for package_id in self.listAllPackageIds():
+                rev_deps = self.retrieveReverseDependencies(
+                    package_id, extended = True)
+                for rev_package_id, dependency in rev_deps:
+                    for dep_str, dep_type in self.retrieveDependencies(
+                            rev_package_id, extended = True,
+                            resolve_conditional_deps = False):
+                        if dep_str == dependency:
+                            yield (package_id, rev_package_id, dependency,
+                                   dep_type)
+
+        return EntropyRepositoryDependencyIndex(
+            _dependencies, _reverse_dependencies)
+
     def isNeededAvailable(self, needed):
         """
         Return whether NEEDED ELF entry (library name) is available in
@@ -4330,6 +4741,18 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
+    def listAllStrictData(self):
+        """
+        List the getStrictData() metadata, plus package identifier and
+        digest, of all the packages available in repository at once.
+
+        @return: tuple of tuples of length 8 composed by
+            (package_id, package key, slot, version, tag, revision, atom,
+            digest)
+        @rtype: tuple
+        """
+        raise NotImplementedError()
+
     def listAllInjectedPackageIds(self):
         """
         List all injected package identifiers available in repository.
@@ -4363,6 +4786,17 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
+    def listAllConflicts(self):
+        """
+        List the conflicts of all the packages available in repository
+        at once.
+
+        @return: tuple of tuples of length 2 composed by
+            (package_id, conflict)
+        @rtype: tuple
+        """
+        raise NotImplementedError()
+
     def listAllSpmUids(self):
         """
         List all Source Package Manager unique package identifiers bindings
@@ -4571,13 +5005,17 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
             self.removePackage(package_id)
 
+        added_ids = list(added_ids)
         maxcount = len(added_ids)
         mycount = 0
-        for package_id in added_ids:
+        added_data = dbconn.iterPackagesData(added_ids, get_content = True,
+            content_insert_formatted = True)
+        for mydata in added_data:
+            package_id = added_ids[mycount]
             mycount += 1
             mytxt = "%s: %s" % (
                 red(_("Adding entry")),
-                blue(str(dbconn.retrieveAtom(package_id))),
+                blue(str(mydata['atom'])),
             )
             self.output(
                 mytxt,
@@ -4587,8 +5025,6 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 back = True,
                 count = (mycount, maxcount)
             )
-            mydata = dbconn.getPackageData(package_id, get_content = True,
-                content_insert_formatted = True)
             self.addPackage(
                 mydata,
                 revision = mydata['revision'],
@@ -4613,7 +5049,9 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
     @staticmethod
     def importRepository(dumpfile, db, data = None):
         """
-        Import dump file to this database.
+        Import dump file to this database. Implementations supporting
+        binary dumps (see exportRepository()) must detect them
+        automatically.
 
         @param dumpfile: dump file to read
         @type dumpfile: string
@@ -4627,12 +5065,17 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         raise NotImplementedError()
 
-    def exportRepository(self, dumpfile):
+    def exportRepository(self, dumpfile, binary = False):
         """
         Export running database to file.
 
         @param dumpfile: dump file object to write to
         @type dumpfile: file object (hint: open())
+        @keyword binary: write a compact binary dump (see entropy.db.dump)
+            instead of a textual SQL dump
+        @type binary: bool
+        @raise NotSupportedError: if binary is True and the repository
+            backend does not support binary dumps
         """
         raise NotImplementedError()
 
@@ -4641,6 +5084,11 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         Get Repository metadata checksum, useful for integrity verification.
         Note: result is cached in EntropyRepository.live_cache (dict).
+        When do_order is False, implementations are free to return a value
+        that is not computed from the metadata itself but still changes
+        every time the metadata does (this is what caches should use).
+        When do_order is True, the checksum is always computed from the
+        metadata and can be compared against other repositories.
 
         @keyword do_order: order metadata collection alphabetically
         @type do_order: bool
@@ -4929,6 +5377,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         """
         return package_id, 0
 
+    @SolverProfiler.profiled("repository.atom_match")
     def atomMatch(self, atom, matchSlot = None, multiMatch = False,
         maskFilter = True, extendedResults = False, useCache = True):
         """
@@ -4962,7 +5411,9 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             cached = self.__atomMatchFetchCache(atom, matchSlot,
                 multiMatch, maskFilter, extendedResults)
             if cached is not None:
+                _profiler.count("repository.atom_match.cache_hit")
                 return cached
+            _profiler.count("repository.atom_match.cache_miss")
 
         # "or" dependency support
         # app-foo/foo-1.2.3;app-foo/bar-1.4.3?
@@ -4976,6 +5427,45 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 if rc == 0:
                     return data, rc
 
+        (matchTag, matchUse, atomSlot, matchRevision, direction, justname,
+         pkgkey, pkgname, pkgcat, pkgversion,
+         stripped_atom) = self._atomMatchParse(atom)
+        if (matchSlot is None) and (atomSlot is not None):
+            matchSlot = atomSlot
+
+        found_ids = []
+        default_package_ids = None
+        if pkgkey is not None:
+            # IDs found in the database that match our search
+            try:
+                found_ids, default_package_ids = self.__generate_found_ids_match(
+                    pkgkey, pkgname, pkgcat, multiMatch)
+            except OperationalError:
+                # we are fault tolerant, cannot crash because
+                # tables are not available and validateDatabase()
+                # hasn't run
+                # found_ids = []
+                # default_package_ids = None
+                pass
+
+        return self._atomMatchResult(atom, matchSlot, found_ids,
+            default_package_ids, (matchTag, matchUse, matchRevision,
+            direction, justname, pkgversion, stripped_atom),
+            multiMatch, maskFilter, extendedResults)
+
+    def _atomMatchParse(self, atom):
+        """
+        Split the given atom (or dependency) into the components used by
+        atomMatch() to look packages up and to filter them.
+
+        @param atom: atom or dependency
+        @type atom: string
+        @return: tuple composed by (tag, USE dependencies, slot, entropy
+            revision, version operator, justname, package key, package name,
+            package category, package version, atom without operator).
+            Package key is None if there is nothing to look up.
+        @rtype: tuple
+        """
         matchTag = entropy.dep.dep_gettag(atom)
         try:
             matchUse = entropy.dep.dep_getusedeps(atom)
@@ -4994,8 +5484,6 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         # slot match
         scan_atom = entropy.dep.remove_slot(scan_atom)
-        if (matchSlot is None) and (atomSlot is not None):
-            matchSlot = atomSlot
 
         # revision match
         scan_atom = entropy.dep.remove_entropy_revision(scan_atom)
@@ -5007,58 +5495,88 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         pkgcat = ''
         pkgversion = ''
         stripped_atom = ''
-        found_ids = []
-        default_package_ids = None
-
-        if scan_atom:
 
-            while True:
-                # check for direction
-                scan_cpv = entropy.dep.dep_getcpv(scan_atom)
-                stripped_atom = scan_cpv
+        if not scan_atom:
+            return (matchTag, matchUse, atomSlot, matchRevision, direction,
+                justname, None, pkgname, pkgcat, pkgversion, stripped_atom)
+
+        while True:
+            # check for direction
+            scan_cpv = entropy.dep.dep_getcpv(scan_atom)
+            stripped_atom = scan_cpv
+            if scan_atom.endswith("*"):
+                stripped_atom += "*"
+            direction = scan_atom[0:-len(stripped_atom)]
+
+            justname = entropy.dep.isjustname(scan_cpv)
+            pkgkey = stripped_atom
+            if justname == 0:
+                # get version
+                data = entropy.dep.catpkgsplit(scan_cpv)
+                if data is None:
+                    break # badly formatted
+                wildcard = ""
                 if scan_atom.endswith("*"):
-                    stripped_atom += "*"
-                direction = scan_atom[0:-len(stripped_atom)]
-
-                justname = entropy.dep.isjustname(scan_cpv)
-                pkgkey = stripped_atom
-                if justname == 0:
-                    # get version
-                    data = entropy.dep.catpkgsplit(scan_cpv)
-                    if data is None:
-                        break # badly formatted
-                    wildcard = ""
-                    if scan_atom.endswith("*"):
-                        wildcard = "*"
-                    pkgversion = data[2]+wildcard+"-"+data[3]
-                    pkgkey = entropy.dep.dep_getkey(stripped_atom)
-
-                splitkey = pkgkey.split("/")
-                if (len(splitkey) == 2):
-                    pkgcat, pkgname = splitkey
-                else:
-                    pkgcat, pkgname = "null", splitkey[0]
+                    wildcard = "*"
+                pkgversion = data[2]+wildcard+"-"+data[3]
+                pkgkey = entropy.dep.dep_getkey(stripped_atom)
 
-                break
+            splitkey = pkgkey.split("/")
+            if (len(splitkey) == 2):
+                pkgcat, pkgname = splitkey
+            else:
+                pkgcat, pkgname = "null", splitkey[0]
 
+            break
 
-            # IDs found in the database that match our search
-            try:
-                found_ids, default_package_ids = self.__generate_found_ids_match(
-                    pkgkey, pkgname, pkgcat, multiMatch)
-            except OperationalError:
-                # we are fault tolerant, cannot crash because
-                # tables are not available and validateDatabase()
-                # hasn't run
-                # found_ids = []
-                # default_package_ids = None
+        return (matchTag, matchUse, atomSlot, matchRevision, direction,
+            justname, pkgkey, pkgname, pkgcat, pkgversion, stripped_atom)
+
+    def _atomMatchResult(self, atom, matchSlot, found_ids,
+        default_package_ids, match_data, multiMatch, maskFilter,
+        extendedResults, metadata = None, storeCache = True):
+        """
+        Filter the package identifiers found for the given atom and
+        return the atomMatch() result.
+
+        @param atom: atom or dependency being matched
+        @type atom: string
+        @param matchSlot: match packages with given slot
+        @type matchSlot: string
+        @param found_ids: package identifiers found by name
+        @type found_ids: set
+        @param default_package_ids: old-style virtual package identifiers
+            or None
+        @type default_package_ids: set
+        @param match_data: tuple composed by (tag, USE dependencies,
+            entropy revision, version operator, justname, package version,
+            atom without operator), as returned by _atomMatchParse()
+        @type match_data: tuple
+        @keyword metadata: object providing the retrieveSlot(),
+            retrieveTag(), retrieveUseflags(), retrieveVersion() and
+            retrieveRevision() methods used to filter packages, this
+            repository if None
+        @type metadata: object
+        @keyword storeCache: store the result into the on-disk cache
+        @type storeCache: bool
+        @return: see atomMatch()
+        @rtype: tuple
+        """
+        (matchTag, matchUse, matchRevision, direction, justname,
+         pkgversion, stripped_atom) = match_data
+        if metadata is None:
+            metadata = self
+        if not storeCache:
+            def _store_cache(*args, **kwargs):
                 pass
+        else:
+            _store_cache = self.__atomMatchStoreCache
 
         ### FILTERING
         # filter slot and tag
         if found_ids:
             found_ids = self.__filterSlotTagUse(found_ids, matchSlot,
-                matchTag, matchUse, direction)
+                matchTag, matchUse, direction, metadata)
             if maskFilter:
                 def _filter(pkg_id):
                     pkg_id, pkg_reason = self.maskFilter(pkg_id)
@@ -5070,7 +5588,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         dbpkginfo = set()
         if found_ids:
             dbpkginfo = self.__handle_found_ids_match(found_ids, direction,
-                matchTag, matchRevision, justname, stripped_atom, pkgversion)
+                matchTag, matchRevision, justname, stripped_atom, pkgversion,
+                metadata)
 
         if not dbpkginfo:
             if extendedResults:
@@ -5078,7 +5597,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                     x = set()
                 else:
                     x = (-1, 1, None, None, None,)
-                self.__atomMatchStoreCache(
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x, 1)
@@ -5089,7 +5608,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                     x = set()
                 else:
                     x = -1
-                self.__atomMatchStoreCache(
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x, 1)
@@ -5098,9 +5617,9 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         if multiMatch:
             if extendedResults:
-                x = set([(x[0], 0, x[1], self.retrieveTag(x[0]), \
-                    self.retrieveRevision(x[0])) for x in dbpkginfo])
-                self.__atomMatchStoreCache(
+                x = set([(x[0], 0, x[1], metadata.retrieveTag(x[0]), \
+                    metadata.retrieveRevision(x[0])) for x in dbpkginfo])
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x, 0)
@@ -5108,7 +5627,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                 return x, 0
             else:
                 x = set([x[0] for x in dbpkginfo])
-                self.__atomMatchStoreCache(
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x, 0)
@@ -5118,17 +5637,17 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         if len(dbpkginfo) == 1:
             x = dbpkginfo.pop()
             if extendedResults:
-                x = (x[0], 0, x[1], self.retrieveTag(x[0]),
-                    self.retrieveRevision(x[0]),)
+                x = (x[0], 0, x[1], metadata.retrieveTag(x[0]),
+                    metadata.retrieveRevision(x[0]),)
 
-                self.__atomMatchStoreCache(
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x, 0)
                 )
                 return x, 0
             else:
-                self.__atomMatchStoreCache(
+                _store_cache(
                     atom, matchSlot,
                     multiMatch, maskFilter,
                     extendedResults, result = (x[0], 0)
@@ -5153,8 +5672,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         versions = set()
 
         for x in dbpkginfo:
-            info_tuple = (x[1], self.retrieveTag(x[0]), \
-                self.retrieveRevision(x[0]))
+            info_tuple = (x[1], metadata.retrieveTag(x[0]), \
+                metadata.retrieveRevision(x[0]))
             versions.add(info_tuple)
             pkgdata[info_tuple] = x[0]
 
@@ -5179,7 +5698,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         if versions:
             # it looks like we wiped out all the
-            newer = entropy.dep.get_entropy_newer_version(list(versions))[0]
+            newer = max(versions,
+                        key = lambda x: entropy.dep.version_sort_key(*x))
             x = pkgdata[newer]
             rc = 0
         else:
@@ -5192,20 +5712,69 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         if extendedResults:
             x = (x, rc, newer[0], newer[1], newer[2])
-            self.__atomMatchStoreCache(
+            _store_cache(
                 atom, matchSlot,
                 multiMatch, maskFilter,
                 extendedResults, result = (x, rc)
             )
             return x, rc
         else:
-            self.__atomMatchStoreCache(
+            _store_cache(
                 atom, matchSlot,
                 multiMatch, maskFilter,
                 extendedResults, result = (x, rc)
             )
             return x, rc
 
+    def atomMatchMany(self, atoms, matchSlot = None, multiMatch = False,
+        maskFilter = True, extendedResults = False, useCache = True):
+        """
+        Match a list of atoms (or dependencies) in repository at once.
+        The returned list has the same length and order of atoms and
+        each element is exactly what atomMatch() would have returned
+        for the atom at the same position. Duplicated atoms are matched
+        only once.
+
+        @param atoms: list of atoms or dependencies to match in repository
+        @type atoms: iterable
+        @keyword matchSlot: match packages with given slot
+        @type matchSlot: string
+        @keyword multiMatch: match all the available packages, not just the
+            best one
+        @type multiMatch: bool
+        @keyword maskFilter: enable package masking filter
+        @type maskFilter: bool
+        @keyword extendedResults: return extended results
+        @type extendedResults: bool
+        @keyword useCache: use on-disk cache
+        @type useCache: bool
+        @return: list of atomMatch() results
+        @rtype: list
+        """
+        results = {}
+        outcome = []
+        for atom in atoms:
+            result = results.get(atom)
+            if result is None:
+                result = self.atomMatch(atom, matchSlot = matchSlot,
+                    multiMatch = multiMatch, maskFilter = maskFilter,
+                    extendedResults = extendedResults, useCache = useCache)
+                results[atom] = result
+            outcome.append(result)
+        return outcome
+
+    def _atomMatchNotFound(self, multiMatch, extendedResults):
+        """
+        Return the atomMatch() result used when nothing is found.
+        """
+        if extendedResults:
+            if multiMatch:
+                return set(), 1
+            return (-1, 1, None, None, None,), 1
+        if multiMatch:
+            return set(), 1
+        return -1, 1
+
     def __generate_found_ids_match(self, pkgkey, pkgname, pkgcat, multiMatch):
 
         if pkgcat == "null":
@@ -5302,7 +5871,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
 
     def __handle_found_ids_match(self, found_ids, direction, matchTag,
-            matchRevision, justname, stripped_atom, pkgversion):
+            matchRevision, justname, stripped_atom, pkgversion, metadata):
 
         dbpkginfo = set()
         # now we have to handle direction
@@ -5333,7 +5902,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
                 for package_id in found_ids:
 
-                    dbver = self.retrieveVersion(package_id)
+                    dbver = metadata.retrieveVersion(package_id)
                     if (direction == "~"):
                         myrev = entropy.dep.dep_get_spm_revision(
                             dbver)
@@ -5347,7 +5916,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                             if dbver.startswith(pkgversion[:-1]):
                                 dbpkginfo.add((package_id, dbver))
                         elif (matchRevision is not None) and (pkgversion == dbver):
-                            dbrev = self.retrieveRevision(package_id)
+                            dbrev = metadata.retrieveRevision(package_id)
                             if dbrev == matchRevision:
                                 dbpkginfo.add((package_id, dbver))
                         elif (pkgversion == dbver) and (matchRevision is None):
@@ -5367,14 +5936,14 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
                         revcmp = 0
                         tagcmp = 0
                         if matchRevision is not None:
-                            dbrev = self.retrieveRevision(package_id)
+                            dbrev = metadata.retrieveRevision(package_id)
                             revcmp = const_cmp(matchRevision, dbrev)
 
                         if matchTag is not None:
-                            dbtag = self.retrieveTag(package_id)
+                            dbtag = metadata.retrieveTag(package_id)
                             tagcmp = const_cmp(matchTag, dbtag)
 
-                        dbver = self.retrieveVersion(package_id)
+                        dbver = metadata.retrieveVersion(package_id)
                         pkgcmp = entropy.dep.compare_versions(
                             pkgversion, dbver)
 
@@ -5435,7 +6004,8 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
 
         else: # just the key
 
-            dbpkginfo = set([(x, self.retrieveVersion(x),) for x in found_ids])
+            dbpkginfo = set([(x, metadata.retrieveVersion(x),) \
+                for x in found_ids])
 
         return dbpkginfo
 
@@ -5443,7 +6013,7 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
         if self._caching:
             ck_sum = self.checksum(strict = False)
             hash_str = self.__atomMatch_gen_hash_str(args)
-            cached = entropy.dump.loadobj("%s/%s/%s_%s" % (
+            cached = self._cacher.pop("%s/%s/%s_%s" % (
                 self.__db_match_cache_key, self.name, ck_sum, hash_str,))
             return cached
 
@@ -5462,29 +6032,29 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             hash_str = self.__atomMatch_gen_hash_str(args)
             self._cacher.push("%s/%s/%s_%s" % (
                 self.__db_match_cache_key, self.name, ck_sum, hash_str,),
-                kwargs.get('result'), async = False)
+                kwargs.get('result'))
 
-    def __filterSlot(self, package_id, slot):
+    def __filterSlot(self, package_id, slot, metadata):
         if slot is None:
             return package_id
-        dbslot = self.retrieveSlot(package_id)
+        dbslot = metadata.retrieveSlot(package_id)
         if dbslot == slot:
             return package_id
 
-    def __filterTag(self, package_id, tag, operators):
+    def __filterTag(self, package_id, tag, operators, metadata):
         if tag is None:
             return package_id
 
-        dbtag = self.retrieveTag(package_id)
+        dbtag = metadata.retrieveTag(package_id)
         compare = const_cmp(tag, dbtag)
         # cannot do operator compare because it breaks the tag concept
         if compare == 0:
             return package_id
 
-    def __filterUse(self, package_id, uses):
+    def __filterUse(self, package_id, uses, metadata):
         if not uses:
             return package_id
-        pkguse = set(self.retrieveUseflags(package_id))
+        pkguse = set(metadata.retrieveUseflags(package_id))
         enabled = set([x for x in uses if not x.startswith("-")])
         disabled = set(uses) - enabled
 
@@ -5551,19 +6121,21 @@ class EntropyRepositoryBase(TextInterface, EntropyRepositoryPluginStore):
             return None
         return package_id
 
-    def __filterSlotTagUse(self, found_ids, slot, tag, use, operators):
+    def __filterSlotTagUse(self, found_ids, slot, tag, use, operators,
+                           metadata):
 
         def myfilter(package_id):
 
-            package_id = self.__filterSlot(package_id, slot)
+            package_id = self.__filterSlot(package_id, slot, metadata)
             if not package_id:
                 return False
 
-            package_id = self.__filterUse(package_id, use)
+            package_id = self.__filterUse(package_id, use, metadata)
             if not package_id:
                 return False
 
-            package_id = self.__filterTag(package_id, tag, operators)
+            package_id = self.__filterTag(package_id, tag, operators,
+                metadata)
             if not package_id:
                 return False
 
@@ -10,6 +10,7 @@
     most of the EntropyRepository methods using standard SQL.
 
 """
+import copy
 import os
 import hashlib
 import itertools
@@ -30,7 +31,8 @@ from entropy.i18n import _
 import entropy.dep
 import entropy.tools
 
-from entropy.db.skel import EntropyRepositoryBase
+from entropy.db.skel import EntropyRepositoryBase, \
+    EntropyRepositoryDependencyIndex, EntropyRepositoryLibraryIndex
 from entropy.db.cache import EntropyRepositoryCacher
 from entropy.db.exceptions import Warning, Error, InterfaceError, \
     DatabaseError, DataError, OperationalError, IntegrityError, \
@@ -246,6 +248,48 @@ class SQLCursorWrapper(object):
         return self._cur.description
 
 
+class _AtomMatchMetadata(object):
+    """
+    Package metadata fetched in bulk by EntropySQLRepository.atomMatchMany(),
+    it provides the retrieve methods used by atomMatch() filters.
+    """
+
+    def __init__(self, candidates, baseinfo, useflags):
+        """
+        @param candidates: map of (name, category) to package identifiers
+        @type candidates: dict
+        @param baseinfo: map of package identifier to (version, tag,
+            revision, slot) tuples
+        @type baseinfo: dict
+        @param useflags: map of package identifier to USE flags
+        @type useflags: dict
+        """
+        self._candidates = candidates
+        self._baseinfo = baseinfo
+        self._useflags = useflags
+
+    def candidates(self, name, category):
+        """
+        Return the package identifiers having given name and category.
+        """
+        return set(self._candidates.get((name, category), ()))
+
+    def retrieveVersion(self, package_id):
+        return self._baseinfo[package_id][0]
+
+    def retrieveTag(self, package_id):
+        return self._baseinfo[package_id][1]
+
+    def retrieveRevision(self, package_id):
+        return self._baseinfo[package_id][2]
+
+    def retrieveSlot(self, package_id):
+        return self._baseinfo[package_id][3]
+
+    def retrieveUseflags(self, package_id):
+        return frozenset(self._useflags.get(package_id, ()))
+
+
 class EntropySQLRepository(EntropyRepositoryBase):
 
     """
@@ -324,6 +368,13 @@ class EntropySQLRepository(EntropyRepositoryBase):
                     dependency VARCHAR
                 );
 
+                CREATE TABLE reversedependencies (
+                    iddependency INTEGER,
+                    idpackage INTEGER,
+                    FOREIGN KEY(idpackage)
+                        REFERENCES baseinfo(idpackage) ON DELETE CASCADE
+                );
+
                 CREATE TABLE conflicts (
                     idpackage INTEGER,
                     conflict VARCHAR,
@@ -619,6 +670,12 @@ class EntropySQLRepository(EntropyRepositoryBase):
     # Generic repository name to use when none is given.
     GENERIC_NAME = "__generic__"
 
+    # If True, reverse dependencies are stored in the "reversedependencies"
+    # table and incrementally updated on package addition and removal.
+    # Only enable it for repositories whose package matching does not
+    # depend on external configuration (like package masking).
+    PERSISTENT_REVERSE_DEPENDENCIES = False
+
     def __init__(self, db, read_only, skip_checks, indexing,
                  xcache, temporary, name, direct=False):
         # connection and cursor automatic cleanup support
@@ -830,6 +887,393 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         raise NotImplementedError()
 
+    # getPackageData() keys filled with getBaseData() results
+    _BASE_DATA_FIELDS = ("atom", "name", "version", "versiontag",
+        "description", "category", "chost", "cflags", "cxxflags", "homepage",
+        "license", "branch", "download", "digest", "slot", "etpapi",
+        "datecreation", "size", "revision")
+
+    def _getPackagesDataRows(self, sql, package_ids):
+        """
+        Execute the given query over chunks of package identifiers and
+        return all the resulting rows. The query must contain a single
+        "%s" placeholder, which is replaced with the chunk of package
+        identifiers parameters.
+
+        @param sql: SQL query
+        @type sql: string
+        @param package_ids: list of package identifiers
+        @type package_ids: list
+        @return: list of rows
+        @rtype: list
+        """
+        rows = []
+        limit = self._BULK_PARAMETERS_LIMIT
+        for index in range(0, len(package_ids), limit):
+            chunk = package_ids[index:index + limit]
+            cur = self._cursor().execute(
+                sql % (", ".join(["?"] * len(chunk)),), chunk)
+            rows.extend(cur)
+        return rows
+
+    def getPackagesData(self, package_ids, fields = None, get_content = True,
+            content_insert_formatted = False, get_changelog = True,
+            get_content_safety = True):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        Every metadata key is retrieved with one query (per chunk of
+        package identifiers) for all the packages.
+        """
+        fields = self._getPackagesDataFields(fields)
+        if not self._isBaseinfoExtrainfo2010():
+            return super(EntropySQLRepository, self).getPackagesData(
+                package_ids, fields = fields, get_content = get_content,
+                content_insert_formatted = content_insert_formatted,
+                get_changelog = get_changelog,
+                get_content_safety = get_content_safety)
+
+        package_ids = list(package_ids)
+        base_data = {}
+        for row in self._getPackagesDataRows("""
+        SELECT
+            baseinfo.idpackage,
+            baseinfo.atom,
+            baseinfo.name,
+            baseinfo.version,
+            baseinfo.versiontag,
+            extrainfo.description,
+            baseinfo.category,
+            extrainfo.chost,
+            extrainfo.cflags,
+            extrainfo.cxxflags,
+            extrainfo.homepage,
+            baseinfo.license,
+            baseinfo.branch,
+            extrainfo.download,
+            extrainfo.digest,
+            baseinfo.slot,
+            baseinfo.etpapi,
+            extrainfo.datecreation,
+            extrainfo.size,
+            baseinfo.revision
+        FROM
+            baseinfo,
+            extrainfo
+        WHERE
+            baseinfo.idpackage IN (%s)
+            AND baseinfo.idpackage = extrainfo.idpackage
+        """, list(set(package_ids))):
+            base_data[row[0]] = row[1:]
+        available_ids = list(base_data.keys())
+
+        def _first(sql, convert = None):
+            values = {}
+            for row in self._getPackagesDataRows(sql, available_ids):
+                if row[0] in values:
+                    continue
+                if len(row) == 2:
+                    value = row[1]
+                else:
+                    value = row[1:]
+                if convert is not None:
+                    value = convert(value)
+                values[row[0]] = value
+            return values
+
+        def _group(sql):
+            values = {}
+            for row in self._getPackagesDataRows(sql, available_ids):
+                if len(row) == 2:
+                    item = row[1]
+                else:
+                    item = row[1:]
+                values.setdefault(row[0], []).append(item)
+            return values
+
+        def _frozenset(sql):
+            return dict((k, frozenset(v)) for k, v in _group(sql).items())
+
+        def _unicode(text):
+            try:
+                return const_convert_to_unicode(text)
+            except UnicodeDecodeError:
+                return const_convert_to_unicode(text, enctype = 'utf-8')
+
+        sources = {}
+        if "sources" in fields or "mirrorlinks" in fields:
+            sources = _frozenset("""
+            SELECT sources.idpackage, sourcesreference.source
+            FROM sources, sourcesreference
+            WHERE sources.idpackage IN (%s) AND
+            sources.idsource = sourcesreference.idsource
+            """)
+
+        # metadata key -> (bulk loader, default value, single loader)
+        loaders = {
+            "counter": (lambda: _first("""
+                SELECT counters.idpackage, counters.counter
+                FROM counters, baseinfo
+                WHERE counters.idpackage IN (%s) AND
+                baseinfo.idpackage = counters.idpackage AND
+                baseinfo.branch = counters.branch
+                """), -1, self.retrieveSpmUid),
+            "trigger": (lambda: _first("""
+                SELECT idpackage, data FROM triggers WHERE idpackage IN (%s)
+                """, convert = const_convert_to_rawstring),
+                const_convert_to_rawstring(''), self.retrieveTrigger),
+            "disksize": (lambda: _first("""
+                SELECT idpackage, size FROM sizes WHERE idpackage IN (%s)
+                """), 0, self.retrieveOnDiskSize),
+            "injected": (lambda: dict((x, True) for x in _group("""
+                SELECT idpackage, idpackage FROM injected
+                WHERE idpackage IN (%s)
+                """)), False, self.isInjected),
+            "systempackage": (lambda: dict((x, True) for x in _group("""
+                SELECT idpackage, idpackage FROM systempackages
+                WHERE idpackage IN (%s)
+                """)), False, self.isSystemPackage),
+            "config_protect": (lambda: _first("""
+                SELECT configprotect.idpackage, protect
+                FROM configprotect, configprotectreference
+                WHERE configprotect.idpackage IN (%s) AND
+                configprotect.idprotect = configprotectreference.idprotect
+                """), '', self.retrieveProtect),
+            "config_protect_mask": (lambda: _first("""
+                SELECT configprotectmask.idpackage, protect
+                FROM configprotectmask, configprotectreference
+                WHERE configprotectmask.idpackage IN (%s) AND
+                configprotectmask.idprotect = configprotectreference.idprotect
+                """), '', self.retrieveProtectMask),
+            "useflags": (lambda: _frozenset("""
+                SELECT useflags.idpackage, useflagsreference.flagname
+                FROM useflags, useflagsreference
+                WHERE useflags.idpackage IN (%s) AND
+                useflags.idflag = useflagsreference.idflag
+                """), frozenset(), self.retrieveUseflags),
+            "keywords": (lambda: _frozenset("""
+                SELECT keywords.idpackage, keywordsreference.keywordname
+                FROM keywords, keywordsreference
+                WHERE keywords.idpackage IN (%s) AND
+                keywords.idkeyword = keywordsreference.idkeyword
+                """), frozenset(), self.retrieveKeywords),
+            "sources": (lambda: sources, frozenset(), self.retrieveSources),
+            "needed": (lambda: dict((k, tuple(v)) for k, v in _group("""
+                SELECT needed.idpackage, neededreference.library,
+                    needed.elfclass
+                FROM needed, neededreference
+                WHERE needed.idpackage IN (%s) AND
+                needed.idneeded = neededreference.idneeded
+                ORDER BY neededreference.library
+                """).items()), tuple(),
+                lambda x: self.retrieveNeeded(x, extended = True)),
+            "provided_libs": (lambda: _frozenset("""
+                SELECT idpackage, library, path, elfclass FROM provided_libs
+                WHERE idpackage IN (%s)
+                """), frozenset(), self.retrieveProvidedLibraries),
+            "provide_extended": (lambda: _frozenset("""
+                SELECT idpackage, atom, is_default FROM provide
+                WHERE idpackage IN (%s)
+                """), frozenset(), self.retrieveProvide),
+            "conflicts": (lambda: _frozenset("""
+                SELECT idpackage, conflict FROM conflicts
+                WHERE idpackage IN (%s)
+                """), frozenset(), self.retrieveConflicts),
+            "pkg_dependencies": (
+                lambda: dict((k, tuple(v)) for k, v in _group("""
+                SELECT dependencies.idpackage,
+                    dependenciesreference.dependency, dependencies.type
+                FROM dependencies, dependenciesreference
+                WHERE dependencies.idpackage IN (%s) AND
+                dependencies.iddependency = dependenciesreference.iddependency
+                """).items()), tuple(),
+                lambda x: self.retrieveDependencies(
+                    x, extended = True, resolve_conditional_deps = False)),
+            "signatures": (lambda: _first("""
+                SELECT idpackage, sha1, sha256, sha512, gpg
+                FROM packagesignatures WHERE idpackage IN (%s)
+                """, convert = lambda x: {
+                    'sha1': x[0], 'sha256': x[1], 'sha512': x[2],
+                    'gpg': x[3]}),
+                {'sha1': None, 'sha256': None, 'sha512': None, 'gpg': None},
+                None),
+            "spm_phases": (lambda: _first("""
+                SELECT idpackage, phases FROM packagespmphases
+                WHERE idpackage IN (%s)
+                """), None, self.retrieveSpmPhases),
+            "spm_repository": (lambda: _first("""
+                SELECT idpackage, repository FROM packagespmrepository
+                WHERE idpackage IN (%s)
+                """), None, self.retrieveSpmRepository),
+            "desktop_mime": (lambda: dict(
+                (k, [{'name': n, 'mimetype': m, 'executable': e, 'icon': i}
+                     for n, m, e, i in v]) for k, v in _group("""
+                SELECT idpackage, name, mimetype, executable, icon
+                FROM packagedesktopmime WHERE idpackage IN (%s)
+                """).items()), [], self.retrieveDesktopMime),
+            "provided_mime": (lambda: _frozenset("""
+                SELECT idpackage, mimetype FROM provided_mime
+                WHERE idpackage IN (%s)
+                """), frozenset(), self.retrieveProvidedMime),
+            "original_repository": (lambda: _first("""
+                SELECT idpackage, repositoryname FROM installedtable
+                WHERE idpackage IN (%s)
+                """), None, self.getInstalledPackageRepository),
+            "extra_download": (lambda: dict(
+                (k, tuple({"download": d, "type": t, "size": s,
+                           "disksize": ds, "md5": md5, "sha1": sha1,
+                           "sha256": sha256, "sha512": sha512, "gpg": gpg}
+                          for d, t, s, ds, md5, sha1, sha256, sha512, gpg
+                          in v)) for k, v in _group("""
+                SELECT idpackage, download, type, size, disksize, md5, sha1,
+                    sha256, sha512, gpg
+                FROM packagedownloads WHERE idpackage IN (%s)
+                """).items()), tuple(), self.retrieveExtraDownload),
+        }
+
+        if get_changelog:
+            loaders["changelog"] = (lambda: _first("""
+                SELECT baseinfo.idpackage, packagechangelogs.changelog
+                FROM packagechangelogs, baseinfo
+                WHERE baseinfo.idpackage IN (%s) AND
+                packagechangelogs.category = baseinfo.category AND
+                packagechangelogs.name = baseinfo.name
+                """, convert = _unicode), None, self.retrieveChangelog)
+        if get_content:
+            if content_insert_formatted:
+                content_sql = """
+                SELECT idpackage, idpackage, file, type FROM content
+                WHERE idpackage IN (%s)
+                """
+                content_loader = lambda: dict(
+                    (k, tuple(v)) for k, v in _group(content_sql).items())
+                content_default = tuple()
+            else:
+                content_sql = """
+                SELECT idpackage, file, type FROM content
+                WHERE idpackage IN (%s)
+                """
+                content_loader = lambda: dict(
+                    (k, dict(v)) for k, v in _group(content_sql).items())
+                content_default = {}
+            loaders["content"] = (content_loader, content_default,
+                lambda x: self.retrieveContent(
+                    x, extended = True, formatted = True,
+                    insert_formatted = content_insert_formatted))
+        if get_content_safety:
+            loaders["content_safety"] = (lambda: dict(
+                (k, dict((path, {'sha256': sha256, 'mtime': mtime})
+                         for path, sha256, mtime in v))
+                for k, v in _group("""
+                SELECT idpackage, file, sha256, mtime FROM contentsafety
+                WHERE idpackage IN (%s)
+                """).items()), {}, self.retrieveContentSafety)
+
+        # metadata key -> {package_id: value}
+        values = {}
+        for field, (loader, default, single_loader) in loaders.items():
+            if field not in fields:
+                continue
+            try:
+                field_values = loader()
+            except OperationalError:
+                # older repositories may lack some tables, let the
+                # retrieve* methods deal with it.
+                if single_loader is None:
+                    raise
+                field_values = dict(
+                    (x, single_loader(x)) for x in available_ids)
+            values[field] = (field_values, default)
+
+        licensedata = {}
+        if "licensedata" in fields:
+            license_names = set()
+            for base_row in base_data.values():
+                licenses = base_row[10]
+                if licenses is None:
+                    continue
+                for licname in licenses.split():
+                    if not licname.strip():
+                        continue
+                    if not entropy.tools.is_valid_string(licname):
+                        continue
+                    license_names.add(licname)
+            license_names = list(license_names)
+            limit = self._BULK_PARAMETERS_LIMIT
+            for index in range(0, len(license_names), limit):
+                chunk = license_names[index:index + limit]
+                cur = self._cursor().execute("""
+                SELECT licensename, text FROM licensedata
+                WHERE licensename IN (%s)
+                """ % (", ".join(["?"] * len(chunk)),), chunk)
+                for licname, lictext in cur:
+                    if licname not in licensedata:
+                        licensedata[licname] = _unicode(lictext)
+
+        mirrorlinks = {}
+        if "mirrorlinks" in fields:
+            mirror_names = set()
+            for package_sources in sources.values():
+                for source in package_sources:
+                    if source.startswith("mirror://"):
+                        mirror_names.add(source.split("/")[2])
+            mirror_names = list(mirror_names)
+            limit = self._BULK_PARAMETERS_LIMIT
+            for index in range(0, len(mirror_names), limit):
+                chunk = mirror_names[index:index + limit]
+                cur = self._cursor().execute("""
+                SELECT mirrorname, mirrorlink FROM mirrorlinks
+                WHERE mirrorname IN (%s)
+                """ % (", ".join(["?"] * len(chunk)),), chunk)
+                for mirrorname, mirrorlink in cur:
+                    mirrorlinks.setdefault(mirrorname, set()).add(mirrorlink)
+
+        data = []
+        for package_id in package_ids:
+            base_row = base_data.get(package_id)
+            if base_row is None:
+                data.append(None)
+                continue
+
+            pkg_data = {}
+            for field, value in zip(self._BASE_DATA_FIELDS, base_row):
+                if field in fields:
+                    pkg_data[field] = value
+            for field, (field_values, default) in values.items():
+                if package_id in field_values:
+                    pkg_data[field] = field_values[package_id]
+                else:
+                    # do not share mutable objects between packages
+                    pkg_data[field] = copy.copy(default)
+
+            if "changelog" in fields and not get_changelog:
+                pkg_data["changelog"] = None
+            if "content" in fields and not get_content:
+                pkg_data["content"] = {}
+            if "content_safety" in fields and not get_content_safety:
+                pkg_data["content_safety"] = {}
+
+            if "licensedata" in fields:
+                licdata = {}
+                licenses = base_row[10]
+                if licenses is not None:
+                    for licname in licenses.split():
+                        if licname in licensedata:
+                            licdata[licname] = licensedata[licname]
+                pkg_data["licensedata"] = licdata
+
+            if "mirrorlinks" in fields:
+                mirrornames = set()
+                for source in sources.get(package_id, frozenset()):
+                    if source.startswith("mirror://"):
+                        mirrornames.add(source.split("/")[2])
+                pkg_data["mirrorlinks"] = [
+                    [x, frozenset(mirrorlinks.get(x, frozenset()))]
+                    for x in mirrornames]
+
+            data.append(pkg_data)
+
+        return iter(data)
+
     def _isBaseinfoExtrainfo2010(self):
         """
         This method is mainly for old adapters that were
@@ -850,7 +1294,8 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Remove any in-memory cache pointed by key.
         """
-        self._live_cacher.clear_key(self._getLiveCacheKey() + key)
+        self._live_cacher.clear_key(
+            key, namespace = self._getLiveCacheKey())
 
     def _discardLiveCache(self):
         """
@@ -862,13 +1307,15 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Save a new key -> value pair to the in-memory cache.
         """
-        self._live_cacher.set(self._getLiveCacheKey() + key, value)
+        self._live_cacher.set(
+            key, value, namespace = self._getLiveCacheKey())
 
     def _getLiveCache(self, key):
         """
         Lookup a key value from the in-memory cache.
         """
-        return self._live_cacher.get(self._getLiveCacheKey() + key)
+        return self._live_cacher.get(
+            key, namespace = self._getLiveCacheKey())
 
     def _getLiveCacheKey(self):
         """
@@ -1106,6 +1553,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         if not entropy.tools.is_valid_string(pkglicense):
             pkglicense = ' '
 
+        ref_id = self._getBulkReferenceId("licenses", pkglicense)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idlicense FROM licenses WHERE license = (?) LIMIT 1
         """, (pkglicense,))
@@ -1132,7 +1583,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO licenses VALUES (NULL,?)
         """, (pkglicense,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("licenses", pkglicense, ref_id)
+        return ref_id
 
     def _isCategoryAvailable(self, category):
         """
@@ -1144,6 +1597,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: availability (True if available)
         @rtype: bool
         """
+        ref_id = self._getBulkReferenceId("categories", category)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idcategory FROM categories WHERE category = (?) LIMIT 1
         """, (category,))
@@ -1167,7 +1624,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO categories VALUES (NULL,?)
         """, (category,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("categories", category, ref_id)
+        return ref_id
 
     def _addPackage(self, pkg_data, revision = -1, package_id = None,
         formatted_content = False):
@@ -1292,7 +1751,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
                 )
             )
         # baseinfo and extrainfo are tainted
-        self.clearCache()
+        # addPackages() clears the cache once, at the end
+        bulk = self._getBulkReferences() is not None
+        if not bulk:
+            self.clearCache()
         ### other information iserted below are not as
         ### critical as these above
 
@@ -1346,7 +1808,7 @@ class EntropySQLRepository(EntropyRepositoryBase):
                 package_id, pkg_data['spm_repository'])
 
         # not depending on other tables == no select done
-        self.insertContent(package_id, pkg_data['content'],
+        self._insertContent(package_id, pkg_data['content'],
             already_formatted = formatted_content)
         # insert content safety metadata (checksum, mtime)
         # if metadatum exists
@@ -1384,7 +1846,8 @@ class EntropySQLRepository(EntropyRepositoryBase):
 
         # baseinfo and extrainfo are tainted
         # ensure that cache is clear even here
-        self.clearCache()
+        if not bulk:
+            self.clearCache()
 
         return package_id
 
@@ -1395,31 +1858,161 @@ class EntropySQLRepository(EntropyRepositoryBase):
         Needs to call superclass method.
         """
         try:
+            update_reverse_deps = self._isReverseDependenciesTableCurrent()
             package_id = self._addPackage(pkg_data, revision = revision,
                 package_id = package_id,
                 formatted_content = formatted_content)
+            self._updateSearchIndex(package_id)
             super(EntropySQLRepository, self).addPackage(
                 pkg_data, revision = revision,
                 package_id = package_id,
                 formatted_content = formatted_content)
+            if update_reverse_deps:
+                self._updateReverseDependencies(
+                    self._getReverseDependenciesKeys(package_id),
+                    package_id = package_id)
             return package_id
         except:
             self._connection().rollback()
             raise
 
+    # amount of packages added by addPackages() between commits
+    _BULK_COMMIT_SIZE = 1000
+
+    # dictionary tables resolved in RAM by addPackages(),
+    # table name -> (identifier column, value column)
+    _BULK_REFERENCE_TABLES = {
+        "dependenciesreference": ("iddependency", "dependency"),
+        "keywordsreference": ("idkeyword", "keywordname"),
+        "useflagsreference": ("idflag", "flagname"),
+        "sourcesreference": ("idsource", "source"),
+        "neededreference": ("idneeded", "library"),
+        "configprotectreference": ("idprotect", "protect"),
+        "licenses": ("idlicense", "license"),
+        "categories": ("idcategory", "category"),
+    }
+
+    def addPackages(self, pkgs_data, formatted_content = False):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        Dictionary tables (dependencies, keywords, USE flags, etc) are
+        resolved through an in-memory map, indexes are dropped and created
+        again at the end and changes are committed every
+        _BULK_COMMIT_SIZE packages.
+        Needs to call superclass addPackage() method.
+        """
+        package_ids = []
+        if self._indexing:
+            self.dropAllIndexes()
+        self._tls._bulk_references = {}
+        try:
+            for pkg_data in pkgs_data:
+                package_id = self._addPackage(
+                    pkg_data, formatted_content = formatted_content)
+                # no-op if the search index has been dropped
+                self._updateSearchIndex(package_id)
+                super(EntropySQLRepository, self).addPackage(
+                    pkg_data, package_id = package_id,
+                    formatted_content = formatted_content)
+                package_ids.append(package_id)
+
+                if len(package_ids) % self._BULK_COMMIT_SIZE == 0:
+                    self.commit()
+
+        except:
+            self._connection().rollback()
+            raise
+
+        finally:
+            self._tls._bulk_references = None
+            # reverse dependencies are regenerated on demand, since
+            # the checksum generation has changed.
+            self.clearCache()
+            self.createAllIndexes()
+
+        self.commit()
+        return package_ids
+
+    def _getBulkReferences(self):
+        """
+        Return the in-memory map of dictionary tables used by addPackages()
+        in the current thread, or None.
+
+        @return: map of table names to value -> identifier maps, or None
+        @rtype: dict
+        """
+        return getattr(self._tls, "_bulk_references", None)
+
+    def _getBulkReferenceId(self, table, value):
+        """
+        Return the identifier of value in the given dictionary table
+        (see _BULK_REFERENCE_TABLES) when called from addPackages().
+        The table is loaded in RAM at the first access.
+
+        @param table: dictionary table name
+        @type table: string
+        @param value: the value to look for
+        @type value: string
+        @return: the value identifier, -1 if not available, None if not
+            called from addPackages()
+        @rtype: int
+        """
+        references = self._getBulkReferences()
+        if references is None:
+            return None
+
+        ids = references.get(table)
+        if ids is None:
+            id_column, column = self._BULK_REFERENCE_TABLES[table]
+            # keep the lowest identifier of duplicated values
+            cur = self._cursor().execute("""
+            SELECT %s, %s FROM %s ORDER BY %s DESC
+            """ % (column, id_column, table, id_column))
+            ids = dict(cur)
+            references[table] = ids
+        return ids.get(value, -1)
+
+    def _setBulkReferenceId(self, table, value, ref_id):
+        """
+        Store the identifier of a value just added to the given dictionary
+        table (see _BULK_REFERENCE_TABLES) when called from addPackages().
+
+        @param table: dictionary table name
+        @type table: string
+        @param value: the value
+        @type value: string
+        @param ref_id: the value identifier
+        @type ref_id: int
+        """
+        references = self._getBulkReferences()
+        if references is not None and table in references:
+            references[table][value] = ref_id
+
     def removePackage(self, package_id, from_add_package = False):
         """
         Reimplemented from EntropyRepositoryBase.
         Needs to call superclass method.
         """
         try:
+            update_reverse_deps = self._isReverseDependenciesTableCurrent()
+            if update_reverse_deps:
+                reverse_deps_keys = self._getReverseDependenciesKeys(
+                    package_id)
+
             self.clearCache()
             super(EntropySQLRepository, self).removePackage(
                 package_id, from_add_package = from_add_package)
             self.clearCache()
 
-            return self._removePackage(package_id,
+            outcome = self._removePackage(package_id,
                 from_add_package = from_add_package)
+            if update_reverse_deps:
+                # legacy repositories may lack ON DELETE CASCADE
+                self._cursor().execute("""
+                DELETE FROM reversedependencies WHERE idpackage = ?
+                """, (package_id,))
+                self._updateReverseDependencies(reverse_deps_keys)
+            return outcome
         except:
             self._connection().rollback()
             raise
@@ -1472,7 +2065,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO configprotectreference VALUES (NULL, ?)
         """, (protect,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("configprotectreference", protect, ref_id)
+        return ref_id
 
     def _addSource(self, source):
         """
@@ -1487,7 +2082,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO sourcesreference VALUES (NULL, ?)
         """, (source,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("sourcesreference", source, ref_id)
+        return ref_id
 
     def _addDependency(self, dependency):
         """
@@ -1502,7 +2099,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO dependenciesreference VALUES (NULL, ?)
         """, (dependency,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("dependenciesreference", dependency, ref_id)
+        return ref_id
 
     def _addKeyword(self, keyword):
         """
@@ -1517,7 +2116,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO keywordsreference VALUES (NULL, ?)
         """, (keyword,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("keywordsreference", keyword, ref_id)
+        return ref_id
 
     def _addUseflag(self, useflag):
         """
@@ -1532,7 +2133,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO useflagsreference VALUES (NULL, ?)
         """, (useflag,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("useflagsreference", useflag, ref_id)
+        return ref_id
 
     def _addNeeded(self, needed):
         """
@@ -1547,7 +2150,9 @@ class EntropySQLRepository(EntropyRepositoryBase):
         cur = self._cursor().execute("""
         INSERT INTO neededreference VALUES (NULL, ?)
         """, (needed,))
-        return cur.lastrowid
+        ref_id = cur.lastrowid
+        self._setBulkReferenceId("neededreference", needed, ref_id)
+        return ref_id
 
     def _setSystemPackage(self, package_id):
         """
@@ -1710,6 +2315,16 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
+        self._insertContent(package_id, content,
+            already_formatted = already_formatted)
+        # addPackage() refreshes the search index by itself
+        self._updateSearchIndex(package_id)
+
+    def _insertContent(self, package_id, content, already_formatted = False):
+        """
+        Insert content metadata for package, see insertContent().
+        The full-text search index is not updated.
+        """
         # respect iterators, so that if they're true iterators
         # we save a lot of memory.
         class MyIter:
@@ -3696,19 +4311,25 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
-        cached = self._getLiveCache("reverseDependenciesMetadata")
-        if cached is None:
-            cached = self._generateReverseDependenciesMetadata()
-
-        dep_ids = set((k for k, v in cached.items() if package_id in v))
-        if not dep_ids:
-            # avoid python3.x memleak
-            del cached
-            if key_slot:
-                return tuple()
-            return frozenset()
-
-        dep_ids_str = ', '.join((str(x) for x in dep_ids))
+        if self._setupReverseDependencies():
+            cached = None
+            dep_ids_str = """
+            SELECT iddependency FROM reversedependencies
+            WHERE idpackage = %d""" % (package_id,)
+        else:
+            cached = self._getLiveCache("reverseDependenciesMetadata")
+            if cached is None:
+                cached = self._generateReverseDependenciesMetadata()
+
+            dep_ids = set((k for k, v in cached.items() if package_id in v))
+            if not dep_ids:
+                # avoid python3.x memleak
+                del cached
+                if key_slot:
+                    return tuple()
+                return frozenset()
+
+            dep_ids_str = ', '.join((str(x) for x in dep_ids))
         excluded_deptypes_query = ""
         if exclude_deptypes is not None:
             for dep_type in exclude_deptypes:
@@ -3819,6 +4440,20 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
+        if self._setupReverseDependencies():
+            cur = self._cursor().execute("""
+            SELECT 1 FROM reversedependencies LIMIT 1
+            """)
+            if cur.fetchone() is None:
+                return tuple()
+            cur = self._cursor().execute("""
+            SELECT idpackage FROM baseinfo
+            WHERE idpackage NOT IN (
+                SELECT idpackage FROM reversedependencies)
+            ORDER BY atom
+            """)
+            return self._cur2tuple(cur)
+
         cached = self._getLiveCache("reverseDependenciesMetadata")
         if cached is None:
             cached = self._generateReverseDependenciesMetadata()
@@ -3878,6 +4513,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: availability (True if available)
         @rtype: bool
         """
+        ref_id = self._getBulkReferenceId("configprotectreference", protect)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idprotect FROM configprotectreference WHERE protect = ?
         LIMIT 1
@@ -3921,6 +4560,110 @@ class EntropySQLRepository(EntropyRepositoryBase):
         WHERE library = ?""" + elfclass_txt, args)
         return self._cur2frozenset(cur)
 
+    def getLibraryIndex(self):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        Each half of the index is loaded with a single query. The index
+        is kept in the in-memory cache and renewed when the checksum
+        generation changes.
+        """
+        generation = self._getChecksumGeneration()
+        cached = self._getLiveCache("getLibraryIndex")
+        if cached is not None:
+            cached_generation, index = cached
+            if cached_generation == generation:
+                return index
+        # avoid python3.x memleak
+        del cached
+
+        def _provided_libs():
+            cur = self._cursor().execute("""
+            SELECT idpackage, library, path, elfclass FROM provided_libs
+            """)
+            return cur.fetchall()
+
+        def _needed():
+            cur = self._cursor().execute("""
+            SELECT needed.idpackage, neededreference.library, needed.elfclass
+            FROM needed, neededreference
+            WHERE needed.idneeded = neededreference.idneeded
+            """)
+            return cur.fetchall()
+
+        index = EntropyRepositoryLibraryIndex(_provided_libs, _needed)
+        self._setLiveCache("getLibraryIndex", (generation, index))
+        return index
+
+    def getDependencyIndex(self):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        Dependencies and reverse dependencies are loaded with a single
+        query each. The index is kept in the in-memory cache and renewed
+        when the checksum generation changes.
+        """
+        generation = self._getChecksumGeneration()
+        cached = self._getLiveCache("getDependencyIndex")
+        if cached is not None:
+            cached_generation, index = cached
+            if cached_generation == generation:
+                return index
+        # avoid python3.x memleak
+        del cached
+
+        def _dependencies():
+            cur = self._cursor().execute("""
+            SELECT dependencies.idpackage, dependenciesreference.dependency,
+                dependencies.type
+            FROM dependencies, dependenciesreference
+            WHERE dependencies.iddependency =
+                dependenciesreference.iddependency
+            """)
+            match_cache = entropy.dep.DependencyMatchCache()
+            for package_id, dependency, dep_type in cur.fetchall():
+                if not dependency.startswith("("):
+                    yield package_id, dependency, dep_type
+                    continue
+                for expanded, expanded_type in \
+                        entropy.dep.expand_dependencies(
+                            [(dependency, dep_type)], [self],
+                            match_cache = match_cache):
+                    yield package_id, expanded, expanded_type
+
+        def _reverse_dependencies():
+            if self._setupReverseDependencies():
+                cur = self._cursor().execute("""
+                SELECT revdeps.idpackage, dependencies.idpackage,
+                    dependenciesreference.dependency, dependencies.type
+                FROM (SELECT DISTINCT iddependency, idpackage
+                      FROM reversedependencies) AS revdeps,
+                    dependencies, dependenciesreference
+                WHERE revdeps.iddependency = dependencies.iddependency AND
+                dependencies.iddependency =
+                    dependenciesreference.iddependency
+                """)
+                for row in cur.fetchall():
+                    yield row
+                return
+
+            rev_deps_data = self._getLiveCache("reverseDependenciesMetadata")
+            if rev_deps_data is None:
+                rev_deps_data = self._generateReverseDependenciesMetadata()
+            cur = self._cursor().execute("""
+            SELECT dependencies.iddependency, dependencies.idpackage,
+                dependenciesreference.dependency, dependencies.type
+            FROM dependencies, dependenciesreference
+            WHERE dependencies.iddependency =
+                dependenciesreference.iddependency
+            """)
+            for iddep, rev_package_id, dependency, dep_type in cur.fetchall():
+                for package_id in rev_deps_data.get(iddep, ()):
+                    yield package_id, rev_package_id, dependency, dep_type
+
+        index = EntropyRepositoryDependencyIndex(
+            _dependencies, _reverse_dependencies)
+        self._setLiveCache("getDependencyIndex", (generation, index))
+        return index
+
     def _isSourceAvailable(self, source):
         """
         Return whether given source package URL is available in repository.
@@ -3931,6 +4674,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: source package URL identifier (idsource) or -1 if not found
         @rtype: int
         """
+        ref_id = self._getBulkReferenceId("sourcesreference", source)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idsource FROM sourcesreference WHERE source = ? LIMIT 1
         """, (source,))
@@ -3949,6 +4696,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: dependency identifier (iddependency) or -1 if not found
         @rtype: int
         """
+        ref_id = self._getBulkReferenceId("dependenciesreference", dependency)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT iddependency FROM dependenciesreference WHERE dependency = ?
         LIMIT 1
@@ -3968,6 +4719,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: keyword identifier (idkeyword) or -1 if not found
         @rtype: int
         """
+        ref_id = self._getBulkReferenceId("keywordsreference", keyword)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idkeyword FROM keywordsreference WHERE keywordname = ? LIMIT 1
         """, (keyword,))
@@ -3986,6 +4741,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         @return: USE flag identifier or -1 if not found
         @rtype: int
         """
+        ref_id = self._getBulkReferenceId("useflagsreference", useflag)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idflag FROM useflagsreference WHERE flagname = ? LIMIT 1
         """, (useflag,))
@@ -3998,6 +4757,10 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         Reimplemented from EntropyRepositoryBase.
         """
+        ref_id = self._getBulkReferenceId("neededreference", needed)
+        if ref_id is not None:
+            return ref_id
+
         cur = self._cursor().execute("""
         SELECT idneeded FROM neededreference WHERE library = ? LIMIT 1
         """, (needed,))
@@ -4084,10 +4847,13 @@ class EntropySQLRepository(EntropyRepositoryBase):
         Reimplemented from EntropyRepositoryBase.
         """
         if like:
+            search_index, search_index_args = self._searchIndexCondition(
+                "content", bfile, "content.idpackage")
             cur = self._cursor().execute("""
             SELECT content.idpackage FROM content,baseinfo
             WHERE file LIKE ? AND
-            content.idpackage = baseinfo.idpackage""", (bfile,))
+            content.idpackage = baseinfo.idpackage %s""" % (search_index,),
+                (bfile,) + search_index_args)
         else:
             cur = self._cursor().execute("""
             SELECT content.idpackage
@@ -4332,7 +5098,12 @@ class EntropySQLRepository(EntropyRepositoryBase):
             like_keyword = "%"+keyword+"%"
         if not sensitive:
             like_keyword = like_keyword.lower()
-        searchkeywords = (like_keyword, like_keyword)
+        search_index, search_index_args = self._searchIndexCondition(
+            "atoms", keyword, "t.idpackage")
+        search_index_provide, search_index_provide_args = \
+            self._searchIndexCondition("atoms", keyword, "d.idpackage")
+        searchkeywords = (like_keyword,) + search_index_args + \
+            (like_keyword,) + search_index_provide_args
 
         slotstring = ''
         if slot:
@@ -4373,33 +5144,62 @@ class EntropySQLRepository(EntropyRepositoryBase):
             cur = self._cursor().execute("""
             SELECT DISTINCT %s FROM (
                 SELECT %s FROM baseinfo t
-                    WHERE t.atom LIKE ?
+                    WHERE t.atom LIKE ? %s
                 UNION ALL
                 SELECT %s FROM baseinfo d, provide as p
                     WHERE d.idpackage = p.idpackage
-                    AND p.atom LIKE ?
+                    AND p.atom LIKE ? %s
             ) WHERE 1=1 %s %s %s
-            """ % (search_elements, search_elements_all,
-                search_elements_provide_all, slotstring, tagstring,
-                order_by_string), searchkeywords)
+            """ % (search_elements, search_elements_all, search_index,
+                search_elements_provide_all, search_index_provide,
+                slotstring, tagstring, order_by_string), searchkeywords)
         else:
             cur = self._cursor().execute("""
             SELECT DISTINCT %s FROM (
                 SELECT %s FROM baseinfo t
-                    WHERE LOWER(t.atom) LIKE ?
+                    WHERE LOWER(t.atom) LIKE ? %s
                 UNION ALL
                 SELECT %s FROM baseinfo d, provide as p
                     WHERE d.idpackage = p.idpackage
-                    AND LOWER(p.atom) LIKE ?
+                    AND LOWER(p.atom) LIKE ? %s
             ) WHERE 1=1 %s %s %s
-            """ % (search_elements, search_elements_all,
-                search_elements_provide_all, slotstring, tagstring,
-                order_by_string), searchkeywords)
+            """ % (search_elements, search_elements_all, search_index,
+                search_elements_provide_all, search_index_provide,
+                slotstring, tagstring, order_by_string), searchkeywords)
 
         if just_id:
             return self._cur2tuple(cur)
         return tuple(cur)
 
+    def _searchIndexCondition(self, column, pattern, package_id_column):
+        """
+        Return an SQL condition (and its arguments) restricting the given
+        package identifier column to the packages whose full-text search
+        index column may contain the given LIKE pattern. The condition is
+        meant to be appended to a WHERE clause. If the search index is
+        not available, an empty condition is returned.
+
+        @param column: search index column, either "atoms", "description"
+            or "content"
+        @type column: string
+        @param pattern: LIKE pattern
+        @type pattern: string
+        @param package_id_column: package identifier column to restrict
+        @type package_id_column: string
+        @return: tuple composed by the SQL condition and its arguments
+        @rtype: tuple
+        """
+        return "", tuple()
+
+    def _updateSearchIndex(self, package_id):
+        """
+        Update the full-text search index entry of the given package,
+        if the search index is available.
+
+        @param package_id: package identifier
+        @type package_id: int
+        """
+
     def searchProvidedVirtualPackage(self, keyword):
         """
         Search in old-style Portage PROVIDE metadata.
@@ -4429,6 +5229,11 @@ class EntropySQLRepository(EntropyRepositoryBase):
             query_str_list.append("LOWER(extrainfo.description) LIKE ?")
             query_args.append("%" + sub_keyword + "%")
         query_str = " AND ".join(query_str_list)
+        for sub_keyword in keyword_split:
+            search_index, search_index_args = self._searchIndexCondition(
+                "description", sub_keyword, "baseinfo.idpackage")
+            query_str += search_index
+            query_args.extend(search_index_args)
         if just_id:
             cur = self._cursor().execute("""
             SELECT baseinfo.idpackage FROM extrainfo, baseinfo
@@ -4548,6 +5353,143 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """, (name, category))
         return tuple(cur)
 
+    # maximum amount of bound parameters used by a single query,
+    # SQLite default limit is 999.
+    _BULK_PARAMETERS_LIMIT = 500
+
+    def atomMatchMany(self, atoms, matchSlot = None, multiMatch = False,
+        maskFilter = True, extendedResults = False, useCache = True):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        Atoms referencing packages by category and name are resolved in
+        bulk: candidate packages and the version, tag, revision, slot and
+        USE flags used to filter them are fetched with a few set-based
+        queries, then the atomMatch() filters are applied in memory.
+        The atomMatch() on-disk cache is not used for them.
+        Other atoms ("or" dependencies, old-style virtuals and atoms
+        without category) go through atomMatch().
+        """
+        atoms = list(atoms)
+        parsed = {}
+        keys = set()
+        use_keys = set()
+        for atom in set(atoms):
+            data = self._atomMatchManyParse(atom)
+            if data is None:
+                continue
+            parsed[atom] = data
+            key = (data[7], data[8])
+            keys.add(key)
+            if data[1]:
+                use_keys.add(key)
+
+        metadata = None
+        if keys:
+            try:
+                metadata = self._atomMatchManyMetadata(keys, use_keys)
+            except OperationalError:
+                # be fault tolerant like atomMatch(), go through
+                # the slow path instead.
+                parsed.clear()
+
+        results = {}
+        outcome = []
+        for atom in atoms:
+            result = results.get(atom)
+            if result is None:
+                data = parsed.get(atom)
+                if data is None:
+                    result = self.atomMatch(atom, matchSlot = matchSlot,
+                        multiMatch = multiMatch, maskFilter = maskFilter,
+                        extendedResults = extendedResults,
+                        useCache = useCache)
+                else:
+                    (match_tag, match_use, atom_slot, match_revision,
+                     direction, justname, pkgkey, pkgname, pkgcat,
+                     pkgversion, stripped_atom) = data
+                    slot = matchSlot
+                    if slot is None:
+                        slot = atom_slot
+                    result = self._atomMatchResult(atom, slot,
+                        metadata.candidates(pkgname, pkgcat), None,
+                        (match_tag, match_use, match_revision, direction,
+                         justname, pkgversion, stripped_atom),
+                        multiMatch, maskFilter, extendedResults,
+                        metadata = metadata, storeCache = False)
+                results[atom] = result
+            outcome.append(result)
+        return outcome
+
+    def _atomMatchManyParse(self, atom):
+        """
+        Return the _atomMatchParse() data of the given atom, or None if
+        the atom cannot be resolved in bulk by atomMatchMany() (empty
+        atoms, "or" dependencies, badly formatted atoms, atoms without
+        category and old-style virtuals).
+        """
+        if not atom:
+            return None
+        if atom.endswith(etpConst['entropyordepquestion']):
+            return None
+
+        data = self._atomMatchParse(atom)
+        pkgkey, pkgname, pkgcat = data[6:9]
+        if (pkgkey is None) or (not pkgname):
+            return None
+        if pkgcat in ("null", self.VIRTUAL_META_PACKAGE_CATEGORY):
+            # category guessing and PROVIDEs are handled by atomMatch()
+            return None
+        return data
+
+    def _atomMatchManyMetadata(self, keys, use_keys):
+        """
+        Fetch the metadata used by atomMatchMany() to resolve atoms.
+
+        @param keys: set of (name, category) tuples
+        @type keys: set
+        @param use_keys: subset of keys whose USE flags are needed
+        @type use_keys: set
+        @return: the fetched metadata
+        @rtype: _AtomMatchMetadata
+        """
+        limit = self._BULK_PARAMETERS_LIMIT
+        names = list(set([name for name, category in keys]))
+
+        candidates = {}
+        baseinfo = {}
+        for index in range(0, len(names), limit):
+            chunk = names[index:index + limit]
+            cur = self._cursor().execute("""
+            SELECT idpackage, name, category, version, versiontag,
+                revision, slot FROM baseinfo
+            WHERE name IN (%s)
+            """ % (", ".join(["?"] * len(chunk)),), chunk)
+            for (package_id, name, category, version, tag,
+                 revision, slot) in cur:
+                key = (name, category)
+                if key not in keys:
+                    continue
+                candidates.setdefault(key, set()).add(package_id)
+                baseinfo[package_id] = (version, tag, revision, slot)
+
+        package_ids = []
+        for key in use_keys:
+            package_ids.extend(candidates.get(key, ()))
+
+        useflags = {}
+        for index in range(0, len(package_ids), limit):
+            chunk = package_ids[index:index + limit]
+            cur = self._cursor().execute("""
+            SELECT useflags.idpackage, useflagsreference.flagname
+            FROM useflags, useflagsreference
+            WHERE useflags.idflag = useflagsreference.idflag
+            AND useflags.idpackage IN (%s)
+            """ % (", ".join(["?"] * len(chunk)),), chunk)
+            for package_id, flag in cur:
+                useflags.setdefault(package_id, set()).add(flag)
+
+        return _AtomMatchMetadata(candidates, baseinfo, useflags)
+
     def isPackageScopeAvailable(self, atom, slot, revision):
         """
         Reimplemented from EntropyRepositoryBase.
@@ -4668,6 +5610,21 @@ class EntropySQLRepository(EntropyRepositoryBase):
                 return tuple()
             return frozenset()
 
+    def listAllStrictData(self):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        concat = self._concatOperator(
+            ("baseinfo.category", "'/'", "baseinfo.name"))
+        cur = self._cursor().execute("""
+        SELECT baseinfo.idpackage, %s, baseinfo.slot, baseinfo.version,
+        baseinfo.versiontag, baseinfo.revision, baseinfo.atom,
+        extrainfo.digest
+        FROM baseinfo LEFT OUTER JOIN extrainfo
+        ON baseinfo.idpackage = extrainfo.idpackage
+        """ % (concat,))
+        return tuple(cur)
+
     def listAllInjectedPackageIds(self):
         """
         Reimplemented from EntropyRepositoryBase.
@@ -4691,6 +5648,15 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """)
         return tuple(cur)
 
+    def listAllConflicts(self):
+        """
+        Reimplemented from EntropyRepositoryBase.
+        """
+        cur = self._cursor().execute("""
+        SELECT idpackage, conflict FROM conflicts
+        """)
+        return tuple(cur)
+
     def listAllDownloads(self, do_sort = True, full_path = False):
         """
         Reimplemented from EntropyRepositoryBase.
@@ -4892,7 +5858,7 @@ class EntropySQLRepository(EntropyRepositoryBase):
         """
         raise NotImplementedError()
 
-    def exportRepository(self, dumpfile):
+    def exportRepository(self, dumpfile, binary = False):
         """
         Not implemented, subclasses must implement this.
         """
@@ -5141,6 +6107,7 @@ class EntropySQLRepository(EntropyRepositoryBase):
         self._createDesktopMimeIndex()
         self._createProvidedMimeIndex()
         self._createPackageDownloadsIndex()
+        self._createReverseDependenciesIndex()
 
     def _createTrashedCountersIndex(self):
         try:
@@ -5387,6 +6354,29 @@ class EntropySQLRepository(EntropyRepositoryBase):
         except OperationalError:
             pass
 
+    def _createReverseDependenciesIndex(self):
+        try:
+            self._cursor().execute("""
+            CREATE INDEX reversedependencies_idpackage
+                ON reversedependencies ( idpackage, iddependency );
+            """)
+        except OperationalError:
+            pass
+        try:
+            self._cursor().execute("""
+            CREATE INDEX reversedependencies_iddependency
+                ON reversedependencies ( iddependency );
+            """)
+        except OperationalError:
+            pass
+        try:
+            self._cursor().execute("""
+            CREATE INDEX dependenciesindex_iddependency
+                ON dependencies ( iddependency );
+            """)
+        except OperationalError:
+            pass
+
     def _createCountersIndex(self):
         try:
             self._cursor().execute("""
@@ -5551,7 +6541,56 @@ class EntropySQLRepository(EntropyRepositoryBase):
             return rev_deps_data
 
         dep_data = {}
-        for iddep, atom in self.listAllDependencies():
+        for iddep, package_id in self._resolveReverseDependencies(
+                self.listAllDependencies()):
+            obj = dep_data.setdefault(iddep, set())
+            obj.add(package_id)
+
+        self._setLiveCache("reverseDependenciesMetadata", dep_data)
+        try:
+            self._cacher.save(cache_key, dep_data)
+        except IOError:
+            # race condition, ignore
+            pass
+        return dep_data
+
+    def _getChecksumGeneration(self):
+        """
+        Return a value that changes every time the metadata hashed by
+        checksum() does, or None if the repository is not tracking
+        its changes.
+
+        @return: the checksum generation or None
+        @rtype: string or None
+        """
+        return None
+
+    def _getDependenciesGeneration(self):
+        """
+        Return a value that changes every time the metadata used to
+        resolve reverse dependencies (dependencies, package names,
+        versions, slots, tags and provides) does, or None if the
+        repository is not tracking such changes. Unlike
+        _getChecksumGeneration(), it is not affected by changes to other
+        package metadata, like the creation date set after a merge.
+
+        @return: the dependencies generation or None
+        @rtype: string or None
+        """
+        return None
+
+    def _resolveReverseDependencies(self, dependencies):
+        """
+        Match the given dependency strings against this repository.
+
+        @param dependencies: iterable of (iddependency, dependency) tuples
+        @type dependencies: iterable
+        @return: set of (iddependency, package_id) tuples
+        @rtype: set
+        """
+        dep_ids = []
+        atoms = []
+        for iddep, atom in dependencies:
 
             if iddep == -1:
                 continue
@@ -5559,28 +6598,159 @@ class EntropySQLRepository(EntropyRepositoryBase):
             if atom.endswith(etpConst['entropyordepquestion']):
                 or_atoms = atom[:-1].split(etpConst['entropyordepsep'])
                 for or_atom in or_atoms:
-                    # not safe to use cache here, people messing with multiple
-                    # instances can make this crash
-                    package_id, rc = self.atomMatch(or_atom, useCache = False)
-                    if package_id != -1:
-                        obj = dep_data.setdefault(iddep, set())
-                        obj.add(package_id)
+                    dep_ids.append(iddep)
+                    atoms.append(or_atom)
             else:
-                # not safe to use cache here, people messing with multiple
-                # instances can make this crash
-                package_id, rc = self.atomMatch(atom, useCache = False)
-                if package_id != -1:
-                    obj = dep_data.setdefault(iddep, set())
-                    obj.add(package_id)
+                dep_ids.append(iddep)
+                atoms.append(atom)
 
-        self._setLiveCache("reverseDependenciesMetadata", dep_data)
-        try:
-            self._cacher.save(cache_key, dep_data)
-        except IOError:
-            # race condition, ignore
-            pass
+        # not safe to use cache here, people messing with multiple
+        # instances can make this crash
+        matches = self.atomMatchMany(atoms, useCache = False)
+
+        dep_data = set()
+        for iddep, (package_id, rc) in zip(dep_ids, matches):
+            if package_id != -1:
+                dep_data.add((iddep, package_id))
         return dep_data
 
+    def _isReverseDependenciesTableAvailable(self):
+        """
+        Return whether the "reversedependencies" table can be used
+        by this repository instance. The table is kept in sync with
+        the repository content through the dependencies generation, see
+        _getDependenciesGeneration().
+
+        @return: True, if the table can be used
+        @rtype: bool
+        """
+        if not self.PERSISTENT_REVERSE_DEPENDENCIES:
+            return False
+        if self.readonly():
+            return False
+        if not self._doesTableExist("reversedependencies"):
+            return False
+        return self._getDependenciesGeneration() is not None
+
+    def _isReverseDependenciesTableCurrent(self):
+        """
+        Return whether the "reversedependencies" table is available and
+        reflects the current repository content.
+
+        @return: True, if the table is up-to-date
+        @rtype: bool
+        """
+        if not self._isReverseDependenciesTableAvailable():
+            return False
+
+        # do not use getSetting(), its cache is not invalidated
+        # by the dependencies triggers
+        cur = self._cursor().execute("""
+        SELECT setting_value FROM settings WHERE setting_name = ?
+        LIMIT 1
+        """, ("reverse_dependencies_generation",))
+        generation = cur.fetchone()
+        if generation is None:
+            return False
+        return generation[0] == self._getDependenciesGeneration()
+
+    def _setupReverseDependencies(self):
+        """
+        Make sure that the "reversedependencies" table is up-to-date,
+        regenerating it if needed. The regenerated table is not
+        committed, this is up to the caller, like for any other change.
+
+        @return: True, if the table can be used to resolve reverse
+            dependencies, False if the in-memory metadata must be used
+        @rtype: bool
+        """
+        if not self._isReverseDependenciesTableAvailable():
+            return False
+        if self._isReverseDependenciesTableCurrent():
+            return True
+
+        try:
+            self._cursor().execute("DELETE FROM reversedependencies")
+            self._cursor().executemany("""
+            INSERT INTO reversedependencies VALUES (?, ?)
+            """, self._resolveReverseDependencies(
+                    self.listAllDependencies()))
+            self._setReverseDependenciesGeneration()
+        except OperationalError:
+            # repository locked or on read-only media
+            return False
+        return True
+
+    def _setReverseDependenciesGeneration(self):
+        """
+        Mark the "reversedependencies" table as up-to-date.
+        """
+        self._setSetting("reverse_dependencies_generation",
+                         self._getDependenciesGeneration())
+
+    def _getReverseDependenciesKeys(self, package_id):
+        """
+        Return the package names that dependency strings should
+        reference in order to match the given package.
+
+        @param package_id: package identifier
+        @type package_id: int
+        @return: set of package names
+        @rtype: set
+        """
+        names = set()
+        key_split = self.retrieveKeySplit(package_id)
+        if key_split is not None:
+            names.add(key_split[1])
+        for provide, is_default in self.retrieveProvide(package_id):
+            names.add(entropy.dep.dep_getkey(provide).split("/")[-1])
+        return names
+
+    def _updateReverseDependencies(self, names, package_id = None):
+        """
+        Incrementally update the "reversedependencies" table, recomputing
+        the matches of the dependency strings referencing the given
+        package names and, if package_id is provided, of the dependencies
+        of the given package.
+
+        @param names: package names, see _getReverseDependenciesKeys()
+        @type names: iterable
+        @keyword package_id: package identifier
+        @type package_id: int
+        """
+        dependencies = {}
+        for name in names:
+            # "_" is a LIKE wildcard, this can only match more
+            # dependency strings than needed.
+            cur = self._cursor().execute("""
+            SELECT iddependency, dependency FROM dependenciesreference
+            WHERE dependency LIKE ?
+            """, ("%" + name + "%",))
+            dependencies.update(cur)
+
+        if package_id is not None:
+            cur = self._cursor().execute("""
+            SELECT dependenciesreference.iddependency,
+                dependenciesreference.dependency
+            FROM dependencies, dependenciesreference
+            WHERE dependencies.idpackage = ? AND
+            dependencies.iddependency = dependenciesreference.iddependency
+            """, (package_id,))
+            dependencies.update(cur)
+
+        dep_ids = list(dependencies.keys())
+        limit = self._BULK_PARAMETERS_LIMIT
+        for index in range(0, len(dep_ids), limit):
+            chunk = dep_ids[index:index + limit]
+            self._cursor().execute("""
+            DELETE FROM reversedependencies WHERE iddependency IN (%s)
+            """ % (", ".join(["?"] * len(chunk)),), chunk)
+
+        self._cursor().executemany("""
+        INSERT INTO reversedependencies VALUES (?, ?)
+        """, self._resolveReverseDependencies(dependencies.items()))
+        self._setReverseDependenciesGeneration()
+
     def moveSpmUidsToBranch(self, to_branch):
         """
         Reimplemented from EntropyRepositoryBase.
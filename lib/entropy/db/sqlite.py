@@ -14,6 +14,9 @@ import collections
 import errno
 import os
 import hashlib
+import itertools
+import re
+import stat
 import time
 try:
     import thread
@@ -35,6 +38,8 @@ from entropy.db.exceptions import Warning, Error, InterfaceError, \
     InternalError, ProgrammingError, NotSupportedError
 from entropy.db.sql import EntropySQLRepository, SQLConnectionWrapper, \
     SQLCursorWrapper
+from entropy.db.dump import RepositoryDumpReader, RepositoryDumpWriter, \
+    RepositoryDumpError
 
 from entropy.i18n import _
 
@@ -133,7 +138,7 @@ class EntropySQLiteRepository(EntropySQLRepository):
 
     # bump this every time schema changes and databaseStructureUpdate
     # should be triggered
-    _SCHEMA_REVISION = 5
+    _SCHEMA_REVISION = 7
 
     _INSERT_OR_REPLACE = "INSERT OR REPLACE"
     _INSERT_OR_IGNORE = "INSERT OR IGNORE"
@@ -141,7 +146,67 @@ class EntropySQLiteRepository(EntropySQLRepository):
     _CACHE_SIZE = 8192
 
     SETTING_KEYS = ("arch", "on_delete_cascade", "schema_revision",
-        "_baseinfo_extrainfo_2010")
+        "_baseinfo_extrainfo_2010", "checksum_generation",
+        "dependencies_generation")
+
+    # If True, "content" metadata is migrated to the compact layout,
+    # which interns directory prefixes into the "contentdirs" table and
+    # stores (directory id, base name, type) into "contentfiles".
+    # The "content" table is then replaced by a view, so that the
+    # full paths are still available.
+    COMPACT_CONTENT = False
+
+    # If True and the repository is opened in read-only mode, connections
+    # use memory mapped I/O and a larger page cache. File locking and
+    # change detection are kept, the database can still be changed in
+    # place by other processes (like the available packages ones, by
+    # the EAPI3 webservice sync).
+    READ_OPTIMIZED = False
+
+    # If True, the Write-Ahead Logging journal mode is used, so that
+    # readers can run alongside a writer. WAL readers must be able to
+    # create the -wal and -shm files next to the database, so the mode
+    # is only enabled if every user that can read the database file can
+    # also write its directory (see _wal_journal_allowed()), otherwise
+    # the rollback journal is kept (and restored, if possible).
+    WAL_JOURNAL = False
+
+    # page cache size (in KiB) and memory mapped I/O size (in bytes) of
+    # read optimized connections
+    _READ_OPTIMIZED_CACHE_SIZE = 32768
+    _READ_OPTIMIZED_MMAP_SIZE = 268435456
+
+    # directory prefix (trailing slash included) of a content path,
+    # see _splitContentPath()
+    _CONTENT_DIR_SQL = "rtrim(%(path)s, replace(%(path)s, '/', ''))"
+
+    # tables whose changes must be tracked by checksum()
+    _CHECKSUM_TABLES = ("baseinfo", "extrainfo", "categories", "licenses",
+        "flags", "packagesignatures", "dependenciesreference", "dependencies")
+
+    # tables whose changes invalidate the reversedependencies table,
+    # see _getDependenciesGeneration()
+    _DEPENDENCIES_TABLES = ("baseinfo", "categories", "provide", "useflags",
+        "dependenciesreference", "dependencies")
+
+    # triggers keeping the full-text search index in sync
+    _SEARCH_INDEX_TRIGGERS = ("searchindex_baseinfo_delete",
+        "searchindex_baseinfo_atom", "searchindex_provide_insert",
+        "searchindex_provide_delete", "searchindex_extrainfo_description")
+
+    # (re)generate the full-text search index content of packages
+    _SEARCH_INDEX_INSERT = """
+    INSERT INTO searchindex (rowid, atoms, description, content)
+    SELECT baseinfo.idpackage,
+        baseinfo.atom || COALESCE(char(10) || (
+            SELECT group_concat(provide.atom, char(10)) FROM provide
+            WHERE provide.idpackage = baseinfo.idpackage), ''),
+        (SELECT extrainfo.description FROM extrainfo
+            WHERE extrainfo.idpackage = baseinfo.idpackage),
+        (SELECT group_concat(content.file, char(10)) FROM content
+            WHERE content.idpackage = baseinfo.idpackage)
+    FROM baseinfo %s
+    """
 
     class SQLiteProxy(object):
 
@@ -224,6 +289,7 @@ class EntropySQLiteRepository(EntropySQLRepository):
 
         self._schema_update_run = False
         self._schema_update_lock = threading.Lock()
+        self._read_optimized = False
 
         if not self._skip_checks:
 
@@ -236,6 +302,13 @@ class EntropySQLiteRepository(EntropySQLRepository):
 
         self._maybeDatabaseSchemaUpdates()
 
+        if self.READ_OPTIMIZED and self._readonly and not self._temporary \
+                and not self._is_memory():
+            # connections opened so far might have been used to
+            # update the schema, don't reuse them.
+            self._cleanup_all()
+            self._read_optimized = True
+
     def lock_path(self):
         """
         Overridden from EntropyBaseRepository.
@@ -402,6 +475,23 @@ class EntropySQLiteRepository(EntropySQLRepository):
                 # to in-memory value
                 # http://www.sqlite.org/pragma.html#pragma_temp_store
                 cursor.execute("pragma temp_store = 2").fetchall()
+                if self._read_optimized:
+                    cursor.execute("pragma cache_size = -%d" % (
+                        self._READ_OPTIMIZED_CACHE_SIZE,)).fetchall()
+                    cursor.execute("pragma mmap_size = %d" % (
+                        self._READ_OPTIMIZED_MMAP_SIZE,)).fetchall()
+                elif self.WAL_JOURNAL and not self._is_memory():
+                    # the journal mode is persistent, this is a no-op
+                    # if already set
+                    journal_mode = "DELETE"
+                    if self._wal_journal_allowed():
+                        journal_mode = "WAL"
+                    try:
+                        cursor.execute("pragma journal_mode = %s" % (
+                            journal_mode,)).fetchall()
+                    except OperationalError:
+                        # read-only file, or busy
+                        pass
                 cursor_pool[c_key] = cursor, threads
                 self._start_cleanup_monitor(current_thread, c_key)
                 _init_db = True
@@ -490,6 +580,37 @@ class EntropySQLiteRepository(EntropySQLRepository):
         """
         return self._db == ":memory:"
 
+    def _wal_journal_allowed(self):
+        """
+        Return True if the Write-Ahead Logging journal mode can be used,
+        that is if the database directory is writable by us and by all
+        the users that can read the database file. Otherwise, unprivileged
+        readers (like "equo query" or Rigo on the installed packages
+        repository) would fail with "attempt to write a readonly
+        database".
+        """
+        db_dir = os.path.dirname(os.path.abspath(self._db))
+        if not os.access(db_dir, os.W_OK):
+            return False
+        try:
+            db_st = os.stat(self._db)
+            dir_st = os.stat(db_dir)
+        except OSError:
+            return False
+
+        if dir_st.st_mode & stat.S_IWOTH:
+            return True
+        if db_st.st_mode & stat.S_IROTH:
+            return False
+        if db_st.st_mode & stat.S_IRGRP:
+            if dir_st.st_gid != db_st.st_gid:
+                return False
+            if not dir_st.st_mode & stat.S_IWGRP:
+                return False
+        if dir_st.st_uid != db_st.st_uid:
+            return False
+        return True
+
     def _setDefaultCacheSize(self, size):
         """
         Change default low-level, storage engine based cache size.
@@ -510,7 +631,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
         if self.__cur_mtime != mtime:
             self.__cur_mtime = mtime
             self._discardLiveCache()
-        return self._live_cacher.get(self._getLiveCacheKey() + key)
+        return self._live_cacher.get(
+            key, namespace = self._getLiveCacheKey())
 
     _FLOCK_LOCK_MAP = {}
     _FLOCK_LOCK_MUTEX = threading.Lock()
@@ -687,6 +809,9 @@ class EntropySQLiteRepository(EntropySQLRepository):
         """
         my = self.Schema()
         self.dropAllIndexes()
+        if self._isContentCompact():
+            # dropping the view also drops its triggers
+            self._cursor().execute("DROP VIEW IF EXISTS content")
         for table in self._listAllTables():
             try:
                 self._cursor().execute("DROP TABLE %s" % (table,))
@@ -697,6 +822,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
         self.commit()
         self._clearLiveCache("_doesTableExist")
         self._clearLiveCache("_doesColumnInTableExist")
+        self._clearLiveCache("_doesChecksumTriggersExist")
+        self._clearLiveCache("_doesDependenciesTriggersExist")
         self._setupInitialSettings()
         # set cache size
         self._setCacheSize(self._CACHE_SIZE)
@@ -1870,7 +1997,12 @@ class EntropySQLiteRepository(EntropySQLRepository):
         except (KeyError, ValueError):
             current_schema_rev = -1
 
+        # repositories can be opened by classes with different layouts
+        content_update = self.COMPACT_CONTENT and \
+            not self._isContentCompact()
+
         if current_schema_rev == EntropySQLiteRepository._SCHEMA_REVISION \
+                and not content_update \
                 and not os.getenv("ETP_REPO_SCHEMA_UPDATE"):
             return
 
@@ -1938,6 +2070,19 @@ class EntropySQLiteRepository(EntropySQLRepository):
 
         self._foreignKeySupport()
 
+        if content_update:
+            self._migrateContentCompact()
+
+        if not self._doesTableExist("reversedependencies"):
+            self._createReverseDependenciesTable()
+
+        # must run after any table migration, triggers are dropped
+        # together with their tables.
+        if not self._doesChecksumTriggersExist():
+            self._createChecksumTriggers()
+        if not self._doesDependenciesTriggersExist():
+            self._createDependenciesTriggers()
+
         self._readonly = old_readonly
         self._connection().commit()
 
@@ -1965,6 +2110,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
     def importRepository(dumpfile, db, data = None):
         """
         Reimplemented from EntropyRepositoryBase.
+        Binary dumps are restored directly, textual SQL dumps are fed
+        to /usr/bin/sqlite3.
         @todo: remove /usr/bin/sqlite3 dependency
         """
         dbfile = os.path.realpath(db)
@@ -1974,6 +2121,14 @@ class EntropySQLiteRepository(EntropySQLRepository):
             raise AttributeError("dbfile value is invalid")
         if not entropy.tools.is_valid_path_string(dumpfile):
             raise AttributeError("dumpfile value is invalid")
+
+        if RepositoryDumpReader.is_dump(dumpfile):
+            rc = EntropySQLiteRepository._importBinaryRepository(
+                dumpfile, tmp_dbfile)
+            if rc == 0:
+                os.rename(tmp_dbfile, dbfile)
+            return rc
+
         with open(dumpfile, "rb") as in_f:
             try:
                 proc = subprocess.Popen(("/usr/bin/sqlite3", tmp_dbfile,),
@@ -1986,10 +2141,85 @@ class EntropySQLiteRepository(EntropySQLRepository):
                 os.rename(tmp_dbfile, dbfile)
         return rc
 
-    def exportRepository(self, dumpfile):
+    @staticmethod
+    def _importBinaryRepository(dumpfile, dbfile):
+        """
+        Restore a binary dump (see entropy.db.dump) into a new SQLite3
+        database file. Indexes, views and triggers are created once all
+        the rows have been inserted.
+
+        @param dumpfile: binary dump file path
+        @type dumpfile: string
+        @param dbfile: path of the database file to create
+        @type dbfile: string
+        @return: import return code (0 = OK)
+        @rtype: int
+        """
+        sqlite = EntropySQLiteRepository.SQLiteProxy.get()
+        try:
+            os.remove(dbfile)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+        def _validate(sql):
+            if not sql.lstrip().upper().startswith("CREATE "):
+                raise RepositoryDumpError("invalid dump statement")
+            return sql
+
+        conn = sqlite.connect(dbfile)
+        try:
+            cur = conn.cursor()
+            cur.execute("PRAGMA synchronous = OFF")
+            cur.execute("PRAGMA journal_mode = MEMORY")
+
+            inserts = {}
+            with open(dumpfile, "rb") as dump_f:
+                reader = RepositoryDumpReader(dump_f)
+                for record_type, data in reader:
+
+                    if record_type == reader.SCHEMA_RECORD:
+                        for name, sql, columns, _blobs in data:
+                            cur.execute(_validate(sql))
+                            inserts[name] = \
+                                "INSERT INTO \"%s\" (%s) VALUES (%s)" % (
+                                    name,
+                                    ", ".join(
+                                        ["\"%s\"" % (x,) for x in columns]),
+                                    ", ".join(["?"] * len(columns)))
+
+                    elif record_type == reader.ROWS_RECORD:
+                        table, rows = data
+                        cur.executemany(inserts[table], rows)
+
+                    elif record_type == reader.OBJECTS_RECORD:
+                        for sql in data:
+                            cur.execute(_validate(sql))
+
+            conn.commit()
+
+        except (RepositoryDumpError, sqlite.Error, IOError, OSError) as err:
+            const_debug_write(
+                __name__,
+                "_importBinaryRepository: cannot import %s: %s" % (
+                    dumpfile, repr(err)))
+            conn.close()
+            try:
+                os.remove(dbfile)
+            except OSError:
+                pass
+            return 1
+
+        conn.close()
+        return 0
+
+    def exportRepository(self, dumpfile, binary = False):
         """
         Reimplemented from EntropyRepositoryBase.
         """
+        if binary:
+            return self._exportBinaryRepository(dumpfile)
+
         exclude_tables = []
         gentle_with_tables = True
         toraw = const_convert_to_rawstring
@@ -2012,6 +2242,10 @@ class EntropySQLiteRepository(EntropySQLRepository):
             )
             if name.startswith("sqlite_"):
                 continue
+            if name.startswith("searchindex"):
+                # full-text search index and its shadow tables,
+                # regenerated by createAllIndexes()
+                continue
 
             t_cmd = "CREATE TABLE"
             if sql.startswith(t_cmd) and gentle_with_tables:
@@ -2036,6 +2270,8 @@ class EntropySQLiteRepository(EntropySQLRepository):
         WHERE sql NOT NULL AND type!='table' AND type!='meta'
         """)
         for name, x, sql in cur4.fetchall():
+            if name.startswith("searchindex"):
+                continue
             dumpfile.write(toraw("%s;\n" % sql))
 
         dumpfile.write(toraw("COMMIT;\n"))
@@ -2050,6 +2286,70 @@ class EntropySQLiteRepository(EntropySQLRepository):
         )
         # remember to close the file
 
+    def _exportBinaryRepository(self, dumpfile):
+        """
+        Export the repository to the given file object using the
+        binary dump format (see entropy.db.dump).
+
+        @param dumpfile: dump file object to write to
+        @type dumpfile: file object
+        """
+        tables = []
+        cur = self._cursor().execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE sql NOT NULL AND type=='table'
+        """)
+        for name, sql in cur.fetchall():
+            if name.startswith("sqlite_"):
+                continue
+            if name.startswith("searchindex"):
+                # full-text search index and its shadow tables,
+                # regenerated by createAllIndexes()
+                continue
+
+            cur2 = self._cursor().execute("PRAGMA table_info('%s')" % name)
+            columns = []
+            blob_columns = []
+            for idx, row in enumerate(cur2.fetchall()):
+                columns.append(row[1])
+                if row[2].upper() == "BLOB":
+                    blob_columns.append(idx)
+            tables.append((name, sql, columns, blob_columns))
+
+        writer = RepositoryDumpWriter(dumpfile)
+        writer.write_schema(tables)
+
+        self._connection().unicode()
+        for name, sql, columns, blob_columns in tables:
+            self.output(
+                red("%s " % (
+                    _("Exporting database table"),
+                ) ) + "["+blue(str(name))+"]",
+                importance = 0,
+                level = "info",
+                back = True,
+                header = "   "
+            )
+            cur = self._cursor().execute("""
+            SELECT %s FROM "%s"
+            """ % (", ".join(["\"%s\"" % (x,) for x in columns]), name))
+            writer.write_rows(name, cur)
+
+        cur = self._cursor().execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE sql NOT NULL AND type!='table' AND type!='meta'
+        """)
+        writer.write_objects([sql for name, sql in cur.fetchall() \
+                                  if not name.startswith("searchindex")])
+        writer.close()
+
+        self.output(
+            red(_("Database Export complete.")),
+            importance = 0,
+            level = "info",
+            header = "   "
+        )
+
     def _listAllTables(self):
         """
         List all available tables in this repository database.
@@ -2071,7 +2371,16 @@ class EntropySQLiteRepository(EntropySQLRepository):
             return 0.0
         if self._is_memory():
             return 0.0
-        return os.path.getmtime(self._db)
+        mtime = os.path.getmtime(self._db)
+        # in WAL mode, committed transactions are appended to the log
+        # and moved into the database file at checkpoint time. The
+        # journal mode is stored in the database file, check the log
+        # even if WAL_JOURNAL is not set on this class.
+        try:
+            mtime = max(mtime, os.path.getmtime(self._db + "-wal"))
+        except OSError:
+            pass
+        return mtime
 
     def checksum(self, do_order = False, strict = True,
                  include_signatures = False, include_dependencies = False):
@@ -2079,7 +2388,19 @@ class EntropySQLiteRepository(EntropySQLRepository):
         Reimplemented from EntropySQLRepository.
         We have to handle _baseinfo_extrainfo_2010.
         We must use the in-memory cache to do some memoization.
-        """
+        If do_order is False and the repository tracks its changes
+        through the "checksum_generation" setting, the metadata is
+        not read at all.
+        """
+        if not do_order:
+            generation = self._getChecksumGeneration()
+            if generation is not None:
+                m = hashlib.sha1()
+                m.update(const_convert_to_rawstring("%s|%s|%s|%s" % (
+                    generation, strict, include_signatures,
+                    include_dependencies)))
+                return m.hexdigest()
+
         _baseinfo_extrainfo_2010 = self._isBaseinfoExtrainfo2010()
         if _baseinfo_extrainfo_2010:
             return super(EntropySQLiteRepository,
@@ -2195,6 +2516,136 @@ class EntropySQLiteRepository(EntropySQLRepository):
         self._setLiveCache(cache_key, result)
         return result
 
+    def _getChecksumGeneration(self):
+        """
+        Reimplemented from EntropySQLRepository.
+        Return the current value of the "checksum_generation" setting,
+        maintained by triggers.
+        """
+        if not self._doesChecksumTriggersExist():
+            return None
+        return self._getTriggersGeneration("checksum_generation")
+
+    def _getDependenciesGeneration(self):
+        """
+        Reimplemented from EntropySQLRepository.
+        Return the current value of the "dependencies_generation" setting,
+        maintained by triggers.
+        """
+        if not self._doesDependenciesTriggersExist():
+            return None
+        return self._getTriggersGeneration("dependencies_generation")
+
+    def _getTriggersGeneration(self, setting_name):
+        """
+        Return the current value of a setting maintained by triggers.
+        """
+        # cannot use getSetting(), the value is changed by triggers
+        # behind our back.
+        cur = self._cursor().execute("""
+        SELECT setting_value FROM settings
+        WHERE setting_name = ? LIMIT 1
+        """, (setting_name,))
+        generation = cur.fetchone()
+        if generation is None:
+            return None
+        return generation[0]
+
+    def _doesChecksumTriggersExist(self):
+        """
+        Return whether all the triggers keeping the "checksum_generation"
+        setting up to date are available.
+        """
+        return self._doesGenerationTriggersExist(
+            "_doesChecksumTriggersExist", "checksum",
+            self._CHECKSUM_TABLES)
+
+    def _doesDependenciesTriggersExist(self):
+        """
+        Return whether all the triggers keeping the
+        "dependencies_generation" setting up to date are available.
+        """
+        return self._doesGenerationTriggersExist(
+            "_doesDependenciesTriggersExist", "dependencies",
+            self._DEPENDENCIES_TABLES)
+
+    def _doesGenerationTriggersExist(self, cache_key, prefix, tables):
+        """
+        Return whether all the "<prefix>_<table>_<event>" triggers of the
+        given tables are available.
+        """
+        cached = self._getLiveCache(cache_key)
+        if cached is not None:
+            return cached
+
+        if not self._doesTableExist("settings"):
+            exists = False
+        else:
+            cur = self._cursor().execute("""
+            SELECT name FROM SQLITE_MASTER
+            WHERE type = "trigger" AND name LIKE ?
+            """, ("%s_%%" % (prefix,),))
+            triggers = self._cur2frozenset(cur)
+            exists = True
+            for table in tables:
+                if not self._doesTableExist(table):
+                    continue
+                for event in ("insert", "update", "delete"):
+                    if "%s_%s_%s" % (prefix, table, event) not in triggers:
+                        exists = False
+                        break
+
+        self._setLiveCache(cache_key, exists)
+        return exists
+
+    def _createChecksumTriggers(self):
+        """
+        Create the triggers that change the "checksum_generation" setting
+        every time the metadata hashed by checksum() does, and start
+        a new generation.
+        """
+        self._createGenerationTriggers(
+            "checksum", "checksum_generation", self._CHECKSUM_TABLES)
+        self._clearLiveCache("_doesChecksumTriggersExist")
+
+    def _createDependenciesTriggers(self):
+        """
+        Create the triggers that change the "dependencies_generation"
+        setting every time the metadata used to resolve reverse
+        dependencies does, and start a new generation.
+        """
+        self._createGenerationTriggers(
+            "dependencies", "dependencies_generation",
+            self._DEPENDENCIES_TABLES)
+        self._clearLiveCache("_doesDependenciesTriggersExist")
+
+    def _createGenerationTriggers(self, prefix, setting_name, tables):
+        """
+        Create the "<prefix>_<table>_<event>" triggers that change the
+        given setting every time a row of the given tables does, and
+        start a new generation.
+        """
+        statements = []
+        for table in tables:
+            if not self._doesTableExist(table):
+                continue
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                statements.append("""
+                CREATE TRIGGER IF NOT EXISTS %s_%s_%s
+                AFTER %s ON %s
+                BEGIN
+                    UPDATE settings SET setting_value = lower(hex(randomblob(20)))
+                    WHERE setting_name = '%s';
+                END;
+                """ % (prefix, table, event.lower(), event, table,
+                       setting_name))
+
+        self._cursor().executescript("".join(statements))
+        self._cursor().execute("""
+        %s INTO settings VALUES (?, lower(hex(randomblob(20))))
+        """ % (self._INSERT_OR_REPLACE,), (setting_name,))
+        self._settings_cache.clear()
+
     def storeInstalledPackage(self, package_id, repoid, source = 0):
         """
         Reimplemented from EntropySQLRepository.
@@ -2298,6 +2749,103 @@ class EntropySQLiteRepository(EntropySQLRepository):
                 raise
             return {}
 
+    def _insertContent(self, package_id, content, already_formatted = False):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        if not self._isContentCompact():
+            return super(EntropySQLiteRepository, self)._insertContent(
+                package_id, content, already_formatted = already_formatted)
+
+        if already_formatted:
+            items = ((path, ftype) for _package_id, path, ftype in content)
+        else:
+            items = ((path, content[path]) for path in content)
+
+        # respect iterators, content is inserted in chunks
+        dir_ids = {}
+        limit = self._BULK_PARAMETERS_LIMIT
+        while True:
+            chunk = [self._splitContentPath(path) + (ftype,)
+                     for path, ftype in itertools.islice(items, limit)]
+            if not chunk:
+                break
+            self._getContentDirIds(
+                [x[0] for x in chunk if x[0] not in dir_ids], dir_ids)
+            self._cursor().executemany("""
+            INSERT INTO contentfiles VALUES (?, ?, ?, ?)
+            """, [(package_id, dir_ids[dirname], name, ftype)
+                  for dirname, name, ftype in chunk])
+
+    def isFileAvailable(self, path, get_id = False):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        if not self._isContentCompact():
+            return super(EntropySQLiteRepository, self).isFileAvailable(
+                path, get_id = get_id)
+
+        cur = self._cursor().execute("""
+        SELECT contentfiles.idpackage FROM contentdirs, contentfiles
+        WHERE contentdirs.dir = ? AND contentfiles.name = ?
+        AND contentfiles.iddir = contentdirs.iddir
+        """, self._splitContentPath(path))
+        result = self._cur2frozenset(cur)
+        if get_id:
+            return result
+        elif result:
+            return True
+        return False
+
+    def searchBelongs(self, bfile, like = False):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        if like or not self._isContentCompact():
+            return super(EntropySQLiteRepository, self).searchBelongs(
+                bfile, like = like)
+
+        cur = self._cursor().execute("""
+        SELECT contentfiles.idpackage FROM contentdirs, contentfiles, baseinfo
+        WHERE contentdirs.dir = ? AND contentfiles.name = ?
+        AND contentfiles.iddir = contentdirs.iddir
+        AND contentfiles.idpackage = baseinfo.idpackage
+        """, self._splitContentPath(bfile))
+        return self._cur2frozenset(cur)
+
+    def dropContent(self):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        if not self._isContentCompact():
+            super(EntropySQLiteRepository, self).dropContent()
+        else:
+            self._cursor().executescript("""
+            DELETE FROM contentfiles;
+            DELETE FROM contentdirs;
+            """)
+            self.dropContentSafety()
+
+        if self._doesSearchIndexExist():
+            self._cursor().execute("""
+            UPDATE searchindex SET content = NULL
+            """)
+
+    def clean(self):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        super(EntropySQLiteRepository, self).clean()
+        if self._isContentCompact():
+            self._cursor().execute("""
+            DELETE FROM contentdirs
+            WHERE iddir NOT IN (SELECT iddir FROM contentfiles)""")
+
     def dropContentSafety(self):
         """
         Reimplemented from EntropySQLRepository.
@@ -2324,6 +2872,30 @@ class EntropySQLiteRepository(EntropySQLRepository):
                 self._cursor().execute('DROP INDEX IF EXISTS %s' % (index,))
             except OperationalError:
                 continue
+        self._dropSearchIndex()
+
+    def _createContentIndex(self):
+        """
+        Reimplemented from EntropySQLRepository.
+        We must handle the compact "content" layout.
+        """
+        if not self._isContentCompact():
+            return super(EntropySQLiteRepository, self)._createContentIndex()
+
+        try:
+            self._cursor().execute("""
+                CREATE INDEX contentfilesindex_couple
+                    ON contentfiles ( idpackage );
+            """)
+        except OperationalError:
+            pass
+        try:
+            self._cursor().execute("""
+                CREATE INDEX contentfilesindex_file
+                    ON contentfiles ( name, iddir );
+            """)
+        except OperationalError:
+            pass
 
     def createAllIndexes(self):
         """
@@ -2335,6 +2907,158 @@ class EntropySQLiteRepository(EntropySQLRepository):
             self.__createLicensesIndex()
             self.__createCategoriesIndex()
             self.__createCompileFlagsIndex()
+        if self._indexing:
+            self._createSearchIndex()
+
+    def _doesSearchIndexExist(self):
+        """
+        Return whether the full-text search index and the triggers
+        keeping it in sync exist.
+
+        @return: True, if the search index can be used
+        @rtype: bool
+        """
+        cached = self._getLiveCache("_doesSearchIndexExist")
+        if cached is not None:
+            return cached
+
+        exists = self._doesTableExist("searchindex")
+        if exists:
+            cur = self._cursor().execute("""
+            SELECT name FROM SQLITE_MASTER
+            WHERE type = "trigger" AND name LIKE "searchindex_%"
+            """)
+            triggers = self._cur2frozenset(cur)
+            for trigger in self._SEARCH_INDEX_TRIGGERS:
+                if trigger not in triggers:
+                    exists = False
+                    break
+
+        self._setLiveCache("_doesSearchIndexExist", exists)
+        return exists
+
+    def _createSearchIndex(self):
+        """
+        Create and populate the full-text search index, an FTS5 table
+        using the trigram tokenizer, which can serve LIKE '%keyword%'
+        queries. Nothing is done if SQLite does not support it.
+        """
+        if self._doesSearchIndexExist():
+            return
+
+        # triggers are dropped together with their tables
+        self._dropSearchIndex()
+        try:
+            self._cursor().executescript("""
+            CREATE VIRTUAL TABLE searchindex USING fts5 (
+                atoms, description, content, tokenize = 'trigram'
+            );
+
+            CREATE TRIGGER searchindex_baseinfo_delete
+            AFTER DELETE ON baseinfo
+            BEGIN
+                DELETE FROM searchindex WHERE rowid = old.idpackage;
+            END;
+
+            CREATE TRIGGER searchindex_baseinfo_atom
+            AFTER UPDATE OF atom ON baseinfo
+            BEGIN
+                UPDATE searchindex SET atoms = new.atom || COALESCE(
+                    char(10) || (
+                        SELECT group_concat(provide.atom, char(10))
+                        FROM provide
+                        WHERE provide.idpackage = new.idpackage), '')
+                WHERE rowid = new.idpackage;
+            END;
+
+            CREATE TRIGGER searchindex_provide_insert
+            AFTER INSERT ON provide
+            BEGIN
+                UPDATE searchindex SET atoms = (
+                    SELECT baseinfo.atom FROM baseinfo
+                    WHERE baseinfo.idpackage = new.idpackage) || COALESCE(
+                    char(10) || (
+                        SELECT group_concat(provide.atom, char(10))
+                        FROM provide
+                        WHERE provide.idpackage = new.idpackage), '')
+                WHERE rowid = new.idpackage;
+            END;
+
+            CREATE TRIGGER searchindex_provide_delete
+            AFTER DELETE ON provide
+            BEGIN
+                UPDATE searchindex SET atoms = (
+                    SELECT baseinfo.atom FROM baseinfo
+                    WHERE baseinfo.idpackage = old.idpackage) || COALESCE(
+                    char(10) || (
+                        SELECT group_concat(provide.atom, char(10))
+                        FROM provide
+                        WHERE provide.idpackage = old.idpackage), '')
+                WHERE rowid = old.idpackage;
+            END;
+
+            CREATE TRIGGER searchindex_extrainfo_description
+            AFTER UPDATE OF description ON extrainfo
+            BEGIN
+                UPDATE searchindex SET description = new.description
+                WHERE rowid = new.idpackage;
+            END;
+            """)
+        except OperationalError as err:
+            # SQLite built without FTS5 or older than 3.34.0,
+            # which introduced the trigram tokenizer
+            const_debug_write(
+                __name__,
+                "_createSearchIndex: search index not available: %s" % (
+                    repr(err),))
+            self._clearLiveCache("_doesTableExist")
+            self._clearLiveCache("_doesSearchIndexExist")
+            return
+
+        self._cursor().execute(self._SEARCH_INDEX_INSERT % ("",))
+        self._clearLiveCache("_doesTableExist")
+        self._clearLiveCache("_doesSearchIndexExist")
+
+    def _dropSearchIndex(self):
+        """
+        Drop the full-text search index, if any.
+        """
+        for trigger in self._SEARCH_INDEX_TRIGGERS:
+            self._cursor().execute(
+                "DROP TRIGGER IF EXISTS %s" % (trigger,))
+        try:
+            self._cursor().execute("DROP TABLE IF EXISTS searchindex")
+        except OperationalError:
+            # no such module: fts5
+            pass
+        self._clearLiveCache("_doesTableExist")
+        self._clearLiveCache("_doesSearchIndexExist")
+
+    def _updateSearchIndex(self, package_id):
+        """
+        Reimplemented from EntropySQLRepository.
+        """
+        if not self._doesSearchIndexExist():
+            return
+        self._cursor().execute("""
+        DELETE FROM searchindex WHERE rowid = ?
+        """, (package_id,))
+        self._cursor().execute(
+            self._SEARCH_INDEX_INSERT % ("WHERE baseinfo.idpackage = ?",),
+            (package_id,))
+
+    def _searchIndexCondition(self, column, pattern, package_id_column):
+        """
+        Reimplemented from EntropySQLRepository.
+        """
+        if not self._doesSearchIndexExist():
+            return "", tuple()
+        # trigram queries need at least three consecutive non-wildcard
+        # characters, otherwise the whole index is scanned.
+        if max([len(x) for x in re.split("[%_]", pattern)]) < 3:
+            return "", tuple()
+        return " AND %s IN (SELECT rowid FROM searchindex WHERE %s LIKE ?)" \
+            % (package_id_column, column), ("%" + pattern + "%",)
 
     def __createCompileFlagsIndex(self):
         try:
@@ -2481,6 +3205,134 @@ class EntropySQLiteRepository(EntropySQLRepository):
         self._setSetting("_baseinfo_extrainfo_2010", "1")
         self._connection().commit()
 
+    @staticmethod
+    def _splitContentPath(path):
+        """
+        Split a content path into its directory prefix, trailing slash
+        included, and its base name. The result is the same as the one
+        of _CONTENT_DIR_SQL.
+
+        @param path: the content path
+        @type path: string
+        @return: tuple composed by directory prefix and base name
+        @rtype: tuple
+        """
+        idx = path.rfind("/") + 1
+        return path[:idx], path[idx:]
+
+    def _isContentCompact(self):
+        """
+        Return whether "content" metadata is stored using the compact
+        layout (see COMPACT_CONTENT).
+        """
+        return self._doesTableExist("contentfiles")
+
+    def _getContentDirIds(self, dirs, dir_ids):
+        """
+        Intern the given directory prefixes into the "contentdirs" table
+        and store their identifiers into dir_ids.
+
+        @param dirs: list of directory prefixes
+        @type dirs: list
+        @param dir_ids: map of directory prefixes to their identifiers,
+            updated in place
+        @type dir_ids: dict
+        """
+        dirs = list(set(dirs))
+        if not dirs:
+            return
+        self._cursor().executemany("""
+        INSERT OR IGNORE INTO contentdirs (dir) VALUES (?)
+        """, [(x,) for x in dirs])
+        limit = self._BULK_PARAMETERS_LIMIT
+        for index in range(0, len(dirs), limit):
+            chunk = dirs[index:index + limit]
+            cur = self._cursor().execute("""
+            SELECT dir, iddir FROM contentdirs WHERE dir IN (%s)
+            """ % (", ".join(["?"] * len(chunk)),), chunk)
+            dir_ids.update(cur)
+
+    def _migrateContentCompact(self):
+        """
+        Migrate "content" metadata to the compact layout, replacing
+        the "content" table with a view on top of the "contentdirs" and
+        "contentfiles" tables. The view is made writable by triggers.
+        """
+        if not self._doesTableExist("content"):
+            return
+
+        mytxt = "%s: [%s] %s" % (
+            bold(_("ATTENTION")),
+            purple(self.name),
+            red(_("updating repository metadata layout, please wait!")),
+        )
+        self.output(
+            mytxt,
+            importance = 1,
+            level = "warning")
+
+        self._cursor().executescript("""
+            BEGIN TRANSACTION;
+
+            CREATE TABLE contentdirs (
+                iddir INTEGER PRIMARY KEY AUTOINCREMENT,
+                dir VARCHAR UNIQUE
+            );
+            CREATE TABLE contentfiles (
+                idpackage INTEGER,
+                iddir INTEGER,
+                name VARCHAR,
+                type VARCHAR,
+                FOREIGN KEY(idpackage)
+                    REFERENCES baseinfo(idpackage) ON DELETE CASCADE
+            );
+            INSERT INTO contentdirs (dir)
+                SELECT DISTINCT %(file_dir)s FROM content;
+            INSERT INTO contentfiles
+                SELECT content.idpackage, contentdirs.iddir,
+                    substr(content.file, length(contentdirs.dir) + 1),
+                    content.type
+                FROM content, contentdirs
+                WHERE contentdirs.dir = %(file_dir)s
+                ORDER BY content.rowid;
+            DROP TABLE content;
+
+            CREATE VIEW content AS
+                SELECT contentfiles.idpackage AS idpackage,
+                    contentdirs.dir || contentfiles.name AS file,
+                    contentfiles.type AS type
+                FROM contentfiles, contentdirs
+                WHERE contentdirs.iddir = contentfiles.iddir;
+            CREATE TRIGGER content_insert INSTEAD OF INSERT ON content
+            BEGIN
+                INSERT OR IGNORE INTO contentdirs (dir) VALUES (%(new_dir)s);
+                INSERT INTO contentfiles
+                    SELECT NEW.idpackage, iddir,
+                        substr(NEW.file, length(dir) + 1), NEW.type
+                    FROM contentdirs WHERE dir = %(new_dir)s;
+            END;
+            CREATE TRIGGER content_delete INSTEAD OF DELETE ON content
+            BEGIN
+                DELETE FROM contentfiles
+                WHERE idpackage = OLD.idpackage
+                AND name = substr(OLD.file, length(%(old_dir)s) + 1)
+                AND iddir = (
+                    SELECT iddir FROM contentdirs WHERE dir = %(old_dir)s);
+            END;
+
+            COMMIT;
+        """ % {
+            'file_dir': self._CONTENT_DIR_SQL % {'path': "content.file"},
+            'new_dir': self._CONTENT_DIR_SQL % {'path': "NEW.file"},
+            'old_dir': self._CONTENT_DIR_SQL % {'path': "OLD.file"},
+        })
+
+        self._clearLiveCache("_doesTableExist")
+        self._clearLiveCache("_doesColumnInTableExist")
+        if self._indexing:
+            self._createContentIndex()
+        self._connection().commit()
+
     def _foreignKeySupport(self):
 
         # entropy.qa uses this name, must skip migration
@@ -2658,6 +3510,20 @@ class EntropySQLiteRepository(EntropySQLRepository):
         self._clearLiveCache("_doesTableExist")
         self._clearLiveCache("_doesColumnInTableExist")
 
+    def _createReverseDependenciesTable(self):
+        self._cursor().executescript("""
+            CREATE TABLE reversedependencies (
+                iddependency INTEGER,
+                idpackage INTEGER,
+                FOREIGN KEY(idpackage)
+                    REFERENCES baseinfo(idpackage) ON DELETE CASCADE
+            );
+        """)
+        self._clearLiveCache("_doesTableExist")
+        self._clearLiveCache("_doesColumnInTableExist")
+        if self._indexing:
+            self._createReverseDependenciesIndex()
+
     def _createPreservedLibsAtomColumn(self):
         self._cursor().execute("""
         ALTER TABLE preserved_libs ADD atom VARCHAR;
@@ -9,10 +9,17 @@
     B{Entropy Package Manager Debug classes}.
 
 """
+import atexit
+import functools
+import json
 import os
+import sys
+import threading
+import time
 
 from entropy.const import const_debug_write, const_setup_file, \
     const_mkstemp, etpConst
+from entropy.core import Singleton
 
 class DebugList(list):
 
@@ -264,3 +271,206 @@ class GraphDrawer(object):
         graph.write_raw(tmp_path)
         const_setup_file(tmp_path, etpConst['entropygid'], 0o644)
         return tmp_path
+
+
+class _NullProfilerPhase(object):
+    """
+    Phase context manager used when profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _ProfilerPhase(object):
+    """
+    Phase context manager recording calls and wall time of a profiled
+    phase. Nested calls of the same phase (recursion) are counted but
+    only the outermost one is timed.
+    """
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = self._profiler._enter(self._name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler._exit(self._name, self._start)
+        return False
+
+
+class SolverProfiler(Singleton):
+    """
+    Opt-in profiler of the Entropy Client dependency solver. It records
+    wall time and call counts of the solver phases (package matching,
+    masking, dependency graph building and sorting, library breakages
+    lookups, etc) and counts events such as cache hits and misses.
+    Profiling is enabled by setting the ETP_PROFILE environment variable
+    to "solver" (a comma separated list of profile names is accepted),
+    or through enable(). The collected data can be retrieved as a JSON
+    report, see report() and dump(). When enabled through ETP_PROFILE,
+    the report is written at exit to the file at ETP_PROFILE_OUTPUT,
+    or to stderr.
+    """
+
+    PROFILE = "solver"
+
+    _NULL_PHASE = _NullProfilerPhase()
+
+    def init_singleton(self):
+        self._mutex = threading.Lock()
+        self._local = threading.local()
+        profiles = os.getenv("ETP_PROFILE", "").split(",")
+        self.enabled = self.PROFILE in [x.strip() for x in profiles]
+        self.reset()
+        if self.enabled:
+            atexit.register(self._dump_at_exit)
+
+    def _dump_at_exit(self):
+        """
+        Write the report to the file at ETP_PROFILE_OUTPUT, or to stderr.
+        """
+        output = os.getenv("ETP_PROFILE_OUTPUT")
+        if not output:
+            self.dump(sys.stderr)
+            return
+        try:
+            with open(output, "w") as file_obj:
+                self.dump(file_obj)
+        except (OSError, IOError) as err:
+            sys.stderr.write("cannot write profile report: %s\n" % (err,))
+
+    def enable(self):
+        """
+        Enable profiling.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Disable profiling, collected data is kept.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop the collected data.
+        """
+        with self._mutex:
+            self._phases = {}
+            self._counters = {}
+            self._started = time.time()
+
+    def _enter(self, name):
+        """
+        Account a new call of the given phase, returning its start time
+        if the call must be timed, None otherwise.
+        """
+        depths = getattr(self._local, "depths", None)
+        if depths is None:
+            depths = {}
+            self._local.depths = depths
+        depth = depths.get(name, 0)
+        depths[name] = depth + 1
+        if depth == 0:
+            return time.time()
+        return None
+
+    def _exit(self, name, start):
+        """
+        Account the end of a call of the given phase.
+        """
+        depths = self._local.depths
+        depths[name] -= 1
+        elapsed = 0.0
+        if start is not None:
+            elapsed = time.time() - start
+        with self._mutex:
+            calls, total = self._phases.get(name, (0, 0.0))
+            self._phases[name] = (calls + 1, total + elapsed)
+
+    def phase(self, name):
+        """
+        Return a context manager profiling the given phase.
+
+        @param name: the phase name
+        @type name: string
+        @return: a context manager
+        """
+        if not self.enabled:
+            return self._NULL_PHASE
+        return _ProfilerPhase(self, name)
+
+    def count(self, name, amount = 1):
+        """
+        Increment the given counter, if profiling is enabled.
+
+        @param name: the counter name, for instance "atom_match.cache_hit"
+        @type name: string
+        @keyword amount: the increment
+        @type amount: int
+        """
+        if not self.enabled:
+            return
+        with self._mutex:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    @classmethod
+    def profiled(cls, name):
+        """
+        Decorator profiling every call of the decorated function as the
+        given phase.
+
+        @param name: the phase name
+        @type name: string
+        """
+        profiler = cls()
+
+        def _decorator(func):
+            @functools.wraps(func)
+            def _wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return func(*args, **kwargs)
+                with profiler.phase(name):
+                    return func(*args, **kwargs)
+            return _wrapper
+        return _decorator
+
+    def report(self):
+        """
+        Return the collected data.
+
+        @return: a dictionary, with "phases" mapping phase names to their
+            "calls" and "time" (seconds) and "counters" mapping counter
+            names to their values
+        @rtype: dict
+        """
+        with self._mutex:
+            phases = {}
+            for name, (calls, total) in self._phases.items():
+                phases[name] = {"calls": calls, "time": total}
+            return {
+                "profile": self.PROFILE,
+                "version": etpConst['entropyversion'],
+                "wall_time": time.time() - self._started,
+                "phases": phases,
+                "counters": dict(self._counters),
+            }
+
+    def dump(self, file_obj):
+        """
+        Write the collected data to the given file object as JSON.
+
+        @param file_obj: the file object
+        @type file_obj: file
+        """
+        json.dump(self.report(), file_obj, indent = 2, sort_keys = True,
+            separators = (",", ": "))
+        file_obj.write("\n")
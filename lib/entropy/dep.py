@@ -11,7 +11,10 @@
     This module contains Entropy package dependency manipulation functions.
 
 """
+import collections
 import re
+import threading
+
 from entropy.exceptions import InvalidAtom, EntropyException
 from entropy.const import etpConst, const_cmp
 
@@ -75,30 +78,6 @@ def _pkgsplit(mypkg):
 
     return  (m.group('pn'), m.group('ver'), rev)
 
-def _generic_sorter(inputlist, cmp_func):
-
-    inputs = inputlist[:]
-    if len(inputs) < 2:
-        return inputs
-    max_idx = len(inputs)
-
-    while True:
-        changed = False
-        for idx in range(max_idx):
-            second_idx = idx+1
-            if second_idx == max_idx:
-                continue
-            str_a = inputs[idx]
-            str_b = inputs[second_idx]
-            if cmp_func(str_a, str_b) < 0:
-                inputs[idx] = str_b
-                inputs[second_idx] = str_a
-                changed = True
-        if not changed:
-            break
-
-    return inputs
-
 def isjustname(mypkg):
     """
     Checks to see if the depstring is only the package name (no version parts)
@@ -602,7 +581,8 @@ def compare_versions(ver1, ver2):
                 r2 = int(s2[1])
             except ValueError:
                 r2 = 0
-            return r1 - r2
+            if r1 != r2:
+                return r1 - r2
 
     # the suffix part is equal to, so finally check the revision
     if match1.group(10):
@@ -694,6 +674,96 @@ def entropy_compare_versions(ver_data, ver_data2):
 
     return rc
 
+_VERSION_KEY_CACHE_SIZE = 16384
+_version_key_cache = collections.OrderedDict()
+_version_key_cache_lock = threading.Lock()
+
+def _parse_version_key(ver):
+    """
+    Parse a version string into a tuple ordered like compare_versions().
+    Invalid versions are lower than any valid one.
+    """
+    match = None
+    if ver:
+        match = ver_regexp.match(ver)
+    if not match:
+        return (0,)
+
+    # version parts before the suffix. compare_versions() compares
+    # two parts as floats when any of them starts with "0", and a
+    # "0"-prefixed part is always lower than a non "0"-prefixed one.
+    # A missing part is lower than any other, like a shorter tuple.
+    parts = [int(match.group(2))]
+    if match.group(3):
+        for part in match.group(3)[1:].split("."):
+            if part[0] == "0":
+                parts.append((0, float("0." + part)))
+            else:
+                parts.append((1, int(part)))
+
+    letter = 0
+    if match.group(5):
+        letter = ord(match.group(5))
+
+    # missing suffixes are compared as "_p0", so "_p0" suffixes are
+    # encoded together with the following suffix: (group, amount of
+    # "_p0" before it, suffix value). A suffix lower than "_p0" is
+    # lower the earlier it appears, an higher one is higher, and the
+    # end of the list is in between.
+    p0_value = (suffix_value["p"], 0)
+    suffixes = []
+    p0_count = 0
+    for suffix in match.group(6).split("_")[1:]:
+        s_type, s_num = suffix_regexp.match(suffix).groups()
+        value = (suffix_value[s_type], int(s_num or 0))
+        if value == p0_value:
+            p0_count += 1
+        elif value < p0_value:
+            suffixes.append((0, p0_count, value))
+            p0_count = 0
+        else:
+            suffixes.append((2, -p0_count, value))
+            p0_count = 0
+    suffixes.append((1,))
+
+    rev = 0
+    if match.group(10):
+        rev = int(match.group(10))
+
+    return (1, tuple(parts), letter, tuple(suffixes), rev)
+
+def version_sort_key(ver, tag = "", rev = 0):
+    """
+    Return a key usable for sorting package versions. Keys are ordered
+    like compare_versions() if tag and rev are not provided, otherwise
+    like entropy_compare_versions(). When tagged and untagged versions
+    are mixed, entropy_compare_versions() is not transitive, untagged
+    versions are considered lower here.
+    Parsed versions are kept in a bounded, least recently used, cache.
+
+    @param ver: package version
+    @type ver: string
+    @keyword tag: package tag
+    @type tag: string
+    @keyword rev: entropy package revision
+    @type rev: int
+    @return: the sort key
+    @rtype: tuple
+    """
+    with _version_key_cache_lock:
+        ver_key = _version_key_cache.pop(ver, None)
+        if ver_key is not None:
+            _version_key_cache[ver] = ver_key
+
+    if ver_key is None:
+        ver_key = _parse_version_key(ver)
+        with _version_key_cache_lock:
+            _version_key_cache[ver] = ver_key
+            if len(_version_key_cache) > _VERSION_KEY_CACHE_SIZE:
+                _version_key_cache.popitem(last = False)
+
+    return (tag, ver_key, rev)
+
 def get_newer_version(versions):
     """
     Return a sorted list of versions
@@ -703,7 +773,7 @@ def get_newer_version(versions):
     @return: sorted version list
     @rtype: list
     """
-    return _generic_sorter(versions, compare_versions)
+    return sorted(versions, key = version_sort_key, reverse = True)
 
 def get_entropy_newer_version(versions):
     """
@@ -714,7 +784,8 @@ def get_entropy_newer_version(versions):
     @return: sorted list
     @rtype: list
     """
-    return _generic_sorter(versions, entropy_compare_versions)
+    return sorted(versions, key = lambda x: version_sort_key(*x),
+                  reverse = True)
 
 sha1_re = re.compile(r"(.*)\.([a-f\d]{40})(.*)")
 def get_entropy_package_sha1(package_name):
@@ -915,12 +986,80 @@ class Dependency(object):
                 eval_data.update((x, repo_id) for x in pkg_deps)
         return eval_data
 
+_DEPENDENCY_AST_CACHE_SIZE = 4096
+_dependency_ast_cache = collections.OrderedDict()
+_dependency_ast_cache_lock = threading.Lock()
+
+class DependencyMatchCache(object):
+
+    """
+    Bounded, least recently used, memo of dependency match results.
+    It can be shared by DependencyStringParser instances (and by
+    expand_dependencies() calls) evaluating dependencies against the
+    same repositories, as long as they do not change in the meantime.
+    """
+
+    DEFAULT_SIZE = 4096
+
+    def __init__(self, size = None):
+        """
+        DependencyMatchCache constructor.
+
+        @keyword size: maximum amount of cached results
+        @type size: int
+        """
+        if size is None:
+            size = self.DEFAULT_SIZE
+        self._size = size
+        self._cache = collections.OrderedDict()
+        self._mutex = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached result at key, or None.
+
+        @param key: the cache key
+        @type key: hashable
+        @return: the cached result or None
+        """
+        with self._mutex:
+            value = self._cache.pop(key, None)
+            if value is not None:
+                self._cache[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Cache a result at key, evicting the least recently used one
+        if the cache is full.
+
+        @param key: the cache key
+        @type key: hashable
+        @param value: the result, cannot be None
+        @type value: any
+        """
+        with self._mutex:
+            self._cache.pop(key, None)
+            self._cache[key] = value
+            if len(self._cache) > self._size:
+                self._cache.popitem(last = False)
+
+    def clear(self):
+        """
+        Drop all the cached results.
+        """
+        with self._mutex:
+            self._cache.clear()
+
 class DependencyStringParser(object):
 
     """
     Conditional dependency string parser. It is used by Entropy dependency
     matching logic to evaluate dependency conditions containing boolean
     operators. Example: "( app-foo/foo & foo-misc/foo ) | foo-misc/new-foo"
+    Dependency strings are compiled once into a tree of
+    (operator, elements) tuples, kept in a bounded cache shared by all
+    the instances.
 
     Example usage (self is an EntropyRepositoryBase instance):
     >>> parser = DependencyStringParser("app-foo/foo & foo-misc/foo", self)
@@ -933,6 +1072,8 @@ class DependencyStringParser(object):
     """
     LOGIC_AND = "&"
     LOGIC_OR = "|"
+    # compiled operator of domains mixing LOGIC_AND and LOGIC_OR
+    _LOGIC_MIXED = LOGIC_AND + LOGIC_OR
 
     class MalformedDependency(EntropyException):
         """
@@ -940,7 +1081,7 @@ class DependencyStringParser(object):
         """
 
     def __init__(self, entropy_dep, entropy_repository_list,
-        selected_matches = None):
+        selected_matches = None, match_cache = None):
         """
         DependencyStringParser constructor.
 
@@ -953,43 +1094,56 @@ class DependencyStringParser(object):
             process of selecting conditional dependencies. Generally, a list
             of selected matches comes directly from user packages selection.
         @type selected_matches: set
+        @keyword match_cache: DependencyMatchCache instance used to share
+            match results with other parsers using the same repositories
+        @type match_cache: DependencyMatchCache
         """
         self.__dep = entropy_dep
         self.__entropy_repository_list = entropy_repository_list
         self.__selected_matches = None
         if selected_matches:
             self.__selected_matches = frozenset(selected_matches)
-        self.__dep_cache = {}
-        self.__eval_cache = {}
+        if match_cache is None:
+            match_cache = DependencyMatchCache()
+        self.__match_cache = match_cache
+        self.__repository_ids = None
 
-    def __clear_cache(self):
-        self.__dep_cache.clear()
-        self.__eval_cache.clear()
+    def __cache_key(self, kind, dep):
+        """
+        Return the match cache key of dep for the given kind of result.
+        """
+        if self.__repository_ids is None:
+            self.__repository_ids = tuple(
+                x.repository_id() for x in self.__entropy_repository_list)
+        return (kind, self.__repository_ids, dep)
 
     def __dependency(self, dep):
         """
-        Helper function to make instantianting Dependency classes less annoying.
+        Return whether dep is matched in any of the repositories.
         """
-        cached = self.__dep_cache.get(dep)
+        key = self.__cache_key("matched", dep)
+        cached = self.__match_cache.get(key)
         if cached is not None:
             return cached
-        obj = Dependency(dep, self.__entropy_repository_list)
-        self.__dep_cache[dep] = obj
+        obj = bool(Dependency(dep, self.__entropy_repository_list))
+        self.__match_cache.set(key, obj)
         return obj
 
     def __evaluate(self, dep):
         """
-        Helper function to make instantianting Dependency classes and retrieving
-        match results less annoying.
+        Return the package matches of dep in all the repositories.
         """
-        cached = self.__eval_cache.get(dep)
+        key = self.__cache_key("matches", dep)
+        cached = self.__match_cache.get(key)
         if cached is not None:
             return cached
-        obj = Dependency(dep, self.__entropy_repository_list).evaluate()
-        self.__eval_cache[dep] = obj
+        obj = frozenset(Dependency(dep, self.__entropy_repository_list
+            ).evaluate())
+        self.__match_cache.set(key, obj)
         return obj
 
-    def __split_subs(self, substring):
+    @classmethod
+    def __split_subs(cls, substring):
         deep_count = 0
         cur_str = ""
         subs = []
@@ -1004,12 +1158,12 @@ class DependencyStringParser(object):
             elif char == "(":
                 cur_str += char
                 deep_count += 1
-            elif char == self.LOGIC_OR and deep_count == 0:
+            elif char == cls.LOGIC_OR and deep_count == 0:
                 if cur_str.strip():
                     subs.append(cur_str.strip())
                 subs.append(char)
                 cur_str = ""
-            elif char == self.LOGIC_AND and deep_count == 0:
+            elif char == cls.LOGIC_AND and deep_count == 0:
                 if cur_str.strip():
                     subs.append(cur_str.strip())
                 subs.append(char)
@@ -1019,13 +1173,14 @@ class DependencyStringParser(object):
                 deep_count -= 1
                 if deep_count == 0:
                     cur_str = cur_str.strip()
-                    deps = self.__encode_sub(cur_str)
+                    deps = cls.__encode_sub(cur_str)
                     if len(deps) == 1:
                         subs.append(deps[0])
                     elif deps:
                         subs.append(deps)
                     else:
-                        raise DependencyStringParser.MalformedDependency()
+                        raise DependencyStringParser.MalformedDependency(
+                            cur_str)
                     cur_str = ""
             else:
                 cur_str += char
@@ -1035,18 +1190,98 @@ class DependencyStringParser(object):
 
         return subs
 
-    def __evaluate_subs(self, iterable):
+    @classmethod
+    def __encode_sub(cls, dep):
+        """
+        Generate a list of lists and strings from a plain dependency match
+        condition.
+        """
+        open_bracket = dep.find("(")
+        closed_bracket = dep.rfind(")")
+
+        try:
+            substring = dep[open_bracket + 1:closed_bracket]
+        except IndexError:
+            raise DependencyStringParser.MalformedDependency(dep)
+        if not substring:
+            raise DependencyStringParser.MalformedDependency(dep)
+
+
+        subs = cls.__split_subs(substring)
+        if not subs:
+            raise DependencyStringParser.MalformedDependency(dep)
 
-        if self.LOGIC_AND in iterable and self.LOGIC_OR in iterable:
+        return subs
+
+    @classmethod
+    def __compile_subs(cls, iterable):
+        """
+        Turn the lists and strings generated by __encode_sub() into a
+        tree of (operator, elements) tuples. Operator is None if the
+        domain does not contain any.
+        """
+        operator = None
+        if cls.LOGIC_AND in iterable and cls.LOGIC_OR in iterable:
+            operator = cls._LOGIC_MIXED
+        elif cls.LOGIC_AND in iterable:
+            operator = cls.LOGIC_AND
+        elif cls.LOGIC_OR in iterable:
+            operator = cls.LOGIC_OR
+
+        elements = []
+        for element in iterable:
+            if isinstance(element, list):
+                elements.append(cls.__compile_subs(element))
+            elif element not in (cls.LOGIC_AND, cls.LOGIC_OR):
+                elements.append(element)
+        return operator, tuple(elements)
+
+    @classmethod
+    def compile(cls, entropy_dep):
+        """
+        Compile a dependency string into a tree of (operator, elements)
+        tuples, where elements are either dependency strings or other
+        trees. Results are kept in a bounded, least recently used, cache.
+
+        @param entropy_dep: the dependency string to compile
+        @type entropy_dep: string
+        @return: the compiled dependency
+        @rtype: tuple
+        @raise MalformedDependency: if dependency string is malformed
+        """
+        with _dependency_ast_cache_lock:
+            ast = _dependency_ast_cache.pop(entropy_dep, None)
+            if ast is not None:
+                _dependency_ast_cache[entropy_dep] = ast
+
+        if ast is None:
+            try:
+                ast = cls.__compile_subs(
+                    cls.__encode_sub("(" + entropy_dep + ")"))
+            except DependencyStringParser.MalformedDependency:
+                # cache the failure as well
+                ast = ()
+            with _dependency_ast_cache_lock:
+                _dependency_ast_cache[entropy_dep] = ast
+                if len(_dependency_ast_cache) > _DEPENDENCY_AST_CACHE_SIZE:
+                    _dependency_ast_cache.popitem(last = False)
+
+        if not ast:
+            raise DependencyStringParser.MalformedDependency(entropy_dep)
+        return ast
+
+    def __evaluate_subs(self, ast):
+
+        operator, elements = ast
+
+        if operator == self._LOGIC_MIXED:
             raise DependencyStringParser.MalformedDependency(
                 "more than one operator in domain, not yet supported")
 
-        if self.LOGIC_AND in iterable:
-            iterable = [x for x in iterable if x != self.LOGIC_AND]
-
+        if operator == self.LOGIC_AND:
             outcomes = []
-            for and_el in iterable:
-                if isinstance(and_el, list):
+            for and_el in elements:
+                if isinstance(and_el, tuple):
                     outcome = self.__evaluate_subs(and_el)
                     if outcome:
                         outcomes.extend(outcome)
@@ -1058,13 +1293,12 @@ class DependencyStringParser(object):
                     return []
             return outcomes
 
-        elif self.LOGIC_OR in iterable:
-            iterable = [x for x in iterable if x != self.LOGIC_OR]
+        elif operator == self.LOGIC_OR:
 
             if self.__selected_matches:
                 # if there is something to prioritize
-                for or_el in iterable:
-                    if isinstance(or_el, list):
+                for or_el in elements:
+                    if isinstance(or_el, tuple):
                         outcome = self.__evaluate_subs(or_el)
                         if outcome:
                             difference = set(outcome) - self.__selected_matches
@@ -1080,8 +1314,8 @@ class DependencyStringParser(object):
                                 return [or_el]
             # no match using selected_matches priority list, fallback to
             # first available.
-            for or_el in iterable:
-                if isinstance(or_el, list):
+            for or_el in elements:
+                if isinstance(or_el, tuple):
                     outcome = self.__evaluate_subs(or_el)
                     if outcome:
                         return outcome
@@ -1092,28 +1326,6 @@ class DependencyStringParser(object):
         # don't know what to do at the moment with this malformation
         return []
 
-    def __encode_sub(self, dep):
-        """
-        Generate a list of lists and strings from a plain dependency match
-        condition.
-        """
-        open_bracket = dep.find("(")
-        closed_bracket = dep.rfind(")")
-
-        try:
-            substring = dep[open_bracket + 1:closed_bracket]
-        except IndexError:
-            raise DependencyStringParser.MalformedDependency()
-        if not substring:
-            raise DependencyStringParser.MalformedDependency()
-
-
-        subs = self.__split_subs(substring)
-        if not subs:
-            raise DependencyStringParser.MalformedDependency()
-
-        return subs
-
     def parse(self):
         """
         Execute the actual parsing and return the result.
@@ -1123,11 +1335,9 @@ class DependencyStringParser(object):
         @rtype: tuple
         @raise MalformedDependency: if dependency string is malformed
         """
-        self.__clear_cache()
         matched = False
         try:
-            matched_deps = self.__evaluate_subs(
-                self.__encode_sub("(" + self.__dep + ")"))
+            matched_deps = self.__evaluate_subs(self.compile(self.__dep))
             if matched_deps:
                 matched = True
         except DependencyStringParser.MalformedDependency:
@@ -1136,7 +1346,7 @@ class DependencyStringParser(object):
 
 
 def expand_dependencies(dependencies, entropy_repository_list,
-    selected_matches = None):
+    selected_matches = None, match_cache = None):
     """
     Expand a list of dependencies resolving conditional ones.
     NOTE: it automatically handles dependencies metadata extended format:
@@ -1151,6 +1361,9 @@ def expand_dependencies(dependencies, entropy_repository_list,
     @keyword selected_matches: list of preferred package matches used to
         evaluate or-dependencies.
     @type selected_matches: set
+    @keyword match_cache: DependencyMatchCache instance shared by the
+        conditional dependencies parsers
+    @type match_cache: DependencyMatchCache
     @return: list (keeping the iterable order when possible) of expanded
         dependencies
     @rtype: list
@@ -1173,7 +1386,8 @@ def expand_dependencies(dependencies, entropy_repository_list,
             try:
                 _matched, deps = DependencyStringParser(dep,
                     entropy_repository_list,
-                    selected_matches = selected_matches).parse()
+                    selected_matches = selected_matches,
+                    match_cache = match_cache).parse()
             except DependencyStringParser.MalformedDependency:
                 # wtf! add as-is
                 if dep_type is None:
@@ -51,7 +51,7 @@ if E_GID == None:
 
 
 def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
-    dump_dir = None, custom_permissions = None):
+    dump_dir = None, custom_permissions = None, serialized = False):
     """
     Dump pickable object to file
 
@@ -70,6 +70,9 @@ def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
     @type dump_dir: string
     @keyword custom_permissions: give custom permission bits
     @type custom_permissions: octal
+    @keyword serialized: my_object has already been serialized by
+        serialize_string() and it is written as it is
+    @type serialized: bool
     @return: None
     @rtype: None
     @raise EOFError: could be caused by pickle.dump, ignored if
@@ -114,7 +117,9 @@ def dumpobj(name, my_object, complete_path = False, ignore_exceptions = True,
             # is causing EBADF. There is probably a race
             # condition down in the stack.
             with open(tmp_dmpfile, "wb") as dmp_f:
-                if const_is_python3():
+                if serialized:
+                    dmp_f.write(my_object)
+                elif const_is_python3():
                     pickle.dump(my_object, dmp_f,
                         protocol = COMPAT_PICKLE_PROTOCOL, fix_imports = True)
                 else:
@@ -219,7 +224,7 @@ def serialize_string(myobj):
     """
     if const_is_python3():
         return pickle.dumps(myobj, protocol = COMPAT_PICKLE_PROTOCOL,
-            fix_imports = True, encoding = etpConst['conf_raw_encoding'])
+            fix_imports = True)
     else:
         return pickle.dumps(myobj)
 
@@ -13,7 +13,8 @@
     based on Tarjan's.
 
 """
-from entropy.misc import Lifo
+from entropy.debug import SolverProfiler
+
 
 class GraphNode(object):
 
@@ -220,6 +221,10 @@ class TopologicalSorter(object):
     """
     This class implements the topological sorting algorithm presented by
     R. E. Tarjan in 1972.
+    Both the strongly connected components search and the sorting are
+    implemented iteratively and run in O(V+E), so that arbitrarily deep
+    dependency chains can be sorted without hitting the Python recursion
+    limit.
     """
 
     def __init__(self, adjacency_map):
@@ -231,31 +236,6 @@ class TopologicalSorter(object):
         """
         object.__init__(self)
         self.__adjacency_map = adjacency_map
-        self.__stack = Lifo()
-
-    def __topological_sort_visit_node(self, node, low, result):
-        """
-        Internal method, visits a node ad push to stack.
-        """
-        if node in low:
-            return
-
-        num = len(low)
-        low[node] = num
-        stack_pos = len(self.__stack)
-        self.__stack.push(node)
-
-        for successor in self.__adjacency_map[node]:
-            self.__topological_sort_visit_node(successor, low, result)
-            low[node] = min(low[node], low[successor])
-
-        if num == low[node]:
-            component = tuple()
-            while len(self.__stack) > stack_pos:
-                component += (self.__stack.pop(),)
-            result.append(component)
-            for item in component:
-                low[item] = len(self.__adjacency_map)
 
     def __strongly_connected_nodes(self):
         """
@@ -264,45 +244,112 @@ class TopologicalSorter(object):
 
         adjacency_map should be a dictionary mapping node names to
         lists of successor nodes.
+        Return a list of components (tuples of nodes), sorted in reverse
+        topological order.
         """
+        adjacency_map = self.__adjacency_map
         result = []
+        index = {}
         low = {}
-
-        for node in self.__adjacency_map:
-            self.__topological_sort_visit_node(node, low, result)
+        stack_pos = {}
+        stack = []
+
+        for root in adjacency_map:
+            if root in index:
+                continue
+
+            index[root] = low[root] = len(index)
+            stack_pos[root] = len(stack)
+            stack.append(root)
+            visit = [(root, iter(adjacency_map[root]))]
+
+            while visit:
+                node, successors = visit[-1]
+
+                descend = False
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = low[successor] = len(index)
+                        stack_pos[successor] = len(stack)
+                        stack.append(successor)
+                        visit.append(
+                            (successor, iter(adjacency_map[successor])))
+                        descend = True
+                        break
+                    if successor in stack_pos:
+                        # successor is still on the stack
+                        if index[successor] < low[node]:
+                            low[node] = index[successor]
+                if descend:
+                    continue
+
+                visit.pop()
+                if visit:
+                    parent = visit[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+
+                if low[node] == index[node]:
+                    pos = stack_pos[node]
+                    component = stack[pos:]
+                    del stack[pos:]
+                    component.reverse()
+                    for item in component:
+                        del stack_pos[item]
+                    result.append(tuple(component))
 
         return result
 
-
     def __topological_sort(self, graph):
         """
-        Effectively executes topological sorting on given graph.
+        Effectively executes topological sorting on given graph, which is
+        a list of successor lists, indexed by node.
+        Return a list of nodes, sorted.
         """
-
         # initialize count map
-        count = dict((node, 0) for node in graph)
-
-        for node in graph:
-            for successor in graph[node]:
+        count = [0] * len(graph)
+        for successors in graph:
+            for successor in successors:
                 count[successor] += 1
 
-        ready_stack = Lifo()
-        for node in graph:
-            if count[node] == 0:
-                ready_stack.push(node)
-
-        dep_level = 1
-        result = {}
-        while ready_stack.is_filled():
+        ready_stack = [x for x in range(len(graph)) if count[x] == 0]
 
+        result = []
+        while ready_stack:
             node = ready_stack.pop()
-            result[dep_level] = node
-            dep_level += 1
-
+            result.append(node)
             for successor in graph[node]:
                 count[successor] -= 1
                 if count[successor] == 0:
-                    ready_stack.push(successor)
+                    ready_stack.append(successor)
+
+        return result
+
+    def __topological_levels(self, graph):
+        """
+        Effectively executes topological sorting on given graph, which is
+        a list of successor lists, indexed by node, grouping nodes in
+        dependency levels. Nodes at the same level have no mutual ordering
+        constraints.
+        Return a list of levels (lists of nodes), sorted.
+        """
+        count = [0] * len(graph)
+        for successors in graph:
+            for successor in successors:
+                count[successor] += 1
+
+        frontier = [x for x in range(len(graph)) if count[x] == 0]
+
+        result = []
+        while frontier:
+            result.append(frontier)
+            next_frontier = []
+            for node in frontier:
+                for successor in graph[node]:
+                    count[successor] -= 1
+                    if count[successor] == 0:
+                        next_frontier.append(successor)
+            frontier = next_frontier
 
         return result
 
@@ -315,34 +362,49 @@ class TopologicalSorter(object):
         """
         return self.__adjacency_map
 
-    def sort(self):
+    def sort(self, levels = False):
         """
         Given an adjacency map, identify strongly connected nodes,
         then perform a topological sort on them.
-
+        By default, every dependency level contains exactly one strongly
+        connected component (a tuple of one or more nodes). If levels is
+        True, every dependency level contains all the nodes that have no
+        mutual ordering constraints and could thus be handled
+        concurrently (the nodes of a strongly connected component are
+        always kept together).
+
+        @keyword levels: group independent nodes in the same level
+        @type levels: bool
         @return: sorted graph representation
         @rtype: dict
         """
-        # clear stack
-        self.__stack.clear()
-
         components = self.__strongly_connected_nodes()
 
         node_component = {}
-        for component in components:
+        for component_id, component in enumerate(components):
             for node in component:
-                node_component[node] = component
+                node_component[node] = component_id
 
-        component_graph = {}
-        for node in self.__adjacency_map:
+        component_graph = [[] for x in components]
+        for node, successors in self.__adjacency_map.items():
             node_c = node_component[node]
-            obj = component_graph.setdefault(node_c, [])
-            for successor in self.__adjacency_map[node]:
+            obj = component_graph[node_c]
+            for successor in successors:
                 successor_c = node_component[successor]
                 if node_c != successor_c:
                     obj.append(successor_c)
 
-        return self.__topological_sort(component_graph)
+        if not levels:
+            sorted_components = self.__topological_sort(component_graph)
+            return dict((dep_level, components[x]) for dep_level, x \
+                            in enumerate(sorted_components, 1))
+
+        sorted_levels = self.__topological_levels(component_graph)
+        result = {}
+        for dep_level, level_components in enumerate(sorted_levels, 1):
+            result[dep_level] = tuple(
+                node for x in level_components for node in components[x])
+        return result
 
 
 class Graph(object):
@@ -451,33 +513,42 @@ class Graph(object):
         self.__graph_map_cache = graph_map.copy()
         return graph_map
 
-    def solve_nodes(self):
+    def solve_nodes(self, levels = False):
         """
         This method is equal to solve() but doesn't do any item back-translation
         and just returns the relation between GraphNode objects that can be
         manipulated directly by the caller.
 
+        @keyword levels: see solve()
+        @type levels: bool
         @return: sorted graph representation (returning GraphNode objects)
         @rtype: dict
         """
         adj_map = self.get_adjacency_map()
         sorter = TopologicalSorter(adj_map)
-        return sorter.sort()
+        return sorter.sort(levels = levels)
 
-    def solve(self):
+    @SolverProfiler.profiled("topological_sort")
+    def solve(self, levels = False):
         """
         Thanks to "R. E. Tarjan" (1972) for the help ;-)
         Serialize the graph and spit out a dependency order.
         Data is returned in map form, where key represents the dependency
         level and value a list of items at that dependency level.
+        If levels is True, items without mutual ordering constraints are
+        grouped in the same dependency level, so that they can be handled
+        concurrently, otherwise every level contains a single strongly
+        connected component (one item, or items depending on each other).
 
+        @keyword levels: group independent items in the same level
+        @type levels: bool
         @return: sorted graph representation
         @rtype: dict
         """
         def trans_vals(node_list):
             return tuple([x.item() for x in node_list])
 
-        sorted_data = self.solve_nodes()
+        sorted_data = self.solve_nodes(levels = levels)
         return dict((x, trans_vals(y),) for x, y in sorted_data.items())
 
     def raw(self):
@@ -386,13 +386,15 @@ class QAInterface(TextInterface, EntropyPluginStore):
         @rtype: set
         """
         repos = sorted(entropy_client.repositories())
+        library_indexes = {}
 
         def _warn_soname(soname, elfclass):
             # try to resolve soname
             for needed_repo in repos:
                 needed_dbconn = entropy_client.open_repository(needed_repo)
-                pkg_ids = needed_dbconn.resolveNeeded(soname,
-                    elfclass = elfclass)
+                pkg_ids = self._library_index(
+                    needed_dbconn, library_indexes).resolveNeeded(
+                        soname, elfclass = elfclass)
                 if pkg_ids:
                     pkg_atoms = sorted((
                         needed_dbconn.retrieveKeySlotAggregated(x) for x in \
@@ -495,6 +497,7 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
         # update content taken from brokenlinksmask.conf
         excluded_libraries.update(self._settings['broken_links_mask'])
+        library_indexes = {}
 
         def _resolve_needed_content_fallback(repo, pkg_id, library):
             # at this point, perhaps the library is self contained in the
@@ -518,8 +521,9 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
         def _resolve_needed(repo, pkg_id, library, elfclass, multi_repo):
 
-            resolved_needed = repo.resolveNeeded(library,
-                elfclass = elfclass)
+            resolved_needed = self._library_index(
+                repo, library_indexes).resolveNeeded(
+                    library, elfclass = elfclass)
             if resolved_needed:
                 return True
 
@@ -532,8 +536,9 @@ class QAInterface(TextInterface, EntropyPluginStore):
                     # already searched here
                     continue
                 other_repo = entropy_client.open_repository(repo_id)
-                resolved_needed = other_repo.resolveNeeded(library,
-                    elfclass = elfclass)
+                resolved_needed = self._library_index(
+                    other_repo, library_indexes).resolveNeeded(
+                        library, elfclass = elfclass)
                 if resolved_needed:
                     # found !
                     return True
@@ -547,8 +552,9 @@ class QAInterface(TextInterface, EntropyPluginStore):
                     # already searched here
                     continue
                 other_repo = entropy_client.open_repository(repo_id)
-                resolved_needed = other_repo.resolveNeeded(library,
-                    elfclass = elfclass, extended = True)
+                resolved_needed = self._library_index(
+                    other_repo, library_indexes).resolveNeeded(
+                        library, elfclass = elfclass, extended = True)
                 if not resolved_needed:
                     continue
                 where = [(x, repo_id, y) for x, y in resolved_needed]
@@ -583,7 +589,9 @@ class QAInterface(TextInterface, EntropyPluginStore):
             is_base_repo = repository_id == base_repository_id
 
             # list of (needed, elfclass)
-            needed = repo.retrieveNeeded(package_id, extended = True)
+            needed = self._library_index(
+                repo, library_indexes).retrieveNeeded(
+                    package_id, extended = True)
             for library, elfclass in needed:
                 if library in excluded_libraries:
                     continue
@@ -1221,7 +1229,7 @@ class QAInterface(TextInterface, EntropyPluginStore):
         return unresolved_sonames
 
     def _resolve_library(self, entropy_client, library_name, elfclass,
-                         repositories):
+                         repositories, library_indexes = None):
         """
         Resolve a library name (SONAME) in the given repositories.
 
@@ -1234,16 +1242,22 @@ class QAInterface(TextInterface, EntropyPluginStore):
         @type elfclass: int
         @param repositories: list of repository identifiers
         @type repositories: list
+        @keyword library_indexes: library indexes already fetched, see
+            _library_index()
+        @type library_indexes: dict
         @return: a list of resolved libraries, each item of the
         list is a tuple composed by (package_id, repository_id, library_path).
         @rtype: list
         """
         results = []
+        if library_indexes is None:
+            library_indexes = {}
 
         for repository_id in repositories:
             repo = entropy_client.open_repository(repository_id)
-            data_solved = repo.resolveNeeded(library_name,
-                elfclass = elfclass, extended = True)
+            data_solved = self._library_index(
+                repo, library_indexes).resolveNeeded(
+                    library_name, elfclass = elfclass, extended = True)
             if not data_solved:
                 continue
 
@@ -1252,6 +1266,27 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
         return results
 
+    def _library_index(self, repo, library_indexes):
+        """
+        Return the library index (see
+        EntropyRepositoryBase.getLibraryIndex()) of the given repository,
+        fetching it only once for the given library_indexes map.
+
+        @param repo: EntropyRepositoryBase instance
+        @type repo: EntropyRepositoryBase
+        @param library_indexes: map of repository identifiers to their
+            library index, updated in place
+        @type library_indexes: dict
+        @return: the library index
+        @rtype: EntropyRepositoryLibraryIndex
+        """
+        repository_id = repo.repository_id()
+        index = library_indexes.get(repository_id)
+        if index is None:
+            index = repo.getLibraryIndex()
+            library_indexes[repository_id] = index
+        return index
+
     def _get_missing_libraries(self, entropy_client, package_match):
         """
         Service method able to determine whether dependencies are missing
@@ -1290,11 +1325,14 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
             return False
 
+        library_indexes = {}
+
         def populate_caches(pkg_id, repo, provided_libs, scope_cache):
             """
             Populate provided_libs and scope_cache structures.
             """
-            provided_libs_set = repo.retrieveProvidedLibraries(pkg_id)
+            provided_libs_set = self._library_index(
+                repo, library_indexes).retrieveProvidedLibraries(pkg_id)
             for pkg_lib, pkg_libpath, pkg_elfclass in provided_libs_set:
                 obj = provided_libs.setdefault((pkg_lib, pkg_elfclass), set())
                 obj.add(pkg_libpath)
@@ -1311,7 +1349,9 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
         rdepends = {}
         rdepends_plain = set()
-        neededs = dbconn.retrieveNeeded(package_id, extended = True)
+        neededs = self._library_index(
+            dbconn, library_indexes).retrieveNeeded(
+                package_id, extended = True)
         if not neededs:
             return rdepends, rdepends_plain
 
@@ -1343,7 +1383,8 @@ class QAInterface(TextInterface, EntropyPluginStore):
 
         for needed, elfclass in neededs:
             data_solved = self._resolve_library(
-                entropy_client, needed, elfclass, repos)
+                entropy_client, needed, elfclass, repos,
+                library_indexes = library_indexes)
             data_size = len(data_solved)
             data_solved = [(pkg_id, pkg_repo, path) for \
                 pkg_id, pkg_repo, path in data_solved if (pkg_id, pkg_repo)
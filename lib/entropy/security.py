@@ -586,8 +586,7 @@ class System(object):
 
         inst_repo = self._entropy.installed_repository()
         with inst_repo.direct():
-            inst_pkgs_cksum = inst_repo.checksum(
-                do_order=True, strict=False)
+            inst_pkgs_cksum = inst_repo.checksum(strict=False)
 
         repo_cksum = self._entropy._repositories_hash()
 
@@ -626,6 +626,22 @@ class ServerPackagesRepositoryUpdater(object):
                 critical.append(data['dump_path_digest_light'])
                 gpg_signed_files.append(data['dump_path_digest_light'])
 
+            if 4 not in disabled_eapis:
+
+                data['dump_path_bin_light'] = os.path.join(
+                    self._entropy._get_local_repository_dir(
+                        self._repository_id),
+                    etpConst['etpdatabasedumpbinlight'])
+                critical.append(data['dump_path_bin_light'])
+                gpg_signed_files.append(data['dump_path_bin_light'])
+
+                data['dump_path_digest_bin_light'] = os.path.join(
+                    self._entropy._get_local_repository_dir(
+                        self._repository_id),
+                    etpConst['etpdatabasedumpbinlighthashfile'])
+                critical.append(data['dump_path_digest_bin_light'])
+                gpg_signed_files.append(data['dump_path_digest_bin_light'])
+
         # EAPI 1
         if 1 not in disabled_eapis:
 
@@ -1283,6 +1299,46 @@ Name:    %s
             header = brown("    # ")
         )
 
+    def _show_eapi4_upload_messages(self, crippled_uri, database_path,
+        upload_data):
+
+        self._entropy.output(
+            "[repo:%s|%s|%s:%s] %s" % (
+                brown(self._repository_id),
+                darkgreen(crippled_uri),
+                red("EAPI"),
+                bold("4"),
+                blue(_("creating binary repository dump + checksum")),
+            ),
+            importance = 0,
+            level = "info",
+            header = darkgreen(" * ")
+        )
+        self._entropy.output(
+            "%s: %s" % (_("repository path"), blue(database_path),),
+            importance = 0,
+            level = "info",
+            header = brown("    # ")
+        )
+        self._entropy.output(
+            "%s: %s" % (
+                _("binary dump light"),
+                blue(upload_data['dump_path_bin_light']),
+            ),
+            importance = 0,
+            level = "info",
+            header = brown("    # ")
+        )
+        self._entropy.output(
+            "%s: %s" % (
+                _("binary dump light checksum"),
+                blue(upload_data['dump_path_digest_bin_light']),
+            ),
+            importance = 0,
+            level = "info",
+            header = brown("    # ")
+        )
+
     def _show_eapi1_upload_messages(self, crippled_uri, database_path,
         upload_data, cmethod):
 
@@ -1528,11 +1584,9 @@ Name:    %s
 
         self._shrink_and_close(dbconn)
 
-        if 2 not in disabled_eapis:
-            self._show_eapi2_upload_messages("~all~", database_path,
-                upload_data, cmethod)
+        if (2 not in disabled_eapis) or (4 not in disabled_eapis):
 
-            # create compressed dump + checksum
+            # create light repository, shared by EAPI2 and EAPI4 dumps
             eapi2_dbfile = self._entropy._get_local_repository_file(
                 self._repository_id)
             temp_eapi2_dbfile = eapi2_dbfile+".light_eapi2.tmp"
@@ -1542,21 +1596,46 @@ Name:    %s
                 self._entropy.open_generic_repository(
                     temp_eapi2_dbfile, indexing_override = False,
                     xcache = False)
-            eapi2_tmp_dbconn.dropContent()
-            eapi2_tmp_dbconn.dropChangelog()
-            eapi2_tmp_dbconn.commit()
-
-            # opener = cmethod[0]
-            f_out = cmethod[0](upload_data['dump_path_light'], "wb")
             try:
-                eapi2_tmp_dbconn.exportRepository(f_out)
+                eapi2_tmp_dbconn.dropContent()
+                eapi2_tmp_dbconn.dropChangelog()
+                eapi2_tmp_dbconn.commit()
+
+                if 2 not in disabled_eapis:
+                    self._show_eapi2_upload_messages("~all~", database_path,
+                        upload_data, cmethod)
+
+                    # create compressed dump + checksum
+                    # opener = cmethod[0]
+                    f_out = cmethod[0](upload_data['dump_path_light'], "wb")
+                    try:
+                        eapi2_tmp_dbconn.exportRepository(f_out)
+                    finally:
+                        f_out.close()
+
+                    self._create_file_checksum(
+                        upload_data['dump_path_light'],
+                        upload_data['dump_path_digest_light'])
+
+                if 4 not in disabled_eapis:
+                    self._show_eapi4_upload_messages("~all~", database_path,
+                        upload_data)
+
+                    # create binary dump + checksum, the dump is
+                    # compressed internally
+                    with open(upload_data['dump_path_bin_light'],
+                              "wb") as f_out:
+                        eapi2_tmp_dbconn.exportRepository(
+                            f_out, binary = True)
+
+                    self._create_file_checksum(
+                        upload_data['dump_path_bin_light'],
+                        upload_data['dump_path_digest_bin_light'])
+
             finally:
-                f_out.close()
                 eapi2_tmp_dbconn.close()
 
             os.remove(temp_eapi2_dbfile)
-            self._create_file_checksum(upload_data['dump_path_light'],
-                upload_data['dump_path_digest_light'])
 
         if 1 not in disabled_eapis:
 
@@ -1184,10 +1184,10 @@ class ServerSystemSettingsPlugin(SystemSettingsPlugin):
             mydis = setting.strip().split(",")
             try:
                 mydis = [int(x) for x in mydis]
-                mydis = set([x for x in mydis if x in (1, 2, 3,)])
+                mydis = set([x for x in mydis if x in (1, 2, 3, 4,)])
             except ValueError:
                 return
-            if (len(mydis) < 3) and mydis:
+            if (len(mydis) < 4) and mydis:
                 data['disabled_eapis'] = mydis
 
         def _server_basic_lang(line, setting):
@@ -5,21 +5,25 @@ sys.path.insert(0, '../../client')
 sys.path.insert(0, '.')
 sys.path.insert(0, '../')
 import unittest
+import fcntl
 import os
 import shutil
 import signal
 import time
+import threading
 
 from entropy.client.interfaces import Client
 from entropy.client.interfaces.db import InstalledPackagesRepository
 from entropy.client.interfaces.package.actions._triggers import Trigger
-from entropy.cache import EntropyCacher
+from entropy.cache import EntropyCacher, PackedCacheBackend, CacheMetrics
 from entropy.const import etpConst, const_mkdtemp
 from entropy.output import set_mute
+from entropy.locks import EntropyResourcesLock
 from entropy.core.settings.base import SystemSettings
 from entropy.db import EntropyRepository
 from entropy.exceptions import RepositoryError, EntropyPackageException
 import entropy.tools
+import entropy.dep
 import tests._misc as _misc
 
 class EntropyClientTest(unittest.TestCase):
@@ -121,8 +125,9 @@ class EntropyClientTest(unittest.TestCase):
                     cacher._EntropyCacher__enter_context_lock._is_owned())
                 cacher.discard()
                 cacher.push("bar", "foo", cache_dir = tmp_dir)
-                self.assertTrue(cacher._EntropyCacher__cache_buffer)
-                self.assertTrue(cacher._EntropyCacher__stashing_cache)
+                self.assertTrue(cacher._EntropyCacher__pending)
+                self.assertEqual(cacher.pop("bar", cache_dir = tmp_dir),
+                                 "foo")
             cacher.sync()
             self.assertEqual(cacher.pop("bar", cache_dir = tmp_dir), "foo")
         finally:
@@ -130,6 +135,122 @@ class EntropyClientTest(unittest.TestCase):
             cacher.stop()
             shutil.rmtree(tmp_dir, True)
 
+    def test_cacher_coalescing(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        cacher.start()
+        st_val = EntropyCacher.STASHING_CACHE
+        try:
+            EntropyCacher.STASHING_CACHE = True
+            with cacher:
+                cacher.discard()
+                stats = cacher.stats()
+                data = [1]
+                for count in range(10):
+                    data.append(count)
+                    cacher.push("foo", data, cache_dir = tmp_dir)
+                new_stats = cacher.stats()
+                self.assertEqual(new_stats['pending'], 1)
+                self.assertEqual(
+                    new_stats['coalesced'] - stats['coalesced'], 9)
+                # pushed objects are snapshots
+                self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir),
+                                 data)
+                data.append(10)
+                self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir),
+                                 data[:-1])
+            cacher.sync()
+            new_stats = cacher.stats()
+            self.assertEqual(new_stats['pending'], 0)
+            self.assertEqual(new_stats['pending_bytes'], 0)
+            self.assertEqual(new_stats['written'] - stats['written'], 1)
+            self.assertEqual(
+                EntropyCacher.backend(tmp_dir).load("foo", tmp_dir),
+                data[:-1])
+        finally:
+            EntropyCacher.STASHING_CACHE = st_val
+            cacher.stop()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_cacher_backpressure(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        limit = EntropyCacher.PENDING_BYTES_LIMIT
+        cacher.start()
+        try:
+            EntropyCacher.PENDING_BYTES_LIMIT = 1024
+            stats = cacher.stats()
+            for count in range(5):
+                cacher.push("foo%d" % (count,), "x" * 2048,
+                            cache_dir = tmp_dir)
+                # the writers have been woken up and waited for
+                self.assertTrue(cacher.stats()['pending_bytes'] <= 1024)
+            new_stats = cacher.stats()
+            self.assertEqual(
+                new_stats['backpressure'] - stats['backpressure'], 5)
+            cacher.sync()
+            self.assertEqual(cacher.pop("foo4", cache_dir = tmp_dir),
+                             "x" * 2048)
+        finally:
+            EntropyCacher.PENDING_BYTES_LIMIT = limit
+            cacher.stop()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_cacher_push_sync_pop(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        obj = {"foo": [1, 2, 3], "bar": ("baz", None), "qux": 1.5}
+        cacher.start()
+        try:
+            stats = cacher.stats()
+            cacher.push("foo", obj, cache_dir = tmp_dir)
+            cacher.push("bar", "bar" * 1024, cache_dir = tmp_dir)
+            cacher.sync()
+            new_stats = cacher.stats()
+            self.assertEqual(new_stats['pushed'] - stats['pushed'], 2)
+            self.assertEqual(new_stats['written'] - stats['written'], 2)
+            self.assertEqual(new_stats['pending'], 0)
+            self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir), obj)
+            self.assertEqual(cacher.pop("bar", cache_dir = tmp_dir),
+                             "bar" * 1024)
+        finally:
+            cacher.stop()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_cacher_writer_errors(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        backend = EntropyCacher.backend(tmp_dir)
+        store_serialized_many = backend.store_serialized_many
+        print_traceback = entropy.tools.print_traceback
+        limit = EntropyCacher.PENDING_BYTES_LIMIT
+        errors = []
+
+        def _store_serialized_many(items, cache_dir, **kwargs):
+            if not errors:
+                raise RuntimeError("backend failure")
+            return store_serialized_many(items, cache_dir, **kwargs)
+
+        cacher.start()
+        try:
+            backend.store_serialized_many = _store_serialized_many
+            entropy.tools.print_traceback = lambda *args: errors.append(1)
+            # push() waits for the writer threads to write the object
+            EntropyCacher.PENDING_BYTES_LIMIT = 1
+            cacher.push("foo", "foo", cache_dir = tmp_dir)
+            self.assertEqual(errors, [1])
+            self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir), None)
+            # the writer threads survived the failure
+            cacher.push("bar", "bar", cache_dir = tmp_dir)
+            self.assertEqual(cacher.stats()['pending'], 0)
+            self.assertEqual(cacher.pop("bar", cache_dir = tmp_dir), "bar")
+        finally:
+            EntropyCacher.PENDING_BYTES_LIMIT = limit
+            del backend.store_serialized_many
+            entropy.tools.print_traceback = print_traceback
+            cacher.stop()
+            shutil.rmtree(tmp_dir, True)
+
     def test_cacher_push_pop_sync(self):
         cacher = self.Client._cacher
         tmp_dir = const_mkdtemp()
@@ -142,6 +263,207 @@ class EntropyClientTest(unittest.TestCase):
         finally:
             shutil.rmtree(tmp_dir, True)
 
+    def test_packed_cache_backend(self):
+        backend = PackedCacheBackend()
+        tmp_dir = const_mkdtemp()
+        try:
+            self.assertEqual(backend.load("foo/bar", tmp_dir), None)
+            backend.store_many([("foo/bar", [1, 2]), ("foo/baz", "baz"),
+                ("foo/sub/qux", 3), ("other", {"a": 1})], tmp_dir)
+            self.assertEqual(backend.load("foo/bar", tmp_dir), [1, 2])
+            self.assertEqual(backend.load("other", tmp_dir), {"a": 1})
+            self.assertEqual(
+                backend.load("foo/bar", tmp_dir, aging_days = 1), [1, 2])
+            self.assertEqual(backend.keys(tmp_dir, "foo"),
+                ["foo/bar", "foo/baz"])
+            self.assertEqual(os.listdir(tmp_dir),
+                [PackedCacheBackend.PACK_FILE])
+
+            self.assertTrue(backend.remove("foo/baz", tmp_dir))
+            self.assertFalse(backend.remove("foo/baz", tmp_dir))
+            self.assertEqual(backend.load("foo/baz", tmp_dir), None)
+
+            backend.purge(tmp_dir, set(["foo"]))
+            self.assertEqual(backend.load("other", tmp_dir), None)
+            self.assertEqual(backend.load("foo/sub/qux", tmp_dir), 3)
+
+            backend.clear("foo/bar_", tmp_dir)
+            self.assertEqual(backend.keys(tmp_dir, "foo"), [])
+            self.assertEqual(backend.load("foo/sub/qux", tmp_dir), None)
+
+            # the pack file is recreated if removed behind our back
+            backend.store("foo/bar", "bar", tmp_dir)
+            os.remove(os.path.join(tmp_dir, PackedCacheBackend.PACK_FILE))
+            self.assertEqual(backend.load("foo/bar", tmp_dir), None)
+            backend.store("foo/bar", "baz", tmp_dir)
+            self.assertEqual(backend.load("foo/bar", tmp_dir), "baz")
+        finally:
+            backend.close()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_packed_cache_reload(self):
+        cacher = self.Client._cacher
+        cache_dir = EntropyCacher.current_directory()
+        disable_val = EntropyCacher.DISABLE_PACKED_CACHE
+        obj = {"foo": [1, 2, 3], "bar": ("baz", None)}
+        keys = ["packed_test/foo", "packed_test/bar"]
+        cacher.start()
+        try:
+            EntropyCacher.DISABLE_PACKED_CACHE = None
+            backend = EntropyCacher.backend()
+            self.assertTrue(isinstance(backend, PackedCacheBackend))
+            cacher.save(keys[0], obj)
+            cacher.push(keys[1], "bar" * 1024, async = False)
+            self.assertTrue(os.path.isfile(
+                os.path.join(cache_dir, PackedCacheBackend.PACK_FILE)))
+
+            # read back from disk through a new connection
+            backend.close()
+            self.assertEqual(backend.load(keys[0], cache_dir), obj)
+            self.assertEqual(backend.load(keys[1], cache_dir),
+                             "bar" * 1024)
+            self.assertEqual(cacher.pop(keys[0]), obj)
+        finally:
+            EntropyCacher.backend().remove_many(keys, cache_dir)
+            EntropyCacher.DISABLE_PACKED_CACHE = disable_val
+            cacher.stop()
+
+    def test_packed_cache_eviction(self):
+        backend = PackedCacheBackend()
+        tmp_dir = const_mkdtemp()
+        big_obj = "x" * (PackedCacheBackend.COMPRESS_THRESHOLD * 4)
+        try:
+            backend.store("foo/b", "b" * 100, tmp_dir)
+            backend.store("foo/c", big_obj, tmp_dir)
+            backend.store("foo/a", "a" * 100, tmp_dir)
+            # foo/a is now the most recently used one
+            self.assertEqual(backend.load("foo/a", tmp_dir), "a" * 100)
+            self.assertEqual(backend.load("foo/c", tmp_dir), big_obj)
+            self.assertEqual(backend.load("foo/a", tmp_dir), "a" * 100)
+
+            sizes = dict((key, size) for key, size, atime in \
+                             backend.usage(tmp_dir))
+            self.assertEqual(sorted(sizes), ["foo/a", "foo/b", "foo/c"])
+            # stored compressed
+            self.assertTrue(sizes["foo/c"] < len(big_obj))
+            self.assertEqual(backend.size(tmp_dir), sum(sizes.values()))
+
+            size_limit = backend.size(tmp_dir)
+            self.assertEqual(backend.evict(tmp_dir, size_limit), 0)
+            size_limit = int(sizes["foo/a"] / backend.EVICTION_RATIO) + 1
+            self.assertEqual(backend.evict(tmp_dir, size_limit), 2)
+            self.assertEqual(backend.keys(tmp_dir, "foo"), ["foo/a"])
+        finally:
+            backend.close()
+            shutil.rmtree(tmp_dir, True)
+
+    def test_cacher_usage(self):
+        cacher = self.Client._cacher
+        tmp_dir = const_mkdtemp()
+        atom_match_key = EntropyCacher.CACHE_IDS['atom_match'] + "foo"
+        try:
+            cacher.save(atom_match_key, "foo", cache_dir = tmp_dir)
+            cacher.save("other", "bar", cache_dir = tmp_dir)
+            usage = EntropyCacher.usage(cache_dir = tmp_dir)
+            self.assertEqual(set(usage), set(["atom_match", None]))
+            self.assertEqual(usage["atom_match"][0], 1)
+            self.assertTrue(usage["atom_match"][1] > 0)
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+    def test_prewarm_cache(self):
+        client = self.Client
+        # xcache is disabled in setUp()
+        self.assertFalse(client.prewarm_cache())
+        self.assertEqual(client.spawn_cache_prewarm(), None)
+
+        abort_event = threading.Event()
+        client.xcache = True
+        client._cacher.start()
+        try:
+            self.assertTrue(client.prewarm_cache(abort_event = abort_event))
+            abort_event.set()
+            self.assertFalse(
+                client.prewarm_cache(abort_event = abort_event))
+        finally:
+            client._cacher.stop()
+            client.xcache = False
+
+    def test_prewarm_cache_lock_timeout(self):
+        client = self.Client
+        # hold the resources lock exclusively, like the process
+        # spawning the pre-warm does, through another open file
+        lock_path = EntropyResourcesLock(output = client).path()
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o664)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        timer = threading.Timer(1.0, fcntl.flock, (lock_fd, fcntl.LOCK_UN))
+
+        client.xcache = True
+        client._cacher.start()
+        try:
+            self.assertFalse(client.prewarm_cache())
+            timer.start()
+            self.assertTrue(client.prewarm_cache(lock_timeout = 30))
+        finally:
+            timer.cancel()
+            os.close(lock_fd)
+            client._cacher.stop()
+            client.xcache = False
+
+    def test_cache_metrics(self):
+        cacher = self.Client._cacher
+        metrics = CacheMetrics()
+        tmp_dir = const_mkdtemp()
+        cache_id = os.path.basename(tmp_dir)
+        enabled = metrics.enabled
+        try:
+            metrics.enable()
+            metrics.reset()
+            self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir), None)
+            cacher.save("foo", [1, 2], cache_dir = tmp_dir)
+            self.assertEqual(cacher.pop("foo", cache_dir = tmp_dir), [1, 2])
+
+            data = metrics.report()["caches"][cache_id]
+            self.assertEqual((data["hits"], data["misses"]), (1, 1))
+            self.assertEqual(data["writes"], 1)
+            self.assertEqual(data["bytes_read"], data["bytes_written"])
+            self.assertEqual(data["unserializations"], 1)
+            self.assertEqual(data["top_keys"], [["foo", 2]])
+
+            stats_file = os.path.join(tmp_dir, "stats.json")
+            metrics.save(path = stats_file)
+            self.assertEqual(metrics.report()["caches"], {})
+            cacher.pop("bar", cache_dir = tmp_dir)
+            metrics.save(path = stats_file)
+            data = CacheMetrics.load(path = stats_file)["caches"][cache_id]
+            self.assertEqual((data["hits"], data["misses"]), (1, 2))
+            self.assertEqual(data["top_keys"], [["foo", 2], ["bar", 1]])
+
+            # savers wait for the lock held by others
+            cacher.pop("baz", cache_dir = tmp_dir)
+            with open(stats_file + ".lock", "a+") as lock_f:
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+                saver = threading.Thread(
+                    target = metrics.save, kwargs = {"path": stats_file})
+                saver.start()
+                saver.join(0.5)
+                self.assertTrue(saver.is_alive())
+                data = CacheMetrics.load(path = stats_file)["caches"]
+                self.assertEqual(data[cache_id]["misses"], 2)
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+            saver.join(30)
+            self.assertFalse(saver.is_alive())
+            data = CacheMetrics.load(path = stats_file)["caches"][cache_id]
+            self.assertEqual((data["hits"], data["misses"]), (1, 3))
+
+            metrics.disable()
+            cacher.pop("foo", cache_dir = tmp_dir)
+            self.assertEqual(metrics.report()["caches"], {})
+        finally:
+            metrics.enabled = enabled
+            metrics.reset()
+            shutil.rmtree(tmp_dir, True)
+
     def test_clear_cache(self):
         current_dir = self.Client._cacher.current_directory()
         test_file = os.path.join(current_dir, "asdasd")
@@ -150,6 +472,85 @@ class EntropyClientTest(unittest.TestCase):
         self.Client.clear_cache()
         self.assertEqual(os.listdir(current_dir), [])
 
+    def test_clear_cache_package_keys(self):
+        client = self.Client
+        current_dir = client._cacher.current_directory()
+        test_file = os.path.join(current_dir, "asdasd")
+        with open(test_file, "w") as f:
+            f.flush()
+
+        with client._package_keys_footprint() as package_keys:
+            client._record_dependency_keys(
+                [">=app-misc/foo-1.0", "( app-misc/bar | app-misc/baz:0 )",
+                 "!app-misc/qux"])
+        self.assertEqual(package_keys, set(["app-misc/foo", "app-misc/bar",
+            "app-misc/baz", "app-misc/qux"]))
+
+        foo_key = EntropyCacher.CACHE_IDS['dep_tree'] + "foo"
+        bar_key = EntropyCacher.CACHE_IDS['depends_tree'] + "bar"
+        client._cacher.start()
+        try:
+            client._push_footprint_cache(foo_key, "foo",
+                ["app-misc/foo"], async = False)
+            client._push_footprint_cache(bar_key, "bar",
+                ["app-misc/bar"], reverse = True, async = False)
+            self.assertEqual(client._pop_footprint_cache(foo_key), "foo")
+            self.assertEqual(client._pop_footprint_cache(bar_key), "bar")
+
+            client.clear_cache(package_keys = ["app-misc/foo"])
+            self.assertFalse(os.path.lexists(test_file))
+            self.assertEqual(client._pop_footprint_cache(foo_key), None)
+            self.assertEqual(client._pop_footprint_cache(bar_key), "bar")
+        finally:
+            client._cacher.stop()
+            client.clear_cache()
+
+    def test_subgraph_cache_size(self):
+        client = self.Client
+        client.xcache = True
+        size = client.SUBGRAPH_CACHE_SIZE
+        client._cacher.start()
+        try:
+            client.SUBGRAPH_CACHE_SIZE = 2
+            subgraph_cache = client._load_subgraph_cache(set())
+            self.assertEqual(subgraph_cache['records'], {})
+
+            records = subgraph_cache['records']
+            for last_used, node_key in enumerate(("a", "b", "c")):
+                records[node_key] = [last_used, {}, [], frozenset(), None]
+            subgraph_cache['changed'] = True
+            client._save_subgraph_cache(subgraph_cache)
+            client._cacher.sync()
+
+            subgraph_cache = client._load_subgraph_cache(set())
+            self.assertEqual(sorted(subgraph_cache['records']), ["b", "c"])
+        finally:
+            client.SUBGRAPH_CACHE_SIZE = size
+            client.xcache = False
+            client._cacher.stop()
+            client.clear_cache()
+
+    def test_subgraph_cache_hit(self):
+        client = self.Client
+        client.xcache = True
+        client._cacher.start()
+        try:
+            subgraph_cache = client._load_subgraph_cache(set())
+            node_key = ((1, "foo"), False, False, False, False, True)
+            client._CalculatorsMixin__push_subgraph_record(
+                subgraph_cache, node_key, ["app-misc/foo"], [], "effects")
+            client._save_subgraph_cache(subgraph_cache)
+            self.assertFalse(subgraph_cache['changed'])
+
+            # a cache hit does not cause the cache to be rewritten
+            self.assertEqual(client._CalculatorsMixin__pop_subgraph_record(
+                subgraph_cache, node_key, set()), "effects")
+            self.assertFalse(subgraph_cache['changed'])
+        finally:
+            client.xcache = False
+            client._cacher.stop()
+            client.clear_cache()
+
     def test_contentsafety(self):
         dbconn = self.Client._init_generic_temp_repository(
             self.mem_repoid, self.mem_repo_desc, temp_file = ":memory:")
@@ -193,6 +594,25 @@ class EntropyClientTest(unittest.TestCase):
             set_mute(False)
         self.assertRaises(RepositoryError, test_load)
 
+    def test_atom_match_many(self):
+        dbconn = self.Client._init_generic_temp_repository(
+            self.mem_repoid, self.mem_repo_desc, temp_file = ":memory:")
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        package_id = dbconn.addPackage(data)
+        key = entropy.dep.dep_getkey(dbconn.retrieveAtom(package_id))
+
+        atoms = [dbconn.retrieveAtom(package_id), key, "app-foo/foo",
+            key, "app-foo/foo;%s?" % (key,)]
+        for multi_match in (False, True):
+            for multi_repo in (False, True):
+                expected = [self.Client.atom_match(x,
+                    multi_match = multi_match, multi_repo = multi_repo)
+                    for x in atoms]
+                self.assertEqual(expected, self.Client._atom_match_many(
+                    atoms, multi_match = multi_match, multi_repo = multi_repo))
+        self.Client.remove_repository(self.mem_repoid)
+
     def test_package_repository(self):
         test_pkg = _misc.get_test_entropy_package()
         # this might fail on 32bit arches
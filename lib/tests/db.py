@@ -2,6 +2,8 @@
 import sys
 sys.path.insert(0, '.')
 sys.path.insert(0, '../')
+import copy
+import shutil
 import unittest
 import os
 import time
@@ -9,11 +11,14 @@ import threading
 
 from entropy.client.interfaces import Client
 from entropy.const import etpConst, const_convert_to_unicode, \
-    const_convert_to_rawstring, const_mkstemp
+    const_convert_to_rawstring, const_mkstemp, const_mkdtemp, \
+    const_get_buffer
 from entropy.output import set_mute
 from entropy.core.settings.base import SystemSettings
 from entropy.misc import ParallelTask
 from entropy.db import EntropyRepository
+from entropy.db.cache import EntropyRepositoryCacher
+from entropy.db.dump import RepositoryDumpReader, RepositoryDumpWriter
 import tests._misc as _misc
 
 import entropy.dep
@@ -149,6 +154,96 @@ class EntropyRepositoryTest(unittest.TestCase):
                 db_needed,
                 tuple((lib for lib, elf_c in data['needed'])))
 
+    def test_library_index(self):
+        package_ids = []
+        for test_pkg in (_misc.get_test_package(),
+                         _misc.get_test_package4()):
+            data = self.Spm.extract_package_metadata(test_pkg)
+            package_ids.append(self.test_db.addPackage(data))
+
+        index = self.test_db.getLibraryIndex()
+        self.assertTrue(index is self.test_db.getLibraryIndex())
+
+        libraries = set()
+        for package_id in package_ids:
+            provided_libs = self.test_db.retrieveProvidedLibraries(package_id)
+            self.assertEqual(
+                index.retrieveProvidedLibraries(package_id), provided_libs)
+            libraries.update((x, z) for x, y, z in provided_libs)
+
+            needed = self.test_db.retrieveNeeded(package_id, extended = True)
+            self.assertEqual(
+                sorted(index.retrieveNeeded(package_id, extended = True)),
+                sorted(needed))
+            self.assertEqual(
+                sorted(index.retrieveNeeded(package_id)),
+                sorted(self.test_db.retrieveNeeded(package_id)))
+            self.assertEqual(
+                index.retrieveNeeded(package_id, extended = True,
+                                     formatted = True),
+                self.test_db.retrieveNeeded(package_id, extended = True,
+                                            formatted = True))
+            libraries.update(needed)
+
+        self.assertNotEqual(libraries, set())
+        for library, elfclass in libraries:
+            for elf in (elfclass, -1):
+                self.assertEqual(
+                    index.resolveNeeded(library, elfclass = elf),
+                    self.test_db.resolveNeeded(library, elfclass = elf))
+                self.assertEqual(
+                    index.resolveNeeded(library, elfclass = elf,
+                                        extended = True),
+                    self.test_db.resolveNeeded(library, elfclass = elf,
+                                               extended = True))
+                self.assertEqual(
+                    index.searchNeeded(library, elfclass = elf),
+                    self.test_db.searchNeeded(library, elfclass = elf))
+
+        # the index is renewed when the repository changes
+        self.test_db.removePackage(package_ids[0])
+        index = self.test_db.getLibraryIndex()
+        self.assertEqual(index.retrieveNeeded(package_ids[0]), tuple())
+        self.assertEqual(
+            index.retrieveProvidedLibraries(package_ids[0]), frozenset())
+
+    def test_dependency_index(self):
+        package_ids = []
+        for test_pkg in (_misc.get_test_package(),
+                         _misc.get_test_package2(),
+                         _misc.get_test_package3()):
+            data = self.Spm.extract_package_metadata(test_pkg)
+            package_ids.append(self.test_db.addPackage(data))
+
+        index = self.test_db.getDependencyIndex()
+        self.assertTrue(index is self.test_db.getDependencyIndex())
+
+        excluded_dep_types = (
+            None, (etpConst['dependency_type_ids']['bdepend_id'],))
+        for package_id in package_ids:
+            for exclude_deptypes in excluded_dep_types:
+                for extended in (False, True):
+                    self.assertEqual(
+                        sorted(index.retrieveDependencies(package_id,
+                            extended = extended,
+                            exclude_deptypes = exclude_deptypes)),
+                        sorted(self.test_db.retrieveDependencies(package_id,
+                            extended = extended,
+                            exclude_deptypes = exclude_deptypes)))
+                    self.assertEqual(
+                        sorted(index.retrieveReverseDependencies(package_id,
+                            extended = extended,
+                            exclude_deptypes = exclude_deptypes)),
+                        sorted(self.test_db.retrieveReverseDependencies(
+                            package_id, extended = extended,
+                            exclude_deptypes = exclude_deptypes)))
+
+        # the index is renewed when the repository changes
+        self.test_db.removePackage(package_ids[0])
+        index = self.test_db.getDependencyIndex()
+        self.assertEqual(index.retrieveDependencies(package_ids[0]),
+            frozenset())
+
     def test_dependencies(self):
         test_pkg = _misc.get_test_package3()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -582,6 +677,31 @@ class EntropyRepositoryTest(unittest.TestCase):
             self.assertEqual(f_match, self.test_db.atomMatch(atom))
             self.assertEqual(f_match, self.test_db.atomMatch("~"+atom))
 
+    def test_db_atom_match_many(self):
+
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        idpackage = self.test_db.addPackage(data)
+        pkg_atom = _misc.get_test_package_atom()
+        pkg_name = _misc.get_test_package_name()
+
+        pkg_key = entropy.dep.dep_getkey(pkg_atom)
+
+        atoms = [pkg_name, "slib", pkg_atom, "app-foo/foo?", "",
+                 "sys-libs/slib-1.0", pkg_name + "foo?", pkg_name,
+                 pkg_key, pkg_key + ":0", pkg_key + ":1", ">=" + pkg_atom,
+                 "<" + pkg_atom, "~" + pkg_atom, "=" + pkg_atom + "*",
+                 pkg_key + "[-foo]", pkg_key + "[foo(+)]",
+                 pkg_key + "#2.6.32", pkg_atom + "~0"]
+        for kwargs in ({}, {'multiMatch': True},
+                       {'extendedResults': True},
+                       {'multiMatch': True, 'extendedResults': True},
+                       {'matchSlot': "0"}):
+            expected = [self.test_db.atomMatch(x, **kwargs) for x in atoms]
+            self.assertEqual(expected,
+                self.test_db.atomMatchMany(atoms, **kwargs))
+        self.assertEqual([], self.test_db.atomMatchMany([]))
+
     def test_db_multithread(self):
 
         # insert/compare
@@ -753,6 +873,164 @@ class EntropyRepositoryTest(unittest.TestCase):
         pkg_data = self.test_db.retrieveUnusedPackageIds()
         self.assertEqual(pkg_data, tuple())
 
+    def test_db_reverse_deps_table(self):
+        # store reverse dependencies in the repository
+        self.test_db.PERSISTENT_REVERSE_DEPENDENCIES = True
+
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        test_pkg2 = _misc.get_test_package2()
+        data2 = self.Spm.extract_package_metadata(test_pkg2)
+        data['pkg_dependencies'] += ((
+                _misc.get_test_package_atom2(),
+                etpConst['dependency_type_ids']['rdepend_id']),)
+        data2['pkg_dependencies'] += ((
+                _misc.get_test_package_atom(),
+                etpConst['dependency_type_ids']['rdepend_id']),)
+
+        idpackage = self.test_db.addPackage(data)
+        # generate the table
+        self.assertEqual(
+            self.test_db.retrieveReverseDependencies(idpackage), frozenset())
+        self.assertTrue(self.test_db._isReverseDependenciesTableCurrent())
+
+        # incrementally updated from now on
+        idpackage2 = self.test_db.addPackage(data2)
+        self.assertTrue(self.test_db._isReverseDependenciesTableCurrent())
+        self.assertEqual(self.test_db.retrieveReverseDependencies(idpackage),
+            frozenset([idpackage2]))
+        self.assertEqual(self.test_db.retrieveReverseDependencies(idpackage2),
+            frozenset([idpackage]))
+        self.assertEqual(self.test_db.retrieveReverseDependencies(idpackage,
+            key_slot = True), (('app-dicts/aspell-es', '0'),))
+        self.assertEqual(self.test_db.retrieveUnusedPackageIds(), tuple())
+
+        # metadata set after a merge does not invalidate the table
+        self.test_db.setCreationDate(idpackage2, "1234567890")
+        self.assertTrue(self.test_db._isReverseDependenciesTableCurrent())
+
+        self.test_db.removePackage(idpackage2)
+        self.assertTrue(self.test_db._isReverseDependenciesTableCurrent())
+        self.assertEqual(
+            self.test_db.retrieveReverseDependencies(idpackage), frozenset())
+
+        # changes outside addPackage() and removePackage() trigger
+        # a full regeneration
+        idpackage2 = self.test_db.addPackage(data2)
+        self.test_db.removeDependencies(idpackage)
+        self.assertFalse(self.test_db._isReverseDependenciesTableCurrent())
+        self.assertEqual(self.test_db.retrieveReverseDependencies(idpackage),
+            frozenset([idpackage2]))
+        self.assertEqual(
+            self.test_db.retrieveReverseDependencies(idpackage2), frozenset())
+        self.assertEqual(self.test_db.retrieveUnusedPackageIds(),
+            (idpackage2,))
+
+    def test_get_packages_data(self):
+        package_ids = []
+        for test_pkg in (_misc.get_test_package(),
+                         _misc.get_test_package2()):
+            data = self.Spm.extract_package_metadata(test_pkg)
+            package_ids.append(self.test_db.addPackage(data))
+        package_ids.append(package_ids[0])
+        package_ids.append(-1)
+
+        expected = [self.test_db.getPackageData(x) for x in package_ids]
+        self.assertEqual(expected[-1], None)
+        self.assertEqual(
+            list(self.test_db.getPackagesData(package_ids)), expected)
+        self.assertEqual(
+            list(self.test_db.iterPackagesData(package_ids, chunk_size = 1)),
+            expected)
+
+        expected = [self.test_db.getPackageData(x,
+                        content_insert_formatted = True,
+                        get_changelog = False) for x in package_ids]
+        self.assertEqual(
+            list(self.test_db.getPackagesData(package_ids,
+                 content_insert_formatted = True, get_changelog = False)),
+            expected)
+
+        fields = ("atom", "slot", "pkg_dependencies", "licensedata")
+        data = list(self.test_db.getPackagesData(package_ids,
+                                                 fields = fields))
+        for pkg_data, full_data in zip(data, expected):
+            if full_data is None:
+                self.assertEqual(pkg_data, None)
+                continue
+            self.assertEqual(sorted(pkg_data.keys()), sorted(fields))
+            for field in fields:
+                self.assertEqual(pkg_data[field], full_data[field])
+
+        self.assertRaises(AttributeError, self.test_db.getPackagesData,
+                          package_ids, fields = ("atom", "foo"))
+        self.assertRaises(AttributeError, self.test_db.iterPackagesData,
+                          package_ids, fields = ("atom", "foo"))
+
+    def test_add_packages(self):
+        pkgs_data = []
+        for test_pkg in (_misc.get_test_package(),
+                         _misc.get_test_package2()):
+            pkgs_data.append(self.Spm.extract_package_metadata(test_pkg))
+
+        expected = []
+        for pkg_data in pkgs_data:
+            package_id = self.test_db2.addPackage(copy.deepcopy(pkg_data))
+            expected.append(self.test_db2.getPackageData(package_id))
+
+        package_ids = self.test_db.addPackages(
+            (copy.deepcopy(x) for x in pkgs_data))
+        self.assertEqual(len(package_ids), len(pkgs_data))
+        self.assertEqual(package_ids, sorted(package_ids))
+        self.assertEqual(
+            [self.test_db.getPackageData(x) for x in package_ids], expected)
+
+    def test_live_cache(self):
+        cacher = EntropyRepositoryCacher()
+        stats = cacher.stats()
+        try:
+            cacher.clear()
+            cacher.set("a", frozenset([1, 2, 3]), namespace = "repo1")
+            cacher.set("b", {1: 2}, namespace = "repo1")
+            cacher.set("a", "foo", namespace = "repo2")
+            self.assertEqual(cacher.get("a", namespace = "repo1"),
+                             frozenset([1, 2, 3]))
+            self.assertEqual(cacher.get("c", namespace = "repo1"), None)
+            self.assertEqual(sorted(cacher.keys()),
+                             ["repo1a", "repo1b", "repo2a"])
+
+            cacher.discard("repo1")
+            self.assertEqual(cacher.get("a", namespace = "repo1"), None)
+            self.assertEqual(cacher.get("a", namespace = "repo2"), "foo")
+            new_stats = cacher.stats()
+            self.assertEqual(new_stats["entries"], 1)
+            self.assertEqual(new_stats["hits"] - stats["hits"], 2)
+            self.assertEqual(new_stats["misses"] - stats["misses"], 2)
+
+            # least recently used items are evicted first
+            cacher.set_budget(new_stats["size"] * 2)
+            cacher.set("x", "bar", namespace = "repo1")
+            cacher.get("a", namespace = "repo2")
+            cacher.set("y", set(range(1024)), namespace = "repo1")
+            self.assertEqual(cacher.get("x", namespace = "repo1"), None)
+            self.assertEqual(cacher.get("y", namespace = "repo1"),
+                             set(range(1024)))
+            self.assertTrue(
+                cacher.stats()["evictions"] > new_stats["evictions"])
+
+            # sizes given by the caller are accounted as they are
+            cacher.clear()
+            cacher.set_budget(stats["budget"])
+            cacher.set("a", "foo", namespace = "repo1", size = 1000)
+            cacher.set("b", list(range(100000)), namespace = "repo1")
+            size = cacher.stats()["size"]
+            self.assertTrue(size > 1000 + 100000 * 8)
+            cacher.clear_key("b", namespace = "repo1")
+            self.assertEqual(cacher.stats()["size"], 1000)
+        finally:
+            cacher.clear()
+            cacher.set_budget(stats["budget"])
+
     def test_similar(self):
         test_pkg = _misc.get_test_package()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -784,6 +1062,94 @@ class EntropyRepositoryTest(unittest.TestCase):
             slot = "0", just_id = True)
         self.assertEqual(out, (1,))
 
+    def test_search_index(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        idpackage = self.test_db.addPackage(data)
+
+        def _search():
+            return (
+                self.test_db.searchPackages(_misc.get_test_package_name()),
+                self.test_db.searchPackages("libs/zl", just_id = True),
+                self.test_db.searchDescription("compression library"),
+                self.test_db.searchBelongs("%/libz.so%", like = True),
+                self.test_db.searchBelongs("/usr/%", like = True),
+                )
+
+        expected = _search()
+        self.test_db._createSearchIndex()
+        if not self.test_db._doesSearchIndexExist():
+            # SQLite without FTS5 trigram tokenizer support
+            return
+        self.assertEqual(expected, _search())
+        self.assertTrue(idpackage in expected[1])
+
+        # kept in sync on package removal and addition
+        self.test_db.removePackage(idpackage)
+        self.assertEqual(self.test_db.searchPackages("libs/zl"), tuple())
+        idpackage = self.test_db.addPackage(data)
+        self.assertEqual(
+            self.test_db.searchPackages("libs/zl", just_id = True),
+            (idpackage,))
+
+        # kept in sync on direct content and provide updates
+        self.test_db.insertContent(idpackage, {"/opt/zsearch/f": "obj"})
+        self.assertEqual(
+            self.test_db.searchBelongs("%/zsearch/%", like = True),
+            frozenset([idpackage]))
+        self.test_db._insertProvide(idpackage, [("virtual/zsearch", False)])
+        self.assertEqual(
+            self.test_db.searchPackages("virtual/zsearch", just_id = True),
+            (idpackage,))
+        self.test_db._cursor().execute(
+            "DELETE FROM provide WHERE idpackage = ?", (idpackage,))
+        self.assertEqual(
+            self.test_db.searchPackages("virtual/zsearch"), tuple())
+        self.test_db.dropContent()
+        self.test_db.insertContent(idpackage, {"/opt/zsearch/g": "obj"})
+        self.assertEqual(
+            self.test_db.searchBelongs("/opt/%", like = True),
+            frozenset([idpackage]))
+
+        self.test_db.dropAllIndexes()
+        self.assertFalse(self.test_db._doesSearchIndexExist())
+
+    def test_content_compact(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        idpackage = self.test_db.addPackage(data)
+
+        def _content(package_id):
+            return (
+                self.test_db.retrieveContent(package_id, extended = True,
+                                             formatted = True),
+                list(self.test_db.retrieveContentIter(package_id)),
+                self.test_db.listAllFiles(clean = True),
+                )
+
+        expected = _content(idpackage)
+        self.assertTrue(expected[0])
+
+        # migrate to the compact layout
+        self.test_db.COMPACT_CONTENT = True
+        self.test_db._databaseSchemaUpdates()
+        self.assertTrue(self.test_db._isContentCompact())
+        self.assertEqual(expected, _content(idpackage))
+        for path in expected[0]:
+            self.assertEqual(self.test_db.searchBelongs(path),
+                             frozenset([idpackage]))
+            self.assertTrue(self.test_db.isFileAvailable(path))
+
+        # package removal and addition
+        self.test_db.removePackage(idpackage)
+        self.assertFalse(self.test_db.isFileAvailable(path))
+        idpackage = self.test_db.addPackage(data)
+        self.assertEqual(expected, _content(idpackage))
+
+        self.test_db.dropContent()
+        self.test_db.clean()
+        self.assertEqual(self.test_db.listAllFiles(count = True), 0)
+
     def test_list_packages(self):
         test_pkg = _misc.get_test_package()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -791,6 +1157,15 @@ class EntropyRepositoryTest(unittest.TestCase):
         out = self.test_db.listAllPackages()
         self.assertEqual(out, (('sys-libs/zlib-1.2.3-r1', 1, '5'),))
 
+    def test_list_strict_data(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        idpackage = self.test_db.addPackage(data)
+        out = self.test_db.listAllStrictData()
+        self.assertEqual(out, ((idpackage,) + \
+            self.test_db.getStrictData(idpackage) + \
+            (self.test_db.retrieveDigest(idpackage),),))
+
     def test_spmuids(self):
         test_pkg = _misc.get_test_package()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -896,6 +1271,91 @@ class EntropyRepositoryTest(unittest.TestCase):
         os.remove(buf_file)
         os.remove(new_db_path)
 
+    def test_db_import_export_binary(self):
+
+        test_pkg = _misc.get_test_package2()
+        data = self.Spm.extract_package_metadata(test_pkg)
+        data['license'] = const_convert_to_unicode('GPL-2')
+        data['licensedata'] = {
+            const_convert_to_unicode('GPL-2'): \
+                const_convert_to_unicode(
+                    "#248083).\n\n  06 Feb 2009; Ra\xc3\xbal Porcel"),
+        }
+        idpackage = self.test_db.addPackage(data)
+        db_data = self.test_db.getPackageData(idpackage)
+        _misc.clean_pkg_metadata(db_data)
+
+        set_mute(True)
+
+        # export
+        fd, buf_file = const_mkstemp()
+        os.close(fd)
+        with open(buf_file, "wb") as buf:
+            self.test_db.exportRepository(buf, binary = True)
+
+        fd, new_db_path = const_mkstemp()
+        os.close(fd)
+        rc = self.test_db.importRepository(buf_file, new_db_path)
+        self.assertEqual(rc, 0)
+        new_db = self.Client.open_generic_repository(new_db_path)
+        new_db_data = new_db.getPackageData(idpackage)
+        _misc.clean_pkg_metadata(new_db_data)
+        self.assertEqual(new_db_data, db_data)
+        self.assertEqual(
+            new_db.checksum(do_order = True, strict = False),
+            self.test_db.checksum(do_order = True, strict = False))
+        new_db.close()
+        os.remove(new_db_path)
+
+        # truncated dumps must be rejected
+        with open(buf_file, "rb") as buf:
+            dump = buf.read()
+        with open(buf_file, "wb") as buf:
+            buf.write(dump[:-1])
+        fd, new_db_path = const_mkstemp()
+        os.close(fd)
+        rc = self.test_db.importRepository(buf_file, new_db_path)
+        self.assertNotEqual(rc, 0)
+        set_mute(False)
+
+        os.remove(buf_file)
+        os.remove(new_db_path)
+
+    def test_binary_dump_values(self):
+        # binary values are detected by type, not by declared column type
+        blob = const_get_buffer()(const_convert_to_rawstring("\x00\xff"))
+        text = const_convert_to_unicode("text")
+        rows = [[blob, text], [text, blob]]
+
+        fd, buf_file = const_mkstemp()
+        os.close(fd)
+        try:
+            with open(buf_file, "wb") as buf:
+                writer = RepositoryDumpWriter(buf)
+                writer.write_schema([
+                    ("test", "CREATE TABLE test (a VARCHAR, b BLOB)",
+                     ["a", "b"], [1])])
+                writer.write_rows("test", rows)
+                writer.write_objects([])
+                writer.close()
+
+            restored = []
+            with open(buf_file, "rb") as buf:
+                for record_type, data in RepositoryDumpReader(buf):
+                    if record_type == RepositoryDumpReader.ROWS_RECORD:
+                        restored.extend(data[1])
+        finally:
+            os.remove(buf_file)
+
+        def _value(value):
+            if isinstance(value, const_get_buffer()):
+                return bytes(value)
+            return value
+
+        self.assertEqual(
+            [[_value(x) for x in row] for row in restored],
+            [[_value(x) for x in row] for row in rows])
+
     def test_use_defaults(self):
         test_pkg = _misc.get_test_package()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -947,6 +1407,32 @@ class EntropyRepositoryTest(unittest.TestCase):
         self.assertEqual(self.test_db.getSetting("something_cool"),
             "abcdef\nabcdef")
 
+    def test_checksum(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+
+        checksum = self.test_db.checksum()
+        verify_checksum = self.test_db.checksum(do_order = True)
+        idpackage = self.test_db.addPackage(data)
+        self.assertNotEqual(checksum, self.test_db.checksum())
+        self.assertNotEqual(verify_checksum,
+            self.test_db.checksum(do_order = True))
+
+        checksum = self.test_db.checksum(include_dependencies = True)
+        self.test_db.removeDependencies(idpackage)
+        self.assertNotEqual(checksum,
+            self.test_db.checksum(include_dependencies = True))
+
+        checksum = self.test_db.checksum()
+        self.test_db.setSlot(idpackage, "99")
+        self.assertNotEqual(checksum, self.test_db.checksum())
+
+        # verification mode is content based
+        idpackage = self.test_db2.addPackage(
+            self.test_db.getPackageData(idpackage))
+        self.assertEqual(self.test_db.checksum(do_order = True),
+            self.test_db2.checksum(do_order = True))
+
     def test_new_entropyrepository_schema(self):
         test_pkg = _misc.get_test_package2()
         data = self.Spm.extract_package_metadata(test_pkg)
@@ -1087,6 +1573,103 @@ class EntropyRepositoryTest(unittest.TestCase):
                 test_db.close()
             os.remove(db_file)
 
+    def test_open_modes(self):
+        test_pkg = _misc.get_test_package()
+        data = self.Spm.extract_package_metadata(test_pkg)
+
+        class WalRepository(EntropyRepository):
+            WAL_JOURNAL = True
+
+        class ReadOptimizedRepository(EntropyRepository):
+            READ_OPTIMIZED = True
+
+        fd, db_file = const_mkstemp()
+        os.close(fd)
+        test_db = None
+        ro_db = None
+
+        try:
+            test_db = WalRepository(readOnly = False, dbFile = db_file,
+                name = "wal_test", skipChecks = True)
+            test_db.initializeRepository()
+            cur = test_db._cursor().execute("pragma journal_mode")
+            self.assertEqual(cur.fetchone()[0], "wal")
+            idpackage = test_db.addPackage(data)
+            test_db.commit()
+
+            ro_db = ReadOptimizedRepository(readOnly = True,
+                dbFile = db_file, name = "read_optimized_test",
+                skipChecks = True)
+            self.assertTrue(ro_db._read_optimized)
+            self.assertEqual(ro_db.retrieveAtom(idpackage),
+                             test_db.retrieveAtom(idpackage))
+            # commits not checkpointed yet are tracked too
+            self.assertEqual(ro_db.mtime(),
+                max(os.path.getmtime(db_file),
+                    os.path.getmtime(db_file + "-wal")))
+
+        finally:
+            for repo in (ro_db, test_db):
+                if repo is not None:
+                    repo.close()
+            for path in (db_file, db_file + "-wal", db_file + "-shm"):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def test_wal_journal_permissions(self):
+
+        class WalRepository(EntropyRepository):
+            WAL_JOURNAL = True
+
+        tmp_dir = const_mkdtemp()
+        db_file = os.path.join(tmp_dir, "wal_test.db")
+
+        def _open(readonly):
+            return WalRepository(readOnly = readonly, dbFile = db_file,
+                name = "wal_test", skipChecks = True)
+
+        def _journal_mode():
+            repo = _open(False)
+            try:
+                return repo._cursor().execute(
+                    "pragma journal_mode").fetchone()[0]
+            finally:
+                repo.close()
+
+        try:
+            test_db = _open(False)
+            test_db.initializeRepository()
+            test_db.commit()
+            test_db.close()
+
+            # only readable by the directory owner
+            os.chmod(tmp_dir, 0o755)
+            os.chmod(db_file, 0o600)
+            self.assertEqual(_journal_mode(), "wal")
+            # readable by users that cannot write the directory
+            os.chmod(db_file, 0o644)
+            self.assertEqual(_journal_mode(), "delete")
+
+            # read-only directory: open it as an unprivileged user
+            os.chmod(tmp_dir, 0o555)
+            pid = os.fork()
+            if pid == 0:
+                exit_st = 1
+                try:
+                    if os.getuid() == 0:
+                        os.setgid(65534)
+                        os.setuid(65534)
+                    ro_db = _open(True)
+                    ro_db.listAllPackageIds()
+                    ro_db.close()
+                    exit_st = 0
+                finally:
+                    os._exit(exit_st)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        finally:
+            os.chmod(tmp_dir, 0o755)
+            shutil.rmtree(tmp_dir, True)
+
     def test_locking_memory(self):
         self.assert_(self.test_db._is_memory())
         return self._test_repository_locking(self.test_db)
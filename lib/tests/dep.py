@@ -10,6 +10,7 @@ import tests._misc as _misc
 import tempfile
 import subprocess
 import shutil
+import itertools
 import stat
 import entropy.dep as et
 
@@ -132,6 +133,41 @@ class DepTest(unittest.TestCase):
             ('3.4', '2222', 0), ('1.0', '2222', 1)]
         self.assertEqual(et.get_entropy_newer_version(vers), out_vers)
 
+    def test_version_sort_key(self):
+
+        def _sign(value):
+            return (value > 0) - (value < 0)
+
+        versions = []
+        for main, parts, letter, suffix, rev in itertools.product(
+                ("1", "10"),
+                ("", ".0", ".1", ".01", ".10", ".0.1", ".05", ".050"),
+                ("", "a"),
+                ("", "_alpha", "_rc", "_p", "_p0", "_p2", "_p0_alpha",
+                 "_p_rc1", "_p0_p0_p1"),
+                ("", "-r1")):
+            versions.append(main + parts + letter + suffix + rev)
+
+        keys = dict((x, et.version_sort_key(x)) for x in versions)
+        for ver_a in versions:
+            for ver_b in versions:
+                key_cmp = (keys[ver_a] > keys[ver_b]) - \
+                    (keys[ver_a] < keys[ver_b])
+                self.assertEqual(
+                    _sign(et.compare_versions(ver_a, ver_b)), key_cmp,
+                    (ver_a, ver_b))
+
+        # invalid versions are the lowest ones
+        self.assertTrue(et.version_sort_key("1.0") > \
+                            et.version_sort_key("foo"))
+        self.assertTrue(et.compare_versions("1.0", "foo") > 0)
+
+        vers = [("1.0", "", 1,), ("1.0_rc1", "", 3,), ("1.0", "", 0,),
+                ("1.0-r1", "", 0,)]
+        out_vers = [("1.0-r1", "", 0,), ("1.0", "", 1,), ("1.0", "", 0,),
+                    ("1.0_rc1", "", 3,)]
+        self.assertEqual(et.get_entropy_newer_version(vers), out_vers)
+
     def test_create_package_filename(self):
         package_category = "app-foo"
         package_name = "foo"
@@ -243,6 +279,22 @@ class DepTest(unittest.TestCase):
             result, outcome = parser.parse()
             self.assertEqual(outcome, expected_outcome)
 
+    def test_parser_compile(self):
+        depstring = "( app-foo/foo & app-foo/bar ) | app-foo/baz"
+        ast = et.DependencyStringParser.compile(depstring)
+        self.assertEqual(ast, ("|", (("&", ("app-foo/foo", "app-foo/bar")),
+            "app-foo/baz")))
+        self.assertTrue(ast is et.DependencyStringParser.compile(depstring))
+        self.assertRaises(et.DependencyStringParser.MalformedDependency,
+            et.DependencyStringParser.compile, "( )")
+
+        test_db = self.__open_test_db()
+        match_cache = et.DependencyMatchCache()
+        for count in range(2):
+            parser = et.DependencyStringParser(depstring, [test_db],
+                match_cache = match_cache)
+            self.assertEqual(parser.parse(), (False, []))
+
     def test_get_entropy_package_sha1(self):
         names = [
             ("app-foo:bar-123.eda9a5004ce8eb127d939de6ec394571a407f863~1.tbz2",
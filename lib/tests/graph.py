@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import sys
+sys.path.insert(0, '.')
+sys.path.insert(0, '../')
+
+import unittest
+
+from entropy.graph import Graph
+
+
+class EntropyGraphTest(unittest.TestCase):
+
+    def _graph(self, adjacency):
+        graph = Graph()
+        for item, deps in adjacency.items():
+            graph.add(item, deps)
+        return graph
+
+    def _positions(self, sorted_map):
+        positions = {}
+        for dep_level, items in sorted_map.items():
+            for item in items:
+                self.assertNotIn(item, positions)
+                positions[item] = dep_level
+        return positions
+
+    def test_solve_cycles(self):
+        adjacency = {
+            "a": ["b"],
+            "b": ["c"],
+            "c": ["b", "d"],
+            "d": [],
+            "e": [],
+        }
+        graph = self._graph(adjacency)
+        try:
+            sorted_map = graph.solve()
+        finally:
+            graph.destroy()
+
+        # one strongly connected component per level
+        self.assertEqual(sorted(sorted_map.keys()),
+                         list(range(1, len(sorted_map) + 1)))
+        components = sorted(sorted(x) for x in sorted_map.values())
+        self.assertEqual(components, [["a"], ["b", "c"], ["d"], ["e"]])
+
+        positions = self._positions(sorted_map)
+        self.assertEqual(positions["b"], positions["c"])
+        self.assertTrue(positions["a"] < positions["b"])
+        self.assertTrue(positions["c"] < positions["d"])
+
+    def test_solve_levels(self):
+        adjacency = {
+            "a": ["b", "x"],
+            "b": ["c"],
+            "c": ["b", "d"],
+            "x": ["d"],
+            "d": [],
+        }
+        graph = self._graph(adjacency)
+        try:
+            sorted_map = graph.solve(levels = True)
+        finally:
+            graph.destroy()
+
+        # independent nodes share the same level, cycles are kept
+        # together
+        self.assertEqual(
+            dict((x, sorted(y)) for x, y in sorted_map.items()),
+            {1: ["a"], 2: ["b", "c", "x"], 3: ["d"]})
+
+    def test_solve_deep_chain(self):
+        # much deeper than the recursion limit
+        nodes = sys.getrecursionlimit() * 10
+        adjacency = dict((x, [x + 1]) for x in range(nodes - 1))
+        # close a cycle at the end of the chain
+        adjacency[nodes - 1] = [nodes - 2]
+
+        graph = self._graph(adjacency)
+        try:
+            for levels in (False, True):
+                sorted_map = graph.solve(levels = levels)
+                self.assertEqual(len(sorted_map), nodes - 1)
+                positions = self._positions(sorted_map)
+                self.assertEqual(len(positions), nodes)
+                self.assertEqual(positions[nodes - 2], positions[nodes - 1])
+                for item in range(nodes - 2):
+                    self.assertTrue(positions[item] < positions[item + 1])
+        finally:
+            graph.destroy()
+
+
+if __name__ == '__main__':
+    unittest.main()
+    raise SystemExit(0)
@@ -9,6 +9,7 @@ import json
 from entropy.const import const_convert_to_unicode, const_mkstemp
 from entropy.misc import Lifo, TimeScheduled, ParallelTask, EmailSender, \
     FastRSS, FlockFile
+from entropy.debug import SolverProfiler
 
 class MiscTest(unittest.TestCase):
 
@@ -255,6 +256,49 @@ class MiscTest(unittest.TestCase):
 
         os.remove(tmp_path)
 
+    def test_solver_profiler(self):
+        profiler = SolverProfiler()
+
+        @SolverProfiler.profiled("test_phase")
+        def _recurse(depth):
+            profiler.count("test_counter")
+            if depth:
+                return _recurse(depth - 1)
+            return depth
+
+        enabled = profiler.enabled
+        try:
+            profiler.disable()
+            profiler.reset()
+            self.assertEqual(_recurse(2), 0)
+            report = profiler.report()
+            self.assertEqual(report["phases"], {})
+            self.assertEqual(report["counters"], {})
+
+            profiler.enable()
+            self.assertEqual(_recurse(2), 0)
+            with profiler.phase("test_other"):
+                profiler.count("test_counter", amount = 2)
+            report = profiler.report()
+            self.assertEqual(report["phases"]["test_phase"]["calls"], 3)
+            self.assertTrue(report["phases"]["test_phase"]["time"] >= 0.0)
+            self.assertEqual(report["phases"]["test_other"]["calls"], 1)
+            self.assertEqual(report["counters"]["test_counter"], 5)
+
+            tmp_fd, tmp_path = const_mkstemp()
+            with os.fdopen(tmp_fd, "w") as tmp_f:
+                profiler.dump(tmp_f)
+            with open(tmp_path, "r") as tmp_f:
+                self.assertEqual(json.load(tmp_f)["counters"],
+                    report["counters"])
+            os.remove(tmp_path)
+        finally:
+            profiler.reset()
+            if enabled:
+                profiler.enable()
+            else:
+                profiler.disable()
+
 
 if __name__ == '__main__':
     unittest.main()
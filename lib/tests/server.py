@@ -61,9 +61,9 @@ class EntropyRepositoryTest(unittest.TestCase):
         self.assertEqual(cacher.keys(), [])
         self.assertNotEqual(dbconn.retrieveRevision(idpackage), None)
         # now it should be filled
-        cache_key = dbconn._getLiveCacheKey() + 'retrieveRevision'
         self.assertEqual(
-            cacher.get(cache_key),
+            cacher.get('retrieveRevision',
+                       namespace = dbconn._getLiveCacheKey()),
             {1: 0})
         # clear again
         dbconn.clearCache()
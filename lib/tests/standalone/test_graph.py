@@ -1,8 +1,50 @@
 # -*- coding: utf-8 -*-
 # temp unit testing code
+import random
+import time
+
+
+def _large_graph_test(graph_class, nodes = 100000):
+    """
+    Sort a deep dependency chain and a random DAG of the given amount of
+    nodes, checking the resulting order and printing timings.
+    """
+    def _check(adjacency, sorted_map):
+        positions = {}
+        for dep_level, items in sorted_map.items():
+            for item in items:
+                positions[item] = dep_level
+        assert len(positions) == len(adjacency)
+        for item, deps in adjacency.items():
+            for dep in deps:
+                assert positions[dep] > positions[item]
+
+    rand = random.Random(0)
+    chain = dict((x, [x + 1]) for x in range(nodes - 1))
+    chain[nodes - 1] = []
+    dag = dict((x, set(rand.randint(x + 1, nodes - 1) for y in range(3))) \
+                   for x in range(nodes - 1))
+    dag[nodes - 1] = set()
+
+    for name, adjacency in (("chain", chain), ("dag", dag)):
+        graph = graph_class()
+        for item, deps in adjacency.items():
+            graph.add(item, deps)
+
+        for levels in (False, True):
+            start = time.time()
+            sorted_map = graph.solve(levels = levels)
+            elapsed = time.time() - start
+            _check(adjacency, sorted_map)
+            print "%s, %d nodes, levels: %s => %d levels in %.2fs" % (
+                name, nodes, levels, len(sorted_map), elapsed)
+        graph.destroy()
+
 if __name__ == "__main__":
 
     from entropy.graph import Graph
+    _large_graph_test(Graph)
+
     from entropy.client.interfaces import Client
     from entropy.const import etpConst
     cl = Client()
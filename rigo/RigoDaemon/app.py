@@ -29,6 +29,7 @@ import signal
 import shutil
 import subprocess
 import copy
+import json
 import threading
 from collections import deque
 
@@ -58,7 +59,7 @@ sys.path.insert(0, '../../lib')
 sys.path.insert(0, '../lib')
 sys.path.insert(0, './')
 
-from entropy.cache import EntropyCacher
+from entropy.cache import EntropyCacher, CacheMetrics
 # update default writeback timeout
 EntropyCacher.WRITEBACK_TIMEOUT = 120
 
@@ -3147,6 +3148,36 @@ class RigoDaemonService(dbus.service.Object):
         # might temporarily go to -1 ?
         return max(0, self._action_queue_length)
 
+    @dbus.service.method(BUS_NAME, in_signature='i',
+        out_signature='s')
+    def cache_stats(self, top):
+        """
+        Return the cache statistics collected by RigoDaemon (see
+        entropy.cache.CacheMetrics.report()), with the given number of
+        most accessed keys per cache, and the asynchronous cache writer
+        ones (under the "writer" key) as JSON string.
+        """
+        write_output("cache_stats called", debug=True)
+        metrics = CacheMetrics()
+        report = metrics.report(top=top)
+        report["enabled"] = metrics.enabled
+        report["writer"] = EntropyCacher().stats()
+        return json.dumps(report, sort_keys=True)
+
+    @dbus.service.method(BUS_NAME, in_signature='b',
+        out_signature='')
+    def set_cache_stats(self, enabled):
+        """
+        Enable or disable the collection of cache statistics.
+        """
+        write_output("set_cache_stats called: %s" % (enabled,),
+                     debug=True)
+        metrics = CacheMetrics()
+        if enabled:
+            metrics.enable()
+        else:
+            metrics.disable()
+
     @dbus.service.method(BUS_NAME, in_signature='',
         out_signature='a(isssba(iss))')
     def action_queue_items(self):
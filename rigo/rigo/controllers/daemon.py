@@ -21,6 +21,7 @@ this program; if not, write to the Free Software Foundation, Inc.,
 import sys
 import time
 import codecs
+import json
 from threading import Lock, Semaphore, current_thread
 from collections import deque
 
@@ -1828,6 +1829,29 @@ class RigoServiceController(GObject.Object):
                 dbus_interface=self.DBUS_INTERFACE).action_queue_length()
         return self._execute_mainloop(_action_queue_length)
 
+    def cache_stats(self, top=10):
+        """
+        Return the RigoDaemon cache statistics, see
+        entropy.cache.CacheMetrics.report(), with the given number
+        of most accessed keys per cache.
+        """
+        def _cache_stats():
+            return dbus.Interface(
+                self._entropy_bus,
+                dbus_interface=self.DBUS_INTERFACE).cache_stats(top)
+        return json.loads(self._execute_mainloop(_cache_stats))
+
+    def set_cache_stats(self, enabled):
+        """
+        Enable or disable the collection of RigoDaemon cache statistics.
+        """
+        def _set_cache_stats():
+            return dbus.Interface(
+                self._entropy_bus,
+                dbus_interface=self.DBUS_INTERFACE).set_cache_stats(
+                    enabled)
+        return self._execute_mainloop(_set_cache_stats)
+
     def action_queue_items(self):
         """
         Return the list of Application objects that are currently processed by